@@ -0,0 +1,259 @@
+# ai_translation.py - Cached, batched LLM translation of AI answers
+
+import json
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+
+from metrics import LatencyStats
+from translations import SUPPORTED_LANGUAGES, translation_manager
+
+# Time a USSD AI question may take end to end (answer + translation), in seconds
+USSD_AI_BUDGET_SECONDS = float(os.environ.get('USSD_AI_BUDGET_SECONDS', 8))
+
+# Translations finishing with less than this left in the budget are not waited for
+MIN_TRANSLATION_SECONDS = 0.2
+
+
+class _LanguageStats:
+    """Cache and fallback counters for one target language"""
+
+    __slots__ = ('hits', 'misses', 'fallbacks')
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+
+class AnswerTranslator:
+    """Translate English AI answers with the LLM, batching concurrent requests into one call.
+
+    Translations are cached per (language, source text); identical requests
+    already in flight share one pending result. Callers wait only until their
+    deadline and otherwise get the keyword-replacement translation.
+    """
+
+    def __init__(self, enabled=True, batch_window=0.05, max_batch=8, max_workers=2, cache_size=2000):
+        """Initialize the cache and batching settings (threads start on first use)"""
+        self.enabled = enabled
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+
+        self.cache = OrderedDict()
+        self.stats = {code: _LanguageStats() for code in SUPPORTED_LANGUAGES}
+        self.batches = 0
+        self.batched_items = 0
+        self.failed_batches = 0
+        self.llm_latency = LatencyStats()
+
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._pending = queue.Queue()
+        self._executor = None
+        self._collector = None
+
+    @classmethod
+    def from_env(cls):
+        """Build a translator from USSD_AI_TRANSLATION* environment settings"""
+        return cls(
+            enabled=os.environ.get('USSD_AI_TRANSLATION', 'true').lower() in ('1', 'true', 'yes'),
+            batch_window=float(os.environ.get('USSD_AI_TRANSLATION_BATCH_WINDOW', 0.05)),
+            max_batch=int(os.environ.get('USSD_AI_TRANSLATION_MAX_BATCH', 8)),
+            max_workers=int(os.environ.get('USSD_AI_TRANSLATION_WORKERS', 2)),
+            cache_size=int(os.environ.get('USSD_AI_TRANSLATION_CACHE_SIZE', 2000))
+        )
+
+    def translate(self, text, lang, deadline=None):
+        """Translate an English answer, waiting at most until `deadline` (time.monotonic())"""
+        if lang == 'en' or not text:
+            return text
+
+        key = (lang, text)
+        stats = self.stats.setdefault(lang, _LanguageStats())
+
+        with self._lock:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self.cache.move_to_end(key)
+                stats.hits += 1
+                return cached
+            stats.misses += 1
+
+        if not self.enabled or self._get_llm() is None:
+            return self._fallback(text, lang, stats)
+
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining < MIN_TRANSLATION_SECONDS:
+            return self._fallback(text, lang, stats)
+
+        future = self._submit(key)
+        try:
+            translated = future.result(timeout=remaining)
+        except TimeoutError:
+            # The result still lands in the cache for the next farmer who asks
+            return self._fallback(text, lang, stats)
+        except Exception:
+            return self._fallback(text, lang, stats)
+
+        return translated or self._fallback(text, lang, stats)
+
+    def _fallback(self, text, lang, stats):
+        with self._lock:
+            stats.fallbacks += 1
+        return translation_manager.translate_response(text, lang)
+
+    def _get_llm(self):
+        """The app's LLM, looked up lazily to avoid a circular import"""
+        try:
+            import app
+            return app.llm
+        except Exception:
+            return None
+
+    def _submit(self, key):
+        """Queue a translation, joining an identical one already in flight"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+
+            future = Future()
+            self._inflight[key] = future
+            if self._collector is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='ai-translation')
+                self._collector = threading.Thread(target=self._collect, name='ai-translation-batcher', daemon=True)
+                self._collector.start()
+
+        self._pending.put(key)
+        return future
+
+    def _collect(self):
+        """Group queued translations into batches and hand them to the LLM workers"""
+        while True:
+            batch = [self._pending.get()]
+            batch_deadline = time.monotonic() + self.batch_window
+
+            while len(batch) < self.max_batch:
+                remaining = batch_deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._executor.submit(self._translate_batch, batch)
+
+    def _translate_batch(self, batch):
+        """Translate a batch of (language, text) keys with a single LLM call"""
+        results = {}
+        try:
+            llm = self._get_llm()
+            started = time.monotonic()
+            response = llm.invoke(self._build_prompt(batch))
+            self.llm_latency.record(time.monotonic() - started)
+
+            translations = self._parse_response(getattr(response, 'content', response), len(batch))
+            if translations is None:
+                raise ValueError(f"Expected {len(batch)} translations in the LLM reply")
+            results = dict(zip(batch, translations))
+
+        except Exception as e:
+            print(f"Error translating {len(batch)} AI answers: {str(e)}")
+            with self._lock:
+                self.failed_batches += 1
+
+        with self._lock:
+            self.batches += 1
+            self.batched_items += len(batch)
+            for key in batch:
+                translated = results.get(key)
+                if translated:
+                    self.cache[key] = translated
+                    self.cache.move_to_end(key)
+                future = self._inflight.pop(key, None)
+                if future is not None:
+                    future.set_result(translated)
+
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _build_prompt(self, batch):
+        """One prompt asking for every answer in the batch, returned as a JSON array"""
+        items = [
+            {'id': index, 'language': SUPPORTED_LANGUAGES.get(lang, lang), 'text': text}
+            for index, (lang, text) in enumerate(batch)
+        ]
+        return (
+            "You translate farming advice for smallholder farmers in Southern Africa. "
+            "Translate the 'text' of each item below into its 'language'. Keep numbers, units, "
+            "crop and product names accurate and keep each translation about as short as the original.\n"
+            f"Reply with only a JSON array of {len(batch)} strings, in the same order as the items.\n\n"
+            f"{json.dumps(items, ensure_ascii=False)}"
+        )
+
+    def _parse_response(self, content, expected):
+        """Extract the JSON array of translations from the LLM reply"""
+        content = str(content)
+        start, end = content.find('['), content.rfind(']')
+        if start == -1 or end <= start:
+            return None
+        try:
+            translations = json.loads(content[start:end + 1])
+        except ValueError:
+            return None
+        if not isinstance(translations, list) or len(translations) != expected:
+            return None
+        return [str(item).strip() if item else None for item in translations]
+
+    def get_metrics(self):
+        """Per-language cache hit rates and batching counters"""
+        with self._lock:
+            languages = {}
+            for lang, stats in self.stats.items():
+                lookups = stats.hits + stats.misses
+                if not lookups:
+                    continue
+                languages[lang] = {
+                    'hits': stats.hits,
+                    'misses': stats.misses,
+                    'fallbacks': stats.fallbacks,
+                    'hit_rate': round(stats.hits / lookups, 3)
+                }
+
+            metrics = {
+                'enabled': self.enabled,
+                'cache_entries': len(self.cache),
+                'cache_size': self.cache_size,
+                'in_flight': len(self._inflight),
+                'batches': self.batches,
+                'failed_batches': self.failed_batches,
+                'avg_batch_size': round(self.batched_items / self.batches, 2) if self.batches else 0.0,
+                'languages': languages
+            }
+
+        metrics['llm_latency'] = self.llm_latency.summary()
+        return metrics
+
+
+# Shared translator instance
+answer_translator = AnswerTranslator.from_env()
+
+
+# Function to register with the main app
+def register_answer_translation(app):
+    """Expose AI answer translation cache metrics on /metrics/ai_translation"""
+    app.config['ANSWER_TRANSLATOR'] = answer_translator
+
+    @app.route('/metrics/ai_translation')
+    def ai_translation_metrics():
+        from flask import jsonify
+        return jsonify(answer_translator.get_metrics())
+
+    return answer_translator
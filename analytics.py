@@ -0,0 +1,485 @@
+# analytics.py - Rollups of crop recommendations (province x crop x week) and USSD menu use (menu node x day)
+#
+# Rollups are maintained on write: each recommendation or USSD hop bumps an
+# in-memory counter, and every ANALYTICS_FLUSH_INTERVAL seconds the counters
+# are applied to the rollup collections as $inc upserts in one bulk write.
+# USSD hops are also appended to the ussd_hops log. The admin endpoints read
+# only the rollups, so their cost depends on the number of crops, menus and
+# weeks asked for, not on how much raw data there is.
+#
+# `python analytics.py backfill` rebuilds the rollups exactly from
+# crop_recommendations and ussd_hops with an aggregation (e.g. after first
+# deploying this, or if a flush was interrupted mid-write).
+
+import hmac
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from metrics import LatencyStats
+
+RECOMMENDATION_ROLLUP = 'rollup_recommendations'
+MENU_ROLLUP = 'rollup_ussd_menus'
+HOP_LOG = 'ussd_hops'
+
+MENU_LABELS = {
+    'main': 'Main menu',
+    '0': 'AI chat',
+    '1': 'Farming advice',
+    '2': 'Crop recommendations',
+    '3': 'Current season info',
+    '4': 'Set location',
+    '5': 'Set farming type',
+    '6': 'Language options',
+    '7': 'Market prices'
+}
+
+# Deeper USSD levels are free text (questions, soil values), not menus
+MENU_DEPTH = 2
+
+
+def utcnow():
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def normalize_province(province):
+    """'Mashonaland East', 'mashonaland_east' -> 'mashonaland_east'; blank -> 'unknown'"""
+    province = (province or '').strip().lower().replace(' ', '_')
+    return province or 'unknown'
+
+
+def iso_week(moment):
+    """ISO week key, e.g. '2026-W42' (same as $dateToString '%G-W%V')"""
+    return moment.strftime('%G-W%V')
+
+
+def recommendation_row_id(province, crop, week, season):
+    """Rollup _id of one recommendation row; an ISO week can straddle two seasons, so season is part of it"""
+    return f"{province}|{crop}|{week}|{season or 'unknown'}"
+
+
+def menu_node(text, mode=None):
+    """Menu node a USSD hop landed on: 'main', '2', '2*5'...; AI chat hops are all '0'"""
+    if not text:
+        return 'main'
+    navigation = text.split('*')
+    if mode == 'chat' or navigation[0] == '0':
+        return '0'
+    node = []
+    for choice in navigation[:MENU_DEPTH]:
+        if not (choice.isdigit() and len(choice) <= 2):
+            break
+        node.append(choice)
+    return '*'.join(node) or 'main'
+
+
+def menu_label(node):
+    top = node.split('*')[0]
+    label = MENU_LABELS.get(top, 'Unknown')
+    return label if node == top else f"{label} > option {node.split('*', 1)[1]}"
+
+
+class AnalyticsRollups:
+    """Counters buffered in memory and folded into MongoDB rollups in bulk"""
+
+    def __init__(self, flush_interval=5.0, max_buffered_hops=100000):
+        self.flush_interval = flush_interval
+        self.max_buffered_hops = max_buffered_hops
+        self.collections = None
+
+        self.recommendations = 0
+        self.hops = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.dropped_hops = 0
+        self.flush_latency = LatencyStats()
+        self.read_latency = LatencyStats()
+
+        # (province, crop, week, season) -> count
+        self._recommendation_counts = defaultdict(int)
+        # (node, day) -> [hops, ended sessions, total ms]
+        self._menu_counts = defaultdict(lambda: [0, 0, 0.0])
+        # Newest hops are kept when MongoDB is unreachable for long
+        self._hop_log = deque(maxlen=max_buffered_hops)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+        self._wakeup = threading.Event()
+
+    @classmethod
+    def from_env(cls):
+        """Build the rollup writer from ANALYTICS_* environment settings"""
+        return cls(
+            flush_interval=float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', 5)),
+            max_buffered_hops=int(os.environ.get('ANALYTICS_MAX_BUFFERED_HOPS', 100000))
+        )
+
+    def attach(self, database):
+        """Write rollups through `database` (db.Database) and start the flusher"""
+        collections = {name: database.collection(name) for name in (RECOMMENDATION_ROLLUP, MENU_ROLLUP, HOP_LOG)}
+        try:
+            collections[RECOMMENDATION_ROLLUP].create_index([('province', 1), ('season', 1), ('week', 1)])
+            collections[MENU_ROLLUP].create_index([('day', 1)])
+            collections[HOP_LOG].create_index([('created_at', 1)])
+        except PyMongoError as e:
+            print(f"Error creating analytics indexes: {str(e)}")
+        self.collections = collections
+        self.start()
+
+    # Recording (request threads)
+
+    def record_recommendation(self, province, crop, season, at=None):
+        at = at or utcnow()
+        with self._lock:
+            self._recommendation_counts[(normalize_province(province), crop, iso_week(at), season)] += 1
+            self.recommendations += 1
+
+    def record_hop(self, session_id, user_id, text, mode=None, response=None, elapsed=0.0, at=None):
+        at = at or utcnow()
+        node = menu_node(text, mode)
+        ended = 1 if (response or '').startswith('END') else 0
+        with self._lock:
+            counts = self._menu_counts[(node, at.strftime('%Y-%m-%d'))]
+            counts[0] += 1
+            counts[1] += ended
+            counts[2] += elapsed * 1000
+            self.hops += 1
+            if len(self._hop_log) == self._hop_log.maxlen:
+                self.dropped_hops += 1
+            self._hop_log.append({
+                '_id': ObjectId(),
+                'session_id': session_id,
+                'user_id': user_id,
+                'node': node,
+                'ended': bool(ended),
+                'total_ms': round(elapsed * 1000, 2),
+                'created_at': at
+            })
+
+    # Flushing
+
+    def _requeue(self, recommendation_counts, menu_counts, hop_log):
+        with self._lock:
+            for key, count in recommendation_counts.items():
+                self._recommendation_counts[key] += count
+            for key, (hops, ended, total_ms) in menu_counts.items():
+                counts = self._menu_counts[key]
+                counts[0] += hops
+                counts[1] += ended
+                counts[2] += total_ms
+            # Unwritten hops go back in front of the ones logged since; the oldest give way if it is full
+            overflow = len(hop_log) + len(self._hop_log) - self.max_buffered_hops
+            if overflow > 0:
+                self.dropped_hops += overflow
+            self._hop_log = deque(hop_log + list(self._hop_log), maxlen=self.max_buffered_hops)
+
+    def flush(self):
+        """Apply buffered counters as $inc upserts and append buffered hops; returns rollup rows touched"""
+        if self.collections is None:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                recommendation_counts, self._recommendation_counts = self._recommendation_counts, defaultdict(int)
+                menu_counts, self._menu_counts = self._menu_counts, defaultdict(lambda: [0, 0, 0.0])
+                hop_log, self._hop_log = list(self._hop_log), deque(maxlen=self.max_buffered_hops)
+            if not (recommendation_counts or menu_counts or hop_log):
+                return 0
+
+            rows = len(recommendation_counts) + len(menu_counts)
+            now = utcnow()
+            started = time.monotonic()
+            try:
+                if hop_log:
+                    # inserted_at is when this attempt reached MongoDB; incremental exports window on it
+                    for hop in hop_log:
+                        hop['inserted_at'] = now
+                    try:
+                        self.collections[HOP_LOG].insert_many(hop_log, ordered=False)
+                    except BulkWriteError as e:
+                        # Hops already logged by an earlier, interrupted flush are duplicates
+                        if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                            raise
+                    hop_log = []
+                if recommendation_counts:
+                    self.collections[RECOMMENDATION_ROLLUP].bulk_write([
+                        UpdateOne({'_id': recommendation_row_id(province, crop, week, season)}, {
+                            '$inc': {'count': count},
+                            '$set': {'province': province, 'crop': crop, 'week': week, 'season': season,
+                                     'updated_at': now}
+                        }, upsert=True)
+                        for (province, crop, week, season), count in recommendation_counts.items()
+                    ], ordered=False)
+                    recommendation_counts = {}
+                if menu_counts:
+                    self.collections[MENU_ROLLUP].bulk_write([
+                        UpdateOne({'_id': f"{node}|{day}"}, {
+                            '$inc': {'hops': hops, 'ended': ended, 'total_ms': round(total_ms, 2)},
+                            '$set': {'node': node, 'day': day, 'updated_at': now}
+                        }, upsert=True)
+                        for (node, day), (hops, ended, total_ms) in menu_counts.items()
+                    ], ordered=False)
+            except PyMongoError as e:
+                # Whatever wasn't written goes back for the next flush. A batch that failed part
+                # way can be counted twice; `python analytics.py backfill` recomputes exactly.
+                self._requeue(recommendation_counts, menu_counts, hop_log)
+                self.flush_errors += 1
+                print(f"Error flushing analytics rollups (will retry): {str(e)}")
+                return 0
+
+            self.flush_latency.record(time.monotonic() - started)
+            self.flushes += 1
+            return rows
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error in analytics flusher: {str(e)}")
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='analytics-rollups', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        """Stop the flusher and write what is still buffered"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    # Backfill
+
+    def backfill(self, database):
+        """Recompute both rollups from the raw collections with server-side aggregations"""
+        now = utcnow()
+        # Rows keyed before season was part of the _id would be counted twice alongside the rebuilt ones
+        database.collection(RECOMMENDATION_ROLLUP).delete_many({'_id': {'$regex': r'^[^|]*\|[^|]*\|[^|]*$'}})
+        database.collection('crop_recommendations').aggregate([
+            {'$group': {
+                '_id': {
+                    'province': {'$replaceAll': {
+                        'input': {'$toLower': {'$ifNull': ['$inputs.province', '']}}, 'find': ' ', 'replacement': '_'
+                    }},
+                    'crop': '$outputs.predicted_crop',
+                    'week': {'$dateToString': {'date': '$created_at', 'format': '%G-W%V'}},
+                    'season': '$outputs.season'
+                },
+                'count': {'$sum': 1}
+            }},
+            {'$project': {
+                '_id': {'$concat': [
+                    {'$cond': [{'$eq': ['$_id.province', '']}, 'unknown', '$_id.province']}, '|',
+                    '$_id.crop', '|', '$_id.week', '|', {'$ifNull': ['$_id.season', 'unknown']}
+                ]},
+                'province': {'$cond': [{'$eq': ['$_id.province', '']}, 'unknown', '$_id.province']},
+                'crop': '$_id.crop',
+                'week': '$_id.week',
+                'season': '$_id.season',
+                'count': 1,
+                'updated_at': now
+            }},
+            {'$merge': {'into': RECOMMENDATION_ROLLUP, 'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+        ])
+        database.collection(HOP_LOG).aggregate([
+            {'$group': {
+                '_id': {'node': '$node', 'day': {'$dateToString': {'date': '$created_at', 'format': '%Y-%m-%d'}}},
+                'hops': {'$sum': 1},
+                'ended': {'$sum': {'$cond': ['$ended', 1, 0]}},
+                'total_ms': {'$sum': '$total_ms'}
+            }},
+            {'$project': {
+                '_id': {'$concat': ['$_id.node', '|', '$_id.day']},
+                'node': '$_id.node',
+                'day': '$_id.day',
+                'hops': 1,
+                'ended': 1,
+                'total_ms': 1,
+                'updated_at': now
+            }},
+            {'$merge': {'into': MENU_ROLLUP, 'whenMatched': 'replace', 'whenNotMatched': 'insert'}}
+        ])
+
+    # Reads (rollups only)
+
+    def crop_summary(self, province=None, season=None, weeks=26):
+        """Recommended crops per province (all if None) over the last `weeks` weeks"""
+        query = {'week': {'$gte': iso_week(utcnow() - timedelta(weeks=weeks))}}
+        if province:
+            query['province'] = normalize_province(province)
+        if season:
+            query['season'] = season
+
+        started = time.monotonic()
+        rows = list(self.collections[RECOMMENDATION_ROLLUP].find(query, {'_id': 0, 'updated_at': 0}))
+        self.read_latency.record(time.monotonic() - started)
+
+        crops = defaultdict(int)
+        by_week = defaultdict(int)
+        for row in rows:
+            crops[row['crop']] += row['count']
+            by_week[row['week']] += row['count']
+        total = sum(crops.values())
+        return {
+            'province': normalize_province(province) if province else 'all',
+            'season': season or 'all',
+            'weeks': weeks,
+            'total': total,
+            'crops': [{'crop': crop, 'count': count, 'share': round(count / total, 4)}
+                      for crop, count in sorted(crops.items(), key=lambda item: -item[1])],
+            'by_week': dict(sorted(by_week.items()))
+        }
+
+    def menu_summary(self, days=7):
+        """USSD menu nodes by number of hops over the last `days` days"""
+        since = (utcnow() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+
+        started = time.monotonic()
+        rows = list(self.collections[MENU_ROLLUP].find({'day': {'$gte': since}}, {'_id': 0, 'updated_at': 0}))
+        self.read_latency.record(time.monotonic() - started)
+
+        nodes = defaultdict(lambda: [0, 0, 0.0])
+        for row in rows:
+            counts = nodes[row['node']]
+            counts[0] += row['hops']
+            counts[1] += row.get('ended', 0)
+            counts[2] += row.get('total_ms', 0.0)
+        total = sum(hops for hops, ended, total_ms in nodes.values())
+        return {
+            'days': days,
+            'since': since,
+            'total_hops': total,
+            'menus': [{
+                'node': node,
+                'label': menu_label(node),
+                'hops': hops,
+                'share': round(hops / total, 4),
+                'ended_here': ended,
+                'avg_ms': round(total_ms / hops, 2)
+            } for node, (hops, ended, total_ms) in sorted(nodes.items(), key=lambda item: -item[1][0])]
+        }
+
+    def get_metrics(self):
+        """Buffered counters and flush / read latency"""
+        with self._lock:
+            buffered = {
+                'recommendation_rows': len(self._recommendation_counts),
+                'menu_rows': len(self._menu_counts),
+                'hops': len(self._hop_log)
+            }
+        return {
+            'persistent': self.collections is not None,
+            'recommendations': self.recommendations,
+            'hops': self.hops,
+            'buffered': buffered,
+            'flushes': self.flushes,
+            'flush_errors': self.flush_errors,
+            'dropped_hops': self.dropped_hops,
+            'flush_latency': self.flush_latency.summary(),
+            'read_latency': self.read_latency.summary()
+        }
+
+
+# Shared by predict_crop / the USSD handler (writes) and the admin endpoints (reads)
+analytics = AnalyticsRollups.from_env()
+
+
+def register_analytics(app):
+    """Maintain the rollups once MongoDB is reachable and add the /admin/analytics endpoints"""
+    import atexit
+    from db import database
+
+    database.on_connect(lambda: analytics.attach(database))
+    atexit.register(analytics.close)
+    app.config['ANALYTICS'] = analytics
+
+    def refused():
+        """Error response unless X-Admin-Token matches ANALYTICS_TOKEN (refused outright while it is unset)"""
+        from flask import jsonify, request
+
+        token = os.environ.get('ANALYTICS_TOKEN')
+        if not token:
+            return jsonify({'error': 'Admin analytics are disabled (ANALYTICS_TOKEN is not set)'}), 503
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode()):
+            return jsonify({'error': 'unauthorized'}), 401
+        return None
+
+    @app.route('/admin/analytics/recommendations', methods=['GET'])
+    def crop_recommendation_analytics():
+        """?province=masvingo&season=summer&weeks=26"""
+        from flask import jsonify, request
+
+        error = refused()
+        if error:
+            return error
+        if analytics.collections is None:
+            return jsonify({'error': 'Analytics are unavailable (no database connection)'}), 503
+        weeks = max(1, min(request.args.get('weeks', 26, type=int), 260))
+        try:
+            return jsonify(analytics.crop_summary(request.args.get('province'), request.args.get('season'), weeks))
+        except PyMongoError as e:
+            print(f"Error reading recommendation rollups: {str(e)}")
+            return jsonify({'error': 'Could not read analytics'}), 503
+
+    @app.route('/admin/analytics/ussd_menus', methods=['GET'])
+    def ussd_menu_analytics():
+        """?days=7"""
+        from flask import jsonify, request
+
+        error = refused()
+        if error:
+            return error
+        if analytics.collections is None:
+            return jsonify({'error': 'Analytics are unavailable (no database connection)'}), 503
+        days = max(1, min(request.args.get('days', 7, type=int), 366))
+        try:
+            return jsonify(analytics.menu_summary(days))
+        except PyMongoError as e:
+            print(f"Error reading USSD menu rollups: {str(e)}")
+            return jsonify({'error': 'Could not read analytics'}), 503
+
+    @app.route('/metrics/analytics', methods=['GET'])
+    def analytics_metrics():
+        from flask import jsonify
+        return jsonify(analytics.get_metrics())
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    from db import database
+
+    parser = argparse.ArgumentParser(description='Rebuild or print the recommendation and USSD menu rollups')
+    parser.add_argument('command', choices=['backfill', 'crops', 'menus'])
+    parser.add_argument('--province')
+    parser.add_argument('--season')
+    parser.add_argument('--weeks', type=int, default=26)
+    parser.add_argument('--days', type=int, default=7)
+    args = parser.parse_args()
+
+    if not database.ping():
+        raise SystemExit(1)
+    if args.command == 'backfill':
+        started = time.monotonic()
+        analytics.backfill(database)
+        print(f"Rollups rebuilt in {time.monotonic() - started:.1f}s")
+    else:
+        analytics.collections = {name: database.collection(name) for name in (RECOMMENDATION_ROLLUP, MENU_ROLLUP)}
+        summary = analytics.crop_summary(args.province, args.season, args.weeks) if args.command == 'crops' \
+            else analytics.menu_summary(args.days)
+        print(json.dumps(summary, indent=2))
@@ -1,6 +1,6 @@
 # Complete app.py with AI-powered USSD - Fixed for deployment
 
-from flask import Flask, render_template, request, jsonify, send_from_directory, session, make_response, redirect, url_for
+from flask import Flask, render_template, request, jsonify, send_from_directory, session, make_response, redirect, url_for, has_request_context
 from langchain_groq import ChatGroq
 from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationChain
@@ -15,13 +15,30 @@ import requests
 from datetime import datetime
 import uuid
 import re
+import threading
+import time
 from functools import wraps
-from pymongo import MongoClient
-from pymongo.server_api import ServerApi
 from dotenv import load_dotenv
 import csv
 from io import StringIO
 from bson.objectid import ObjectId
+from db import database, register_database
+from deferred_answers import register_deferred_answers, DEFERRED_USSD_MESSAGE
+from ussd_gateways import register_ussd_gateways
+from ussd_tracing import tracer, register_ussd_tracing
+from translations.reloader import register_translation_reload
+from ai_translation import answer_translator, register_answer_translation, USSD_AI_BUDGET_SECONDS
+from translations import translation_manager
+from sms_encoding import prepare_for_channel, truncate_to_budget
+from audience_index import audience_index, register_audience_index
+from weather import weather_service, register_weather
+from market_prices import market_price_store, register_market_prices
+from pest_alerts import farm_index, register_pest_alerts
+from delivery_reports import register_delivery_reports
+from user_profiles import UserProfileRepository, register_user_profiles
+from recommendation_history import recommendation_history, register_recommendation_history
+from analytics import analytics, register_analytics
+from export import register_export
 
 # Load environment variables from .env file
 load_dotenv()
@@ -32,11 +49,22 @@ app = Flask(__name__,
     template_folder='templates')
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', os.urandom(24))
 
+def index_user_profile(user_id, prefs):
+    """Keep the campaign audience and farm indexes in step with a user's preferences"""
+    audience_index.update(user_id, prefs)
+    farm_index.update(user_id, prefs)
+
 # Initialize global variables
 llm = None
-user_preferences = {}  # Store user preferences
+user_preferences = UserProfileRepository.from_env(on_change=index_user_profile)  # Store user preferences (MongoDB once connected)
 ussd_sessions = {}     # Store USSD sessions
 
+def set_user_preference(user_id, **values):
+    """Create or update a user's preferences (saved to MongoDB in the background) and reindex them"""
+    prefs = user_preferences.update(user_id, values)
+    index_user_profile(user_id, prefs)
+    return prefs
+
 # USSD menu structure
 MAIN_MENU = """🌾 Mudhumeni AI Farm Guide
 1. Get Farming Advice
@@ -45,6 +73,7 @@ MAIN_MENU = """🌾 Mudhumeni AI Farm Guide
 4. Set My Location
 5. Set Farming Type
 6. Language Options
+7. Market Prices
 0. Chat with AI Assistant
 """
 
@@ -93,27 +122,11 @@ def initialize_llm():
 
 # MongoDB Connection Setup
 def setup_mongodb():
-    """Setup MongoDB connection"""
-    try:
-        mongodb_uri = os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/')
-        client = MongoClient(mongodb_uri, server_api=ServerApi('1'))
-        client.admin.command('ping')
-        print("MongoDB connection successful")
-        
-        db = client['mudhumeni_db']
-        crop_recommendations = db['crop_recommendations']
-        crop_recommendations.create_index([("user_id", 1)])
-        
-        return {
-            "client": client,
-            "db": db,
-            "collections": {
-                "crop_recommendations": crop_recommendations
-            }
-        }
-    except Exception as e:
-        print(f"Error connecting to MongoDB: {str(e)}")
-        return None
+    """Configure the shared MongoDB data layer; indexes are created once it is reachable"""
+    database.on_connect(
+        lambda: database.collection('crop_recommendations').create_index([("user_id", 1)])
+    )
+    return database
 
 # AI-Powered USSD Handler
 @app.route('/ussd', methods=['POST'])
@@ -125,11 +138,40 @@ def ussd_handler():
     phone_number = request.form.get('phoneNumber', '')
     text = request.form.get('text', '')
     
+    return process_ussd_request(session_id, service_code, phone_number, text)
+
+def process_ussd_request(session_id, service_code, phone_number, text):
+    """Run one USSD hop through the menu engine and return the CON/END response text"""
+    
     print(f"USSD Request: sessionId={session_id}, text='{text}'")
     
-    # Create or retrieve user session
+    response = None
+    user_session = None
+    started = time.perf_counter()
+    tracer.start_hop(session_id, text)
+    try:
+        with tracer.span('session_lookup'):
+            user_session = get_ussd_session(session_id, phone_number)
+        
+        with tracer.span('menu_dispatch'):
+            response = dispatch_ussd_menu(user_session, service_code, phone_number, text)
+        
+        # Transliterate (and optionally strip emoji) so the screen can stay GSM-7
+        with tracer.span('formatting'):
+            response = prepare_for_channel(response, 'ussd')
+        return response
+    finally:
+        tracer.end_hop(response)
+        if user_session is not None:
+            analytics.record_hop(session_id, user_session['user_id'], text, user_session.get('mode'),
+                                 response, time.perf_counter() - started)
+
+def get_ussd_session(session_id, phone_number):
+    """Create or retrieve the USSD session for a gateway session id"""
     if session_id not in ussd_sessions:
-        user_id = str(uuid.uuid4())
+        # Returning farmers keep their saved location, farming type and language
+        user_id = (audience_index.user_for_phone(phone_number) or user_preferences.find_by_phone(phone_number)
+                   if phone_number else None) or str(uuid.uuid4())
         ussd_sessions[session_id] = {
             'user_id': user_id,
             'phone_number': phone_number,
@@ -139,14 +181,18 @@ def ussd_handler():
         }
         
         if user_id not in user_preferences:
-            user_preferences[user_id] = {
-                'phone_number': phone_number,
-                'language': 'en',
-                'location': '',
-                'farming_type': ''
-            }
-    
-    user_session = ussd_sessions[session_id]
+            set_user_preference(
+                user_id,
+                phone_number=phone_number,
+                language='en',
+                location='',
+                farming_type=''
+            )
+    
+    return ussd_sessions[session_id]
+
+def dispatch_ussd_menu(user_session, service_code, phone_number, text):
+    """Route a USSD hop to the right menu and build the response"""
     user_id = user_session['user_id']
     
     # Process the USSD request
@@ -171,24 +217,10 @@ def ussd_handler():
                 # Get AI response
                 try:
                     print(f"Getting AI response for: {current_choice}")
-                    ai_response = chatbot_response(current_choice, user_id)
+                    ai_response = ussd_ai_answer(current_choice, user_id)
                     
                     # Format for USSD
-                    if len(ai_response) > 140:
-                        # Truncate to fit USSD
-                        sentences = ai_response.split('. ')
-                        formatted_response = ""
-                        for sentence in sentences:
-                            if len(formatted_response + sentence + '. ') <= 140:
-                                formatted_response += sentence + '. '
-                            else:
-                                break
-                        if not formatted_response:
-                            formatted_response = ai_response[:137] + "..."
-                        else:
-                            formatted_response = formatted_response.strip()
-                    else:
-                        formatted_response = ai_response
+                    formatted_response = format_for_ussd(ai_response, by_sentence=True)
                     
                     return f"END 💡 {formatted_response}\n\n💬 To continue chatting, dial {service_code} again"
                     
@@ -196,29 +228,34 @@ def ussd_handler():
                     print(f"AI Response Error: {str(e)}")
                     return "END Sorry, I'm having trouble right now. Please try again later."
     
+    # Soil test entry (2*5*...) spans up to 7 more hops
+    if len(navigation) >= 3 and navigation[0] == '2' and navigation[1] == '5':
+        return handle_soil_entry_hop(user_session, current_choice)
+    
     # Handle Menu Navigation with AI Enhancement
     if len(navigation) == 1:
         if current_choice == '1':
             return "CON 🌱 Farming Advice:\n1. Planting Times\n2. Fertilizer Use\n3. Pest Control\n4. Irrigation\n5. Harvesting\n6. Ask Custom Question"
         elif current_choice == '2':
-            return "CON 🌽 Crop Recommendations:\n1. Best crops for my area\n2. Soil analysis guide\n3. Seasonal recommendations\n4. Ask about specific crop"
+            return "CON 🌽 Crop Recommendations:\n1. Best crops for my area\n2. Soil analysis guide\n3. Seasonal recommendations\n4. Ask about specific crop\n5. Enter my soil test results"
         elif current_choice == '3':
             # Use AI for seasonal info
+            # Cached forecast for the farmer's location, if there is one
+            forecast = weather_line_for_user(user_id)
             try:
                 season = get_current_season()
                 query = f"What should farmers focus on during {season} season in Southern Africa? Give 2-3 key activities."
-                ai_response = chatbot_response(query, user_id)
+                ai_response = ussd_ai_answer(query, user_id)
                 
                 # Format for USSD
-                if len(ai_response) > 120:
-                    ai_response = ai_response[:117] + "..."
+                ai_response = format_for_ussd(ai_response, max_length=120)
                 
-                return f"END 🌿 {season.title()} Season:\n{ai_response}"
+                return f"END 🌿 {season.title()} Season:\n{forecast}{ai_response}"
             except Exception as e:
                 print(f"AI Error: {e}")
                 season = get_current_season()
                 crops = ", ".join(seasonal_crops[season][:3])
-                return f"END 🌿 Current season: {season}\nRecommended crops: {crops}"
+                return f"END 🌿 Current season: {season}\n{forecast}Recommended crops: {crops}"
         
         elif current_choice == '4':
             return "CON 📍 Select Your Province:\n1. Harare\n2. Bulawayo\n3. Manicaland\n4. Mashonaland Central\n5. Other"
@@ -226,6 +263,12 @@ def ussd_handler():
             return "CON 🚜 Select Farming Type:\n1. Subsistence\n2. Small-scale commercial\n3. Large-scale commercial\n4. Mixed farming"
         elif current_choice == '6':
             return "CON 🗣️ Select Language:\n1. English\n2. Shona\n3. Ndebele\n4. Afrikaans"
+        elif current_choice == '7':
+            location, prices = market_prices_for_user(user_id)
+            if not prices:
+                return f"END 💰 No market prices for {location} yet. Please check again later."
+            crops = "\n".join(f"{i}. {crop.title()}" for i, crop in enumerate(prices, 1))
+            return f"CON 💰 Market Prices ({location}):\n{crops}"
         else:
             return "CON Invalid selection. " + MAIN_MENU
             
@@ -250,21 +293,10 @@ def ussd_handler():
                 if question:
                     try:
                         print(f"Getting AI advice for: {question}")
-                        ai_response = chatbot_response(question, user_id)
+                        ai_response = ussd_ai_answer(question, user_id)
                         
                         # Format for USSD
-                        if len(ai_response) > 140:
-                            sentences = ai_response.split('. ')
-                            formatted_response = ""
-                            for sentence in sentences:
-                                if len(formatted_response + sentence + '. ') <= 140:
-                                    formatted_response += sentence + '. '
-                                else:
-                                    break
-                            if not formatted_response:
-                                formatted_response = ai_response[:137] + "..."
-                        else:
-                            formatted_response = ai_response
+                        formatted_response = format_for_ussd(ai_response, by_sentence=True)
                         
                         return f"END 💡 {formatted_response}"
                     except Exception as e:
@@ -282,6 +314,10 @@ def ussd_handler():
         elif main_choice == '2':  # Crop Recommendations
             if sub_choice == '4':
                 return "CON 🌱 Which crop? (e.g. maize, tobacco, cotton):"
+            elif sub_choice == '5':
+                # Soil values are accumulated in the session, one per hop
+                user_session['soil_values'] = []
+                return "CON 🧪 " + soil_entry_prompt(0) + "\nOr send all 7 at once: N,P,K,T,H,pH,R"
             else:
                 # Use AI for crop recommendations
                 queries = {
@@ -294,13 +330,10 @@ def ussd_handler():
                 if query:
                     try:
                         print(f"Getting AI crop advice: {query}")
-                        ai_response = chatbot_response(query, user_id)
+                        ai_response = ussd_ai_answer(query, user_id)
                         
                         # Format for USSD
-                        if len(ai_response) > 140:
-                            formatted_response = ai_response[:137] + "..."
-                        else:
-                            formatted_response = ai_response
+                        formatted_response = format_for_ussd(ai_response)
                         
                         return f"END 🌾 {formatted_response}"
                     except Exception as e:
@@ -313,20 +346,30 @@ def ussd_handler():
         elif main_choice == '4':  # Set Location
             locations = {'1': 'Harare', '2': 'Bulawayo', '3': 'Manicaland', '4': 'Mashonaland Central', '5': 'Other'}
             location = locations.get(sub_choice, 'Unknown')
-            user_preferences[user_id]['location'] = location
+            set_user_preference(user_id, location=location)
             return f"END 📍 Location set to: {location}"
             
         elif main_choice == '5':  # Set Farming Type
             farming_types = {'1': 'Subsistence', '2': 'Small-scale commercial', '3': 'Large-scale commercial', '4': 'Mixed farming'}
             farming_type = farming_types.get(sub_choice, 'Unknown')
-            user_preferences[user_id]['farming_type'] = farming_type
+            set_user_preference(user_id, farming_type=farming_type)
             return f"END 🚜 Farming type set to: {farming_type}"
             
         elif main_choice == '6':  # Set Language
             languages = {'1': 'English', '2': 'Shona', '3': 'Ndebele', '4': 'Afrikaans'}
             language = languages.get(sub_choice, 'English')
-            user_preferences[user_id]['language'] = language
+            set_user_preference(user_id, language=language)
             return f"END 🗣️ Language set to: {language}"
+        
+        elif main_choice == '7':  # Market price for one crop
+            location, prices = market_prices_for_user(user_id)
+            crops = list(prices)
+            if not sub_choice.isdigit() or not 1 <= int(sub_choice) <= len(crops):
+                return "END Invalid selection. Please dial again."
+            crop = crops[int(sub_choice) - 1]
+            summary = prices[crop]
+            averages = "\n".join(f"{days}-day avg: ${average:.2f}" for days, average in summary.averages.items())
+            return f"END 💰 {crop.title()} in {location}\n${summary.price:.2f}/kg on {summary.day}\n{averages}"
             
     elif len(navigation) == 3:
         main_choice = navigation[0]
@@ -334,15 +377,17 @@ def ussd_handler():
         user_question = current_choice
         
         if main_choice == '1' and sub_choice == '6':  # Custom farming question
+            # Answer by SMS when deferred answers are enabled
+            deferred = app.config.get('DEFERRED_ANSWERS')
+            if deferred and deferred.submit(phone_number, user_question, user_id):
+                return DEFERRED_USSD_MESSAGE
+            
             try:
                 print(f"Getting AI response for custom question: {user_question}")
-                ai_response = chatbot_response(user_question, user_id)
+                ai_response = ussd_ai_answer(user_question, user_id)
                 
                 # Format for USSD
-                if len(ai_response) > 140:
-                    formatted_response = ai_response[:137] + "..."
-                else:
-                    formatted_response = ai_response
+                formatted_response = format_for_ussd(ai_response)
                 
                 return f"END 💡 {formatted_response}"
             except Exception as e:
@@ -350,15 +395,18 @@ def ussd_handler():
                 return "END Sorry, couldn't process your question. Please try again later."
                 
         elif main_choice == '2' and sub_choice == '4':  # Specific crop question
+            query = f"Tell me about growing {user_question} in Southern Africa"
+            
+            # Answer by SMS when deferred answers are enabled
+            deferred = app.config.get('DEFERRED_ANSWERS')
+            if deferred and deferred.submit(phone_number, query, user_id, title=user_question.title()):
+                return DEFERRED_USSD_MESSAGE
+            
             try:
-                query = f"Tell me about growing {user_question} in Southern Africa"
                 print(f"Getting AI crop info: {query}")
-                ai_response = chatbot_response(query, user_id)
+                ai_response = ussd_ai_answer(query, user_id)
                 
-                if len(ai_response) > 140:
-                    formatted_response = ai_response[:137] + "..."
-                else:
-                    formatted_response = ai_response
+                formatted_response = format_for_ussd(ai_response)
                 
                 return f"END 🌱 {user_question.title()}:\n{formatted_response}"
             except Exception as e:
@@ -367,6 +415,78 @@ def ussd_handler():
         
     return "END Session too long. Please start again."
 
+def translate_ai_answer(answer, user_id, deadline=None):
+    """Translate an English AI answer into the user's language (keyword replacement if past the deadline)"""
+    lang = translation_manager.get_user_language(user_preferences, user_id)
+    if lang == 'en':
+        return answer
+    with tracer.span('translation'):
+        return answer_translator.translate(answer, lang, deadline=deadline)
+
+def ussd_ai_answer(question, user_id):
+    """AI answer for a USSD hop in the user's language; the answer and its translation share one time budget"""
+    deadline = time.monotonic() + USSD_AI_BUDGET_SECONDS
+    return translate_ai_answer(chatbot_response(question, user_id), user_id, deadline=deadline)
+
+def weather_line_for_user(user_id):
+    """Forecast line for the user's location from the weather cache, or '' (a cold location is fetched in the background)"""
+    location = user_preferences.get(user_id, {}).get('location')
+    if not location or location in ('Other', 'Unknown'):
+        return ""
+    forecast = weather_service.get(location, timeout=0)
+    if not forecast:
+        return ""
+    lang = translation_manager.get_user_language(user_preferences, user_id)
+    return translation_manager.translate('weather_forecast_summary', lang, location=location, **forecast) + "\n"
+
+def market_prices_for_user(user_id, max_crops=8):
+    """(location shown, {crop: PriceSummary}) for the user's location or the default market"""
+    location = user_preferences.get(user_id, {}).get('location') or market_price_store.default_location
+    prices = market_price_store.location_prices(location, fallback=False)
+    if not prices:
+        location = market_price_store.default_location
+        prices = market_price_store.location_prices(location, fallback=False)
+    return location, dict(sorted(prices.items())[:max_crops])
+
+def format_for_ussd(ai_response, max_length=140, by_sentence=False):
+    """Shorten an AI answer to fit a USSD screen, optionally at a sentence boundary"""
+    with tracer.span('formatting'):
+        # max_length is in GSM-7 characters; text that needs UCS-2 gets half the room
+        ai_response = prepare_for_channel(ai_response, 'ussd')
+        return truncate_to_budget(ai_response, max_length, by_sentence=by_sentence)
+
+def soil_entry_prompt(index):
+    """USSD prompt for the soil parameter at `index`"""
+    low, high, label, unit = SOIL_PARAMETER_RANGES[SOIL_PARAMETERS[index]]
+    return f"Enter {label} ({low}-{high}{unit}):"
+
+def handle_soil_entry_hop(user_session, entry):
+    """Take one soil entry, re-prompt on errors and recommend once all 7 values are in"""
+    collected = user_session.setdefault('soil_values', [])
+    
+    error = accumulate_soil_entry(collected, entry)
+    if error == 'input':
+        return "CON Please enter a number. " + soil_entry_prompt(len(collected))
+    elif error:
+        return "CON " + soil_range_message(error) + ". " + soil_entry_prompt(len(collected))
+    
+    if len(collected) < len(SOIL_PARAMETERS):
+        return "CON " + soil_entry_prompt(len(collected))
+    
+    values = list(collected)
+    user_session['soil_values'] = []
+    
+    crop = predict_crop_from_features(values)
+    if crop is None:
+        return "END Crop model is not available right now. Please try the web platform."
+    
+    season = get_current_season()
+    advice = get_seasonal_advice(crop, season)
+    location = (user_preferences.get(user_session['user_id']) or {}).get('location', '')
+    save_crop_recommendation(user_session['user_id'], values, location, crop, season, advice)
+    response = f"END 🌱 Recommended crop: {crop.title()}"
+    return response + f"\n{advice}" if advice else response
+
 # Utility functions
 def sanitize_input(input_string):
     """Remove potentially dangerous characters"""
@@ -374,32 +494,135 @@ def sanitize_input(input_string):
         return None
     return re.sub(r'[${}()"]', '', input_string)
 
+# Accepted soil and climate inputs, in model feature order: (min, max, label, unit)
+SOIL_PARAMETERS = ['nitrogen', 'phosphorus', 'potassium', 'temperature', 'humidity', 'ph', 'rainfall']
+SOIL_PARAMETER_RANGES = {
+    'nitrogen': (0, 150, 'Nitrogen', ' mg/kg'),
+    'phosphorus': (0, 150, 'Phosphorus', ' mg/kg'),
+    'potassium': (0, 150, 'Potassium', ' mg/kg'),
+    'temperature': (0, 50, 'Temperature', ' °C'),
+    'humidity': (0, 100, 'Humidity', '%'),
+    'ph': (0, 14, 'pH', ''),
+    'rainfall': (0, 5000, 'Rainfall', ' mm')
+}
+SOIL_RANGE_MIN = np.array([SOIL_PARAMETER_RANGES[p][0] for p in SOIL_PARAMETERS], dtype=float)
+SOIL_RANGE_MAX = np.array([SOIL_PARAMETER_RANGES[p][1] for p in SOIL_PARAMETERS], dtype=float)
+
+def soil_range_message(param):
+    """Human-readable range error for a soil parameter"""
+    low, high, label, unit = SOIL_PARAMETER_RANGES[param]
+    return f"{label} must be between {low} and {high}{unit}"
+
+def find_invalid_soil_values(values, offset=0):
+    """Return the indexes (into SOIL_PARAMETERS) of values outside their accepted range.
+
+    `values` holds consecutive parameters starting at SOIL_PARAMETERS[offset].
+    """
+    vector = np.asarray(values, dtype=float)
+    low = SOIL_RANGE_MIN[offset:offset + len(vector)]
+    high = SOIL_RANGE_MAX[offset:offset + len(vector)]
+    return np.flatnonzero(~((vector >= low) & (vector <= high))) + offset
+
+def accumulate_soil_entry(collected, entry):
+    """Parse one USSD soil entry into `collected` (a list in SOIL_PARAMETERS order).
+
+    The entry is either the next single value or, as the first entry, all seven
+    values at once ("N,P,K,T,H,pH,R"). Returns None when the entry is accepted,
+    otherwise the name of the first invalid parameter ('input' if not numeric).
+    """
+    parts = [part for part in re.split(r'[,;\s]+', entry.strip()) if part]
+    if not parts or (len(parts) > 1 and (collected or len(parts) != len(SOIL_PARAMETERS))):
+        return 'input'
+    
+    try:
+        values = [float(part) for part in parts]
+    except ValueError:
+        return 'input'
+    
+    invalid = find_invalid_soil_values(values, offset=len(collected))
+    if len(invalid):
+        return SOIL_PARAMETERS[invalid[0]]
+    
+    collected.extend(values)
+    return None
+
 def validate_recommendation_data(data):
     """Validate recommendation data before insertion"""
-    required_fields = ['nitrogen', 'phosphorus', 'potassium', 'temperature', 'humidity', 'ph', 'rainfall']
-    
-    for field in required_fields:
+    for field in SOIL_PARAMETERS:
         if field not in data['inputs']:
             return False, f"Missing required field: {field}"
             
     # Validate ranges
-    if not (0 <= data['inputs']['nitrogen'] <= 150):
-        return False, "Nitrogen must be between 0 and 150 mg/kg"
-    if not (0 <= data['inputs']['phosphorus'] <= 150):
-        return False, "Phosphorus must be between 0 and 150 mg/kg"
-    if not (0 <= data['inputs']['potassium'] <= 150):
-        return False, "Potassium must be between 0 and 150 mg/kg"
-    if not (0 <= data['inputs']['temperature'] <= 50):
-        return False, "Temperature must be between 0 and 50 °C"
-    if not (0 <= data['inputs']['humidity'] <= 100):
-        return False, "Humidity must be between 0 and 100%"
-    if not (0 <= data['inputs']['ph'] <= 14):
-        return False, "pH must be between 0 and 14"
-    if not (0 <= data['inputs']['rainfall'] <= 5000):
-        return False, "Rainfall must be between 0 and 5000 mm"
+    invalid = find_invalid_soil_values([data['inputs'][field] for field in SOIL_PARAMETERS])
+    if len(invalid):
+        return False, soil_range_message(SOIL_PARAMETERS[invalid[0]])
         
     return True, "Data is valid"
 
+# Crop model labels (see train_model.py)
+CROP_LABELS = {
+    1: 'rice', 2: 'maize', 3: 'jute', 4: 'cotton', 5: 'coconut',
+    6: 'papaya', 7: 'orange', 8: 'apple', 9: 'muskmelon', 10: 'watermelon',
+    11: 'grapes', 12: 'mango', 13: 'banana', 14: 'pomegranate',
+    15: 'lentil', 16: 'blackgram', 17: 'mungbean', 18: 'mothbeans',
+    19: 'pigeonpeas', 20: 'kidneybeans', 21: 'chickpea', 22: 'coffee'
+}
+
+_crop_models = None
+_crop_models_lock = threading.Lock()
+
+def load_crop_models():
+    """Load the crop model and scalers once per process; None if not trained yet"""
+    global _crop_models
+    if _crop_models is None:
+        with _crop_models_lock:
+            if _crop_models is None:
+                model_files = ('model.pkl', 'minmaxscaler.pkl', 'standscaler.pkl')
+                if not all(os.path.exists(path) for path in model_files):
+                    return None
+                
+                loaded = []
+                for path in model_files:
+                    with open(path, 'rb') as f:
+                        loaded.append(pickle.load(f))
+                _crop_models = tuple(loaded)
+    return _crop_models
+
+def predict_crop_from_features(values):
+    """Predict a crop for [N, P, K, temperature, humidity, ph, rainfall]; None if no model"""
+    models = load_crop_models()
+    if models is None:
+        return None
+    
+    model, minmaxscaler, standscaler = models
+    features = np.array([values], dtype=float)
+    sc_mx_features = standscaler.transform(minmaxscaler.transform(features))
+    prediction = model.predict(sc_mx_features)
+    return CROP_LABELS[prediction[0]]
+
+def save_crop_recommendation(user_id, values, province, crop, season, advice):
+    """Queue a recommendation for the user's history and the analytics rollups; returns its history id"""
+    analytics.record_recommendation(province, crop, season)
+    return recommendation_history.record(user_id, {
+        'nitrogen': values[0], 'phosphorus': values[1], 'potassium': values[2],
+        'temperature': values[3], 'humidity': values[4], 'ph': values[5], 'rainfall': values[6],
+        'province': province
+    }, {
+        'predicted_crop': crop,
+        'season': season,
+        'seasonal_advice': advice
+    })
+
+def get_seasonal_advice(crop, season):
+    """Short note on how well a crop suits the given season"""
+    if crop in seasonal_crops[season]:
+        return f"Good choice! {crop.title()} is well-suited for the current {season} season."
+    
+    appropriate_season = next((s for s, crops in seasonal_crops.items() if crop in crops), None)
+    if appropriate_season:
+        return f"Note: {crop.title()} is typically better for {appropriate_season} season."
+    return ""
+
 # Generate system prompt for web chatbot
 def generate_system_prompt(user_id=None):
     season = get_current_season()
@@ -439,9 +662,7 @@ def chatbot_response(user_input, user_id=None):
         # Handle preference setting
         if user_input.lower().startswith("set location:"):
             location = user_input[13:].strip()
-            if user_id not in user_preferences:
-                user_preferences[user_id] = {}
-            user_preferences[user_id]["location"] = location
+            set_user_preference(user_id, location=location)
             return f"Thank you! I've noted that you're farming in {location}."
         
         # Handle season inquiry
@@ -450,8 +671,8 @@ def chatbot_response(user_input, user_id=None):
             crops = ", ".join(seasonal_crops[season])
             return f"We're currently in {season} season in Southern Africa. Recommended crops: {crops}"
         
-        # Get conversation history
-        chat_history = session.get('chat_history', [])
+        # Get conversation history (background workers have no web session)
+        chat_history = session.get('chat_history', []) if has_request_context() else []
         history_text = ""
         
         recent_history = chat_history[-10:] if len(chat_history) > 10 else chat_history
@@ -468,7 +689,8 @@ def chatbot_response(user_input, user_id=None):
         else:
             full_prompt = f"{system_prompt}\n\nUser: {user_input}\nAssistant:"
             
-        response = llm.invoke(full_prompt)
+        with tracer.span('llm'):
+            response = llm.invoke(full_prompt)
         return response.content
         
     except Exception as e:
@@ -479,13 +701,52 @@ def chatbot_response(user_input, user_id=None):
 print("Initializing Mudhumeni AI Chatbot......")
 llm = initialize_llm()
 
-mongo_data = setup_mongodb()
-if mongo_data:
-    app.config['MONGO_DATA'] = mongo_data
-    print("MongoDB integration initialized successfully")
-else:
-    print("WARNING: MongoDB connection failed. Some features may be limited.")
-    app.config['MONGO_DATA'] = None
+# Pooled MongoDB client with timeouts and a circuit breaker; connects in the background
+# so a slow or missing database never holds up boot
+setup_mongodb()
+register_database(app)
+
+# Persist user preferences to MongoDB (read-through cache, write-behind bulk upserts)
+register_user_profiles(app, user_preferences)
+
+# Crop recommendation history (batched inserts, cursor-paged history endpoints)
+register_recommendation_history(app)
+
+# Province x crop x week and USSD menu x day rollups, read by /admin/analytics
+register_analytics(app)
+
+# Streamed gzip CSV exports for offline analysis (/admin/export/<dataset>)
+register_export(app)
+
+# Deferred (SMS) answers for slow USSD AI questions
+register_deferred_answers(app)
+
+# In-process USSD gateway adapters (Africa's Talking, Comviva, Infobip)
+register_ussd_gateways(app)
+
+# Per-hop USSD span histograms on /metrics/ussd
+register_ussd_tracing(app)
+
+# Reload edited translation files without restarting the workers
+register_translation_reload(app)
+
+# LLM translation cache for AI answers in other languages
+register_answer_translation(app)
+
+# Location / crop / language index for SMS campaign audiences
+register_audience_index(app)
+
+# Cached per-location forecasts shared by weather alerts and the USSD season info screen
+register_weather(app)
+
+# Market price feeds (CSV drops) for the price SMS campaign and USSD menu
+register_market_prices(app)
+
+# Pest outbreak reports and feed, matched to nearby farms growing affected crops
+register_pest_alerts(app)
+
+# SMS delivery report webhook and per-campaign delivery metrics
+register_delivery_reports(app)
 
 print("USSD AI interface registered successfully")
 
@@ -505,58 +766,45 @@ def chatbot():
 
 @app.route('/crop-recommendation')
 def crop_recommendation():
+    if 'user_id' not in session:
+        session['user_id'] = str(uuid.uuid4())
     return render_template('crop_recommendation.html')
 
+@app.route('/recommendation-history')
+def recommendation_history_page():
+    return render_template('recommendation_history.html')
+
 @app.route('/predict_crop', methods=['POST'])
 def predict_crop():
     try:
-        # Check if model files exist
-        if not os.path.exists('model.pkl'):
-            return jsonify({'success': False, 'error': 'Model not found. Please train the model first.'})
-        
-        model = pickle.load(open('model.pkl', 'rb'))
-        minmaxscaler = pickle.load(open('minmaxscaler.pkl', 'rb'))
-        standscaler = pickle.load(open('standscaler.pkl', 'rb'))
-        
         data = request.form
-        N = float(data['N'])
-        P = float(data['P'])
-        K = float(data['K'])
-        temperature = float(data['temperature'])
-        humidity = float(data['humidity'])
-        ph = float(data['ph'])
-        rainfall = float(data['rainfall'])
+        values = [
+            float(data['N']), float(data['P']), float(data['K']),
+            float(data['temperature']), float(data['humidity']),
+            float(data['ph']), float(data['rainfall'])
+        ]
         province = sanitize_input(data.get('province', ''))
         
-        features = np.array([[N, P, K, temperature, humidity, ph, rainfall]])
-        mx_features = minmaxscaler.transform(features)
-        sc_mx_features = standscaler.transform(mx_features)
-        prediction = model.predict(sc_mx_features)
-        
-        crop_dict = {
-            1: 'rice', 2: 'maize', 3: 'jute', 4: 'cotton', 5: 'coconut',
-            6: 'papaya', 7: 'orange', 8: 'apple', 9: 'muskmelon', 10: 'watermelon',
-            11: 'grapes', 12: 'mango', 13: 'banana', 14: 'pomegranate',
-            15: 'lentil', 16: 'blackgram', 17: 'mungbean', 18: 'mothbeans',
-            19: 'pigeonpeas', 20: 'kidneybeans', 21: 'chickpea', 22: 'coffee'
-        }
+        predicted_crop = predict_crop_from_features(values)
+        if predicted_crop is None:
+            return jsonify({'success': False, 'error': 'Model not found. Please train the model first.'})
         
-        predicted_crop = crop_dict[prediction[0]]
         season = get_current_season()
+        seasonal_advice = get_seasonal_advice(predicted_crop, season)
         
-        seasonal_advice = ""
-        if predicted_crop in seasonal_crops[season]:
-            seasonal_advice = f"Good choice! {predicted_crop.title()} is well-suited for the current {season} season."
-        else:
-            appropriate_season = next((s for s, crops in seasonal_crops.items() if predicted_crop in crops), None)
-            if appropriate_season:
-                seasonal_advice = f"Note: {predicted_crop.title()} is typically better for {appropriate_season} season."
+        if 'user_id' not in session:
+            session['user_id'] = str(uuid.uuid4())
+        # Queued for batched writes; the response doesn't wait for MongoDB
+        recommendation_id = save_crop_recommendation(
+            session['user_id'], values, province, predicted_crop, season, seasonal_advice
+        )
         
         return jsonify({
             'success': True, 
             'prediction': predicted_crop,
             'season': season,
-            'seasonal_advice': seasonal_advice
+            'seasonal_advice': seasonal_advice,
+            'recommendation_id': recommendation_id
         })
     
     except Exception as e:
@@ -593,11 +841,8 @@ def internal_error(error):
 
 if __name__ == '__main__':
     try:
-        # Check if model files exist
-        if os.path.exists('model.pkl') and os.path.exists('minmaxscaler.pkl') and os.path.exists('standscaler.pkl'):
-            model = pickle.load(open('model.pkl', 'rb'))
-            minmaxscaler = pickle.load(open('minmaxscaler.pkl', 'rb'))
-            standscaler = pickle.load(open('standscaler.pkl', 'rb'))
+        # Load the models into the shared cache used by /predict_crop and USSD
+        if load_crop_models() is not None:
             print("ML models loaded successfully")
         else:
             print("WARNING: ML model files not found. Crop recommendation feature will be limited.")
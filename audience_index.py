@@ -0,0 +1,188 @@
+# audience_index.py - Location / crop / language index over user preferences for campaign targeting
+
+import threading
+
+# Farming type keywords that pin a user's primary crop (checked in order)
+FARMING_TYPE_CROPS = (
+    ('maize', 'maize'),
+    ('cotton', 'cotton'),
+    ('tobacco', 'tobacco'),
+    ('vegetable', 'vegetables'),
+    ('livestock', 'pasture')
+)
+
+# Index key for users whose primary crop depends on the season (chosen at send time)
+SEASONAL_CROP = None
+
+
+def primary_crop(farming_type):
+    """Primary crop implied by a farming type, or SEASONAL_CROP when it depends on the season"""
+    farming_type = (farming_type or '').lower()
+    if not farming_type:
+        return 'maize'  # Most common crop in Southern Africa
+    for keyword, crop in FARMING_TYPE_CROPS:
+        if keyword in farming_type:
+            return crop
+    return SEASONAL_CROP
+
+
+def _normalize_language(language):
+    from translations import translation_manager
+    return translation_manager.normalize_language(language)
+
+
+class AudienceIndex:
+    """Reverse indexes (location, crop, language, phone number) -> user ids.
+
+    Kept current by app.set_user_preference, so a campaign picks its audience by
+    intersecting sets instead of scanning every user's preferences.
+    """
+
+    def __init__(self):
+        self.by_location = {}
+        self.by_crop = {}
+        self.by_language = {}
+        self.by_phone = {}
+        self.reachable = set()
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def _add(self, index, key, user_id):
+        users = index.get(key)
+        if users is None:
+            users = index[key] = set()
+        users.add(user_id)
+
+    def _discard(self, index, key, user_id):
+        users = index.get(key)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del index[key]
+
+    def _unindex(self, user_id):
+        keys = self._keys.pop(user_id, None)
+        if keys is None:
+            return
+        location, crop, language, phone_number = keys
+        self._discard(self.by_location, location, user_id)
+        self._discard(self.by_crop, crop, user_id)
+        self._discard(self.by_language, language, user_id)
+        if phone_number:
+            if self.by_phone.get(phone_number) == user_id:
+                del self.by_phone[phone_number]
+            self.reachable.discard(user_id)
+
+    def update(self, user_id, prefs):
+        """(Re)index one user from their current preferences"""
+        keys = (
+            prefs.get('location') or 'Unknown',
+            primary_crop(prefs.get('farming_type')),
+            _normalize_language(prefs.get('language')),
+            prefs.get('phone_number') or None
+        )
+        with self._lock:
+            if self._keys.get(user_id) == keys:
+                return
+            self._unindex(user_id)
+            location, crop, language, phone_number = keys
+            self._keys[user_id] = keys
+            self._add(self.by_location, location, user_id)
+            self._add(self.by_crop, crop, user_id)
+            self._add(self.by_language, language, user_id)
+            if phone_number:
+                self.by_phone[phone_number] = user_id
+                self.reachable.add(user_id)
+
+    def remove(self, user_id):
+        """Drop a user from every index"""
+        with self._lock:
+            self._unindex(user_id)
+
+    def rebuild(self, preferences):
+        """Index every user in a {user_id: prefs} mapping from scratch"""
+        with self._lock:
+            self.by_location = {}
+            self.by_crop = {}
+            self.by_language = {}
+            self.by_phone = {}
+            self.reachable = set()
+            self._keys = {}
+        for user_id, prefs in list(preferences.items()):
+            self.update(user_id, prefs)
+
+    def _sets(self, index, keys):
+        if keys is None:
+            return None
+        return [index[key] for key in set(keys) if key in index]
+
+    def select(self, locations=None, crops=None, languages=None, reachable_only=True):
+        """User ids matching every given filter (any of the values within one filter).
+
+        Pass crops=[SEASONAL_CROP] to include users whose crop depends on the season.
+        """
+        with self._lock:
+            filters = [
+                self._sets(self.by_location, locations),
+                self._sets(self.by_crop, crops),
+                self._sets(self.by_language, languages and [_normalize_language(lang) for lang in languages]),
+                [self.reachable] if reachable_only else None
+            ]
+            filters = sorted((sets for sets in filters if sets is not None), key=lambda sets: sum(map(len, sets)))
+            if not filters:
+                return set(self._keys)
+
+            # Start from the smallest filter and intersect per set, so the work is
+            # proportional to the audience rather than to the sets being combined
+            audience = set().union(*filters[0])
+            for sets in filters[1:]:
+                if len(sets) == 1:
+                    audience &= sets[0]
+                else:
+                    audience = set().union(*(audience & users for users in sets))
+            return audience
+
+    def by_location_groups(self, reachable_only=True):
+        """{location: user ids} for every indexed location"""
+        with self._lock:
+            if not reachable_only:
+                return {location: set(users) for location, users in self.by_location.items()}
+            return {
+                location: users & self.reachable
+                for location, users in self.by_location.items()
+                if not users.isdisjoint(self.reachable)
+            }
+
+    def crops(self):
+        """Indexed crop keys (SEASONAL_CROP included if any user has one)"""
+        with self._lock:
+            return list(self.by_crop)
+
+    def user_for_phone(self, phone_number):
+        """User id registered with this phone number, or None"""
+        return self.by_phone.get(phone_number)
+
+    def get_metrics(self):
+        """Index sizes"""
+        with self._lock:
+            return {
+                'users': len(self._keys),
+                'reachable': len(self.reachable),
+                'locations': {location: len(users) for location, users in self.by_location.items()},
+                'crops': {crop or 'seasonal': len(users) for crop, users in self.by_crop.items()},
+                'languages': {language: len(users) for language, users in self.by_language.items()}
+            }
+
+
+# Shared index over app.user_preferences
+audience_index = AudienceIndex()
+
+
+def register_audience_index(app):
+    """Expose audience index sizes on /metrics/audience"""
+    app.config['AUDIENCE_INDEX'] = audience_index
+
+    @app.route('/metrics/audience', methods=['GET'])
+    def audience_metrics():
+        from flask import jsonify
+        return jsonify(audience_index.get_metrics())
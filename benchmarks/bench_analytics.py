@@ -0,0 +1,114 @@
+# bench_analytics.py - "Which crops are recommended in Masvingo?": scanning raw history vs reading the rollups
+#
+# Usage: MONGODB_URI=mongodb://localhost:27017/ python benchmarks/bench_analytics.py [--rows 1000000]
+#
+# Needs a running MongoDB; uses (and drops) the mudhumeni_bench database.
+# Loads synthetic crop_recommendations and USSD hops, builds the rollups both
+# ways (on write through AnalyticsRollups, and with the backfill aggregation),
+# checks they agree, then times the admin queries against raw data and rollups.
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson.objectid import ObjectId
+
+from analytics import HOP_LOG, MENU_ROLLUP, RECOMMENDATION_ROLLUP, AnalyticsRollups, normalize_province, utcnow
+from db import Database
+
+PROVINCES = ['Harare', 'Bulawayo', 'Manicaland', 'Masvingo', 'Midlands', 'Mashonaland East', 'Limpopo']
+CROPS = ['maize', 'sorghum', 'cotton', 'groundnuts', 'rice', 'coffee', 'banana', 'mango', 'chickpea', 'lentil']
+MENUS = ['', '1', '1*2', '2', '2*5', '3', '4', '5', '6', '7', '7*1', '0']
+
+
+def load(database, rollups, rows, seed):
+    rng = random.Random(seed)
+    now = utcnow()
+    recommendations = []
+    for _ in range(rows):
+        at = now - timedelta(minutes=rng.randrange(365 * 24 * 60))
+        province, crop = rng.choice(PROVINCES), rng.choice(CROPS)
+        season = 'summer' if at.month in (12, 1, 2) else 'autumn' if at.month < 6 else 'winter' if at.month < 9 else 'spring'
+        recommendations.append({'_id': ObjectId(), 'user_id': f'user-{rng.randrange(50000)}', 'created_at': at,
+                                'inputs': {'province': province.lower().replace(' ', '_')},
+                                'outputs': {'predicted_crop': crop, 'season': season}})
+        rollups.record_recommendation(province, crop, season, at=at)
+        rollups.record_hop(f'session-{rng.randrange(rows)}', None, rng.choice(MENUS), None,
+                           rng.choice(['CON', 'END']), rng.uniform(0.005, 0.2), at=at)
+        if len(recommendations) == 10000:
+            database.collection('crop_recommendations').insert_many(recommendations)
+            recommendations = []
+            rollups.flush()
+    if recommendations:
+        database.collection('crop_recommendations').insert_many(recommendations)
+    rollups.flush()
+
+
+def timed(call, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = call()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare raw-data aggregation with rollup reads for the admin analytics')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=13)
+    args = parser.parse_args()
+
+    database = Database(uri=os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/'), name='mudhumeni_bench',
+                        socket_timeout_ms=600000)
+    database.client.drop_database('mudhumeni_bench')
+    rollups = AnalyticsRollups(max_buffered_hops=args.rows)
+    rollups.collections = {name: database.collection(name) for name in (RECOMMENDATION_ROLLUP, MENU_ROLLUP, HOP_LOG)}
+    database.collection(RECOMMENDATION_ROLLUP).create_index([('province', 1), ('season', 1), ('week', 1)])
+    database.collection(MENU_ROLLUP).create_index([('day', 1)])
+    database.collection('crop_recommendations').create_index([('inputs.province', 1), ('created_at', 1)])
+
+    started = time.perf_counter()
+    load(database, rollups, args.rows, args.seed)
+    print(f"Rows: {args.rows:,} recommendations and hops, loaded in {time.perf_counter() - started:.1f}s\n")
+
+    on_write = {row['_id']: row['count'] for row in database.collection(RECOMMENDATION_ROLLUP).find({})}
+    backfill_seconds, _ = timed(lambda: rollups.backfill(database), repeat=1)
+    rebuilt = {row['_id']: row['count'] for row in database.collection(RECOMMENDATION_ROLLUP).find({})}
+    assert on_write == rebuilt, 'rollups maintained on write differ from the backfill'
+    print(f"Backfill aggregation: {backfill_seconds:.2f}s (matches the rollups kept on write)\n")
+
+    since = utcnow() - timedelta(weeks=26)
+    province = normalize_province('Masvingo')
+
+    def raw_crops():
+        return list(database.collection('crop_recommendations').aggregate([
+            {'$match': {'inputs.province': province, 'created_at': {'$gte': since}}},
+            {'$group': {'_id': '$outputs.predicted_crop', 'count': {'$sum': 1}}}
+        ]))
+
+    def raw_menus():
+        return list(database.collection(HOP_LOG).aggregate([
+            {'$match': {'created_at': {'$gte': utcnow() - timedelta(days=7)}}},
+            {'$group': {'_id': '$node', 'hops': {'$sum': 1}}}
+        ]))
+
+    print(f"{'query':<34}{'raw ms':>10}{'rollup ms':>11}")
+    for name, raw, rollup in (
+        ('crops in Masvingo, last 26 weeks', raw_crops, lambda: rollups.crop_summary('Masvingo', weeks=26)),
+        ('USSD menus, last 7 days', raw_menus, lambda: rollups.menu_summary(7)),
+    ):
+        raw_seconds, _ = timed(raw)
+        rollup_seconds, _ = timed(rollup)
+        print(f"{name:<34}{raw_seconds * 1000:>10.1f}{rollup_seconds * 1000:>11.2f}")
+    database.client.drop_database('mudhumeni_bench')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# bench_audience_index.py - Campaign audience selection: full preference scan vs audience index
+#
+# Usage: python benchmarks/bench_audience_index.py [--users 1000000] [--repeat 5]
+#
+# Builds synthetic user preferences, indexes them, then times the audience
+# queries the SMS campaigns run: the old loop over every user's preferences
+# against set intersections on the index.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audience_index import AudienceIndex, primary_crop, SEASONAL_CROP
+
+LOCATIONS = [
+    "Harare", "Bulawayo", "Manicaland", "Mashonaland Central", "Mashonaland East",
+    "Mashonaland West", "Masvingo", "Matabeleland North", "Matabeleland South", "Midlands",
+    "Gauteng", "Western Cape", "Limpopo"
+]
+FARMING_TYPES = ['maize farming', 'cotton', 'tobacco', 'vegetable gardening', 'livestock', 'Subsistence', '']
+LANGUAGES = ['en', 'sn', 'nd', 'af', 'English', 'Shona']
+
+
+def make_preferences(count, seed):
+    rng = random.Random(seed)
+    return {
+        f'user-{i}': {
+            'phone_number': f'+2637{i:08d}' if rng.random() < 0.9 else '',
+            'location': rng.choice(LOCATIONS),
+            'farming_type': rng.choice(FARMING_TYPES),
+            'language': rng.choice(LANGUAGES)
+        }
+        for i in range(count)
+    }
+
+
+def scan_pest_audience(preferences, regions, target_crops):
+    """The previous check_pest_alerts filter"""
+    audience = []
+    for user_id, prefs in preferences.items():
+        if not prefs.get('phone_number') or not prefs.get('location'):
+            continue
+        if prefs['location'] not in regions:
+            continue
+        crop = primary_crop(prefs.get('farming_type')) or 'seasonal'
+        if any(target in crop for target in target_crops):
+            audience.append(user_id)
+    return audience
+
+
+def index_pest_audience(index, regions, target_crops):
+    crops = [crop for crop in index.crops() if crop is not SEASONAL_CROP and any(t in crop for t in target_crops)]
+    return index.select(locations=regions, crops=crops)
+
+
+def scan_by_location(preferences):
+    """The previous weather / market price grouping"""
+    groups = {}
+    for user_id, prefs in preferences.items():
+        if not prefs.get('phone_number'):
+            continue
+        groups.setdefault(prefs.get('location', 'Unknown'), []).append(user_id)
+    return groups
+
+
+def scan_segment(preferences, location, language):
+    return [
+        user_id for user_id, prefs in preferences.items()
+        if prefs.get('phone_number') and prefs.get('location') == location and prefs.get('language') == language
+    ]
+
+
+def best_of(repeat, func, *args):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare preference scans with the campaign audience index')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    preferences = make_preferences(args.users, args.seed)
+    index = AudienceIndex()
+
+    started = time.perf_counter()
+    index.rebuild(preferences)
+    build_elapsed = time.perf_counter() - started
+
+    # Preference writes (what set_user_preference pays per USSD settings change)
+    rng = random.Random(args.seed)
+    user_ids = rng.sample(list(preferences), min(100000, args.users))
+    started = time.perf_counter()
+    for user_id in user_ids:
+        prefs = preferences[user_id]
+        prefs['location'] = rng.choice(LOCATIONS)
+        index.update(user_id, prefs)
+    update_rate = len(user_ids) / (time.perf_counter() - started)
+
+    queries = [
+        ('pest alert, 1 region, maize', scan_pest_audience, (preferences, ['Masvingo'], ['maize'])),
+        ('pest alert, 3 regions, 2 crops', scan_pest_audience, (preferences, ['Harare', 'Midlands', 'Limpopo'], ['cotton', 'vegetables'])),
+        ('location + language', scan_segment, (preferences, 'Bulawayo', 'nd')),
+        ('group by location', scan_by_location, (preferences,)),
+    ]
+    indexed = {
+        'pest alert, 1 region, maize': lambda: index_pest_audience(index, ['Masvingo'], ['maize']),
+        'pest alert, 3 regions, 2 crops': lambda: index_pest_audience(index, ['Harare', 'Midlands', 'Limpopo'], ['cotton', 'vegetables']),
+        'location + language': lambda: index.select(locations=['Bulawayo'], languages=['nd']),
+        'group by location': index.by_location_groups,
+    }
+
+    print(f"Users: {args.users:,}  index build: {build_elapsed:.2f}s  updates: {update_rate:,.0f}/s\n")
+    print(f"{'query':<32}{'audience':>10}{'scan ms':>10}{'index ms':>10}{'speedup':>9}")
+    for name, scan, scan_args in queries:
+        scan_elapsed, scan_result = best_of(args.repeat, scan, *scan_args)
+        index_elapsed, index_result = best_of(args.repeat, indexed[name])
+        if isinstance(scan_result, dict):
+            assert {k: set(v) for k, v in scan_result.items()} == index_result, name
+            audience = sum(len(v) for v in scan_result.values())
+        else:
+            assert set(scan_result) == index_result, name
+            audience = len(scan_result)
+        print(f"{name:<32}{audience:>10,}{scan_elapsed * 1000:>10.1f}{index_elapsed * 1000:>10.1f}"
+              f"{scan_elapsed / index_elapsed:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
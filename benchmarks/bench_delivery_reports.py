@@ -0,0 +1,78 @@
+# bench_delivery_reports.py - Delivery receipt ingestion: one write per receipt vs batched writes
+#
+# Usage: python benchmarks/bench_delivery_reports.py [--messages 200000] [--per-post 100]
+#
+# Logs synthetic sends, then feeds delivery receipts in webhook-sized posts to
+# a store that commits every receipt on its own and to one that batches, and
+# times the per-campaign rollup over the result.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from delivery_reports import DeliveryReportStore, new_ref
+
+PREFIXES = ['+26377', '+26378', '+26371', '+26373', '+2782', '+2783']
+REASONS = ['absent subscriber', 'network congestion', 'invalid number', 'blocked']
+
+
+def make_traffic(count, campaigns, seed):
+    rng = random.Random(seed)
+    sends = [(f"campaign-{i % campaigns}", new_ref(), f"{rng.choice(PREFIXES)}{i:07d}") for i in range(count)]
+    receipts = []
+    for campaign, ref, phone_number in sends:
+        if rng.random() < 0.92:
+            receipts.append({'client_ref': ref, 'status': 'DELIVRD'})
+        else:
+            receipts.append({'client_ref': ref, 'status': 'UNDELIV', 'error': rng.choice(REASONS)})
+    rng.shuffle(receipts)
+    return sends, receipts
+
+
+def run(store, sends, receipts, per_post):
+    for campaign, ref, phone_number in sends:
+        store.record_sent(campaign, [(ref, phone_number)])
+    store.flush(timeout=600)
+
+    started = time.perf_counter()
+    for start in range(0, len(receipts), per_post):
+        store.record_reports(receipts[start:start + per_post])
+    accepted = time.perf_counter() - started
+    store.flush(timeout=600)
+    ingested = time.perf_counter() - started
+
+    started = time.perf_counter()
+    store.refresh()
+    rollup = time.perf_counter() - started
+    return accepted, ingested, rollup
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-receipt and batched delivery report writes')
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--campaigns', type=int, default=5)
+    parser.add_argument('--per-post', type=int, default=100, help='receipts per webhook post')
+    parser.add_argument('--seed', type=int, default=3)
+    args = parser.parse_args()
+
+    sends, receipts = make_traffic(args.messages, args.campaigns, args.seed)
+    print(f"Messages: {args.messages:,}  receipts: {len(receipts):,}  ({args.per_post} per post)\n")
+    print(f"{'writes':<12}{'accept s':>10}{'ingest s':>10}{'receipts/s':>12}{'rollup s':>10}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, batch_size in (('per receipt', 1), ('batched', 2000)):
+            store = DeliveryReportStore(os.path.join(directory, f"{batch_size}.sqlite3"),
+                                        batch_size=batch_size, flush_interval=0.5 if batch_size > 1 else 0)
+            accepted, ingested, rollup = run(store, sends, receipts, args.per_post)
+            delivered = sum(summary['delivered'] for summary in store.get_metrics()['campaigns'].values())
+            assert delivered == sum(1 for receipt in receipts if receipt['status'] == 'DELIVRD'), name
+            print(f"{name:<12}{accepted:>10.2f}{ingested:>10.2f}{len(receipts) / ingested:>12,.0f}{rollup:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# bench_dry_run.py - Time notification dry runs (audience, rendering, segments, cost) over synthetic users
+#
+# Usage: python benchmarks/bench_dry_run.py [--users 1000000] [job ...]
+#
+# Loads synthetic users into app.user_preferences and the campaign indexes, then
+# runs FarmingSMSNotification.dry_run for each job. Nothing is sent or enqueued.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+from audience_index import audience_index
+from pest_alerts import farm_index
+from sms_notifications import FarmingSMSNotification
+
+LOCATIONS = [
+    "Harare", "Bulawayo", "Manicaland", "Mashonaland Central", "Mashonaland East",
+    "Mashonaland West", "Masvingo", "Matabeleland North", "Matabeleland South", "Midlands",
+    "Gauteng", "Western Cape", "Limpopo"
+]
+FARMING_TYPES = ['maize farming', 'cotton', 'tobacco', 'vegetable gardening', 'livestock', 'Subsistence', '']
+LANGUAGES = ['en', 'sn', 'nd']
+
+
+def load_users(count, seed):
+    rng = random.Random(seed)
+    # Cache only: synthetic users must never reach MongoDB
+    app.user_preferences.prime({
+        f'user-{i}': {
+            'phone_number': f'+2637{i:08d}',
+            'location': rng.choice(LOCATIONS),
+            'farming_type': rng.choice(FARMING_TYPES),
+            'language': rng.choice(LANGUAGES)
+        }
+        for i in range(count)
+    })
+    audience_index.rebuild(app.user_preferences)
+    farm_index.rebuild(app.user_preferences)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time SMS notification dry runs over synthetic users')
+    parser.add_argument('jobs', nargs='*', help='job names (default: all)')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=5)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    load_users(args.users, args.seed)
+    print(f"Users: {args.users:,}  loaded and indexed in {time.perf_counter() - started:.1f}s\n")
+
+    sms_system = FarmingSMSNotification(schedule_jobs=False)
+    results = sms_system.dry_run(args.jobs)
+
+    print(f"{'job':<22}{'campaigns':>10}{'recipients':>12}{'segments':>12}{'cost':>16}{'send time':>11}{'dry run':>9}")
+    for name, result in results.items():
+        cost = f"{result['estimated_cost']:,.2f} {result['currency']}"
+        print(f"{name:<22}{len(result['campaigns']):>10}{result['recipients']:>12,}{result['segments']:>12,}"
+              f"{cost:>16}{result['projected_seconds'] / 60:>9.1f}m{result['dry_run_seconds']:>8.2f}s")
+
+
+if __name__ == '__main__':
+    main()
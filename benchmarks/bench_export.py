@@ -0,0 +1,92 @@
+# bench_export.py - Export memory and speed: load everything into pandas vs stream in chunks
+#
+# Usage: python benchmarks/bench_export.py [--rows 500000] [--chunk-rows 50000]
+#
+# Feeds synthetic crop recommendation documents (shaped like a MongoDB cursor's
+# output) to a pandas DataFrame written with to_csv, and to the chunked export
+# writers. Reports wall time, peak traced memory and file size. Parquet and
+# Arrow are included when pyarrow is installed.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+from bson.objectid import ObjectId
+
+import export
+
+PROVINCES = ['harare', 'bulawayo', 'manicaland', 'masvingo', 'midlands', 'mashonaland_east', 'limpopo']
+CROPS = ['maize', 'sorghum', 'cotton', 'groundnuts', 'rice', 'coffee', 'banana', 'mango', 'chickpea', 'lentil']
+
+
+def documents(rows, seed):
+    """Generator standing in for a server-side cursor"""
+    rng = random.Random(seed)
+    start = datetime(2026, 1, 1)
+    for i in range(rows):
+        yield {
+            '_id': ObjectId(), 'user_id': f'user-{rng.randrange(50000)}', 'created_at': start + timedelta(seconds=i * 30),
+            'inputs': {'nitrogen': rng.randint(0, 140), 'phosphorus': rng.randint(5, 145), 'potassium': rng.randint(5, 205),
+                       'temperature': round(rng.uniform(8, 44), 1), 'humidity': round(rng.uniform(14, 100), 1),
+                       'ph': round(rng.uniform(3.5, 9.9), 2), 'rainfall': round(rng.uniform(20, 300), 1),
+                       'province': rng.choice(PROVINCES)},
+            'outputs': {'predicted_crop': rng.choice(CROPS), 'season': 'summer'}
+        }
+
+
+def load_all(rows, seed, path):
+    """What exporting without streaming looks like: every row in memory, then one write"""
+    frame = pd.DataFrame([export.flatten('recommendations', document) for document in documents(rows, seed)])
+    columns = [column for column, kind in export.DATASETS['recommendations'][2]]
+    frame[columns].to_csv(path, index=False, compression='gzip')
+    return len(frame)
+
+
+def measure(call):
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = call()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare in-memory and streamed exports of crop recommendations')
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--chunk-rows', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=17)
+    args = parser.parse_args()
+
+    print(f"Rows: {args.rows:,}  chunk: {args.chunk_rows:,}  pyarrow: {'yes' if export.ARROW_AVAILABLE else 'no'}\n")
+    print(f"{'export':<20}{'seconds':>9}{'rows/s':>11}{'peak MB':>10}{'file MB':>10}")
+
+    runs = [('pandas, csv.gz', 'csv.gz', lambda path: load_all(args.rows, args.seed, path))]
+    for fmt in ('csv', 'parquet', 'arrow'):
+        if fmt != 'csv' and not export.ARROW_AVAILABLE:
+            continue
+        runs.append((f"streamed, {fmt}", export.EXTENSIONS[fmt].lstrip('.'),
+                     lambda path, fmt=fmt: export.WRITERS[fmt](
+                         'recommendations', export.chunks('recommendations', documents(args.rows, args.seed),
+                                                          args.chunk_rows), path)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name, extension, call in runs:
+            path = os.path.join(directory, f"{name.replace(', ', '-')}.{extension}")
+            rows, elapsed, peak = measure(lambda: call(path))
+            assert rows == args.rows, (name, rows)
+            print(f"{name:<20}{elapsed:>9.2f}{rows / elapsed:>11,.0f}{peak / 2 ** 20:>10.1f}"
+                  f"{os.path.getsize(path) / 2 ** 20:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# bench_market_prices.py - Market price store: CSV ingest rate, cache load time and lookup latency
+#
+# Usage: python benchmarks/bench_market_prices.py [--years 5] [--locations 13] [--crops 12]
+#
+# Writes one CSV drop per year of daily prices, ingests them, then compares the
+# cached latest / rolling-average lookups with the equivalent SQL queries.
+
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from market_prices import MarketPriceStore
+
+
+def write_drops(directory, years, locations, crops, seed):
+    rng = random.Random(seed)
+    start = date.today() - timedelta(days=365 * years)
+    prices = {(location, crop): rng.uniform(0.2, 2.0) for location in locations for crop in crops}
+    rows = 0
+    for year in range(years):
+        with open(os.path.join(directory, f'prices_{year}.csv'), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['date', 'location', 'crop', 'price'])
+            for offset in range(365 * year, 365 * (year + 1)):
+                day = (start + timedelta(days=offset)).isoformat()
+                for key, price in prices.items():
+                    price = max(0.05, price * rng.uniform(0.97, 1.03))
+                    prices[key] = price
+                    writer.writerow([day, key[0], key[1], f'{price:.3f}'])
+                    rows += 1
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure market price ingest and lookup performance')
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--locations', type=int, default=13)
+    parser.add_argument('--crops', type=int, default=12)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=5)
+    args = parser.parse_args()
+
+    locations = [f'Location {i}' for i in range(args.locations)]
+    crops = [f'crop{i}' for i in range(args.crops)]
+
+    with tempfile.TemporaryDirectory() as directory:
+        drop_dir = os.path.join(directory, 'drops')
+        os.mkdir(drop_dir)
+        rows = write_drops(drop_dir, args.years, locations, crops, args.seed)
+        db_path = os.path.join(directory, 'prices.sqlite3')
+
+        store = MarketPriceStore(db_path)
+        started = time.perf_counter()
+        store.ingest_directory(drop_dir)
+        ingest_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        skipped = store.ingest_directory(drop_dir)
+        rescan_elapsed = time.perf_counter() - started
+
+        # A fresh process: build the in-memory summaries from disk
+        store = MarketPriceStore(db_path)
+        tracemalloc.start()
+        started = time.perf_counter()
+        store.location_prices(locations[0])
+        load_elapsed = time.perf_counter() - started
+        cache_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        rng = random.Random(args.seed)
+        keys = [(rng.choice(locations), rng.choice(crops)) for _ in range(args.lookups)]
+        started = time.perf_counter()
+        for location, crop in keys:
+            store.latest(location, crop).averages[30]
+        cached_elapsed = time.perf_counter() - started
+
+        conn = store._conn()
+        sql_keys = keys[:args.lookups // 10]
+        started = time.perf_counter()
+        for location, crop in sql_keys:
+            location, crop = location.lower(), crop.lower()
+            day, price = conn.execute(
+                "SELECT day, price FROM prices WHERE location = ? AND crop = ? ORDER BY day DESC LIMIT 1",
+                (location, crop)
+            ).fetchone()
+            start = (date.fromisoformat(day) - timedelta(days=29)).isoformat()
+            conn.execute("SELECT AVG(price) FROM prices WHERE location = ? AND crop = ? AND day >= ?",
+                         (location, crop, start)).fetchone()
+        sql_elapsed = time.perf_counter() - started
+        db_bytes = os.path.getsize(db_path) + (os.path.getsize(db_path + '-wal') if os.path.exists(db_path + '-wal') else 0)
+
+    print(f"{rows:,} daily prices ({args.years} years x {args.locations} locations x {args.crops} crops)\n")
+    print(f"Ingest:        {ingest_elapsed:6.2f}s  ({rows / ingest_elapsed:,.0f} rows/s), store {db_bytes / 1e6:.1f} MB")
+    print(f"Re-scan drops: {rescan_elapsed * 1000:6.1f} ms  ({skipped} rows re-ingested)")
+    print(f"Cache load:    {load_elapsed * 1000:6.1f} ms  ({args.locations * args.crops} series, {cache_bytes / 1024:.0f} KiB)")
+    print(f"Latest + 30-day average: cached {cached_elapsed / args.lookups * 1e6:.2f} us, "
+          f"SQL {sql_elapsed / len(sql_keys) * 1e6:.1f} us per lookup")
+
+
+if __name__ == '__main__':
+    main()
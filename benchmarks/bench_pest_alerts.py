@@ -0,0 +1,105 @@
+# bench_pest_alerts.py - Pest outbreak matching: haversine scan over every farm vs spatial + audience index
+#
+# Usage: python benchmarks/bench_pest_alerts.py [--users 1000000] [--gps 0.3] [--repeat 5]
+#
+# A share of the synthetic farms (--gps) have their own coordinates scattered
+# around their province; the rest fall back to the province centroid. Each
+# outbreak is matched by distance and affected crop both ways.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audience_index import AudienceIndex, primary_crop
+from pest_alerts import (AFFECTED_CROPS, PROVINCE_COORDINATES, Outbreak, PestAlertMatcher, SpatialIndex,
+                         farm_coordinates, haversine_km)
+
+FARMING_TYPES = ['maize farming', 'cotton', 'tobacco', 'vegetable gardening', 'livestock', 'Subsistence', '']
+
+
+def make_preferences(count, gps_share, seed):
+    rng = random.Random(seed)
+    provinces = sorted(PROVINCE_COORDINATES)
+    preferences = {}
+    for i in range(count):
+        province = rng.choice(provinces)
+        prefs = {
+            'phone_number': f'+2637{i:08d}',
+            'location': province.title(),
+            'farming_type': rng.choice(FARMING_TYPES),
+            'language': 'en'
+        }
+        if rng.random() < gps_share:
+            latitude, longitude = PROVINCE_COORDINATES[province]
+            prefs['latitude'] = latitude + rng.uniform(-1.5, 1.5)
+            prefs['longitude'] = longitude + rng.uniform(-1.5, 1.5)
+        preferences[f'user-{i}'] = prefs
+    return preferences
+
+
+def scan_match(preferences, outbreak):
+    """Distance and crop check on every user's preferences"""
+    target_crops = AFFECTED_CROPS[outbreak.pest]
+    audience = set()
+    for user_id, prefs in preferences.items():
+        if not prefs.get('phone_number'):
+            continue
+        point = farm_coordinates(prefs)
+        if point is None or haversine_km(outbreak.latitude, outbreak.longitude, *point) > outbreak.radius_km:
+            continue
+        crop = primary_crop(prefs.get('farming_type'))
+        if crop is None or any(target in crop for target in target_crops):
+            audience.add(user_id)
+    return audience
+
+
+def best_of(repeat, func, *args):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare a full farm scan with indexed pest outbreak matching')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--gps', type=float, default=0.3, help='share of farms with their own coordinates')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    preferences = make_preferences(args.users, args.gps, args.seed)
+    spatial, audience = SpatialIndex(), AudienceIndex()
+
+    started = time.perf_counter()
+    spatial.rebuild(preferences)
+    audience.rebuild(preferences)
+    build_elapsed = time.perf_counter() - started
+    matcher = PestAlertMatcher(spatial, audience)
+
+    outbreaks = [
+        ('Fall Armyworm, Masvingo 50 km', Outbreak('a', 'Fall Armyworm', -20.07, 30.83, 50.0, 'Masvingo', 'bench', '')),
+        ('Aphids, Harare 25 km', Outbreak('b', 'Aphids', -17.83, 31.05, 25.0, 'Harare', 'bench', '')),
+        ('Whitefly, point 120 km', Outbreak('c', 'Whitefly', -19.5, 29.9, 120.0, None, 'bench', '')),
+    ]
+
+    print(f"Users: {args.users:,}  ({args.gps:.0%} with coordinates)  index build: {build_elapsed:.2f}s  "
+          f"points: {spatial.get_metrics()['points']:,}\n")
+    print(f"{'outbreak':<32}{'audience':>10}{'scan ms':>10}{'index ms':>10}{'speedup':>9}")
+    for name, outbreak in outbreaks:
+        scan_elapsed, scan_result = best_of(args.repeat, scan_match, preferences, outbreak)
+        index_elapsed, index_result = best_of(args.repeat, matcher.match, outbreak)
+        assert scan_result == index_result, name
+        print(f"{name:<32}{len(scan_result):>10,}{scan_elapsed * 1000:>10.1f}{index_elapsed * 1000:>10.1f}"
+              f"{scan_elapsed / index_elapsed:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
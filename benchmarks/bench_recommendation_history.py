@@ -0,0 +1,100 @@
+# bench_recommendation_history.py - Recommendation history paging: skip/limit vs keyset cursors, plus batched inserts
+#
+# Usage: MONGODB_URI=mongodb://localhost:27017/ python benchmarks/bench_recommendation_history.py [--rows 200000] [--users 20]
+#
+# Needs a running MongoDB; uses (and drops) the mudhumeni_bench database.
+# Records synthetic recommendations through RecommendationHistory (batched
+# insert_many), then walks one user's whole history page by page both ways and
+# reports the time per page at increasing depths.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+
+from recommendation_history import SORT, TABLE_PROJECTION, RecommendationHistory
+
+CROPS = ['maize', 'rice', 'cotton', 'coffee', 'banana', 'mango', 'chickpea', 'lentil']
+PROVINCES = ['harare', 'bulawayo', 'manicaland', 'masvingo', 'midlands', 'limpopo']
+
+
+def load(history, rows, users, seed):
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    for _ in range(rows):
+        history.record(f'user-{rng.randrange(users)}', {
+            'nitrogen': rng.randint(0, 140), 'phosphorus': rng.randint(5, 145), 'potassium': rng.randint(5, 205),
+            'temperature': round(rng.uniform(8, 44), 1), 'humidity': round(rng.uniform(14, 100), 1),
+            'ph': round(rng.uniform(3.5, 9.9), 2), 'rainfall': round(rng.uniform(20, 300), 1),
+            'province': rng.choice(PROVINCES)
+        }, {'predicted_crop': rng.choice(CROPS), 'season': 'summer', 'seasonal_advice': ''})
+    recorded = time.perf_counter() - started
+    history.flush(timeout=600)
+    return recorded, time.perf_counter() - started
+
+
+def walk_skip(collection, user_id, per_page):
+    """Per-page seconds reading every page with skip/limit"""
+    timings = []
+    page = 0
+    while True:
+        started = time.perf_counter()
+        documents = list(collection.find({'user_id': user_id}, TABLE_PROJECTION)
+                         .sort(SORT).skip(page * per_page).limit(per_page))
+        timings.append(time.perf_counter() - started)
+        if len(documents) < per_page:
+            return timings
+        page += 1
+
+
+def walk_cursor(history, user_id, per_page):
+    """Per-page seconds reading every page with keyset cursors"""
+    timings = []
+    cursor = None
+    while True:
+        started = time.perf_counter()
+        documents, cursor = history.page(user_id, cursor, per_page, TABLE_PROJECTION)
+        timings.append(time.perf_counter() - started)
+        if cursor is None:
+            return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare skip/limit and cursor paging of recommendation history')
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--per-page', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=11)
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/'))
+    client.drop_database('mudhumeni_bench')
+    collection = client['mudhumeni_bench']['crop_recommendations']
+    history = RecommendationHistory()
+    history.attach(collection)
+
+    recorded, durable = load(history, args.rows, args.users, args.seed)
+    print(f"Rows: {args.rows:,} over {args.users} users  record {args.rows / recorded:,.0f}/s  "
+          f"durable {args.rows / durable:,.0f}/s in {history.batches:,} inserts\n")
+
+    user_id = 'user-0'
+    skip = walk_skip(collection, user_id, args.per_page)
+    cursor = walk_cursor(history, user_id, args.per_page)
+    assert len(skip) == len(cursor), (len(skip), len(cursor))
+
+    print(f"{'page':>8}{'skip ms':>10}{'cursor ms':>11}")
+    depth = 1
+    while depth <= len(skip):
+        print(f"{depth:>8,}{skip[depth - 1] * 1000:>10.2f}{cursor[depth - 1] * 1000:>11.2f}")
+        depth *= 4
+    print(f"{'total':>8}{sum(skip) * 1000:>10.0f}{sum(cursor) * 1000:>11.0f}")
+    client.drop_database('mudhumeni_bench')
+
+
+if __name__ == '__main__':
+    main()
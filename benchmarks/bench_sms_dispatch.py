@@ -0,0 +1,134 @@
+# bench_sms_dispatch.py - SMS dispatch throughput against a local stub gateway
+#
+# Usage: python benchmarks/bench_sms_dispatch.py [--messages 2000] [--latency 0.02] [--error-rate 0.02] [--bulk-size 100]
+#
+# Starts a stub SMS gateway that sleeps for a fixed latency per request and
+# returns 503 for a fraction of them, then sends the same messages with
+# (a) the old pattern, one blocking requests.post per recipient,
+# (b) SMSDispatcher with pooled connections, a worker pool and retries, and
+# (c) the same dispatcher sending identical bodies as bulk calls.
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+from sms_dispatch import SMSDispatcher
+
+
+class StubGateway(BaseHTTPRequestHandler):
+    """Accept SMS posts after a delay, failing some with 503"""
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.02
+    error_rate = 0.0
+    received = 0
+    recipients = 0
+    connections = set()
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        time.sleep(self.latency)
+
+        with self.lock:
+            StubGateway.received += 1
+            StubGateway.recipients += len(body.get('recipients', [])) or 1
+            StubGateway.connections.add(self.client_address)
+
+        status = 503 if random.random() < self.error_rate else 200
+        payload = b'{"status": "queued"}'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if status == 503:
+            self.send_header('Retry-After', '0')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def send_serial(url, messages):
+    """The previous send_sms: a fresh connection and no timeout per recipient"""
+    sent = 0
+    for phone_number, message in messages:
+        try:
+            response = requests.post(url, headers={"Authorization": "Bearer test"},
+                                     json={"recipient": phone_number, "message": message, "sender_id": "Mudhumeni"})
+            response.raise_for_status()
+            sent += 1
+        except Exception:
+            pass
+    return sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare serial SMS sends with the pooled SMS dispatcher')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--serial-messages', type=int, default=300, help='messages for the (slow) serial run')
+    parser.add_argument('--latency', type=float, default=0.02, help='stub gateway latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='fraction of 503 responses')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--rate', type=float, default=0, help='gateway rate limit per second (0 = unlimited)')
+    parser.add_argument('--bulk-size', type=int, default=100, help='recipients per bulk call')
+    parser.add_argument('--bodies', type=int, default=10, help='distinct message bodies (e.g. one per location)')
+    parser.add_argument('--port', type=int, default=8767)
+    args = parser.parse_args()
+
+    StubGateway.latency = args.latency
+    StubGateway.error_rate = args.error_rate
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StubGateway)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{args.port}/messages'
+
+    messages = [(f'+2637{i:08d}', f"Mudhumeni: Market prices update {i % args.bodies}") for i in range(args.messages)]
+    groups = {}
+    for phone_number, message in messages:
+        groups.setdefault(message, []).append(phone_number)
+
+    try:
+        started = time.perf_counter()
+        serial_sent = send_serial(url, messages[:args.serial_messages])
+        serial_elapsed = time.perf_counter() - started
+        serial_rate = args.serial_messages / serial_elapsed
+
+        StubGateway.connections.clear()
+        dispatcher = SMSDispatcher(api_url=url, api_key='test', max_workers=args.workers,
+                                   rate_per_second=args.rate, backoff_seconds=0.01)
+        result = dispatcher.send_many(messages)
+        summary = result.summary()
+        connections = len(StubGateway.connections)
+
+        dispatcher.bulk_size = args.bulk_size
+        bulk = dispatcher.send_groups(list(groups.items())).summary()
+        dispatcher.shutdown()
+    finally:
+        server.shutdown()
+
+    print(f"Stub gateway: {args.latency * 1000:.0f} ms per request, {args.error_rate:.0%} 503 responses\n")
+    print(f"{'path':<22}{'messages':>10}{'sent':>8}{'HTTP calls':>12}{'msg/s':>10}")
+    print(f"{'serial requests.post':<22}{args.serial_messages:>10}{serial_sent:>8}{args.serial_messages:>12}{serial_rate:>10.1f}")
+    print(f"{'SMSDispatcher':<22}{args.messages:>10}{summary['sent']:>8}{summary['http_calls']:>12}"
+          f"{summary['messages_per_second']:>10.1f}")
+    print(f"{'SMSDispatcher bulk':<22}{args.messages:>10}{bulk['sent']:>8}{bulk['http_calls']:>12}"
+          f"{bulk['messages_per_second']:>10.1f}")
+    print(f"\nDispatcher retries: {summary['retries']}, gateway connections opened: {connections}")
+    print(f"Bulk sends saved {bulk['http_calls_saved']} HTTP calls ({args.bodies} bodies, batches of {args.bulk_size})")
+    print(f"Speedup: {summary['messages_per_second'] / serial_rate:.1f}x")
+    print(f"Projected 100k broadcast: serial {100000 / serial_rate / 3600:.1f} h, "
+          f"dispatcher {100000 / summary['messages_per_second'] / 60:.1f} min")
+
+
+if __name__ == '__main__':
+    main()
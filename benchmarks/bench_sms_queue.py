@@ -0,0 +1,97 @@
+# bench_sms_queue.py - Enqueue and drain rates of the durable SMS outbox
+#
+# Usage: python benchmarks/bench_sms_queue.py [--recipients 100000] [--failure-rate 0.01]
+#
+# Enqueues a campaign, enqueues it again (all rows should be ignored), claims a
+# batch with a "crashed" worker, then drains everything through an in-process
+# fake gateway (so only the queue is measured) and checks every recipient got
+# exactly one message.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sms_queue import SMSOutbox, OutboxWorker, campaign_run_id, SENT, DEAD
+
+
+class FakeDispatcher:
+    """Accept bulk calls instantly, failing a fraction of them"""
+
+    api_key = 'test'
+
+    def __init__(self, failure_rate=0.0, bulk_size=100):
+        self.failure_rate = failure_rate
+        self.bulk_size = bulk_size
+        self.delivered = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def send_groups(self, groups, on_result=None, campaign=None):
+        for message, phone_numbers in groups:
+            for start in range(0, len(phone_numbers), self.bulk_size):
+                batch = phone_numbers[start:start + self.bulk_size]
+                ok = random.random() >= self.failure_rate
+                with self._lock:
+                    self.calls += 1
+                    if ok:
+                        for phone_number in batch:
+                            self.delivered[phone_number] = self.delivered.get(phone_number, 0) + 1
+                on_result(batch, message, ok)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure SMS outbox enqueue and drain rates')
+    parser.add_argument('--recipients', type=int, default=100000)
+    parser.add_argument('--locations', type=int, default=25, help='distinct message bodies')
+    parser.add_argument('--batch-size', type=int, default=1000, help='rows claimed per worker batch')
+    parser.add_argument('--failure-rate', type=float, default=0.01, help='fraction of failing gateway calls')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        outbox = SMSOutbox(os.path.join(directory, 'outbox.sqlite3'), max_attempts=5, retry_backoff=0)
+        run_id = campaign_run_id('market_price')
+        items = [
+            (f'user-{i}', f'+2637{i:08d}', f"Mudhumeni: Current market prices in location {i % args.locations}")
+            for i in range(args.recipients)
+        ]
+
+        started = time.perf_counter()
+        added = outbox.enqueue(run_id, items)
+        enqueue_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        added_again = outbox.enqueue(run_id, items)
+        rerun_elapsed = time.perf_counter() - started
+
+        # A worker claims a batch and dies before sending it
+        crashed = outbox.claim(args.batch_size, 'crashed-worker')
+        recovered = outbox.recover_stale(older_than=0)
+
+        dispatcher = FakeDispatcher(failure_rate=args.failure_rate)
+        worker = OutboxWorker(outbox, dispatcher, batch_size=args.batch_size)
+        started = time.perf_counter()
+        drained = worker.drain()
+        drain_elapsed = time.perf_counter() - started
+
+        counts = outbox.stats(run_id)[run_id]
+        duplicates = sum(1 for count in dispatcher.delivered.values() if count > 1)
+
+    print(f"Recipients: {args.recipients:,}  distinct bodies: {args.locations}  gateway failure rate: {args.failure_rate:.0%}\n")
+    print(f"Enqueue:         {added:>9,} rows in {enqueue_elapsed:6.2f}s  ({added / enqueue_elapsed:>10,.0f} rows/s)")
+    print(f"Re-enqueue:      {added_again:>9,} rows in {rerun_elapsed:6.2f}s  ({args.recipients / rerun_elapsed:>10,.0f} rows/s checked)")
+    print(f"Drain:           {drained:>9,} claims in {drain_elapsed:6.2f}s  ({counts[SENT] / drain_elapsed:>10,.0f} sent/s)")
+    print(f"\nCrashed worker claimed {len(crashed):,} rows, {recovered:,} recovered and resent")
+    print(f"Gateway calls: {dispatcher.calls:,}  sent: {counts[SENT]:,}  dead-lettered: {counts[DEAD]:,}  "
+          f"duplicates: {duplicates}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# bench_translations.py - Translation lookups per second: compiled catalogue vs per-file dicts
+#
+# Usage: python benchmarks/bench_translations.py [--seconds 2]
+#
+# The "dict" path is a straightforward manager: one dict per language file, a
+# fallback walk to English for missing/empty entries and str.format on every
+# parameterized lookup. The "compiled" path is translations.translate.
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from translations import SUPPORTED_LANGUAGES, TRANSLATIONS_DIR, translate, get_menu_text
+
+
+def load_tables():
+    tables = {}
+    for code in SUPPORTED_LANGUAGES:
+        with open(os.path.join(TRANSLATIONS_DIR, f'{code}.json'), encoding='utf-8') as f:
+            tables[code] = json.load(f)
+    return tables
+
+
+class DictTranslationManager:
+    """Per-file dict lookup with a fallback walk to English and str.format per call"""
+
+    def __init__(self, tables):
+        self.translations = tables
+
+    def translate(self, key, lang='en', default=None, **kwargs):
+        text = self.translations.get(lang, {}).get(key)
+        if not text:
+            text = self.translations['en'].get(key)
+        if not text:
+            text = default if default is not None else key
+        if kwargs:
+            try:
+                return text.format(**kwargs)
+            except (KeyError, IndexError):
+                return text
+        return text
+
+
+def measure(function, workload, seconds):
+    """Run the workload repeatedly for `seconds` and return lookups per second"""
+    calls = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        for key, lang, kwargs in workload:
+            function(key, lang, **kwargs)
+        calls += len(workload)
+    return calls / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark translation lookups')
+    parser.add_argument('--seconds', type=float, default=2.0)
+    args = parser.parse_args()
+
+    tables = load_tables()
+    dict_translate = DictTranslationManager(tables).translate
+
+    keys = list(tables['en'])
+    languages = list(SUPPORTED_LANGUAGES)
+    random.seed(1)
+
+    plain = [(random.choice(keys), random.choice(languages), {}) for _ in range(1000)]
+    formatted = [(key, random.choice(languages), {'season': 'summer', 'crop': 'maize', 'pests': 'aphids'})
+                 for key in random.choices(['planting_advice', 'fertilizer_advice', 'pest_advice'], k=1000)]
+    missing = [('no_such_key', random.choice(languages), {}) for _ in range(1000)]
+
+    print(f"{'workload':<22}{'dict lookups/s':>18}{'compiled lookups/s':>22}{'speedup':>10}")
+    for name, workload in (('plain keys', plain), ('format templates', formatted), ('unknown keys', missing)):
+        baseline = measure(dict_translate, workload, args.seconds)
+        compiled = measure(translate, workload, args.seconds)
+        print(f"{name:<22}{baseline:>18,.0f}{compiled:>22,.0f}{compiled / baseline:>9.2f}x")
+
+    menus = [(menu, random.choice(languages), {}) for menu in
+             random.choices(['main_menu', 'advice_menu', 'language_menu'], k=1000)]
+    rendered = measure(get_menu_text, menus, args.seconds)
+    print(f"\nPre-rendered menu screens: {rendered:,.0f} per second")
+
+
+if __name__ == '__main__':
+    main()
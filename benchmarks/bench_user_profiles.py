@@ -0,0 +1,97 @@
+# bench_user_profiles.py - Preference writes: one MongoDB update per write vs write-behind bulk upserts
+#
+# Usage: MONGODB_URI=mongodb://localhost:27017/ python benchmarks/bench_user_profiles.py [--writes 50000] [--users 10000]
+#
+# Needs a running MongoDB; uses (and drops) the mudhumeni_bench database.
+# Replays USSD-style preference writes (location, farming type, language
+# changes spread over many users) both ways and reports the write latency the
+# request thread sees and the time until everything is durable.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient
+
+from metrics import LatencyStats
+from user_profiles import UserProfileRepository
+
+LOCATIONS = ["Harare", "Bulawayo", "Manicaland", "Masvingo", "Midlands", "Limpopo"]
+FARMING_TYPES = ['maize farming', 'cotton', 'tobacco', 'vegetable gardening', 'livestock']
+LANGUAGES = ['en', 'sn', 'nd']
+
+
+def make_writes(count, users, seed):
+    rng = random.Random(seed)
+    writes = []
+    for _ in range(count):
+        field, values = rng.choice([('location', LOCATIONS), ('farming_type', FARMING_TYPES), ('language', LANGUAGES)])
+        writes.append((f'user-{rng.randrange(users)}', {field: rng.choice(values)}))
+    return writes
+
+
+def direct(collection, writes):
+    latency = LatencyStats(max_samples=len(writes))
+    started = time.perf_counter()
+    for user_id, values in writes:
+        write_started = time.perf_counter()
+        collection.update_one({'_id': user_id}, {'$set': values, '$currentDate': {'updated_at': True}}, upsert=True)
+        latency.record(time.perf_counter() - write_started)
+    return time.perf_counter() - started, latency
+
+
+def write_behind(collection, writes):
+    repository = UserProfileRepository(sync_interval=0)
+    repository.attach(collection, warm=False)
+    latency = LatencyStats(max_samples=len(writes))
+    started = time.perf_counter()
+    for user_id, values in writes:
+        write_started = time.perf_counter()
+        repository.update(user_id, values)
+        latency.record(time.perf_counter() - write_started)
+    repository.close()
+    return time.perf_counter() - started, latency, repository
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-write MongoDB updates with the write-behind profile store')
+    parser.add_argument('--writes', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=9)
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/'))
+    db = client['mudhumeni_bench']
+    writes = make_writes(args.writes, args.users, args.seed)
+    expected = {}
+    for user_id, values in writes:
+        expected.setdefault(user_id, {}).update(values)
+
+    print(f"Writes: {args.writes:,} over {args.users:,} users\n")
+    print(f"{'mode':<14}{'durable s':>10}{'writes/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'round trips':>13}")
+
+    client.drop_database('mudhumeni_bench')
+    elapsed, latency = direct(db['direct'], writes)
+    summary = latency.summary()
+    print(f"{'per write':<14}{elapsed:>10.2f}{args.writes / elapsed:>11,.0f}{summary['p50_ms']:>9.3f}"
+          f"{summary['p99_ms']:>9.3f}{args.writes:>13,}")
+
+    elapsed, latency, repository = write_behind(db['write_behind'], writes)
+    summary = latency.summary()
+    print(f"{'write-behind':<14}{elapsed:>10.2f}{args.writes / elapsed:>11,.0f}{summary['p50_ms']:>9.3f}"
+          f"{summary['p99_ms']:>9.3f}{repository.flushes:>13,}")
+
+    # Both collections must end up with the same final preferences
+    for name in ('direct', 'write_behind'):
+        for document in db[name].find():
+            stored = {key: value for key, value in document.items() if key not in ('_id', 'updated_at')}
+            assert stored == expected[document['_id']], (name, document['_id'])
+    client.drop_database('mudhumeni_bench')
+
+
+if __name__ == '__main__':
+    main()
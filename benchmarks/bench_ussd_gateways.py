@@ -0,0 +1,96 @@
+# bench_ussd_gateways.py - Compare in-process gateway adapters with HTTP self-forwarding
+#
+# Usage: python benchmarks/bench_ussd_gateways.py [--requests 500]
+#
+# Starts the Flask app on a local port and drives the same Comviva payloads
+# through (a) the old pattern, where the gateway handler re-posts to /ussd with
+# requests.post, and (b) the in-process adapter at /ussd/comviva.
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from flask import request, jsonify
+from werkzeug.serving import make_server
+
+from metrics import LatencyStats
+
+# Menu hops that do not call the LLM, so we measure gateway overhead only
+MENU_HOPS = ['', '4', '4*1', '', '5', '5*2', '', '1']
+
+
+def legacy_comviva_forwarding(base_url):
+    """The previous Comviva handler: re-post the request to our own /ussd endpoint"""
+    data = request.get_json()
+    forwarded_data = {
+        'sessionId': data.get('session_id', ''),
+        'serviceCode': data.get('ussd_code', ''),
+        'phoneNumber': data.get('msisdn', ''),
+        'text': data.get('user_input', '')
+    }
+
+    response = requests.post(f'{base_url}/ussd', data=forwarded_data)
+    is_continue = response.text.startswith('CON')
+
+    return jsonify({
+        'message': response.text.replace('CON ', '').replace('END ', ''),
+        'session_state': 'CONTINUE' if is_continue else 'END'
+    })
+
+
+def run(client, url, total):
+    """Post `total` Comviva payloads to `url` and collect latencies"""
+    stats = LatencyStats(max_samples=total)
+    started = time.perf_counter()
+
+    for i in range(total):
+        payload = {
+            'session_id': f'bench-{url.rsplit("/", 1)[-1]}-{i // len(MENU_HOPS)}',
+            'ussd_code': '*123#',
+            'msisdn': f'+2637{i // len(MENU_HOPS):08d}',
+            'user_input': MENU_HOPS[i % len(MENU_HOPS)]
+        }
+        hop_start = time.perf_counter()
+        response = client.post(url, json=payload)
+        response.raise_for_status()
+        stats.record(time.perf_counter() - hop_start)
+
+    elapsed = time.perf_counter() - started
+    return stats.summary(), total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare gateway adapters with HTTP self-forwarding')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    from app import app
+
+    base_url = f'http://127.0.0.1:{args.port}'
+    app.add_url_rule('/bench/legacy/comviva', endpoint='bench_legacy_comviva',
+                     view_func=lambda: legacy_comviva_forwarding(base_url), methods=['POST'])
+
+    server = make_server('127.0.0.1', args.port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        with requests.Session() as client:
+            legacy, legacy_rate = run(client, f'{base_url}/bench/legacy/comviva', args.requests)
+            adapter, adapter_rate = run(client, f'{base_url}/ussd/comviva', args.requests)
+    finally:
+        server.shutdown()
+
+    print(f"{'path':<22}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, summary, rate in (('forwarding (legacy)', legacy, legacy_rate),
+                                ('in-process adapter', adapter, adapter_rate)):
+        print(f"{name:<22}{rate:>10.1f}{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}{summary['p99_ms']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+# bench_ussd_load.py - Scripted USSD load generator and latency benchmark
+#
+# Usage:
+#   python benchmarks/bench_ussd_load.py --sessions 500 --concurrency 8 --llm-latency 0.8
+#   python benchmarks/bench_ussd_load.py --server --port 8766   # go through a local HTTP server
+#
+# Replays a weighted mix of multi-hop USSD sessions against the Flask app with
+# a stubbed LLM, then reports p50/p95/p99 latency per hop, overall throughput
+# and how much the in-memory session stores grew.
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import LatencyStats
+
+# Session mixes: name -> (weight, list of cumulative USSD `text` values)
+SESSION_MIXES = {
+    'menu_browsing': (30, ['', '1']),
+    'crop_menu': (10, ['', '2']),
+    'set_location': (15, ['', '4', '4*1']),
+    'set_farming_type': (10, ['', '5', '5*2']),
+    'set_language': (5, ['', '6', '6*2']),
+    'seasonal_info': (10, ['', '3']),
+    'advice_topic': (10, ['', '1', '1*2']),
+    'ai_question': (7, ['', '1', '1*6', '1*6*How do I control fall armyworm in maize']),
+    'crop_question': (3, ['', '2', '2*4', '2*4*sorghum']),
+    'soil_entry': (5, ['', '2', '2*5', '2*5*90', '2*5*90*42', '2*5*90*42*43', '2*5*90*42*43*20.8',
+                       '2*5*90*42*43*20.8*82', '2*5*90*42*43*20.8*82*6.5', '2*5*90*42*43*20.8*82*6.5*202.9']),
+    'soil_entry_compact': (5, ['', '2', '2*5', '2*5*90,42,43,20.8,82,6.5,202.9'])
+}
+
+
+class StubLLMResponse:
+    """Mimics the .content attribute of a LangChain chat response"""
+
+    def __init__(self, content):
+        self.content = content
+
+
+class StubLLM:
+    """Stand-in for ChatGroq that sleeps for a configurable latency"""
+
+    def __init__(self, latency=0.5, jitter=0.2):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def invoke(self, prompt):
+        with self._lock:
+            self.calls += 1
+        delay = max(0.0, random.uniform(self.latency * (1 - self.jitter), self.latency * (1 + self.jitter)))
+        time.sleep(delay)
+        return StubLLMResponse(
+            "Plant early-maturing varieties after the first effective rains. "
+            "Scout fields weekly and apply control measures early. Keep soil covered to retain moisture."
+        )
+
+
+class FlaskClientTransport:
+    """Send hops through the Flask test client (no network)"""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def post(self, data):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        response = self.local.client.post('/ussd', data=data)
+        return response.get_data(as_text=True)
+
+
+class HTTPTransport:
+    """Send hops to a running server over HTTP"""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self.local = threading.local()
+        self.requests = requests
+
+    def post(self, data):
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+        response = self.local.session.post(f'{self.base_url}/ussd', data=data, timeout=30)
+        response.raise_for_status()
+        return response.text
+
+
+def deep_sizeof(obj, seen=None):
+    """Approximate memory used by a container and everything it references"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def run_session(transport, mix_name, hops, session_number, hop_stats):
+    """Replay one multi-hop session and record per-hop latency"""
+    session_id = f'load-{mix_name}-{session_number}'
+    phone_number = f'+2637{session_number:08d}'
+
+    for hop_index, text in enumerate(hops):
+        data = {
+            'sessionId': session_id,
+            'serviceCode': '*123#',
+            'phoneNumber': phone_number,
+            'text': text
+        }
+        started = time.perf_counter()
+        response = transport.post(data)
+        hop_stats[(mix_name, hop_index, text)].record(time.perf_counter() - started)
+
+        if response.startswith('END'):
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay USSD session mixes and report latency percentiles')
+    parser.add_argument('--sessions', type=int, default=200, help='number of sessions to replay')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent sessions')
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='stub LLM latency in seconds')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--server', action='store_true', help='start a local HTTP server instead of using the test client')
+    parser.add_argument('--url', help='drive an already running server (LLM stub not applied)')
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    import app as app_module
+
+    stub_llm = StubLLM(latency=args.llm_latency)
+    app_module.llm = stub_llm
+
+    server = None
+    if args.url:
+        transport = HTTPTransport(args.url)
+    elif args.server:
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', args.port, app_module.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        transport = HTTPTransport(f'http://127.0.0.1:{args.port}')
+    else:
+        transport = FlaskClientTransport(app_module.app)
+
+    names = list(SESSION_MIXES)
+    weights = [SESSION_MIXES[name][0] for name in names]
+    plan = random.choices(names, weights=weights, k=args.sessions)
+
+    # Create every per-hop recorder up front so worker threads never insert keys
+    hop_stats = {
+        (name, hop_index, text): LatencyStats(max_samples=args.sessions)
+        for name, (weight, hops) in SESSION_MIXES.items()
+        for hop_index, text in enumerate(hops)
+    }
+    sessions_before = len(app_module.ussd_sessions)
+    preferences_before = len(app_module.user_preferences)
+    store_bytes_before = deep_sizeof(app_module.ussd_sessions) + deep_sizeof(app_module.user_preferences)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            futures = [
+                executor.submit(run_session, transport, name, SESSION_MIXES[name][1], number, hop_stats)
+                for number, name in enumerate(plan)
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        if server:
+            server.shutdown()
+
+    elapsed = time.perf_counter() - started
+    traced_current, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total_hops = sum(stats.count for stats in hop_stats.values())
+    store_bytes_after = deep_sizeof(app_module.ussd_sessions) + deep_sizeof(app_module.user_preferences)
+
+    print(f"\n{'mix':<20}{'hop':>4}  {'text':<28}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for (mix_name, hop_index, text), stats in sorted(hop_stats.items()):
+        if not stats.count:
+            continue
+        summary = stats.summary()
+        label = (text or '<dial>')[:26]
+        print(f"{mix_name:<20}{hop_index:>4}  {label:<28}{summary['count']:>6}"
+              f"{summary['p50_ms']:>10.1f}{summary['p95_ms']:>10.1f}{summary['p99_ms']:>10.1f}")
+
+    print(f"\nSessions: {args.sessions}  Hops: {total_hops}  Elapsed: {elapsed:.2f}s")
+    print(f"Throughput: {total_hops / elapsed:.1f} hops/s, {args.sessions / elapsed:.1f} sessions/s")
+    print(f"Stub LLM calls: {stub_llm.calls} at ~{args.llm_latency:.2f}s each")
+    print(f"ussd_sessions: {sessions_before} -> {len(app_module.ussd_sessions)} entries")
+    print(f"user_preferences: {preferences_before} -> {len(app_module.user_preferences)} entries")
+    print(f"Session store size: {store_bytes_before / 1024:.1f} KB -> {store_bytes_after / 1024:.1f} KB")
+    print(f"Python heap growth during run: {traced_current / 1024:.1f} KB (peak {traced_peak / 1024:.1f} KB)")
+
+
+if __name__ == '__main__':
+    main()
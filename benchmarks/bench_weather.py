@@ -0,0 +1,69 @@
+# bench_weather.py - Weather alert forecast fetches: serial provider calls vs the cached WeatherService
+#
+# Usage: python benchmarks/bench_weather.py [--locations 13] [--latency 0.3]
+#
+# Writes a forecast file for a file-backed provider that sleeps for a fixed
+# latency per call, then compares one blocking fetch per location with
+# WeatherService.get_many (concurrent cold fetch, then cached and stale reads).
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from weather import FileWeatherProvider, WeatherService
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare serial forecast fetches with the cached weather service')
+    parser.add_argument('--locations', type=int, default=13)
+    parser.add_argument('--latency', type=float, default=0.3, help='provider latency per call in seconds')
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    locations = [f'Location {i}' for i in range(args.locations)]
+    forecast = {"temperature": 24.0, "temperature_min": 15.0, "temperature_max": 29.0,
+                "rainfall_probability": 40, "rainfall_amount": 6.0}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'forecasts.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({location: forecast for location in locations}, f)
+        provider = FileWeatherProvider(path, latency=args.latency)
+
+        started = time.perf_counter()
+        for location in locations:
+            provider.fetch(location)
+        serial = time.perf_counter() - started
+
+        service = WeatherService(provider, ttl=60, stale_ttl=600, max_workers=args.workers, fetch_timeout=30)
+        started = time.perf_counter()
+        cold = service.get_many(locations)
+        cold_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        service.get_many(locations)
+        warm_elapsed = time.perf_counter() - started
+
+        # Age every entry past its TTL: reads return at once and refresh in the background
+        service.ttl = 0
+        started = time.perf_counter()
+        stale = service.get_many(locations)
+        stale_elapsed = time.perf_counter() - started
+        service.shutdown()
+
+    print(f"{args.locations} locations, provider latency {args.latency * 1000:.0f} ms\n")
+    print(f"{'path':<28}{'forecasts':>10}{'ms':>10}")
+    print(f"{'serial provider calls':<28}{args.locations:>10}{serial * 1000:>10.1f}")
+    print(f"{'cold cache (concurrent)':<28}{len(cold):>10}{cold_elapsed * 1000:>10.1f}")
+    print(f"{'warm cache':<28}{args.locations:>10}{warm_elapsed * 1000:>10.3f}")
+    print(f"{'stale (revalidating)':<28}{len(stale):>10}{stale_elapsed * 1000:>10.3f}")
+    print(f"\n{service.get_metrics()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,505 @@
+# db.py - Shared MongoDB access: bounded pool and timeouts, lazy background connect, circuit breaker
+#
+# One MongoClient per worker process, created on first use with explicit pool
+# and timeout settings (MONGO_* environment variables) so a slow or missing
+# database costs a bounded wait instead of stalling boot or requests.
+#
+# Every operation goes through a circuit breaker. After
+# MONGO_BREAKER_THRESHOLD consecutive connection failures or timeouts it opens,
+# and calls fail at once with DatabaseUnavailable (a PyMongoError, so existing
+# error handling applies) for MONGO_BREAKER_RESET seconds. A single trial call
+# is then let through. While the breaker is open, small reads (find_one,
+# count_documents, finds with a limit) are answered from a cache of their last
+# successful result.
+#
+# Latency, errors and stale reads are recorded per collection and operation
+# and exposed on /metrics/mongodb.
+
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import MongoClient
+from pymongo.errors import ConnectionFailure, ExecutionTimeout
+from pymongo.monitoring import ConnectionCheckOutFailedReason, ConnectionPoolListener
+from pymongo.server_api import ServerApi
+
+from metrics import LatencyStats
+
+# Operations timed and guarded by the breaker; the first group may be served stale
+CACHEABLE_READS = ('find_one', 'count_documents', 'distinct')
+OTHER_OPERATIONS = (
+    'insert_one', 'insert_many', 'update_one', 'update_many', 'replace_one', 'delete_one', 'delete_many',
+    'bulk_write', 'find_one_and_update', 'find_one_and_delete', 'create_index', 'estimated_document_count'
+)
+
+# Finds with a larger (or no) limit are not kept for stale reads
+STALE_FIND_LIMIT = 100
+
+# Errors that mean the database is unreachable or too slow (as opposed to a bad query)
+OUTAGE_ERRORS = (ConnectionFailure, ExecutionTimeout)
+
+
+class DatabaseUnavailable(ConnectionFailure):
+    """Raised without contacting MongoDB while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures -> half-open after `reset_timeout` seconds"""
+
+    def __init__(self, threshold=5, reset_timeout=30.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go to MongoDB now"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                # Exactly one trial call; everyone else keeps failing fast
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                print("MongoDB reachable again; circuit breaker closed")
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.threshold):
+                if self.state == 'closed':
+                    print(f"MongoDB failing ({self.failures} errors in a row); circuit breaker open")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+
+    def summary(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'times_opened': self.times_opened,
+                'rejected_calls': self.rejected,
+                'retry_in_s': round(max(0.0, self.opened_at + self.reset_timeout - time.monotonic()), 1)
+                if self.state == 'open' else 0.0
+            }
+
+
+class PoolMonitor(ConnectionPoolListener):
+    """Connection pool usage for /metrics/mongodb"""
+
+    def __init__(self):
+        self.open = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkout_timeouts = 0
+        self._lock = threading.Lock()
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        if event.reason == ConnectionCheckOutFailedReason.TIMEOUT:
+            with self._lock:
+                self.checkout_timeouts += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+class OperationStats:
+    """Latency and outcome counters for one collection operation"""
+
+    def __init__(self):
+        self.latency = LatencyStats(max_samples=1000)
+        self.errors = 0
+        self.stale = 0
+        self.rejected = 0
+
+    def summary(self):
+        return dict(self.latency.summary(), errors=self.errors, stale=self.stale, rejected=self.rejected)
+
+
+class TimedCursor:
+    """Lazy find(): records sort/skip/limit and streams the query through the breaker when iterated"""
+
+    def __init__(self, collection, args, kwargs):
+        self._collection = collection
+        self._args = args
+        self._kwargs = kwargs
+        self._chain = []
+        self._limit = kwargs.get('limit', 0)
+
+    def _add(self, method, *args, **kwargs):
+        self._chain.append((method, args, kwargs))
+        return self
+
+    def sort(self, *args, **kwargs):
+        return self._add('sort', *args, **kwargs)
+
+    def skip(self, *args, **kwargs):
+        return self._add('skip', *args, **kwargs)
+
+    def limit(self, limit):
+        self._limit = limit
+        return self._add('limit', limit)
+
+    def batch_size(self, *args, **kwargs):
+        return self._add('batch_size', *args, **kwargs)
+
+    def _open(self):
+        cursor = self._collection.raw.find(*self._args, **self._kwargs)
+        for method, args, kwargs in self._chain:
+            cursor = getattr(cursor, method)(*args, **kwargs)
+        return cursor
+
+    def __iter__(self):
+        if 0 < self._limit <= STALE_FIND_LIMIT:
+            # Small enough to keep for stale reads while the breaker is open
+            key = ('find', repr(self._args), repr(sorted(self._kwargs.items())), repr(self._chain))
+            return iter(self._collection._run('find', lambda: list(self._open()), key))
+        # Anything else streams batch by batch from the server
+        return self._collection.database.stream(self._collection, 'find', self._open)
+
+
+class TimedCollection:
+    """Collection proxy that times each operation and sends it through the database's breaker"""
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.stats = {}
+        self._raw = None
+
+    @property
+    def raw(self):
+        """The underlying pymongo Collection (creates the client on first use)"""
+        if self._raw is None:
+            self._raw = self.database.db[self.name]
+        return self._raw
+
+    def _stats(self, operation):
+        stats = self.stats.get(operation)
+        if stats is None:
+            stats = self.stats.setdefault(operation, OperationStats())
+        return stats
+
+    def _run(self, operation, call, cache_key=None):
+        return self.database.execute(self, operation, call, cache_key)
+
+    def find(self, *args, **kwargs):
+        return TimedCursor(self, args, kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        return iter(self._run('aggregate', lambda: list(self.raw.aggregate(pipeline, **kwargs))))
+
+    def __getattr__(self, name):
+        if name in CACHEABLE_READS or name in OTHER_OPERATIONS:
+            def operation(*args, **kwargs):
+                key = (name, repr(args), repr(sorted(kwargs.items()))) if name in CACHEABLE_READS else None
+                return self._run(name, lambda: getattr(self.raw, name)(*args, **kwargs), key)
+            return operation
+        return getattr(self.raw, name)
+
+
+class Database:
+    """The worker's MongoDB client, collections and circuit breaker"""
+
+    def __init__(self, uri='mongodb://localhost:27017/', name='mudhumeni_db', max_pool_size=20, min_pool_size=0,
+                 server_selection_timeout_ms=2000, connect_timeout_ms=2000, socket_timeout_ms=10000,
+                 wait_queue_timeout_ms=2000, breaker_threshold=5, breaker_reset=30.0, stale_cache_size=2000):
+        """Nothing connects until the first operation or connect_in_background()"""
+        self.uri = uri
+        self.name = name
+        self.options = {
+            'maxPoolSize': max_pool_size,
+            'minPoolSize': min_pool_size,
+            'serverSelectionTimeoutMS': server_selection_timeout_ms,
+            'connectTimeoutMS': connect_timeout_ms,
+            'socketTimeoutMS': socket_timeout_ms,
+            'waitQueueTimeoutMS': wait_queue_timeout_ms,
+            'maxIdleTimeMS': 60000
+        }
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self.pool = PoolMonitor()
+        self.stale_cache_size = stale_cache_size
+        self.connected = False
+
+        self._client = None
+        self._collections = {}
+        self._stale = OrderedDict()
+        self._hooks = []
+        self._connector = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build the data layer from MONGODB_URI and MONGO_* environment settings"""
+        return cls(
+            uri=os.environ.get('MONGODB_URI', 'mongodb://localhost:27017/'),
+            name=os.environ.get('MONGO_DB_NAME', 'mudhumeni_db'),
+            max_pool_size=int(os.environ.get('MONGO_MAX_POOL_SIZE', 20)),
+            min_pool_size=int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+            server_selection_timeout_ms=int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 2000)),
+            connect_timeout_ms=int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 2000)),
+            socket_timeout_ms=int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 10000)),
+            wait_queue_timeout_ms=int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+            breaker_threshold=int(os.environ.get('MONGO_BREAKER_THRESHOLD', 5)),
+            breaker_reset=float(os.environ.get('MONGO_BREAKER_RESET', 30)),
+            stale_cache_size=int(os.environ.get('MONGO_STALE_CACHE_SIZE', 2000))
+        )
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    # connect=False: no sockets or monitor threads until the first operation
+                    self._client = MongoClient(self.uri, server_api=ServerApi('1'), connect=False,
+                                               event_listeners=[self.pool], **self.options)
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.name]
+
+    def collection(self, name):
+        """Timed, breaker-guarded collection (shared per name)"""
+        collection = self._collections.get(name)
+        if collection is None:
+            with self._lock:
+                collection = self._collections.setdefault(name, TimedCollection(self, name))
+        return collection
+
+    # Operations
+
+    def execute(self, collection, operation, call, cache_key=None):
+        """Run `call` for collection.operation through the breaker, timing it"""
+        stats = collection._stats(operation)
+        key = (collection.name,) + cache_key if cache_key else None
+        if not self.breaker.allow():
+            stats.rejected += 1
+            return self._serve_stale(stats, key, DatabaseUnavailable(f"MongoDB unavailable (circuit open): "
+                                                                     f"{collection.name}.{operation}"))
+        started = time.monotonic()
+        try:
+            result = call()
+        except OUTAGE_ERRORS as e:
+            stats.errors += 1
+            self.breaker.record_failure()
+            return self._serve_stale(stats, key, e)
+        except Exception:
+            # The server answered (bad query, duplicate key...): it is up
+            stats.errors += 1
+            self.breaker.record_success()
+            raise
+        stats.latency.record(time.monotonic() - started)
+        self.breaker.record_success()
+        if key is not None:
+            self._remember(key, result)
+        return result
+
+    def stream(self, collection, operation, open_cursor):
+        """Iterate the cursor from `open_cursor()` through the breaker without loading it into memory
+
+        Latency is the time spent waiting on MongoDB across the whole iteration (not the
+        caller's work between documents); it is recorded when the cursor is exhausted or
+        the caller stops early.
+        """
+        stats = collection._stats(operation)
+        if not self.breaker.allow():
+            stats.rejected += 1
+            raise DatabaseUnavailable(f"MongoDB unavailable (circuit open): {collection.name}.{operation}")
+        waited = 0.0
+        cursor = None
+        try:
+            started = time.monotonic()
+            try:
+                cursor = open_cursor()
+                documents = iter(cursor)
+            finally:
+                waited += time.monotonic() - started
+            while True:
+                started = time.monotonic()
+                try:
+                    document = next(documents)
+                except StopIteration:
+                    break
+                finally:
+                    waited += time.monotonic() - started
+                yield document
+        except OUTAGE_ERRORS:
+            stats.errors += 1
+            self.breaker.record_failure()
+            raise
+        except Exception:
+            stats.errors += 1
+            self.breaker.record_success()
+            raise
+        except GeneratorExit:
+            # The caller stopped early (break, next()): the reads it made still succeeded
+            stats.latency.record(waited)
+            self.breaker.record_success()
+            raise
+        finally:
+            if cursor is not None and hasattr(cursor, 'close'):
+                cursor.close()
+        stats.latency.record(waited)
+        self.breaker.record_success()
+
+    def _remember(self, key, result):
+        with self._lock:
+            self._stale[key] = copy.deepcopy(result)
+            self._stale.move_to_end(key)
+            while len(self._stale) > self.stale_cache_size:
+                self._stale.popitem(last=False)
+
+    def _serve_stale(self, stats, key, error):
+        if key is not None:
+            with self._lock:
+                if key in self._stale:
+                    stats.stale += 1
+                    return copy.deepcopy(self._stale[key])
+        raise error
+
+    # Connecting
+
+    def ping(self, quiet=False):
+        """True if MongoDB answers a ping (bypasses the breaker, but resets it on success)"""
+        try:
+            self.client.admin.command('ping')
+        except Exception as e:
+            if not quiet:
+                print(f"Error connecting to MongoDB: {str(e)}")
+            return False
+        self.breaker.record_success()
+        return True
+
+    def on_connect(self, callback):
+        """Run `callback()` in the background once MongoDB is first reached"""
+        with self._lock:
+            if not self.connected:
+                self._hooks.append(callback)
+                return
+        threading.Thread(target=self._run_hook, args=(callback,), name='mongodb-connect-hook', daemon=True).start()
+
+    def _run_hook(self, callback):
+        try:
+            callback()
+        except Exception as e:
+            print(f"Error in MongoDB connect hook {getattr(callback, '__name__', callback)}: {str(e)}")
+
+    def _connect_loop(self):
+        delay = 1.0
+        if not self.ping():
+            print("WARNING: MongoDB unreachable; retrying in the background. Some features are limited until then.")
+            while not self.ping(quiet=True):
+                time.sleep(delay)
+                delay = min(delay * 2, self.breaker.reset_timeout)
+        print("MongoDB connection successful")
+        with self._lock:
+            self.connected = True
+            hooks, self._hooks = self._hooks, []
+        for callback in hooks:
+            self._run_hook(callback)
+
+    def connect_in_background(self):
+        """Keep trying to reach MongoDB off the boot path, then run the on_connect hooks"""
+        if self._connector is None:
+            self._connector = threading.Thread(target=self._connect_loop, name='mongodb-connect', daemon=True)
+            self._connector.start()
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+    def get_metrics(self):
+        """Connection, pool, breaker and per-collection operation metrics"""
+        return {
+            'connected': self.connected,
+            'database': self.name,
+            'pool': {
+                'max_pool_size': self.options['maxPoolSize'],
+                'min_pool_size': self.options['minPoolSize'],
+                'open_connections': self.pool.open,
+                'checked_out': self.pool.checked_out,
+                'max_checked_out': self.pool.max_checked_out,
+                'checkout_timeouts': self.pool.checkout_timeouts
+            },
+            'timeouts_ms': {
+                'server_selection': self.options['serverSelectionTimeoutMS'],
+                'connect': self.options['connectTimeoutMS'],
+                'socket': self.options['socketTimeoutMS'],
+                'wait_queue': self.options['waitQueueTimeoutMS']
+            },
+            'breaker': self.breaker.summary(),
+            'stale_cache_entries': len(self._stale),
+            'collections': {
+                name: {operation: stats.summary() for operation, stats in sorted(collection.stats.items())}
+                for name, collection in sorted(self._collections.items())
+            }
+        }
+
+
+# One per worker process; everything that talks to MongoDB goes through it
+database = Database.from_env()
+
+
+def register_database(app):
+    """Start connecting to MongoDB in the background and expose /metrics/mongodb"""
+    app.config['DATABASE'] = database
+    database.connect_in_background()
+
+    @app.route('/metrics/mongodb', methods=['GET'])
+    def mongodb_metrics():
+        from flask import jsonify
+        return jsonify(database.get_metrics())
@@ -0,0 +1,157 @@
+# deferred_answers.py - Answer slow USSD AI questions by SMS
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import LatencyStats
+from sms_encoding import prepare_for_channel, truncate_to_segments
+
+# Most SMS segments one deferred answer may use (459 GSM-7 characters)
+DEFERRED_SMS_MAX_SEGMENTS = 3
+
+# Longest a deferred answer waits for its LLM translation, in seconds
+DEFERRED_TRANSLATION_SECONDS = float(os.environ.get('USSD_DEFERRED_TRANSLATION_SECONDS', 30))
+
+DEFERRED_USSD_MESSAGE = "END ⏳ Your answer will arrive by SMS shortly. Thank you for using Mudhumeni AI."
+
+
+class DeferredAnswerService:
+    """Answer USSD questions on a background worker pool and deliver them by SMS"""
+
+    def __init__(self, app=None, sms_system=None, max_workers=4, max_queue_depth=500, enabled=True):
+        """Initialize the worker pool and metrics"""
+        self.app = app
+        self.sms_system = sms_system
+        self.enabled = enabled
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='deferred-answer')
+
+        # Metrics
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.in_progress = 0
+        self.submitted = 0
+        self.delivered = 0
+        self.failed = 0
+        self.rejected = 0
+        self.end_to_end_latency = LatencyStats()
+        self.llm_latency = LatencyStats()
+
+    def submit(self, phone_number, question, user_id=None, title=None):
+        """Queue a question for background answering.
+
+        Returns False when the service is disabled or the queue is full, so the
+        caller can fall back to answering synchronously.
+        """
+        if not self.enabled or not phone_number:
+            return False
+
+        with self._lock:
+            if self.queued >= self.max_queue_depth:
+                self.rejected += 1
+                return False
+            self.queued += 1
+            self.submitted += 1
+
+        enqueued_at = time.monotonic()
+        self.executor.submit(self._answer, phone_number, question, user_id, title, enqueued_at)
+        return True
+
+    def _answer(self, phone_number, question, user_id, title, enqueued_at):
+        """Worker: ask the AI and send the full answer by SMS"""
+        with self._lock:
+            self.queued -= 1
+            self.in_progress += 1
+
+        try:
+            from app import chatbot_response, translate_ai_answer
+
+            llm_start = time.monotonic()
+            answer = chatbot_response(question, user_id)
+            answer = translate_ai_answer(answer, user_id, deadline=time.monotonic() + DEFERRED_TRANSLATION_SECONDS)
+            self.llm_latency.record(time.monotonic() - llm_start)
+
+            message = self._format_sms(answer, title)
+            sent = self._get_sms_system().send_sms(phone_number, message)
+
+            with self._lock:
+                if sent:
+                    self.delivered += 1
+                else:
+                    self.failed += 1
+
+            self.end_to_end_latency.record(time.monotonic() - enqueued_at)
+
+        except Exception as e:
+            print(f"Deferred answer error for {phone_number}: {str(e)}")
+            with self._lock:
+                self.failed += 1
+
+        finally:
+            with self._lock:
+                self.in_progress -= 1
+
+    def _format_sms(self, answer, title=None):
+        """Format the AI answer as an SMS message"""
+        prefix = f"Mudhumeni - {title}: " if title else "Mudhumeni: "
+        message = prepare_for_channel(prefix + answer.strip(), 'sms')
+        return truncate_to_segments(message, DEFERRED_SMS_MAX_SEGMENTS)
+
+    def _get_sms_system(self):
+        """Use the app's SMS system, creating one without schedules if needed"""
+        if self.sms_system is None and self.app is not None:
+            self.sms_system = self.app.config.get('SMS_SYSTEM')
+
+        if self.sms_system is None:
+            from sms_notifications import FarmingSMSNotification
+            self.sms_system = FarmingSMSNotification(schedule_jobs=False)
+
+        return self.sms_system
+
+    def get_metrics(self):
+        """Return queue depth and latency metrics"""
+        with self._lock:
+            counters = {
+                'enabled': self.enabled,
+                'workers': self.max_workers,
+                'queue_depth': self.queued,
+                'in_progress': self.in_progress,
+                'max_queue_depth': self.max_queue_depth,
+                'submitted': self.submitted,
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'rejected': self.rejected
+            }
+
+        counters['end_to_end_latency'] = self.end_to_end_latency.summary()
+        counters['llm_latency'] = self.llm_latency.summary()
+        return counters
+
+    def shutdown(self, wait=True):
+        """Stop accepting questions and optionally wait for queued answers"""
+        self.enabled = False
+        self.executor.shutdown(wait=wait)
+
+
+# Function to register with the main app
+def register_deferred_answers(app):
+    """Register the deferred answer service with the main app"""
+    enabled = os.environ.get('USSD_DEFERRED_ANSWERS', 'false').lower() in ('1', 'true', 'yes')
+
+    service = DeferredAnswerService(
+        app=app,
+        max_workers=int(os.environ.get('USSD_DEFERRED_WORKERS', 4)),
+        max_queue_depth=int(os.environ.get('USSD_DEFERRED_MAX_QUEUE', 500)),
+        enabled=enabled
+    )
+    app.config['DEFERRED_ANSWERS'] = service
+
+    @app.route('/metrics/deferred_answers')
+    def deferred_answer_metrics():
+        from flask import jsonify
+        return jsonify(service.get_metrics())
+
+    return service
@@ -0,0 +1,403 @@
+# delivery_reports.py - SMS delivery receipts (DLRs): outbound message log, webhook ingestion and per-campaign rollups
+#
+# Every gateway call carries a client reference per recipient ("client_ref", or
+# "client_refs" in recipient order for bulk calls). The gateway's delivery
+# report callback posts it back to /sms/delivery_reports, e.g.
+#   {"client_ref": "5f0c...", "status": "DELIVRD"}
+#   [{"client_ref": "5f0c...", "status": "UNDELIV", "error": "absent subscriber"}, ...]
+#
+# Sends and receipts are queued in memory and written to SQLite in batches.
+# Each process folds the rows written by every process into an in-memory rollup.
+
+import hmac
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+from metrics import LatencyHistogram
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sms_messages (
+    id INTEGER PRIMARY KEY,
+    ref TEXT NOT NULL UNIQUE,
+    campaign TEXT NOT NULL,
+    phone_number TEXT NOT NULL,
+    carrier TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'sent',
+    delivered_at REAL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS delivery_reports (
+    id INTEGER PRIMARY KEY,
+    ref TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL,
+    error TEXT,
+    received_at REAL NOT NULL
+);
+"""
+
+# Gateway status words -> delivered / failed (anything else is an intermediate state)
+DELIVERED_STATUSES = {'delivrd', 'delivered', 'success', 'ok'}
+FAILED_STATUSES = {'undeliv', 'undelivered', 'failed', 'rejectd', 'rejected', 'expired', 'deleted', 'unknown'}
+
+# Mobile network by number prefix (longest prefix wins)
+CARRIER_PREFIXES = {
+    '+26377': 'Econet', '+26378': 'Econet',
+    '+26371': 'NetOne',
+    '+26373': 'Telecel',
+    '+2782': 'Vodacom', '+2772': 'Vodacom', '+2776': 'Vodacom', '+2779': 'Vodacom',
+    '+2783': 'MTN', '+2773': 'MTN', '+2778': 'MTN',
+    '+2784': 'Cell C', '+2774': 'Cell C',
+    '+2781': 'Telkom'
+}
+
+# Delivery latency buckets: seconds to a day
+DELIVERY_BUCKETS_MS = (1000, 2000, 5000, 10000, 30000, 60000, 120000, 300000, 600000,
+                       1800000, 3600000, 6 * 3600000, 24 * 3600000)
+
+# Default database location: the app's instance folder, not whatever directory the worker started in
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'sms_delivery.sqlite3')
+
+# How long a receipt may wait for its send record (written in a later batch) before counting as unmatched
+UNMATCHED_GRACE_SECONDS = 60
+
+
+def new_ref():
+    """Client reference for one outbound SMS"""
+    return uuid.uuid4().hex
+
+
+def carrier_for(phone_number):
+    """Mobile network for a +E.164 number, or 'other'"""
+    for length in (6, 5):
+        carrier = CARRIER_PREFIXES.get(phone_number[:length])
+        if carrier:
+            return carrier
+    return 'other'
+
+
+def normalize_status(status):
+    """'delivered', 'failed' or 'pending' for a gateway status word"""
+    status = (status or '').strip().lower()
+    if status in DELIVERED_STATUSES:
+        return 'delivered'
+    if status in FAILED_STATUSES:
+        return 'failed'
+    return 'pending'
+
+
+class CampaignRollup:
+    """Send and delivery counters for one campaign run"""
+
+    def __init__(self):
+        self.sent = 0
+        self.first_sent_at = None
+        self.last_sent_at = None
+        self.delivered = 0
+        self.failed = 0
+        self.latency = LatencyHistogram(DELIVERY_BUCKETS_MS)
+        self.failure_reasons = {}
+        self.failures_by_carrier = {}
+        self.sent_by_carrier = {}
+
+    def add_sent(self, sent_at, carrier):
+        self.sent += 1
+        self.sent_by_carrier[carrier] = self.sent_by_carrier.get(carrier, 0) + 1
+        if self.first_sent_at is None or sent_at < self.first_sent_at:
+            self.first_sent_at = sent_at
+        if self.last_sent_at is None or sent_at > self.last_sent_at:
+            self.last_sent_at = sent_at
+
+    def add_report(self, status, error, carrier, latency):
+        if status == 'delivered':
+            self.delivered += 1
+            self.latency.record(max(0.0, latency))
+        else:
+            self.failed += 1
+            reason = error or 'unknown'
+            self.failure_reasons[reason] = self.failure_reasons.get(reason, 0) + 1
+            self.failures_by_carrier[carrier] = self.failures_by_carrier.get(carrier, 0) + 1
+
+    def summary(self):
+        elapsed = (self.last_sent_at - self.first_sent_at) if self.sent > 1 else 0.0
+        reported = self.delivered + self.failed
+        return {
+            'sent': self.sent,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'awaiting_report': max(0, self.sent - reported),
+            'delivery_rate': round(self.delivered / reported, 3) if reported else 0.0,
+            'send_rate_per_second': round(self.sent / elapsed, 1) if elapsed else None,
+            'first_sent_at': self.first_sent_at,
+            'last_sent_at': self.last_sent_at,
+            'delivery_latency': self.latency.summary(),
+            'failure_reasons': dict(sorted(self.failure_reasons.items(), key=lambda item: -item[1])[:10]),
+            'failures_by_carrier': dict(self.failures_by_carrier),
+            'sent_by_carrier': dict(self.sent_by_carrier)
+        }
+
+
+class DeliveryReportStore:
+    """Outbound message log and delivery receipts with batched writes and an in-memory rollup"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, batch_size=2000, flush_interval=0.5, refresh_interval=5.0):
+        """Nothing is opened or started until the first send or receipt"""
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.refresh_interval = refresh_interval
+
+        self.queued = 0
+        self.written = 0
+        self.batches = 0
+        self.unmatched = 0
+        self.dropped = 0
+
+        self._queue = queue.Queue()
+        self._writer = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        # Rollup state: rows already folded in, per campaign counters
+        self._campaigns = {}
+        self._last_message_id = 0
+        self._last_report_id = 0
+        self._waiting = deque()
+        self._refreshed_at = 0.0
+        self._refresh_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a store from SMS_DLR_* environment settings"""
+        return cls(
+            path=os.environ.get('SMS_DLR_DB', DEFAULT_DB_PATH),
+            batch_size=int(os.environ.get('SMS_DLR_BATCH_SIZE', 2000)),
+            flush_interval=float(os.environ.get('SMS_DLR_FLUSH_INTERVAL', 0.5)),
+            refresh_interval=float(os.environ.get('SMS_DLR_REFRESH_INTERVAL', 5))
+        )
+
+    def _conn(self):
+        """One connection per thread, in WAL mode so the rollup doesn't block the writer"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    # Batched writes
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name='sms-dlr-writer', daemon=True)
+                    self._writer.start()
+
+    def record_sent(self, campaign, refs_and_numbers, sent_at=None):
+        """Log accepted sends: (ref, phone_number) pairs for one campaign run"""
+        sent_at = sent_at or time.time()
+        campaign = campaign or 'ad_hoc'
+        count = 0
+        for ref, phone_number in refs_and_numbers:
+            self._queue.put(('sent', (ref, campaign, phone_number, carrier_for(phone_number), sent_at)))
+            count += 1
+        with self._lock:
+            self.queued += count
+        self._ensure_writer()
+
+    def record_reports(self, reports):
+        """Queue delivery receipts: dicts with client_ref (or message_id), status and optional error;
+        returns how many were accepted"""
+        accepted = 0
+        now = time.time()
+        for report in reports:
+            ref = report.get('client_ref') or report.get('message_id')
+            if not ref:
+                continue
+            status = normalize_status(report.get('status'))
+            if status == 'pending':
+                continue
+            error = report.get('error') or report.get('failure_reason') or report.get('reason')
+            if status == 'failed' and not error:
+                error = str(report.get('status')).upper()
+            self._queue.put(('report', (str(ref), status, error, now)))
+            accepted += 1
+        if accepted:
+            with self._lock:
+                self.queued += accepted
+            self._ensure_writer()
+        return accepted
+
+    def _write_loop(self):
+        while True:
+            items = [self._queue.get()]
+            # Gather whatever else arrives within the flush interval, up to one batch
+            deadline = time.monotonic() + self.flush_interval
+            while len(items) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(items)
+
+    def _write(self, items):
+        sent = [row for kind, row in items if kind == 'sent']
+        reports = [row for kind, row in items if kind == 'report']
+        conn = self._conn()
+        try:
+            with conn:
+                if sent:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO sms_messages (ref, campaign, phone_number, carrier, sent_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        sent
+                    )
+                if reports:
+                    # Gateways resend callbacks; the first final receipt per message wins
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO delivery_reports (ref, status, error, received_at) VALUES (?, ?, ?, ?)",
+                        reports
+                    )
+                    conn.executemany(
+                        "UPDATE sms_messages SET status = ?, error = ?, delivered_at = ? WHERE ref = ? AND status = 'sent'",
+                        [(status, error, received_at, ref) for ref, status, error, received_at in reports]
+                    )
+            with self._lock:
+                self.written += len(items)
+                self.batches += 1
+        except sqlite3.Error as e:
+            with self._lock:
+                self.dropped += len(items)
+            print(f"Error writing {len(items)} SMS delivery records: {str(e)}")
+
+    def flush(self, timeout=10.0):
+        """Wait until everything queued so far has been written (e.g. before reading the rollup)"""
+        deadline = time.monotonic() + timeout
+        while self.written + self.dropped < self.queued and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    # Rollup
+
+    def _campaign(self, campaign):
+        rollup = self._campaigns.get(campaign)
+        if rollup is None:
+            rollup = self._campaigns[campaign] = CampaignRollup()
+        return rollup
+
+    def refresh(self):
+        """Fold rows written since the last refresh (by any process) into the rollup"""
+        with self._refresh_lock:
+            conn = self._conn()
+            rows = conn.execute(
+                "SELECT id, campaign, carrier, sent_at FROM sms_messages WHERE id > ? ORDER BY id",
+                (self._last_message_id,)
+            ).fetchall()
+            for row_id, campaign, carrier, sent_at in rows:
+                self._campaign(campaign).add_sent(sent_at, carrier)
+                self._last_message_id = row_id
+
+            reports = conn.execute(
+                "SELECT d.id, d.ref, d.status, d.error, d.received_at, m.campaign, m.carrier, m.sent_at "
+                "FROM delivery_reports d LEFT JOIN sms_messages m ON m.ref = d.ref WHERE d.id > ? ORDER BY d.id",
+                (self._last_report_id,)
+            ).fetchall()
+            if reports:
+                self._last_report_id = reports[-1][0]
+
+            # Receipts that arrived before their send record was written get another chance
+            retries = []
+            for report in self._waiting:
+                message = conn.execute(
+                    "SELECT campaign, carrier, sent_at FROM sms_messages WHERE ref = ?", (report[1],)
+                ).fetchone()
+                retries.append(report[:5] + (message or (None, None, None)))
+            self._waiting.clear()
+
+            now = time.time()
+            for report in retries + reports:
+                _, ref, status, error, received_at, campaign, carrier, sent_at = report
+                if campaign is None:
+                    if now - received_at < UNMATCHED_GRACE_SECONDS:
+                        self._waiting.append(report)
+                    else:
+                        self.unmatched += 1
+                    continue
+                self._campaign(campaign).add_report(status, error, carrier, received_at - sent_at)
+            self._refreshed_at = time.monotonic()
+
+    def _maybe_refresh(self):
+        if time.monotonic() - self._refreshed_at >= self.refresh_interval:
+            self.refresh()
+
+    def campaign_metrics(self, campaign):
+        """Rollup for one campaign run, or None"""
+        self._maybe_refresh()
+        rollup = self._campaigns.get(campaign)
+        return rollup.summary() if rollup else None
+
+    def get_metrics(self):
+        """Per-campaign rollups and writer counters"""
+        self._maybe_refresh()
+        return {
+            'campaigns': {campaign: rollup.summary() for campaign, rollup in sorted(self._campaigns.items())},
+            'queued': self.queued,
+            'written': self.written,
+            'batches': self.batches,
+            'backlog': self._queue.qsize(),
+            'dropped': self.dropped,
+            'unmatched_reports': self.unmatched,
+            'awaiting_match': len(self._waiting)
+        }
+
+
+# Shared by the SMS dispatcher (sends) and the delivery report webhook (receipts)
+delivery_store = DeliveryReportStore.from_env()
+
+
+def register_delivery_reports(app):
+    """Add the gateway delivery report webhook and /metrics/sms"""
+    app.config['SMS_DELIVERY_STORE'] = delivery_store
+
+    @app.route('/sms/delivery_reports', methods=['POST'])
+    def delivery_report_webhook():
+        from flask import jsonify, request
+
+        # Forged receipts would corrupt delivery metrics, so nothing is accepted until a token is set
+        token = os.environ.get('SMS_DLR_TOKEN')
+        if not token:
+            return jsonify({'error': 'Delivery reports are disabled (SMS_DLR_TOKEN is not set)'}), 503
+        if not hmac.compare_digest(request.headers.get('X-Webhook-Token', '').encode(), token.encode()):
+            return jsonify({'error': 'unauthorized'}), 401
+
+        data = request.get_json(silent=True)
+        if data is None:
+            # Some gateways post form fields
+            data = request.form.to_dict()
+        reports = data if isinstance(data, list) else [data]
+        accepted = delivery_store.record_reports(report for report in reports if isinstance(report, dict))
+        # Queued for the batch writer; the gateway only needs to know we have it
+        return jsonify({'accepted': accepted}), 202
+
+    @app.route('/metrics/sms', methods=['GET'])
+    def sms_metrics():
+        from flask import jsonify, request
+
+        campaign = request.args.get('campaign')
+        if campaign:
+            metrics = delivery_store.campaign_metrics(campaign)
+            if metrics is None:
+                return jsonify({'error': f"No sends recorded for {campaign}"}), 404
+            return jsonify(metrics)
+        return jsonify(delivery_store.get_metrics())
@@ -0,0 +1,347 @@
+# export.py - Bulk export of crop recommendations, user profiles and USSD hops for offline analysis
+#
+# Usage: python export.py [recommendations user_profiles ussd_hops] [--out exports] [--format parquet|arrow|csv] [--full]
+#
+# Documents are streamed from a server-side cursor (EXPORT_BATCH_SIZE per
+# round trip) and written EXPORT_CHUNK_ROWS at a time, so memory stays flat
+# however large the collection. Each run exports the rows whose write time lies
+# between the dataset's watermark (kept in <out>/_watermarks.json) and
+# EXPORT_SETTLE_SECONDS ago, then moves the watermark forward; --full starts
+# from the beginning.
+#
+# The write time is when a row reached MongoDB, not when it was created:
+# recommendations and USSD hops carry an inserted_at stamped by the batched
+# writers on each insert attempt, and profiles an updated_at set by the server
+# ($currentDate). A row held back by an outage is therefore exported by the run
+# after it is finally written. The guarantee that remains: every row is exported
+# exactly once provided a single insert attempt completes within the settle lag
+# (the MongoDB socket timeout keeps it far shorter) and worker clocks agree to
+# within it.
+#
+# Parquet and Arrow need pyarrow (pip install pyarrow); without it exports are
+# gzip-compressed CSV. /admin/export/<dataset> streams the same CSV over HTTP.
+
+import csv
+import hmac
+import io
+import json
+import os
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+# dataset -> (collection, timestamp field, [(column, type)])
+DATASETS = {
+    'recommendations': ('crop_recommendations', 'inserted_at', [
+        ('recommendation_id', 'string'), ('user_id', 'string'), ('created_at', 'timestamp'),
+        ('nitrogen', 'float'), ('phosphorus', 'float'), ('potassium', 'float'), ('temperature', 'float'),
+        ('humidity', 'float'), ('ph', 'float'), ('rainfall', 'float'), ('province', 'string'),
+        ('predicted_crop', 'string'), ('season', 'string')
+    ]),
+    'user_profiles': ('user_profiles', 'updated_at', [
+        # Phone numbers stay out of analyst exports
+        ('user_id', 'string'), ('location', 'string'), ('farming_type', 'string'), ('language', 'string'),
+        ('updated_at', 'timestamp')
+    ]),
+    'ussd_hops': ('ussd_hops', 'inserted_at', [
+        ('hop_id', 'string'), ('session_id', 'string'), ('user_id', 'string'), ('node', 'string'),
+        ('ended', 'bool'), ('total_ms', 'float'), ('created_at', 'timestamp')
+    ])
+}
+
+# Fields fetched per dataset, so nothing unexported crosses the wire
+PROJECTIONS = {
+    'recommendations': {'user_id': 1, 'created_at': 1, 'inputs': 1, 'outputs.predicted_crop': 1, 'outputs.season': 1},
+    'user_profiles': {'location': 1, 'farming_type': 1, 'language': 1, 'updated_at': 1},
+    'ussd_hops': {'session_id': 1, 'user_id': 1, 'node': 1, 'ended': 1, 'total_ms': 1, 'created_at': 1}
+}
+
+# Rows written before inserted_at existed are stamped with their creation time once
+LEGACY_TIMESTAMPS = {'crop_recommendations': 'created_at', 'ussd_hops': 'created_at'}
+
+EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv.gz'}
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def flatten(dataset, document):
+    """One export row (column -> value) from a stored document"""
+    if dataset == 'recommendations':
+        inputs = document.get('inputs', {})
+        outputs = document.get('outputs', {})
+        return dict(inputs, recommendation_id=str(document['_id']), user_id=document.get('user_id'),
+                    created_at=document.get('created_at'), predicted_crop=outputs.get('predicted_crop'),
+                    season=outputs.get('season'))
+    if dataset == 'user_profiles':
+        return dict(document, user_id=document['_id'])
+    return dict(document, hop_id=str(document['_id']))
+
+
+def _cell(value, kind):
+    if value is None or value == '':
+        return None
+    if kind == 'float':
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if kind == 'bool':
+        return bool(value)
+    if kind == 'timestamp':
+        return value if isinstance(value, datetime) else None
+    return str(value)
+
+
+def chunks(dataset, documents, chunk_rows):
+    """Typed rows in lists of at most chunk_rows"""
+    columns = DATASETS[dataset][2]
+    chunk = []
+    for document in documents:
+        row = flatten(dataset, document)
+        chunk.append(tuple(_cell(row.get(column), kind) for column, kind in columns))
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Writers: each takes typed row chunks and returns the row count
+
+def _arrow_schema(dataset):
+    types = {'string': pa.string(), 'float': pa.float64(), 'bool': pa.bool_(), 'timestamp': pa.timestamp('ms')}
+    return pa.schema([(column, types[kind]) for column, kind in DATASETS[dataset][2]])
+
+
+def _arrow_batch(schema, chunk):
+    return pa.record_batch([pa.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)],
+                           schema=schema)
+
+
+def write_parquet(dataset, row_chunks, path):
+    schema = _arrow_schema(dataset)
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression='zstd') as writer:
+        for chunk in row_chunks:
+            # One row group per chunk
+            writer.write_batch(_arrow_batch(schema, chunk))
+            rows += len(chunk)
+    return rows
+
+
+def write_arrow(dataset, row_chunks, path):
+    schema = _arrow_schema(dataset)
+    rows = 0
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+        for chunk in row_chunks:
+            writer.write_batch(_arrow_batch(schema, chunk))
+            rows += len(chunk)
+    return rows
+
+
+def csv_text(chunk, header=None):
+    """CSV for one chunk (ISO timestamps, empty cells for missing values)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+    writer.writerows(tuple(value.isoformat() if isinstance(value, datetime) else value for value in row)
+                     for row in chunk)
+    return buffer.getvalue()
+
+
+def gzip_csv_stream(dataset, row_chunks):
+    """Yield a gzip-compressed CSV (header first) piece by piece"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    yield compressor.compress(csv_text([], header=[column for column, kind in DATASETS[dataset][2]]).encode())
+    for chunk in row_chunks:
+        data = compressor.compress(csv_text(chunk).encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def write_csv(dataset, row_chunks, path):
+    rows = 0
+
+    def counted():
+        nonlocal rows
+        for chunk in row_chunks:
+            rows += len(chunk)
+            yield chunk
+
+    with open(path, 'wb') as f:
+        for data in gzip_csv_stream(dataset, counted()):
+            f.write(data)
+    return rows
+
+
+WRITERS = {'parquet': write_parquet, 'arrow': write_arrow, 'csv': write_csv}
+
+
+class Exporter:
+    """Stream datasets out of MongoDB into files, advancing a watermark per dataset"""
+
+    def __init__(self, database, out_dir='exports', batch_size=5000, chunk_rows=50000, settle_seconds=300):
+        self.database = database
+        self.out_dir = out_dir
+        self.batch_size = batch_size
+        self.chunk_rows = chunk_rows
+        self.settle = timedelta(seconds=settle_seconds)
+        self.state_path = os.path.join(out_dir, '_watermarks.json')
+
+    @classmethod
+    def from_env(cls, database, out_dir=None):
+        """Build an exporter from EXPORT_* environment settings"""
+        return cls(
+            database,
+            out_dir=out_dir or os.environ.get('EXPORT_DIR', 'exports'),
+            batch_size=int(os.environ.get('EXPORT_BATCH_SIZE', 5000)),
+            chunk_rows=int(os.environ.get('EXPORT_CHUNK_ROWS', 50000)),
+            settle_seconds=float(os.environ.get('EXPORT_SETTLE_SECONDS', 300))
+        )
+
+    def watermarks(self):
+        try:
+            with open(self.state_path) as f:
+                return {dataset: datetime.fromisoformat(value) for dataset, value in json.load(f).items()}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_watermark(self, dataset, watermark):
+        state = {name: value.isoformat() for name, value in self.watermarks().items()}
+        state[dataset] = watermark.isoformat()
+        temporary = self.state_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(temporary, self.state_path)
+
+    def window(self, dataset, full=False):
+        """(since, cutoff) for the next export of `dataset`"""
+        since = None if full else self.watermarks().get(dataset)
+        return since, utcnow() - self.settle
+
+    def documents(self, dataset, since, cutoff):
+        """Server-side cursor over the window, oldest first, batch_size documents per round trip"""
+        collection, field, columns = DATASETS[dataset]
+        window = {'$lt': cutoff}
+        if since is not None:
+            window['$gte'] = since
+        # The raw collection: a long export streams rather than buffering through the breaker
+        return self.database.collection(collection).raw.find(
+            {field: window}, PROJECTIONS[dataset], batch_size=self.batch_size
+        ).sort(field, 1)
+
+    def ensure_indexes(self):
+        """Each dataset is read in write-time order; older rows get a write time first"""
+        for collection, field, columns in DATASETS.values():
+            self.database.collection(collection).create_index([(field, 1)])
+            legacy = LEGACY_TIMESTAMPS.get(collection)
+            if legacy:
+                self.database.collection(collection).update_many(
+                    {field: {'$exists': False}}, [{'$set': {field: f'${legacy}'}}]
+                )
+
+    def export(self, dataset, fmt='parquet', full=False):
+        """Write one file for the next window of `dataset` and advance its watermark; returns a summary"""
+        if fmt in ('parquet', 'arrow') and not ARROW_AVAILABLE:
+            print(f"WARNING: pyarrow not installed; exporting {dataset} as gzip CSV instead of {fmt}")
+            fmt = 'csv'
+        since, cutoff = self.window(dataset, full)
+        directory = os.path.join(self.out_dir, dataset)
+        os.makedirs(directory, exist_ok=True)
+        start_label = since.strftime('%Y%m%dT%H%M%S') if since else 'start'
+        path = os.path.join(directory, f"{dataset}-{start_label}-{cutoff.strftime('%Y%m%dT%H%M%S')}{EXTENSIONS[fmt]}")
+
+        started = time.monotonic()
+        cursor = self.documents(dataset, since, cutoff)
+        try:
+            rows = WRITERS[fmt](dataset, chunks(dataset, cursor, self.chunk_rows), path + '.part')
+        finally:
+            cursor.close()
+        os.replace(path + '.part', path)
+        # Only a finished file moves the watermark, so a failed run is simply repeated
+        self._save_watermark(dataset, cutoff)
+        return {
+            'dataset': dataset,
+            'rows': rows,
+            'path': path,
+            'since': since.isoformat() if since else None,
+            'watermark': cutoff.isoformat(),
+            'seconds': round(time.monotonic() - started, 2)
+        }
+
+
+def register_export(app):
+    """Add /admin/export/<dataset>: a streamed gzip CSV of rows changed in [since, now - settle)"""
+    from db import database
+
+    exporter = Exporter.from_env(database)
+    database.on_connect(exporter.ensure_indexes)
+
+    @app.route('/admin/export/<dataset>', methods=['GET'])
+    def export_dataset(dataset):
+        """?since=<watermark from the previous export's X-Export-Watermark header>"""
+        from flask import Response, jsonify, request
+
+        # Exports hold every user id and location: refused outright until a token is set
+        token = os.environ.get('ANALYTICS_TOKEN')
+        if not token:
+            return jsonify({'error': 'Export is disabled (ANALYTICS_TOKEN is not set)'}), 503
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode()):
+            return jsonify({'error': 'unauthorized'}), 401
+        if dataset not in DATASETS:
+            return jsonify({'error': f"Unknown dataset; choose from {', '.join(DATASETS)}"}), 404
+        if not database.connected:
+            return jsonify({'error': 'Export is unavailable (no database connection)'}), 503
+        since = request.args.get('since')
+        try:
+            since = datetime.fromisoformat(since) if since else None
+        except ValueError:
+            return jsonify({'error': 'since must be an ISO timestamp'}), 400
+
+        cutoff = utcnow() - exporter.settle
+
+        def stream():
+            cursor = exporter.documents(dataset, since, cutoff)
+            try:
+                yield from gzip_csv_stream(dataset, chunks(dataset, cursor, exporter.chunk_rows))
+            finally:
+                cursor.close()
+
+        return Response(stream(), mimetype='application/gzip', headers={
+            'Content-Disposition': f'attachment; filename="{dataset}-{cutoff.strftime("%Y%m%dT%H%M%S")}.csv.gz"',
+            'X-Export-Watermark': cutoff.isoformat()
+        })
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from db import database
+
+    parser = argparse.ArgumentParser(description='Export recommendations, user profiles and USSD hops for offline analysis')
+    parser.add_argument('datasets', nargs='*', help=f"datasets (default: all of {', '.join(DATASETS)})")
+    parser.add_argument('--out', help='output directory (default: EXPORT_DIR or ./exports)')
+    parser.add_argument('--format', choices=list(WRITERS), default='parquet' if ARROW_AVAILABLE else 'csv')
+    parser.add_argument('--full', action='store_true', help='ignore the watermark and export everything')
+    args = parser.parse_args()
+
+    unknown = set(args.datasets) - set(DATASETS)
+    if unknown:
+        parser.error(f"unknown dataset(s): {', '.join(sorted(unknown))}")
+    if not database.ping():
+        raise SystemExit(1)
+    exporter = Exporter.from_env(database, args.out)
+    exporter.ensure_indexes()
+    for dataset in args.datasets or list(DATASETS):
+        print(json.dumps(exporter.export(dataset, args.format, args.full)))
@@ -0,0 +1,384 @@
+# market_prices.py - Market price time series (SQLite) with an in-memory latest / rolling-average cache
+#
+# Usage:
+#   python market_prices.py ingest prices.csv [more.csv | drop_dir ...]
+#   python market_prices.py latest --location Harare
+#
+# CSV drops have the columns date,location,crop,price (USD per kg, ISO dates).
+
+import argparse
+import csv
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import date, timedelta
+
+# Rolling averages kept in memory for every (location, crop)
+ROLLING_WINDOWS = (7, 30)
+
+# Default database location: the app's instance folder, not whatever directory the worker started in
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'market_prices.sqlite3')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prices (
+    location TEXT NOT NULL,
+    crop TEXT NOT NULL,
+    day TEXT NOT NULL,
+    price REAL NOT NULL,
+    PRIMARY KEY (location, crop, day)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ingested_files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    rows INTEGER NOT NULL,
+    ingested_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS series_changes (
+    location TEXT NOT NULL,
+    crop TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (location, crop)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS series_changes_seq ON series_changes (seq);
+"""
+
+PriceSummary = namedtuple('PriceSummary', ['crop', 'day', 'price', 'averages'])
+
+
+def _key(value):
+    return value.strip().lower()
+
+
+class MarketPriceStore:
+    """Daily prices per (location, crop) on disk; latest prices and rolling averages in memory.
+
+    Only one summary per (location, crop) is cached, so years of history cost
+    nothing at query time; history() reads ranges straight off the primary key.
+
+    Every ingest stamps the series it touched with a new sequence number in
+    series_changes. Before answering from the cache, a store checks SQLite's
+    data_version and, if another connection (another thread, worker or the
+    ingest CLI) has committed since, reloads the series stamped after the last
+    sequence it has seen.
+    """
+
+    def __init__(self, path=DEFAULT_DB_PATH, default_location='National', windows=ROLLING_WINDOWS):
+        """Nothing is opened until the first ingest or query"""
+        self.path = path
+        self.default_location = default_location
+        self.windows = tuple(windows)
+
+        self.rows_ingested = 0
+        self.files_ingested = 0
+        self.last_ingest = None
+
+        self._summaries = None
+        self._seen_seq = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a store from MARKET_PRICES_* environment settings"""
+        return cls(
+            path=os.environ.get('MARKET_PRICES_DB', DEFAULT_DB_PATH),
+            default_location=os.environ.get('MARKET_PRICES_DEFAULT_LOCATION', 'National')
+        )
+
+    def _conn(self):
+        """One connection per thread, in WAL mode so readers don't block ingestion"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    # Ingestion
+
+    def ingest_rows(self, rows):
+        """Upsert (day, location, crop, price) rows; returns rows written.
+
+        Re-ingesting a day replaces its price, so corrected feeds can simply be dropped again.
+        """
+        conn = self._conn()
+        touched = set()
+        count = 0
+
+        def records():
+            nonlocal count
+            for day, location, crop, price in rows:
+                location, crop = _key(location), _key(crop)
+                touched.add((location, crop))
+                count += 1
+                yield location, crop, day, price
+
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO prices (location, crop, day, price) VALUES (?, ?, ?, ?)", records())
+            seq, = conn.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM series_changes").fetchone()
+            conn.executemany("INSERT OR REPLACE INTO series_changes (location, crop, seq) VALUES (?, ?, ?)",
+                             ((location, crop, seq) for location, crop in touched))
+
+        self.rows_ingested += count
+        self.last_ingest = time.time()
+        self._catch_up(conn)
+        return count
+
+    def ingest_csv(self, path):
+        """Stream one CSV drop into the store; returns rows written (bad rows are skipped)"""
+        skipped = 0
+
+        def rows():
+            nonlocal skipped
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                for record in csv.DictReader(f):
+                    try:
+                        day = date.fromisoformat(record['date'].strip()).isoformat()
+                        price = float(record['price'])
+                        location, crop = record['location'], record['crop']
+                        if not location.strip() or not crop.strip():
+                            raise ValueError('empty location or crop')
+                    except (KeyError, TypeError, ValueError, AttributeError):
+                        skipped += 1
+                        continue
+                    yield day, location, crop, price
+
+        count = self.ingest_rows(rows())
+        if skipped:
+            print(f"Skipped {skipped} malformed rows in {path}")
+        return count
+
+    def ingest_directory(self, directory):
+        """Ingest CSV files in a drop directory that are new or changed since last time"""
+        conn = self._conn()
+        total = 0
+        for name in sorted(os.listdir(directory)):
+            if not name.lower().endswith('.csv'):
+                continue
+            path = os.path.abspath(os.path.join(directory, name))
+            stat = os.stat(path)
+            seen = conn.execute("SELECT mtime_ns, size FROM ingested_files WHERE path = ?", (path,)).fetchone()
+            if seen == (stat.st_mtime_ns, stat.st_size):
+                continue
+
+            rows = self.ingest_csv(path)
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO ingested_files (path, mtime_ns, size, rows, ingested_at) VALUES (?, ?, ?, ?, ?)",
+                    (path, stat.st_mtime_ns, stat.st_size, rows, time.time())
+                )
+            self.files_ingested += 1
+            total += rows
+            print(f"Ingested {rows} market prices from {name}")
+        return total
+
+    # In-memory summaries
+
+    def _summary(self, conn, location, crop):
+        """Latest price and rolling averages for one (location, crop), read off the primary key"""
+        latest = conn.execute(
+            "SELECT day, price FROM prices WHERE location = ? AND crop = ? ORDER BY day DESC LIMIT 1",
+            (location, crop)
+        ).fetchone()
+        if latest is None:
+            return None
+
+        day, price = latest
+        averages = {}
+        for window in self.windows:
+            start = (date.fromisoformat(day) - timedelta(days=window - 1)).isoformat()
+            average, = conn.execute(
+                "SELECT AVG(price) FROM prices WHERE location = ? AND crop = ? AND day >= ? AND day <= ?",
+                (location, crop, start, day)
+            ).fetchone()
+            averages[window] = round(average, 2)
+        return PriceSummary(crop, day, price, averages)
+
+    def _load(self):
+        """Build summaries for every (location, crop); cost scales with the number of series"""
+        conn = self._conn()
+        summaries = {}
+        # Seek from one series to the next on the primary key instead of scanning every day
+        series = conn.execute("SELECT location, crop FROM prices ORDER BY location, crop LIMIT 1").fetchone()
+        while series is not None:
+            location, crop = series
+            summary = self._summary(conn, location, crop)
+            if summary:
+                summaries.setdefault(location, {})[crop] = summary
+            series = conn.execute(
+                "SELECT location, crop FROM prices WHERE (location, crop) > (?, ?) ORDER BY location, crop LIMIT 1",
+                series
+            ).fetchone()
+        return summaries
+
+    def _ensure_loaded(self):
+        if self._summaries is None:
+            with self._lock:
+                if self._summaries is None:
+                    conn = self._conn()
+                    # Read the sequence first: an ingest racing the load is simply reloaded later
+                    self._seen_seq, = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM series_changes").fetchone()
+                    self._summaries = self._load()
+        else:
+            self._check_for_changes()
+        return self._summaries
+
+    def _check_for_changes(self):
+        """Catch up if any other connection has committed since this thread last looked"""
+        conn = self._conn()
+        version, = conn.execute("PRAGMA data_version").fetchone()
+        if version != getattr(self._local, 'data_version', None):
+            self._local.data_version = version
+            self._catch_up(conn)
+
+    def _catch_up(self, conn):
+        """Recompute the summaries of every series ingested since the last sequence seen"""
+        if self._summaries is None:
+            return
+        changed = conn.execute("SELECT location, crop, seq FROM series_changes WHERE seq > ?",
+                               (self._seen_seq,)).fetchall()
+        if not changed:
+            return
+        updated = {(location, crop): self._summary(conn, location, crop) for location, crop, seq in changed}
+        with self._lock:
+            for (location, crop), summary in updated.items():
+                if summary:
+                    self._summaries.setdefault(location, {})[crop] = summary
+            self._seen_seq = max(self._seen_seq, max(seq for location, crop, seq in changed))
+
+    # Queries
+
+    def location_prices(self, location, fallback=True):
+        """{crop: PriceSummary} for a location, or for the default location if it has none"""
+        summaries = self._ensure_loaded()
+        prices = summaries.get(_key(location or ''))
+        if not prices and fallback:
+            prices = summaries.get(_key(self.default_location))
+        return dict(prices or {})
+
+    def latest(self, location, crop, fallback=True):
+        """PriceSummary for one crop at a location, or None"""
+        summaries = self._ensure_loaded()
+        prices = summaries.get(_key(location or ''))
+        if not prices and fallback:
+            prices = summaries.get(_key(self.default_location))
+        return prices.get(_key(crop)) if prices else None
+
+    def rolling_average(self, location, crop, days):
+        """Average price over the `days` days up to the latest price (cached windows are O(1))"""
+        summary = self.latest(location, crop, fallback=False)
+        if summary is None:
+            return None
+        if days in summary.averages:
+            return summary.averages[days]
+        start = (date.fromisoformat(summary.day) - timedelta(days=days - 1)).isoformat()
+        average, = self._conn().execute(
+            "SELECT AVG(price) FROM prices WHERE location = ? AND crop = ? AND day >= ? AND day <= ?",
+            (_key(location), _key(crop), start, summary.day)
+        ).fetchone()
+        return round(average, 2) if average is not None else None
+
+    def history(self, location, crop, start=None, end=None):
+        """Yield (day, price) in date order, streamed from disk"""
+        cursor = self._conn().execute(
+            "SELECT day, price FROM prices WHERE location = ? AND crop = ? AND day >= ? AND day <= ? ORDER BY day",
+            (_key(location), _key(crop), start or '0000-00-00', end or '9999-99-99')
+        )
+        yield from cursor
+
+    def get_metrics(self):
+        """Store and cache sizes"""
+        summaries = self._ensure_loaded()
+        return {
+            'locations': len(summaries),
+            'series': sum(len(crops) for crops in summaries.values()),
+            'rows_ingested': self.rows_ingested,
+            'files_ingested': self.files_ingested,
+            'last_ingest': self.last_ingest,
+            'windows': list(self.windows)
+        }
+
+
+class MarketPriceWatcher:
+    """Poll a CSV drop directory and ingest new files into the store"""
+
+    def __init__(self, store, directory, interval=60):
+        self.store = store
+        self.directory = directory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.store.ingest_directory(self.directory)
+            except Exception as e:
+                print(f"Error ingesting market prices from {self.directory}: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='market-prices', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+# Shared by the market price SMS campaign and the USSD market prices menu
+market_price_store = MarketPriceStore.from_env()
+
+
+def format_price_line(crop, summary, with_average=True):
+    """'Maize $0.32/kg (7d avg $0.30)'"""
+    line = f"{crop.title()} ${summary.price:.2f}/kg"
+    if with_average and 7 in summary.averages:
+        line += f" (7d avg ${summary.averages[7]:.2f})"
+    return line
+
+
+def register_market_prices(app):
+    """Watch MARKET_PRICES_DROP_DIR for CSV feeds and expose /metrics/market_prices"""
+    app.config['MARKET_PRICE_STORE'] = market_price_store
+
+    drop_dir = os.environ.get('MARKET_PRICES_DROP_DIR')
+    if drop_dir and os.path.isdir(drop_dir):
+        watcher = MarketPriceWatcher(market_price_store, drop_dir,
+                                     interval=float(os.environ.get('MARKET_PRICES_POLL_INTERVAL', 60)))
+        watcher.start()
+        app.config['MARKET_PRICE_WATCHER'] = watcher
+
+    @app.route('/metrics/market_prices', methods=['GET'])
+    def market_price_metrics():
+        from flask import jsonify
+        return jsonify(market_price_store.get_metrics())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Ingest or query market price feeds')
+    parser.add_argument('command', choices=['ingest', 'latest'])
+    parser.add_argument('paths', nargs='*', help='CSV files or drop directories to ingest')
+    parser.add_argument('--location', default=None)
+    args = parser.parse_args()
+
+    store = market_price_store
+    if args.command == 'ingest':
+        for path in args.paths:
+            rows = store.ingest_directory(path) if os.path.isdir(path) else store.ingest_csv(path)
+            print(f"{path}: {rows} rows")
+    else:
+        location = args.location or store.default_location
+        for crop, summary in sorted(store.location_prices(location).items()):
+            averages = ', '.join(f"{days}d {average:.2f}" for days, average in summary.averages.items())
+            print(f"{location} {crop}: {summary.price:.2f} on {summary.day} ({averages})")
+
+
+if __name__ == '__main__':
+    main()
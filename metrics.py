@@ -0,0 +1,125 @@
+# metrics.py - Lightweight in-process latency metrics
+
+import bisect
+import threading
+from collections import deque
+
+
+class LatencyStats:
+    """Keep a bounded window of latency samples and summarize them as percentiles"""
+
+    def __init__(self, max_samples=2000):
+        """Initialize an empty sample window"""
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Record a single latency sample (in seconds)"""
+        with self._lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, pct):
+        """Return the given percentile (0-100) of the recent samples in seconds"""
+        with self._lock:
+            ordered = sorted(self.samples)
+
+        return _percentile_of_sorted(ordered, pct)
+
+    def summary(self):
+        """Summarize the recorded samples in milliseconds"""
+        with self._lock:
+            ordered = sorted(self.samples)
+            count = self.count
+            total = self.total
+            maximum = self.max
+
+        return {
+            'count': count,
+            'avg_ms': round(total / count * 1000, 2) if count else 0.0,
+            'p50_ms': round(_percentile_of_sorted(ordered, 50) * 1000, 2),
+            'p95_ms': round(_percentile_of_sorted(ordered, 95) * 1000, 2),
+            'p99_ms': round(_percentile_of_sorted(ordered, 99) * 1000, 2),
+            'max_ms': round(maximum * 1000, 2)
+        }
+
+
+def _percentile_of_sorted(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+
+    index = int(round((pct / 100.0) * (len(ordered) - 1)))
+    return ordered[max(0, min(len(ordered) - 1, index))]
+
+
+# Histogram bucket upper bounds in milliseconds (last bucket is open-ended)
+DEFAULT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram: constant memory, cheap to record"""
+
+    def __init__(self, buckets_ms=DEFAULT_BUCKETS_MS):
+        """Initialize empty buckets"""
+        self.buckets_ms = tuple(buckets_ms)
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Record a single latency sample (in seconds)"""
+        index = bisect.bisect_left(self.buckets_ms, seconds * 1000)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, pct):
+        """Approximate percentile in milliseconds (upper bound of the bucket it falls in)"""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            maximum = self.max
+
+        if not count:
+            return 0.0
+
+        target = max(1, int(round(pct / 100.0 * count)))
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= target:
+                if index < len(self.buckets_ms):
+                    return float(min(self.buckets_ms[index], maximum * 1000))
+                break
+        return maximum * 1000
+
+    def summary(self):
+        """Summarize the histogram in milliseconds"""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.total
+            maximum = self.max
+
+        labels = [f"le_{bound}" for bound in self.buckets_ms] + ['le_inf']
+        return {
+            'count': count,
+            'avg_ms': round(total / count * 1000, 2) if count else 0.0,
+            'p50_ms': round(self.percentile(50), 2),
+            'p95_ms': round(self.percentile(95), 2),
+            'p99_ms': round(self.percentile(99), 2),
+            'max_ms': round(maximum * 1000, 2),
+            'buckets': dict(zip(labels, counts))
+        }
@@ -0,0 +1,369 @@
+# notification_scheduler.py - Leader-elected campaign scheduler with persisted next runs and catch-up
+#
+# Every web worker may create a scheduler; only the one holding the leader lock
+# (a file lock on one host, or a MongoDB lease across hosts) runs jobs.
+
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Default home of the lock and state files: the app's instance folder, not whatever directory the worker started in
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+
+WEEKDAYS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+class Job:
+    """A recurring job: daily (or every N days) or weekly at a local time"""
+
+    def __init__(self, name, func, at='00:00', weekday=None, every_days=1):
+        self.name = name
+        self.func = func
+        self.hour, self.minute = (int(part) for part in at.split(':'))
+        self.weekday = WEEKDAYS.index(weekday) if weekday else None
+        self.every_days = every_days
+
+        self.next_run = None
+        self.last_run = None
+        # Scheduled time of a run that has started but not finished
+        self.in_progress = None
+        self.last_status = None
+        self.last_error = None
+        self.last_duration = None
+        self.runs = 0
+        self.failures = 0
+        self.catch_ups = 0
+        self.future = None
+
+    def next_run_after(self, moment):
+        """First scheduled time strictly after `moment`"""
+        candidate = moment.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if self.weekday is not None:
+            candidate += timedelta(days=(self.weekday - candidate.weekday()) % 7)
+            if candidate <= moment:
+                candidate += timedelta(days=7)
+            return candidate
+
+        if candidate <= moment:
+            candidate += timedelta(days=1)
+        if self.every_days > 1 and self.last_run:
+            spaced = self.last_run.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+            candidate = max(candidate, spaced + timedelta(days=self.every_days))
+        return candidate
+
+    def state(self):
+        return {
+            'next_run': self.next_run.isoformat() if self.next_run else None,
+            'last_run': self.last_run.isoformat() if self.last_run else None,
+            'in_progress': self.in_progress.isoformat() if self.in_progress else None,
+            'last_status': self.last_status
+        }
+
+    def restore(self, state):
+        if state.get('next_run'):
+            self.next_run = datetime.fromisoformat(state['next_run'])
+        if state.get('last_run'):
+            self.last_run = datetime.fromisoformat(state['last_run'])
+        self.in_progress = datetime.fromisoformat(state['in_progress']) if state.get('in_progress') else None
+        self.last_status = state.get('last_status')
+
+
+class FileLeaderLock:
+    """Leadership among the processes of one host: an exclusive flock on a lock file"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, holder):
+        """Try to become (or stay) leader without blocking"""
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, holder.encode())
+        self._fd = fd
+        return True
+
+    def release(self, holder):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+class MongoLeaderLease:
+    """Leadership across hosts: a MongoDB document lease renewed by the holder"""
+
+    def __init__(self, collection, name='sms_scheduler', ttl=60):
+        self.collection = collection
+        self.name = name
+        self.ttl = ttl
+
+    def acquire(self, holder):
+        """Take the lease if it is free or expired, or renew it if we hold it"""
+        from pymongo.errors import DuplicateKeyError
+
+        now = time.time()
+        try:
+            self.collection.update_one(
+                {'_id': self.name, '$or': [{'holder': holder}, {'expires_at': {'$lt': now}}]},
+                {'$set': {'holder': holder, 'expires_at': now + self.ttl}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # Someone else holds an unexpired lease
+            return False
+
+    def release(self, holder):
+        self.collection.delete_one({'_id': self.name, 'holder': holder})
+
+
+class FileJobStore:
+    """Persist job state as JSON, replaced atomically on every change"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self, states):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(states, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+class MongoJobStore:
+    """Persist job state in a MongoDB collection (one document per job)"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def load(self):
+        return {doc.pop('_id'): doc for doc in self.collection.find()}
+
+    def save(self, states):
+        for name, state in states.items():
+            self.collection.update_one({'_id': name}, {'$set': state}, upsert=True)
+
+
+class NotificationScheduler:
+    """Run recurring jobs on one elected leader, sleeping until the next job is due"""
+
+    def __init__(self, leader, store, max_workers=2, catch_up_window=24 * 3600, retry_interval=30):
+        """`catch_up_window` is how late (in seconds) a missed run may still be made up"""
+        self.leader = leader
+        self.store = store
+        self.catch_up_window = timedelta(seconds=catch_up_window)
+        self.retry_interval = retry_interval
+        self.max_workers = max_workers
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.jobs = {}
+        self.is_leader = False
+        self.leader_since = None
+        self._executor = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a scheduler from SMS_SCHEDULER_* environment settings"""
+        backend = os.environ.get('SMS_SCHEDULER_LEADER', 'file').lower()
+        ttl = int(os.environ.get('SMS_SCHEDULER_LEASE_TTL', 60))
+
+        if backend == 'mongo':
+            from db import database
+            leader = MongoLeaderLease(database.collection('scheduler_leases'), ttl=ttl)
+            store = MongoJobStore(database.collection('scheduler_jobs'))
+        else:
+            state_dir = os.environ.get('SMS_SCHEDULER_STATE_DIR', DEFAULT_STATE_DIR)
+            os.makedirs(state_dir, exist_ok=True)
+            leader = FileLeaderLock(os.path.join(state_dir, 'sms_scheduler.lock'))
+            store = FileJobStore(os.path.join(state_dir, 'sms_scheduler_state.json'))
+
+        return cls(
+            leader,
+            store,
+            max_workers=int(os.environ.get('SMS_SCHEDULER_WORKERS', 2)),
+            catch_up_window=float(os.environ.get('SMS_SCHEDULER_CATCH_UP_HOURS', 24)) * 3600,
+            retry_interval=min(30, ttl / 3)
+        )
+
+    def add_job(self, name, func, at='00:00', weekday=None, every_days=1):
+        """Register a job, e.g. add_job('market_price', send, at='12:00', weekday='friday')"""
+        self.jobs[name] = Job(name, func, at=at, weekday=weekday, every_days=every_days)
+        self._wakeup.set()
+        return self.jobs[name]
+
+    def _save(self):
+        try:
+            self.store.save({name: job.state() for name, job in self.jobs.items()})
+        except Exception as e:
+            print(f"Error saving scheduler state: {str(e)}")
+
+    def _become_leader(self, now):
+        """Load persisted next runs and decide which missed runs to make up"""
+        try:
+            states = self.store.load()
+        except Exception as e:
+            print(f"Error loading scheduler state: {str(e)}")
+            states = {}
+
+        for name, job in self.jobs.items():
+            if name in states:
+                job.restore(states[name])
+            if job.in_progress is not None and (job.future is None or job.future.done()):
+                # Started by a leader that died before finishing it; next_run was left at
+                # that run, so it is made up below like any other missed run
+                print(f"Scheduler found unfinished {name} run (due {job.in_progress:%Y-%m-%d %H:%M})")
+                job.in_progress = None
+            if job.next_run is None:
+                job.next_run = job.next_run_after(now)
+            elif job.next_run < now:
+                if now - job.next_run <= self.catch_up_window:
+                    # Missed while no leader was running: run once now (runs are coalesced)
+                    job.catch_ups += 1
+                    print(f"Scheduler catching up on {name} (due {job.next_run:%Y-%m-%d %H:%M})")
+                else:
+                    print(f"Scheduler skipping missed {name} run (due {job.next_run:%Y-%m-%d %H:%M})")
+                    job.next_run = job.next_run_after(now)
+
+        self.is_leader = True
+        self.leader_since = now
+        self._save()
+        print(f"SMS scheduler leader: {self.holder}")
+
+    def _run_job(self, job, scheduled_for, dispatched_at):
+        """Run one scheduled occurrence; next_run only moves on once it has finished"""
+        started = time.monotonic()
+        try:
+            job.func()
+            job.last_status = 'ok'
+            job.last_error = None
+        except Exception as e:
+            job.failures += 1
+            job.last_status = 'failed'
+            job.last_error = str(e)
+            print(f"Scheduled job {job.name} failed: {str(e)}")
+        finally:
+            with self._lock:
+                job.runs += 1
+                job.last_run = scheduled_for
+                job.in_progress = None
+                job.next_run = job.next_run_after(dispatched_at)
+                job.last_duration = round(time.monotonic() - started, 3)
+                self._save()
+            self._wakeup.set()
+
+    def _dispatch_due(self, now):
+        """Submit due jobs to the executor; returns seconds until the next one"""
+        with self._lock:
+            for job in self.jobs.values():
+                if job.next_run is None:
+                    job.next_run = job.next_run_after(now)
+                if job.next_run > now:
+                    continue
+                if job.future is not None and not job.future.done():
+                    # Still running from last time; check again shortly
+                    continue
+
+                # Persist the start before running: a leader that dies mid-run leaves
+                # next_run at this run, so whoever takes over makes it up
+                job.in_progress = job.next_run
+                self._save()
+                job.future = self._executor.submit(self._run_job, job, job.in_progress, now)
+
+            pending = [job.next_run for job in self.jobs.values() if job.next_run and job.in_progress is None]
+        if not pending:
+            return self.retry_interval
+        return max(0.0, (min(pending) - datetime.now()).total_seconds())
+
+    def _loop(self):
+        while not self._stopping:
+            now = datetime.now()
+            try:
+                leader = self.leader.acquire(self.holder)
+            except Exception as e:
+                print(f"Error acquiring scheduler leadership: {str(e)}")
+                leader = False
+
+            if not leader:
+                if self.is_leader:
+                    print(f"SMS scheduler lost leadership: {self.holder}")
+                self.is_leader = False
+                self._wakeup.wait(self.retry_interval)
+                self._wakeup.clear()
+                continue
+
+            if not self.is_leader:
+                self._become_leader(now)
+
+            wait = self._dispatch_due(now)
+            # Wake for the next job, but often enough to renew a lease
+            self._wakeup.wait(min(wait + 0.01, self.retry_interval))
+            self._wakeup.clear()
+
+    def start(self):
+        """Start competing for leadership on a background thread"""
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sms-job')
+        self._thread = threading.Thread(target=self._loop, name='sms-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """Stop scheduling, let running jobs finish and hand leadership over"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self._executor.shutdown(wait=wait)
+        self._executor = None
+        if self.is_leader:
+            self.leader.release(self.holder)
+            self.is_leader = False
+
+    def get_metrics(self):
+        """Leadership and per-job schedule state"""
+        with self._lock:
+            jobs = {
+                name: dict(
+                    job.state(),
+                    running=job.future is not None and not job.future.done(),
+                    last_error=job.last_error,
+                    last_duration_seconds=job.last_duration,
+                    runs=job.runs,
+                    failures=job.failures,
+                    catch_ups=job.catch_ups
+                )
+                for name, job in self.jobs.items()
+            }
+        return {
+            'holder': self.holder,
+            'leader': self.is_leader,
+            'leader_since': self.leader_since.isoformat() if self.leader_since else None,
+            'jobs': jobs
+        }
@@ -0,0 +1,457 @@
+# pest_alerts.py - Pest outbreak reports, a spatial index over farms and radius + crop matching
+#
+# Outbreaks come from extension officers (POST /pest_alerts/reports) or a local
+# JSON-lines feed (PEST_OUTBREAK_FEED), one report per line:
+#   {"pest": "Fall Armyworm", "province": "Masvingo", "radius_km": 60}
+#   {"pest": "Aphids", "latitude": -17.83, "longitude": 31.05, "radius_km": 25}
+
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from audience_index import audience_index, SEASONAL_CROP
+from metrics import LatencyStats
+
+# Approximate province / region centroids (lat, lon) used when a farm has no coordinates
+PROVINCE_COORDINATES = {
+    "harare": (-17.83, 31.05),
+    "bulawayo": (-20.15, 28.58),
+    "manicaland": (-18.92, 32.40),
+    "mashonaland central": (-16.76, 31.11),
+    "mashonaland east": (-18.20, 31.90),
+    "mashonaland west": (-17.48, 29.79),
+    "masvingo": (-20.07, 30.83),
+    "matabeleland north": (-18.53, 27.55),
+    "matabeleland south": (-21.05, 29.00),
+    "midlands": (-19.06, 29.60),
+    "gauteng": (-26.27, 28.11),
+    "western cape": (-33.23, 21.86),
+    "eastern cape": (-32.30, 26.42),
+    "limpopo": (-23.40, 29.42)
+}
+
+# Crops each pest attacks
+AFFECTED_CROPS = {
+    "Fall Armyworm": ["maize", "sorghum", "millet"],
+    "Stalk Borer": ["maize", "sorghum"],
+    "Aphids": ["vegetables", "cotton", "tobacco"],
+    "Bollworm": ["cotton", "maize", "tomatoes"],
+    "Red Spider Mites": ["cotton", "tomatoes"],
+    "Whitefly": ["cotton", "vegetables"],
+    "Cutworms": ["seedlings", "vegetables"],
+    "Diamondback Moth": ["cabbage", "vegetables"],
+    "Thrips": ["onions", "cotton", "vegetables"],
+    "Leaf Miners": ["vegetables", "leafy greens"],
+    "African Armyworm": ["maize", "pasture", "cereals"]
+}
+
+# Common pests by season (used for simulated outbreaks)
+SEASONAL_PESTS = {
+    "summer": ["Fall Armyworm", "Stalk Borer", "Aphids"],
+    "autumn": ["Bollworm", "Red Spider Mites", "Whitefly"],
+    "winter": ["Aphids", "Cutworms", "Diamondback Moth"],
+    "spring": ["Thrips", "Leaf Miners", "African Armyworm"]
+}
+
+# Default database location: the app's instance folder, not whatever directory the worker started in
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'pest_alerts.sqlite3')
+
+DEFAULT_RADIUS_KM = 50.0
+EARTH_RADIUS_KM = 6371.0
+
+# Without a feed, scheduled checks simulate outbreaks (as before) so alerts can be demonstrated
+SIMULATE_OUTBREAKS = os.environ.get(
+    'PEST_ALERTS_SIMULATE', 'false' if os.environ.get('PEST_OUTBREAK_FEED') else 'true'
+).lower() in ('1', 'true', 'yes')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbreaks (
+    id TEXT PRIMARY KEY,
+    pest TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    radius_km REAL NOT NULL,
+    province TEXT,
+    source TEXT NOT NULL,
+    reported_at TEXT NOT NULL,
+    alerted_at REAL,
+    recipients INTEGER
+);
+CREATE INDEX IF NOT EXISTS outbreaks_pending ON outbreaks (alerted_at);
+"""
+
+Outbreak = namedtuple('Outbreak', ['id', 'pest', 'latitude', 'longitude', 'radius_km', 'province', 'source', 'reported_at'])
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def province_coordinates(location):
+    """Centroid for a province name ('Mashonaland East', 'harare'), or None"""
+    if not location:
+        return None
+    location = location.strip().lower()
+    if location in PROVINCE_COORDINATES:
+        return PROVINCE_COORDINATES[location]
+    for name, coordinates in PROVINCE_COORDINATES.items():
+        if name in location:
+            return coordinates
+    return None
+
+
+def farm_coordinates(prefs):
+    """A farm's (lat, lon): its own coordinates if known, else its province centroid"""
+    try:
+        return round(float(prefs['latitude']), 4), round(float(prefs['longitude']), 4)
+    except (KeyError, TypeError, ValueError):
+        return province_coordinates(prefs.get('location'))
+
+
+class SpatialIndex:
+    """Grid index over farm points: cell -> points -> user ids.
+
+    Users sharing a point (e.g. a province centroid) are stored together, so a
+    radius query measures each distinct point once.
+    """
+
+    def __init__(self, cell_degrees=0.5):
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        self._points = {}
+        self._user_points = {}
+        self._lock = threading.Lock()
+
+    def _cell(self, latitude, longitude):
+        return int(math.floor(latitude / self.cell_degrees)), int(math.floor(longitude / self.cell_degrees))
+
+    def _remove(self, user_id):
+        point = self._user_points.pop(user_id, None)
+        if point is None:
+            return
+        users = self._points.get(point)
+        if users is not None:
+            users.discard(user_id)
+            if not users:
+                del self._points[point]
+                cell = self._cells.get(self._cell(*point))
+                if cell is not None:
+                    cell.discard(point)
+                    if not cell:
+                        del self._cells[self._cell(*point)]
+
+    def update(self, user_id, prefs):
+        """(Re)index one farm from the user's preferences"""
+        point = farm_coordinates(prefs)
+        with self._lock:
+            if self._user_points.get(user_id) == point:
+                return
+            self._remove(user_id)
+            if point is None:
+                return
+            self._user_points[user_id] = point
+            users = self._points.get(point)
+            if users is None:
+                users = self._points[point] = set()
+                self._cells.setdefault(self._cell(*point), set()).add(point)
+            users.add(user_id)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def rebuild(self, preferences):
+        """Index every user in a {user_id: prefs} mapping from scratch"""
+        with self._lock:
+            self._cells = {}
+            self._points = {}
+            self._user_points = {}
+        for user_id, prefs in list(preferences.items()):
+            self.update(user_id, prefs)
+
+    def users_within(self, latitude, longitude, radius_km):
+        """User ids whose farm lies within `radius_km` of the point"""
+        lat_span = radius_km / 111.0
+        lon_span = radius_km / max(1.0, 111.0 * math.cos(math.radians(latitude)))
+        min_cell = self._cell(latitude - lat_span, longitude - lon_span)
+        max_cell = self._cell(latitude + lat_span, longitude + lon_span)
+
+        with self._lock:
+            # Walk only the cells the radius' bounding box overlaps
+            cell_count = (max_cell[0] - min_cell[0] + 1) * (max_cell[1] - min_cell[1] + 1)
+            if cell_count > len(self._cells):
+                cells = [points for cell, points in self._cells.items()
+                         if min_cell[0] <= cell[0] <= max_cell[0] and min_cell[1] <= cell[1] <= max_cell[1]]
+            else:
+                cells = [self._cells[(x, y)]
+                         for x in range(min_cell[0], max_cell[0] + 1)
+                         for y in range(min_cell[1], max_cell[1] + 1)
+                         if (x, y) in self._cells]
+
+            matched = [
+                self._points[point]
+                for points in cells
+                for point in points
+                if haversine_km(latitude, longitude, point[0], point[1]) <= radius_km
+            ]
+            return set().union(*matched) if matched else set()
+
+    def get_metrics(self):
+        with self._lock:
+            return {'users': len(self._user_points), 'points': len(self._points), 'cells': len(self._cells)}
+
+
+class OutbreakStore:
+    """Outbreak reports in SQLite; each one is alerted once"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, feed_path=None):
+        self.path = path
+        self.feed_path = feed_path
+        self._feed_offset = 0
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls):
+        """Build a store from PEST_* environment settings"""
+        return cls(
+            path=os.environ.get('PEST_ALERTS_DB', DEFAULT_DB_PATH),
+            feed_path=os.environ.get('PEST_OUTBREAK_FEED')
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def report(self, pest, latitude=None, longitude=None, province=None, radius_km=None,
+               source='officer', reported_at=None, outbreak_id=None):
+        """Record an outbreak; returns the Outbreak (a repeated report is ignored)"""
+        if latitude is None or longitude is None:
+            coordinates = province_coordinates(province)
+            if coordinates is None:
+                raise ValueError(f"Unknown outbreak location: {province!r}")
+            latitude, longitude = coordinates
+        radius_km = float(radius_km or DEFAULT_RADIUS_KM)
+        reported_at = reported_at or datetime.now().isoformat(timespec='seconds')
+        if outbreak_id is None:
+            fingerprint = f"{pest}|{float(latitude):.3f}|{float(longitude):.3f}|{radius_km}|{reported_at[:10]}"
+            outbreak_id = hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+
+        outbreak = Outbreak(outbreak_id, pest, float(latitude), float(longitude), radius_km, province, source, reported_at)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO outbreaks (id, pest, latitude, longitude, radius_km, province, source, reported_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                outbreak
+            )
+        return outbreak
+
+    def ingest_feed(self):
+        """Read reports appended to the feed file since the last call; returns reports read"""
+        if not self.feed_path or not os.path.exists(self.feed_path):
+            return 0
+        if os.path.getsize(self.feed_path) < self._feed_offset:
+            # Feed was truncated or rotated
+            self._feed_offset = 0
+
+        count = 0
+        with open(self.feed_path, 'r', encoding='utf-8') as f:
+            f.seek(self._feed_offset)
+            for line in iter(f.readline, ''):
+                if not line.endswith('\n'):
+                    break  # partially written line; pick it up next time
+                self._feed_offset = f.tell()
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    report = json.loads(line)
+                    self.report(
+                        report['pest'],
+                        latitude=report.get('latitude'),
+                        longitude=report.get('longitude'),
+                        province=report.get('province'),
+                        radius_km=report.get('radius_km'),
+                        source=report.get('source', 'feed'),
+                        reported_at=report.get('reported_at'),
+                        outbreak_id=report.get('id')
+                    )
+                    count += 1
+                except (KeyError, ValueError, TypeError) as e:
+                    print(f"Skipping bad outbreak report: {str(e)}")
+        return count
+
+    def pending(self):
+        """Outbreaks not alerted yet, oldest first"""
+        rows = self._conn().execute(
+            "SELECT id, pest, latitude, longitude, radius_km, province, source, reported_at "
+            "FROM outbreaks WHERE alerted_at IS NULL ORDER BY reported_at"
+        ).fetchall()
+        return [Outbreak(*row) for row in rows]
+
+    def claim(self, outbreak_id):
+        """Take an outbreak for alerting; False if another worker already has it"""
+        conn = self._conn()
+        with conn:
+            cursor = conn.execute("UPDATE outbreaks SET alerted_at = ? WHERE id = ? AND alerted_at IS NULL",
+                                  (time.time(), outbreak_id))
+        return cursor.rowcount == 1
+
+    def mark_alerted(self, outbreak_id, recipients):
+        conn = self._conn()
+        with conn:
+            conn.execute("UPDATE outbreaks SET recipients = ? WHERE id = ?", (recipients, outbreak_id))
+
+    def simulate(self, season):
+        """Report a random seasonal pest in 1-5 random provinces (demo data)"""
+        pest = random.choice(SEASONAL_PESTS.get(season, ["Unknown Pest"]))
+        provinces = random.sample(sorted(PROVINCE_COORDINATES), k=random.randint(1, 5))
+        return [self.report(pest, province=province.title(), source='simulated') for province in provinces]
+
+
+class OutbreakFeedWatcher:
+    """Poll the outbreak feed file and alert as soon as new reports arrive"""
+
+    def __init__(self, store, on_reports, interval=60):
+        self.store = store
+        self.on_reports = on_reports
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.store.ingest_feed():
+                    self.on_reports()
+            except Exception as e:
+                print(f"Error reading outbreak feed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='pest-outbreak-feed', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+class PestAlertMatcher:
+    """Find the users near an outbreak who grow an affected crop"""
+
+    def __init__(self, spatial_index, audience_index):
+        self.spatial_index = spatial_index
+        self.audience_index = audience_index
+        self.latency = LatencyStats()
+        self.alerts = 0
+        self.matched = 0
+
+    def match(self, outbreak):
+        """User ids within the outbreak radius whose indexed crop is affected.
+
+        Users whose crop depends on the season (SEASONAL_CROP) are included so the
+        caller can check their crop for this season.
+        """
+        started = time.monotonic()
+        nearby = self.spatial_index.users_within(outbreak.latitude, outbreak.longitude, outbreak.radius_km)
+        target_crops = AFFECTED_CROPS.get(outbreak.pest, ["crops"])
+        crops = [
+            crop for crop in self.audience_index.crops()
+            if crop is not SEASONAL_CROP and any(target in crop for target in target_crops)
+        ]
+        growers = self.audience_index.select(crops=crops + [SEASONAL_CROP])
+
+        # Intersect from the smaller side
+        audience = nearby & growers if len(nearby) <= len(growers) else growers & nearby
+        self.latency.record(time.monotonic() - started)
+        self.alerts += 1
+        self.matched += len(audience)
+        return audience
+
+    def get_metrics(self):
+        return {
+            'alerts': self.alerts,
+            'users_matched': self.matched,
+            'match_latency': self.latency.summary(),
+            'spatial_index': self.spatial_index.get_metrics()
+        }
+
+
+# Farm locations, kept current by app.set_user_preference
+farm_index = SpatialIndex()
+
+# Shared outbreak store (reports and feed)
+outbreak_store = OutbreakStore.from_env()
+
+# Radius + crop matching shared by scheduled checks and officer reports
+pest_alert_matcher = PestAlertMatcher(farm_index, audience_index)
+
+
+def register_pest_alerts(app):
+    """Add the outbreak report endpoint, watch the feed file and expose /metrics/pest_alerts"""
+    app.config['PEST_OUTBREAK_STORE'] = outbreak_store
+
+    def alert_pending():
+        sms_system = app.config.get('SMS_SYSTEM')
+        if sms_system is not None:
+            sms_system.send_outbreak_alerts()
+
+    if outbreak_store.feed_path:
+        watcher = OutbreakFeedWatcher(outbreak_store, alert_pending,
+                                      interval=float(os.environ.get('PEST_FEED_POLL_INTERVAL', 60)))
+        watcher.start()
+        app.config['PEST_FEED_WATCHER'] = watcher
+
+    @app.route('/pest_alerts/reports', methods=['POST'])
+    def report_outbreak():
+        from flask import jsonify, request
+
+        # Reports can trigger SMS alerts, so they are refused until a token is configured
+        token = os.environ.get('PEST_REPORT_TOKEN')
+        if not token:
+            return jsonify({'error': 'Pest reports are disabled (PEST_REPORT_TOKEN is not set)'}), 503
+        if not hmac.compare_digest(request.headers.get('X-Report-Token', '').encode(), token.encode()):
+            return jsonify({'error': 'unauthorized'}), 401
+
+        data = request.get_json(silent=True) or {}
+        if not data.get('pest'):
+            return jsonify({'error': 'pest is required'}), 400
+        try:
+            outbreak = outbreak_store.report(
+                data['pest'],
+                latitude=data.get('latitude'),
+                longitude=data.get('longitude'),
+                province=data.get('province'),
+                radius_km=data.get('radius_km'),
+                source=data.get('source', 'officer')
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Alert right away rather than waiting for the next scheduled check
+        threading.Thread(target=alert_pending, daemon=True).start()
+
+        return jsonify({'id': outbreak.id, 'pest': outbreak.pest, 'radius_km': outbreak.radius_km}), 201
+
+    @app.route('/metrics/pest_alerts', methods=['GET'])
+    def pest_alert_metrics():
+        from flask import jsonify
+        return jsonify(pest_alert_matcher.get_metrics())
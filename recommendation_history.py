@@ -0,0 +1,399 @@
+# recommendation_history.py - Crop recommendation history: batched write-through to MongoDB and cursor-paged reads
+#
+# predict_crop hands every recommendation to record(), which returns at once;
+# a writer thread inserts them with insert_many in batches. Until a batch is
+# written the records are still served from memory, so a farmer sees a new
+# recommendation in their history straight away. Recommendations made before
+# MongoDB is first reached are held (up to max_buffered) and written once it is.
+#
+# Reads page with a keyset cursor on the (user_id, created_at, _id) index
+# instead of skip(): the cursor is the position of the last row returned, so
+# page 50 costs the same index seek as page 1.
+
+import base64
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from bson.objectid import ObjectId
+from pymongo import DESCENDING
+from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError
+
+from metrics import LatencyStats
+
+# Fields each view needs; everything else stays on the server
+TABLE_PROJECTION = {'created_at': 1, 'inputs.province': 1, 'outputs.predicted_crop': 1, 'outputs.season': 1}
+CARD_PROJECTION = dict(TABLE_PROJECTION, **{
+    'inputs.nitrogen': 1, 'inputs.phosphorus': 1, 'inputs.potassium': 1, 'inputs.ph': 1,
+    'outputs.seasonal_advice': 1
+})
+DETAIL_PROJECTION = {'user_id': 0}
+
+SORT = [('created_at', DESCENDING), ('_id', DESCENDING)]
+MAX_PAGE_SIZE = 50
+DUPLICATE_KEY = 11000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(document):
+    """Opaque cursor for the position just after `document`"""
+    position = f"{document['created_at'].isoformat()}|{document['_id']}"
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(created_at, _id) from encode_cursor(); raises InvalidCursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, _id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), ObjectId(_id)
+    except Exception:
+        raise InvalidCursor(cursor)
+
+
+def _project(document, projection):
+    """Apply an inclusion projection ({'a.b': 1}) to an in-memory document"""
+    if projection is DETAIL_PROJECTION:
+        return {key: value for key, value in document.items() if key != 'user_id'}
+    projected = {'_id': document['_id']}
+    for path in projection:
+        head, _, tail = path.partition('.')
+        if not tail:
+            if head in document:
+                projected[head] = document[head]
+        elif tail in document.get(head, {}):
+            projected.setdefault(head, {})[tail] = document[head][tail]
+    return projected
+
+
+def serialize(document):
+    """JSON shape the templates use"""
+    recommendation_id = str(document['_id'])
+    serialized = {key: value for key, value in document.items() if key not in ('_id', 'created_at')}
+    serialized['_id'] = recommendation_id
+    serialized['recommendation_id'] = recommendation_id
+    serialized['recommendation_date'] = document['created_at'].isoformat() + 'Z'
+    return serialized
+
+
+class RecommendationHistory:
+    """Per-user crop recommendation history in MongoDB, written in batches and read by keyset cursor"""
+
+    def __init__(self, batch_size=500, flush_interval=0.5, max_attempts=3, max_buffered=10000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.max_buffered = max_buffered
+        self.collection = None
+
+        self.recorded = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.insert_latency = LatencyStats()
+        self.page_latency = LatencyStats()
+
+        self._queue = queue.Queue()
+        self._pending = {}
+        self._writer = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Build a history store from RECOMMENDATION_HISTORY_* environment settings"""
+        return cls(
+            batch_size=int(os.environ.get('RECOMMENDATION_HISTORY_BATCH_SIZE', 500)),
+            flush_interval=float(os.environ.get('RECOMMENDATION_HISTORY_FLUSH_INTERVAL', 0.5)),
+            max_buffered=int(os.environ.get('RECOMMENDATION_HISTORY_MAX_BUFFERED', 10000))
+        )
+
+    def attach(self, collection):
+        """Store history in `collection`, make sure the paging index exists and write anything buffered"""
+        try:
+            collection.create_index([('user_id', 1), ('created_at', DESCENDING), ('_id', DESCENDING)])
+        except PyMongoError as e:
+            print(f"Error creating recommendation history index: {str(e)}")
+        self.collection = collection
+        self._ensure_writer()
+
+    @property
+    def available(self):
+        return self.collection is not None
+
+    # Write-through
+
+    def record(self, user_id, inputs, outputs):
+        """Queue one recommendation for insertion; returns its id (None if it had to be dropped)"""
+        if not user_id:
+            return None
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        document = {
+            '_id': ObjectId(),
+            'user_id': user_id,
+            # MongoDB keeps milliseconds; truncate so cursors match stored values exactly
+            'created_at': now.replace(microsecond=now.microsecond // 1000 * 1000),
+            'inputs': inputs,
+            'outputs': outputs
+        }
+        with self._lock:
+            # Before MongoDB is reached nothing drains the buffer, so it is capped
+            if self.collection is None and len(self._pending) >= self.max_buffered:
+                self.dropped += 1
+                return None
+            self._pending[document['_id']] = document
+            self.recorded += 1
+        self._queue.put((document, 1))
+        if self.collection is not None:
+            self._ensure_writer()
+        return str(document['_id'])
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name='recommendation-history', daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(items) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(items)
+
+    def _write(self, items):
+        # inserted_at is when this attempt reached MongoDB; incremental exports window on it
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        documents = [dict(document, inserted_at=now) for document, attempt in items]
+        started = time.monotonic()
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # A retried batch may be partly in already; only other errors are real failures
+            failed = {error['index'] for error in e.details.get('writeErrors', []) if error.get('code') != DUPLICATE_KEY}
+            if failed:
+                self._retry([items[index] for index in sorted(failed)], e)
+            items = [item for index, item in enumerate(items) if index not in failed]
+        except PyMongoError as e:
+            self._retry(items, e)
+            return
+
+        self.insert_latency.record(time.monotonic() - started)
+        with self._lock:
+            for document, attempt in items:
+                self._pending.pop(document['_id'], None)
+            self.written += len(items)
+            self.batches += 1
+
+    def _retry(self, items, error):
+        # While the database is unreachable keep everything, without using up attempts
+        outage = isinstance(error, ConnectionFailure)
+        retry = [(document, attempt if outage else attempt + 1) for document, attempt in items
+                 if outage or attempt < self.max_attempts]
+        with self._lock:
+            for document, attempt in items:
+                if not outage and attempt >= self.max_attempts:
+                    self._pending.pop(document['_id'], None)
+                    self.dropped += 1
+        print(f"Error saving {len(items)} crop recommendations ({len(retry)} will be retried): {str(error)}")
+        if retry:
+            time.sleep(1)
+            for item in retry:
+                self._queue.put(item)
+
+    def flush(self, timeout=10.0):
+        """Wait until every recorded recommendation has been written or dropped"""
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    # Reads
+
+    def _pending_for(self, user_id):
+        with self._lock:
+            return [document for document in self._pending.values() if document['user_id'] == user_id]
+
+    def page(self, user_id, cursor=None, limit=5, projection=CARD_PROJECTION):
+        """Up to `limit` recommendations after `cursor`, newest first; returns (documents, next_cursor)"""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        query = {'user_id': user_id}
+        after = None
+        if cursor:
+            after = decode_cursor(cursor)
+            created_at, _id = after
+            query['$or'] = [
+                {'created_at': {'$lt': created_at}},
+                {'created_at': created_at, '_id': {'$lt': _id}}
+            ]
+
+        started = time.monotonic()
+        documents = list(self.collection.find(query, projection).sort(SORT).limit(limit + 1))
+        self.page_latency.record(time.monotonic() - started)
+
+        # Fold in recommendations still waiting for the writer
+        pending = [document for document in self._pending_for(user_id)
+                   if after is None or (document['created_at'], document['_id']) < after]
+        if pending:
+            seen = {document['_id'] for document in documents}
+            documents += [_project(document, projection) for document in pending if document['_id'] not in seen]
+            documents.sort(key=lambda document: (document['created_at'], document['_id']), reverse=True)
+
+        next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+        return documents[:limit], next_cursor
+
+    def page_number(self, user_id, page, limit=5, projection=TABLE_PROJECTION):
+        """Old-style ?page=N: skips rows, so only used when a client has no cursor"""
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        if page <= 1:
+            return self.page(user_id, limit=limit, projection=projection)
+        documents = list(self.collection.find({'user_id': user_id}, projection)
+                         .sort(SORT).skip((page - 1) * limit).limit(limit + 1))
+        next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+        return documents[:limit], next_cursor
+
+    def count(self, user_id):
+        """Total recommendations for a user (index-only count)"""
+        stored = self.collection.count_documents({'user_id': user_id})
+        pending = self._pending_for(user_id)
+        if pending:
+            # Anything the writer already inserted is counted in `stored`
+            ids = [document['_id'] for document in pending]
+            stored += len(ids) - self.collection.count_documents({'user_id': user_id, '_id': {'$in': ids}})
+        return stored
+
+    def get(self, user_id, recommendation_id):
+        """One full recommendation owned by `user_id`, or None"""
+        try:
+            _id = ObjectId(recommendation_id)
+        except Exception:
+            return None
+        with self._lock:
+            document = self._pending.get(_id)
+        if document is not None:
+            return _project(document, DETAIL_PROJECTION) if document['user_id'] == user_id else None
+        return self.collection.find_one({'_id': _id, 'user_id': user_id}, DETAIL_PROJECTION)
+
+    def get_metrics(self):
+        """Write-through backlog and read latencies"""
+        return {
+            'persistent': self.collection is not None,
+            'recorded': self.recorded,
+            'written': self.written,
+            'batches': self.batches,
+            'pending': len(self._pending),
+            'dropped': self.dropped,
+            'insert_latency': self.insert_latency.summary(),
+            'page_latency': self.page_latency.summary()
+        }
+
+
+# Shared by predict_crop (writes) and the history endpoints (reads)
+recommendation_history = RecommendationHistory.from_env()
+
+
+def register_recommendation_history(app):
+    """Store crop recommendations in MongoDB once it is reachable and add the history endpoints"""
+    from db import database
+
+    # History is unavailable until MongoDB has been reached once
+    database.on_connect(lambda: recommendation_history.attach(database.collection('crop_recommendations')))
+    app.config['RECOMMENDATION_HISTORY'] = recommendation_history
+
+    def history_request():
+        """(user_id, error response) for the current web session"""
+        from flask import jsonify, session
+
+        if not recommendation_history.available:
+            return None, jsonify({'success': False, 'error': 'Recommendation history is unavailable right now.'})
+        # Sessions without a user id have no history; their queries simply match nothing
+        return session.get('user_id'), None
+
+    @app.route('/recommendation_history', methods=['GET'])
+    def recommendation_history_table():
+        """Table view on the crop recommendation page: ?per_page=&cursor= (or legacy ?page=)"""
+        from flask import jsonify, request
+
+        user_id, response = history_request()
+        if response is not None:
+            return response
+        per_page = request.args.get('per_page', 5, type=int)
+        page = request.args.get('page', 1, type=int)
+        cursor = request.args.get('cursor')
+        try:
+            if cursor:
+                documents, next_cursor = recommendation_history.page(user_id, cursor, per_page, TABLE_PROJECTION)
+            else:
+                documents, next_cursor = recommendation_history.page_number(user_id, page, per_page)
+            # Counting is the only part that grows with history size, so only the first page pays for it
+            total = recommendation_history.count(user_id) if not cursor and page <= 1 else None
+        except InvalidCursor:
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+        except PyMongoError as e:
+            print(f"Error loading recommendation history: {str(e)}")
+            return jsonify({'success': False, 'error': 'Could not load recommendation history.'})
+
+        per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+        pagination = {'page': page, 'per_page': per_page, 'has_more': next_cursor is not None, 'next_cursor': next_cursor}
+        if total is not None:
+            pagination.update(total=total, total_pages=(total + per_page - 1) // per_page)
+        return jsonify({
+            'success': True,
+            'count': len(documents),
+            'recommendations': [serialize(document) for document in documents],
+            'pagination': pagination
+        })
+
+    @app.route('/api/recommendation_history', methods=['GET'])
+    def recommendation_history_api():
+        """Card view: ?limit=&cursor=, newest first"""
+        from flask import jsonify, request
+
+        user_id, response = history_request()
+        if response is not None:
+            return response
+        try:
+            documents, next_cursor = recommendation_history.page(
+                user_id, request.args.get('cursor'), request.args.get('limit', 12, type=int), CARD_PROJECTION)
+        except InvalidCursor:
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+        except PyMongoError as e:
+            print(f"Error loading recommendation history: {str(e)}")
+            return jsonify({'success': False, 'error': 'Could not load recommendation history.'})
+        return jsonify({
+            'success': True,
+            'recommendations': [serialize(document) for document in documents],
+            'next_cursor': next_cursor
+        })
+
+    @app.route('/api/recommendation/<recommendation_id>', methods=['GET'])
+    def recommendation_detail(recommendation_id):
+        from flask import jsonify
+
+        user_id, response = history_request()
+        if response is not None:
+            return response
+        try:
+            document = recommendation_history.get(user_id, recommendation_id)
+        except PyMongoError as e:
+            print(f"Error loading recommendation {recommendation_id}: {str(e)}")
+            return jsonify({'success': False, 'error': 'Could not load the recommendation.'})
+        if document is None:
+            return jsonify({'success': False, 'error': 'Recommendation not found'}), 404
+        return jsonify({'success': True, 'recommendation': serialize(document)})
+
+    @app.route('/metrics/recommendation_history', methods=['GET'])
+    def recommendation_history_metrics():
+        from flask import jsonify
+        return jsonify(recommendation_history.get_metrics())
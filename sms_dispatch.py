@@ -0,0 +1,356 @@
+# sms_dispatch.py - Pooled, concurrent and rate-limited SMS gateway dispatch
+
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from delivery_reports import delivery_store, new_ref
+from metrics import LatencyStats
+
+DEFAULT_SMS_API_URL = "https://api.yoursmsgateway.com/messages"
+
+# Sends are not idempotent: only statuses meaning the gateway refused the message
+# before taking it (rate limited, unavailable) are retried. A 500/502/504 or a read
+# timeout may come after the gateway accepted it, and a resend would duplicate the SMS.
+RETRYABLE_STATUS = {429, 503}
+
+
+def never_sent(error):
+    """True if a request failed before reaching the gateway (no connection), so a retry can't duplicate it"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), (NewConnectionError, ConnectTimeoutError))
+    return False
+
+
+class TokenBucket:
+    """Allow `rate` operations per second with bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available"""
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class DispatchResult:
+    """Outcome of one batch of SMS sends (counted per recipient)"""
+
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.http_calls = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, ok, retries, recipients=1):
+        with self._lock:
+            if ok:
+                self.sent += recipients
+            else:
+                self.failed += recipients
+            self.retries += retries
+            self.http_calls += 1
+
+    def summary(self):
+        total = self.sent + self.failed
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retries': self.retries,
+            'http_calls': self.http_calls,
+            'http_calls_saved': total - self.http_calls,
+            'elapsed_seconds': round(self.elapsed, 3),
+            'messages_per_second': round(total / self.elapsed, 1) if self.elapsed else 0.0
+        }
+
+
+class SMSDispatcher:
+    """Send SMS through one gateway with pooled connections, bounded concurrency,
+    a token-bucket rate limit and retries with exponential backoff"""
+
+    def __init__(self, api_url=DEFAULT_SMS_API_URL, api_key=None, sender_id='Mudhumeni', name='default',
+                 max_workers=16, rate_per_second=50, burst=None, max_retries=3, backoff_seconds=0.5,
+                 connect_timeout=3.05, read_timeout=10, bulk_url=None, bulk_size=100,
+                 cost_per_segment=0.0, currency='USD', delivery_tracker=None):
+        """Configure the gateway; threads and connections are created on first use.
+
+        `bulk_size` is the most recipients the gateway accepts per bulk call
+        (0 or 1 disables bulk sends). `cost_per_segment` is only used for estimates.
+        With a `delivery_tracker` every recipient gets a client reference and accepted
+        sends are logged so delivery reports can be matched to campaigns.
+        """
+        self.name = name
+        self.api_url = api_url
+        self.bulk_url = bulk_url or api_url
+        self.bulk_size = bulk_size
+        self.api_key = api_key
+        self.sender_id = sender_id
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.timeout = (connect_timeout, read_timeout)
+        self.rate_limiter = TokenBucket(rate_per_second, burst)
+        self.cost_per_segment = cost_per_segment
+        self.currency = currency
+        self.delivery_tracker = delivery_tracker
+
+        self.latency = LatencyStats()
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @classmethod
+    def from_env(cls, api_key=None, sender_id=None):
+        """Build a dispatcher from SMS_API_* / SMS_DISPATCH_* environment settings"""
+        return cls(
+            api_url=os.environ.get('SMS_API_URL', DEFAULT_SMS_API_URL),
+            api_key=api_key or os.environ.get('SMS_API_KEY'),
+            sender_id=sender_id or os.environ.get('SMS_SENDER_ID', 'Mudhumeni'),
+            name=os.environ.get('SMS_GATEWAY_NAME', 'default'),
+            max_workers=int(os.environ.get('SMS_DISPATCH_WORKERS', 16)),
+            rate_per_second=float(os.environ.get('SMS_GATEWAY_RATE', 50)),
+            burst=int(os.environ.get('SMS_GATEWAY_BURST', 0)) or None,
+            max_retries=int(os.environ.get('SMS_DISPATCH_RETRIES', 3)),
+            backoff_seconds=float(os.environ.get('SMS_DISPATCH_BACKOFF', 0.5)),
+            connect_timeout=float(os.environ.get('SMS_CONNECT_TIMEOUT', 3.05)),
+            read_timeout=float(os.environ.get('SMS_READ_TIMEOUT', 10)),
+            bulk_url=os.environ.get('SMS_API_BULK_URL'),
+            bulk_size=int(os.environ.get('SMS_GATEWAY_BULK_SIZE', 100)),
+            cost_per_segment=float(os.environ.get('SMS_COST_PER_SEGMENT', 0.0)),
+            currency=os.environ.get('SMS_COST_CURRENCY', 'USD'),
+            delivery_tracker=delivery_store if os.environ.get('SMS_DLR_ENABLED', 'true').lower() in ('1', 'true', 'yes') else None
+        )
+
+    def _session(self):
+        """One keep-alive session per worker thread"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            })
+            self._local.session = session
+        return session
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=f'sms-{self.name}')
+            return self._executor
+
+    def _backoff(self, attempt, response=None):
+        """Seconds to wait before retry `attempt`, honouring Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(float(retry_after), 60.0)
+                except ValueError:
+                    pass
+        delay = self.backoff_seconds * (2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _post(self, url, data, label):
+        """POST to the gateway, retrying transient failures; returns (ok, retries)"""
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            response = None
+            started = time.monotonic()
+            try:
+                response = self._session().post(url, json=data, timeout=self.timeout)
+                self.latency.record(time.monotonic() - started)
+                if response.status_code < 400:
+                    return True, attempt
+                if response.status_code not in RETRYABLE_STATUS:
+                    print(f"SMS gateway rejected message to {label}: HTTP {response.status_code}")
+                    return False, attempt
+            except requests.RequestException as e:
+                self.latency.record(time.monotonic() - started)
+                if attempt == self.max_retries or not never_sent(e):
+                    print(f"Error sending SMS to {label}: {str(e)}")
+                    return False, attempt
+
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt, response))
+
+        return False, self.max_retries
+
+    def _deliver(self, phone_numbers, message, campaign=None):
+        """Send one message to one recipient, or to several in a single bulk call"""
+        refs = [new_ref() for _ in phone_numbers] if self.delivery_tracker is not None else None
+
+        if len(phone_numbers) == 1:
+            data = {
+                "recipient": phone_numbers[0],
+                "message": message,
+                "sender_id": self.sender_id
+            }
+            if refs:
+                data["client_ref"] = refs[0]
+            ok, retries = self._post(self.api_url, data, phone_numbers[0])
+        else:
+            data = {
+                "recipients": list(phone_numbers),
+                "message": message,
+                "sender_id": self.sender_id
+            }
+            if refs:
+                data["client_refs"] = refs
+            ok, retries = self._post(self.bulk_url, data, f"{len(phone_numbers)} recipients")
+
+        if ok and refs:
+            self.delivery_tracker.record_sent(campaign, zip(refs, phone_numbers))
+        return ok, retries
+
+    def send(self, phone_number, message, campaign=None):
+        """Send one SMS on the calling thread"""
+        ok, retries = self._deliver([phone_number], message, campaign)
+        self._count(ok, retries)
+        return ok
+
+    def _count(self, ok, retries, recipients=1):
+        with self._lock:
+            if ok:
+                self.sent += recipients
+            else:
+                self.failed += recipients
+            self.retries += retries
+
+    def send_many(self, messages, campaign=None):
+        """Send (phone_number, message) pairs concurrently, one call each; blocks until all are done"""
+        return self._run((([phone_number], message) for phone_number, message in messages), campaign=campaign)
+
+    def send_groups(self, groups, on_result=None, campaign=None):
+        """Send [(message, [phone_number, ...]), ...]; identical messages go out in bulk batches.
+
+        `on_result(phone_numbers, message, ok)` is called after every gateway call.
+        """
+        return self._run(self._plan_calls(groups), on_result, campaign)
+
+    def _plan_calls(self, groups):
+        """Chunk each group's recipients into gateway-sized bulk calls"""
+        for message, phone_numbers in groups:
+            if self.bulk_size > 1 and len(phone_numbers) > 1:
+                for start in range(0, len(phone_numbers), self.bulk_size):
+                    yield phone_numbers[start:start + self.bulk_size], message
+            else:
+                for phone_number in phone_numbers:
+                    yield [phone_number], message
+
+    def estimate(self, groups, segments=0):
+        """Gateway calls, projected duration and cost of send_groups(groups) without sending.
+
+        Duration is bounded by the rate limit and, once latency has been observed,
+        by how many calls the worker pool can keep in flight.
+        """
+        calls = 0
+        for message, phone_numbers in groups:
+            if self.bulk_size > 1 and len(phone_numbers) > 1:
+                calls += -(-len(phone_numbers) // self.bulk_size)
+            else:
+                calls += len(phone_numbers)
+
+        seconds = calls / self.rate_limiter.rate if self.rate_limiter.rate > 0 else 0.0
+        average_latency = self.latency.summary()['avg_ms'] / 1000
+        if average_latency:
+            seconds = max(seconds, calls * average_latency / self.max_workers)
+        return {
+            'http_calls': calls,
+            'rate_per_second': self.rate_limiter.rate,
+            'projected_seconds': round(seconds, 1),
+            'estimated_cost': round(segments * self.cost_per_segment, 2),
+            'currency': self.currency
+        }
+
+    def _run(self, calls, on_result=None, campaign=None):
+        """Run (phone_numbers, message) gateway calls on the worker pool"""
+        result = DispatchResult()
+        executor = self._get_executor()
+
+        # Keep a bounded number of sends in flight so huge campaigns don't queue millions of tasks
+        limit = self.max_workers * 4
+        in_flight = threading.BoundedSemaphore(limit)
+
+        def deliver(phone_numbers, message):
+            try:
+                ok, retries = self._deliver(phone_numbers, message, campaign)
+            except Exception as e:
+                print(f"Error sending SMS to {len(phone_numbers)} recipients: {str(e)}")
+                ok, retries = False, 0
+            try:
+                self._count(ok, retries, len(phone_numbers))
+                result.record(ok, retries, len(phone_numbers))
+                if on_result is not None:
+                    on_result(phone_numbers, message, ok)
+            except Exception as e:
+                print(f"Error recording SMS result: {str(e)}")
+            finally:
+                in_flight.release()
+
+        for phone_numbers, message in calls:
+            in_flight.acquire()
+            executor.submit(deliver, phone_numbers, message)
+
+        # Every permit back means every send has finished
+        for _ in range(limit):
+            in_flight.acquire()
+
+        result.elapsed = time.monotonic() - result.started
+        return result
+
+    def get_metrics(self):
+        """Delivery counters and gateway latency"""
+        with self._lock:
+            counters = {
+                'gateway': self.name,
+                'workers': self.max_workers,
+                'rate_per_second': self.rate_limiter.rate,
+                'bulk_size': self.bulk_size,
+                'sent': self.sent,
+                'failed': self.failed,
+                'retries': self.retries
+            }
+        counters['latency'] = self.latency.summary()
+        return counters
+
+    def shutdown(self, wait=True):
+        """Stop the worker pool"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
@@ -0,0 +1,245 @@
+# sms_encoding.py - GSM-7 / UCS-2 aware message encoding and segmenting
+
+import os
+import re
+import unicodedata
+from collections import namedtuple
+
+# GSM 03.38 default alphabet (one septet each)
+GSM7_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+
+# Extension table characters (escape + character = two septets each)
+GSM7_EXTENDED = frozenset("^{}\\[~]|€\f")
+
+GSM7_CHARS = GSM7_BASIC | GSM7_EXTENDED
+
+# Segment sizes: (single message, each part of a concatenated message)
+SEGMENT_SIZES = {
+    'GSM-7': (160, 153),
+    'UCS-2': (70, 67)
+}
+
+# Common characters outside GSM-7 and their closest GSM-7 spelling
+TRANSLITERATIONS = {
+    '‘': "'", '’': "'", '‚': "'", '′': "'",
+    '“': '"', '”': '"', '„': '"', '″': '"',
+    '–': '-', '—': '-', '−': '-', '•': '-', '·': '-',
+    '…': '...', '\u00a0': ' ', '\u2009': ' ', '\u202f': ' ',
+    '°': '', '×': 'x', '÷': '/', '½': '1/2', '¼': '1/4', '¾': '3/4',
+    '≤': '<=', '≥': '>=', '→': '->', 'ç': 'c', 'º': 'o', 'ª': 'a'
+}
+
+# Emoji joiners and variation selectors left behind when stripping emoji
+_EMOJI_MODIFIERS = frozenset('\u200d\ufe0e\ufe0f\u20e3')
+
+# Per-channel defaults: (transliterate, strip_emoji)
+CHANNEL_POLICIES = {
+    'sms': (True, os.environ.get('SMS_STRIP_EMOJI', 'true').lower() in ('1', 'true', 'yes')),
+    'ussd': (True, os.environ.get('USSD_STRIP_EMOJI', 'false').lower() in ('1', 'true', 'yes'))
+}
+
+_SPACES = re.compile(r' {2,}')
+
+MessageCost = namedtuple('MessageCost', ['encoding', 'units', 'segments'])
+
+
+def is_gsm7(text):
+    """True if every character can be sent in the GSM-7 alphabet"""
+    return GSM7_CHARS.issuperset(text)
+
+
+def _ucs2_units(char):
+    return 2 if ord(char) > 0xFFFF else 1
+
+
+def char_units(char, encoding):
+    """Septets (GSM-7) or UTF-16 code units (UCS-2) one character takes"""
+    if encoding == 'GSM-7':
+        return 2 if char in GSM7_EXTENDED else 1
+    return _ucs2_units(char)
+
+
+def message_units(text, encoding=None):
+    """Length of the text in septets or UTF-16 code units"""
+    encoding = encoding or encoding_for(text)
+    if encoding == 'GSM-7':
+        return len(text) + sum(1 for char in text if char in GSM7_EXTENDED)
+    return len(text) + sum(1 for char in text if ord(char) > 0xFFFF)
+
+
+def encoding_for(text):
+    """'GSM-7' if the text fits the default alphabet, otherwise 'UCS-2'"""
+    return 'GSM-7' if is_gsm7(text) else 'UCS-2'
+
+
+def segment_count(units, encoding):
+    """Number of SMS segments needed for `units` septets / code units"""
+    single, multipart = SEGMENT_SIZES[encoding]
+    if units <= single:
+        return 1 if units else 0
+    return -(-units // multipart)
+
+
+def message_cost(text):
+    """Encoding, length in units and SMS segment count of a message"""
+    encoding = encoding_for(text)
+    units = message_units(text, encoding)
+    return MessageCost(encoding, units, segment_count(units, encoding))
+
+
+def is_emoji(char):
+    """Emoji, pictographs and other symbols that force UCS-2 without adding meaning"""
+    if char in _EMOJI_MODIFIERS:
+        return True
+    code = ord(char)
+    if code >= 0x1F000 or 0x2600 <= code <= 0x27BF or 0x2B00 <= code <= 0x2BFF:
+        return True
+    return unicodedata.category(char) == 'So' and char not in GSM7_CHARS
+
+
+def strip_emoji(text):
+    """Remove emoji and tidy the spaces they leave behind"""
+    if is_gsm7(text):
+        return text
+    stripped = ''.join(char for char in text if not is_emoji(char))
+    return '\n'.join(_SPACES.sub(' ', line).strip(' ') for line in stripped.split('\n'))
+
+
+def transliterate(text):
+    """Replace characters outside GSM-7 with their nearest GSM-7 spelling where one exists"""
+    if is_gsm7(text):
+        return text
+
+    parts = []
+    for char in text:
+        if char in GSM7_CHARS:
+            parts.append(char)
+        elif char in TRANSLITERATIONS:
+            parts.append(TRANSLITERATIONS[char])
+        else:
+            # Accented letters (ê, ô, ...) lose their accent; anything else is kept as is
+            base = unicodedata.normalize('NFKD', char)
+            base = ''.join(c for c in base if not unicodedata.combining(c))
+            parts.append(base if base and is_gsm7(base) else char)
+    return ''.join(parts)
+
+
+def prepare_for_channel(text, channel):
+    """Apply the channel's transliteration and emoji policy"""
+    if not text or is_gsm7(text):
+        return text
+    do_transliterate, do_strip_emoji = CHANNEL_POLICIES.get(channel, (False, False))
+    if do_strip_emoji:
+        text = strip_emoji(text)
+    if do_transliterate:
+        text = transliterate(text)
+    return text
+
+
+def split_segments(text):
+    """Split a message into the fewest SMS segments without breaking escapes or surrogate pairs"""
+    encoding = encoding_for(text)
+    units = message_units(text, encoding)
+    single, multipart = SEGMENT_SIZES[encoding]
+    if units <= single:
+        return [text] if text else []
+
+    segments = []
+    current = []
+    used = 0
+    for char in text:
+        size = char_units(char, encoding)
+        if used + size > multipart:
+            segments.append(''.join(current))
+            current = []
+            used = 0
+        current.append(char)
+        used += size
+
+    if current:
+        segments.append(''.join(current))
+    return segments
+
+
+def budget_units(max_length, encoding):
+    """Units that fit in a budget of `max_length` GSM-7 characters (140 bytes per 160)"""
+    if encoding == 'GSM-7':
+        return max_length
+    return (max_length * 7 // 8) // 2
+
+
+def _truncate_units(text, limit, encoding):
+    used = 0
+    for index, char in enumerate(text):
+        used += char_units(char, encoding)
+        if used > limit:
+            return text[:index]
+    return text
+
+
+def fits(text, max_length):
+    """True if the text fits a budget of `max_length` GSM-7 characters in its own encoding"""
+    encoding = encoding_for(text)
+    return message_units(text, encoding) <= budget_units(max_length, encoding)
+
+
+def truncate_to_budget(text, max_length, by_sentence=False, ellipsis='...'):
+    """Shorten text to fit `max_length` GSM-7 characters (fewer if it needs UCS-2)"""
+    if fits(text, max_length):
+        return text
+
+    encoding = encoding_for(text)
+    limit = budget_units(max_length, encoding)
+
+    if by_sentence:
+        shortened = _truncate_units(text, limit, encoding)
+        last_period = shortened.rfind('. ')
+        if shortened.endswith('.'):
+            return shortened.strip()
+        if last_period > 0:
+            return shortened[:last_period + 1].strip()
+
+    return _truncate_units(text, limit - message_units(ellipsis, encoding), encoding) + ellipsis
+
+
+def truncate_to_segments(text, max_segments, ellipsis='...'):
+    """Shorten an SMS so it needs at most `max_segments` segments"""
+    encoding = encoding_for(text)
+    single, multipart = SEGMENT_SIZES[encoding]
+    limit = single if max_segments == 1 else multipart * max_segments
+    if message_units(text, encoding) <= limit:
+        return text
+    return _truncate_units(text, limit - message_units(ellipsis, encoding), encoding) + ellipsis
+
+
+class SegmentReport:
+    """Tally messages, recipients and segments for one SMS campaign"""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.messages = 0
+        self.recipients = 0
+        self.segments = 0
+        self.by_encoding = {'GSM-7': 0, 'UCS-2': 0}
+
+    def add(self, message, recipients=1):
+        """Count a distinct message sent to `recipients` phone numbers"""
+        cost = message_cost(message)
+        self.messages += 1
+        self.recipients += recipients
+        self.segments += cost.segments * recipients
+        self.by_encoding[cost.encoding] += recipients
+        return cost
+
+    def summary(self):
+        return {
+            'campaign': self.name,
+            'messages': self.messages,
+            'recipients': self.recipients,
+            'segments': self.segments,
+            'segments_per_recipient': round(self.segments / self.recipients, 2) if self.recipients else 0.0,
+            'recipients_by_encoding': dict(self.by_encoding)
+        }
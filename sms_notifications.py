@@ -1,9 +1,9 @@
 # sms_notifications.py
 
+import atexit
+import hmac
 import os
-import requests
 import json
-import schedule
 import time
 import threading
 from datetime import datetime, timedelta
@@ -16,72 +16,120 @@ from app import (
     user_preferences,
     chatbot_response
 )
+from sms_templates import sms_template_engine
+from sms_encoding import prepare_for_channel, SegmentReport
+from sms_dispatch import SMSDispatcher
+from sms_queue import SMSOutbox, OutboxWorker, campaign_run_id
+from audience_index import audience_index, primary_crop, SEASONAL_CROP
+from notification_scheduler import NotificationScheduler
+from weather import weather_service
+from market_prices import market_price_store, format_price_line
+from pest_alerts import outbreak_store, pest_alert_matcher, AFFECTED_CROPS, SIMULATE_OUTBREAKS
+
+# Crops listed per market price SMS (keeps the message to a couple of segments)
+MARKET_PRICE_SMS_CROPS = 5
+
+# Distinct messages shown per campaign in a dry run (largest groups first)
+DRY_RUN_SAMPLES = 5
 
 class FarmingSMSNotification:
     """Handle SMS notifications for farming events and advice"""
     
-    def __init__(self, sms_api_key=None, sms_sender_id=None):
+    def __init__(self, sms_api_key=None, sms_sender_id=None, schedule_jobs=True):
         """Initialize the SMS notification system"""
         self.api_key = sms_api_key or os.environ.get('SMS_API_KEY')
         self.sender_id = sms_sender_id or os.environ.get('SMS_SENDER_ID', 'Mudhumeni')
         self.running = False
-        self.scheduler_thread = None
-        
-        # Notification templates
-        self.templates = {
-            'planting_reminder': (
-                "Mudhumeni: It's time to prepare for planting {crops} in your area. "
-                "Optimal planting window begins soon. Reply *123# for more info."
-            ),
-            'fertilizer_reminder': (
-                "Mudhumeni: Time to apply fertilizer to your {crop} crops. "
-                "For specific advice, dial *123# and select Farming Advice."
-            ),
-            'pest_alert': (
-                "Mudhumeni ALERT: {pest} reported in your region. "
-                "Check your {crop} fields and apply control measures if needed. Dial *123# for advice."
-            ),
-            'rainfall_forecast': (
-                "Mudhumeni: Rain forecast for {location} in next 48hrs. "
-                "Consider {activity} for your {crop} crops."
-            ),
-            'market_price': (
-                "Mudhumeni: Current market prices in {location}: {prices}. "
-                "Dial *123# for more agricultural info."
-            ),
-            'seasonal_transition': (
-                "Mudhumeni: {current_season} is ending soon. Time to prepare for {next_season}. "
-                "Recommended activities: {activities}. Dial *123# for details."
-            ),
-            'harvest_reminder': (
-                "Mudhumeni: Optimal harvest time for {crop} approaching. "
-                "For harvesting best practices, dial *123# and select Harvesting Advice."
-            )
-        }
+        self.scheduler = None
+        self.campaign_reports = []
+        self._outbreak_lock = threading.Lock()
+        
+        # Per-thread dry-run state: campaigns are planned instead of sent (see dry_run)
+        self._dry_run = threading.local()
+        
+        # Pooled, rate-limited gateway client shared by single sends and campaigns
+        self.dispatcher = SMSDispatcher.from_env(api_key=self.api_key, sender_id=self.sender_id)
+        
+        # Durable outbox (SMS_OUTBOX_PATH): campaigns are enqueued and drained by workers
+        self.outbox = SMSOutbox.from_env()
+        self.outbox_worker = OutboxWorker(self.outbox, self.dispatcher) if self.outbox else None
         
-        # Initialize notification scheduling
-        self._setup_schedules()
+        # Notification templates, precompiled per language (see sms_templates.py)
+        self.template_engine = sms_template_engine
+        
+        # Initialize notification scheduling (skipped for send-only instances)
+        if schedule_jobs:
+            self._setup_schedules()
     
     def _setup_schedules(self):
-        """Set up scheduled notifications"""
+        """Set up scheduled notifications (run only by the elected scheduler leader)"""
+        self.scheduler = NotificationScheduler.from_env()
+        
         # Daily weather notifications at 6 AM
-        schedule.every().day.at("06:00").do(self.send_weather_notifications)
+        self.scheduler.add_job('weather', self.send_weather_notifications, at="06:00")
         
         # Seasonal transition notifications (check weekly)
-        schedule.every().monday.at("08:00").do(self.check_seasonal_transitions)
+        self.scheduler.add_job('seasonal_transition', self.check_seasonal_transitions, at="08:00", weekday='monday')
         
         # Pest alerts (randomized to simulate real events - twice a week)
-        schedule.every().wednesday.at("09:00").do(self.check_pest_alerts)
-        schedule.every().saturday.at("09:00").do(self.check_pest_alerts)
+        self.scheduler.add_job('pest_alert_wednesday', self.check_pest_alerts, at="09:00", weekday='wednesday')
+        self.scheduler.add_job('pest_alert_saturday', self.check_pest_alerts, at="09:00", weekday='saturday')
         
         # Market prices (weekly)
-        schedule.every().friday.at("12:00").do(self.send_market_price_updates)
+        self.scheduler.add_job('market_price', self.send_market_price_updates, at="12:00", weekday='friday')
         
         # Planting reminders (every 3 days during planting seasons)
-        schedule.every(3).days.at("07:00").do(self.send_planting_reminders)
+        self.scheduler.add_job('planting_reminder', self.send_planting_reminders, at="07:00", every_days=3)
         
         # Maintenance reminders (check every 10 days)
-        schedule.every(10).days.at("10:00").do(self.send_crop_maintenance_reminders)
+        self.scheduler.add_job('crop_maintenance', self.send_crop_maintenance_reminders, at="10:00", every_days=10)
+    
+    def jobs(self):
+        """Notification jobs by name (the scheduler runs pest_alert twice a week)"""
+        return {
+            'weather': self.send_weather_notifications,
+            'seasonal_transition': self.check_seasonal_transitions,
+            'pest_alert': self.check_pest_alerts,
+            'market_price': self.send_market_price_updates,
+            'planting_reminder': self.send_planting_reminders,
+            'crop_maintenance': self.send_crop_maintenance_reminders
+        }
+    
+    def is_dry_run(self):
+        """True while this thread is inside dry_run()"""
+        return getattr(self._dry_run, 'plans', None) is not None
+    
+    def dry_run(self, job_names=None):
+        """Run jobs without sending anything and report what they would send.
+        
+        Audiences, rendering and segment counting go through the real job code;
+        send_template_campaign stops before the outbox / gateway and records the
+        campaign with its gateway calls, estimated cost and projected send time.
+        """
+        jobs = self.jobs()
+        job_names = list(job_names or jobs)
+        unknown = [name for name in job_names if name not in jobs]
+        if unknown:
+            raise ValueError(f"Unknown notification jobs: {', '.join(unknown)}")
+        
+        results = {}
+        for name in job_names:
+            self._dry_run.plans = []
+            started = time.monotonic()
+            try:
+                jobs[name]()
+            finally:
+                plans, self._dry_run.plans = self._dry_run.plans, None
+            results[name] = {
+                'campaigns': plans,
+                'recipients': sum(plan['recipients'] for plan in plans),
+                'segments': sum(plan['segments'] for plan in plans),
+                'estimated_cost': round(sum(plan['estimated_cost'] for plan in plans), 2),
+                'currency': self.dispatcher.currency,
+                'projected_seconds': round(sum(plan['projected_seconds'] for plan in plans), 1),
+                'dry_run_seconds': round(time.monotonic() - started, 3)
+            }
+        return results
     
     def _format_phone_number(self, phone_number):
         """Format phone number for SMS API"""
@@ -98,6 +146,9 @@ class FarmingSMSNotification:
     
     def send_sms(self, phone_number, message):
         """Send SMS message to a user"""
+        # Transliterate and strip emoji so the message stays in cheap GSM-7 segments
+        message = prepare_for_channel(message, 'sms')
+        
         if not self.api_key:
             print(f"[MOCK SMS] To: {phone_number}, Message: {message}")
             return True
@@ -105,80 +156,126 @@ class FarmingSMSNotification:
         # Format phone number
         formatted_number = self._format_phone_number(phone_number)
         
-        try:
-            # This is a generic SMS API call - adjust for your specific provider
-            url = "https://api.yoursmsgateway.com/messages"
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            data = {
-                "recipient": formatted_number,
-                "message": message,
-                "sender_id": self.sender_id
-            }
-            
-            response = requests.post(url, headers=headers, json=data)
-            response.raise_for_status()
-            
+        # Generic SMS API call with timeouts and retries - adjust SMS_API_URL for your provider
+        if self.dispatcher.send(formatted_number, message):
             print(f"SMS sent to {formatted_number}")
             return True
-            
-        except Exception as e:
-            print(f"Error sending SMS to {formatted_number}: {str(e)}")
-            return False
+        
+        return False
+    
+    def send_template_campaign(self, recipients, campaign=None):
+        """Render each distinct (language, template, params) message once and send it to its group"""
+        recipients = list(recipients)
+        groups = self.template_engine.render_groups(recipients)
+        report = SegmentReport(campaign)
+        
+        outgoing = []
+        for message, phone_numbers in groups:
+            message = prepare_for_channel(message, 'sms')
+            report.add(message, len(phone_numbers))
+            outgoing.append((message, phone_numbers))
+        
+        plans = getattr(self._dry_run, 'plans', None)
+        if plans is not None:
+            # Dry run: everything up to the outbox / gateway, then estimate instead of sending
+            summary = report.summary()
+            summary.update(self.dispatcher.estimate(outgoing, summary['segments']))
+            summary['samples'] = [
+                {'message': message, 'recipients': len(phone_numbers)}
+                for message, phone_numbers in sorted(outgoing, key=lambda group: -len(group[1]))[:DRY_RUN_SAMPLES]
+            ]
+            plans.append(summary)
+            return 0
+        
+        if self.outbox is not None:
+            # Enqueue once per (campaign run, user); a rerun only adds who was missed. Keys use the
+            # user id (looked up by phone), so a farmer who changes number isn't sent the run twice
+            run_id = campaign_run_id(campaign or 'ad_hoc')
+            added = self.outbox.enqueue(run_id, (
+                (audience_index.user_for_phone(phone_number) or phone_number,
+                 self._format_phone_number(phone_number), message)
+                for message, phone_numbers in outgoing
+                for phone_number in phone_numbers
+            ))
+            summary = report.summary()
+            summary['enqueued'] = added
+            self.campaign_reports = (self.campaign_reports + [summary])[-50:]
+            print(f"SMS campaign {run_id}: {summary['messages']} distinct messages, "
+                  f"{summary['segments']} SMS segments, {added} of {summary['recipients']} recipients enqueued "
+                  f"({summary['recipients'] - added} already queued)")
+            return added
+        
+        if self.api_key:
+            # Identical messages go out in bulk calls; personalized ones one by one
+            result = self.dispatcher.send_groups([
+                (message, [self._format_phone_number(phone_number) for phone_number in phone_numbers])
+                for message, phone_numbers in outgoing
+            ], campaign=campaign_run_id(campaign or 'ad_hoc'))
+            sent = result.sent
+            http_calls = result.http_calls
+            print(f"SMS campaign {campaign or 'ad hoc'} dispatch: {result.summary()}")
+        else:
+            sent = 0
+            http_calls = report.recipients
+            for message, phone_numbers in outgoing:
+                for phone_number in phone_numbers:
+                    if self.send_sms(phone_number, message):
+                        sent += 1
+        
+        summary = report.summary()
+        summary['http_calls'] = http_calls
+        summary['http_calls_saved'] = report.recipients - http_calls
+        self.campaign_reports = (self.campaign_reports + [summary])[-50:]
+        print(f"SMS campaign {campaign or 'ad hoc'}: {summary['messages']} distinct messages, "
+              f"{summary['recipients']} recipients, {summary['segments']} SMS segments "
+              f"(UCS-2 recipients: {summary['recipients_by_encoding']['UCS-2']}), "
+              f"{http_calls} HTTP calls ({summary['http_calls_saved']} saved)")
+        
+        return sent
+    
+    def _audience(self, user_ids):
+        """(user_id, prefs) for indexed users that still have a phone number"""
+        for user_id in user_ids:
+            prefs = user_preferences.get(user_id)
+            if prefs and prefs.get('phone_number'):
+                yield user_id, prefs
     
     def send_weather_notifications(self):
         """Send weather-related notifications to users"""
         print("Checking weather forecasts for notifications...")
         
-        # Group users by location for batch processing
-        users_by_location = {}
+        # Forecasts for every location at once (cached, fetched concurrently when cold)
+        audience_by_location = audience_index.by_location_groups()
+        forecasts = weather_service.get_many(list(audience_by_location))
         
-        for user_id, prefs in user_preferences.items():
-            if not prefs.get('phone_number'):
+        # For each location with a forecast, collect notifications
+        recipients = []
+        for location, user_ids in audience_by_location.items():
+            weather_conditions = forecasts.get(location)
+            if not weather_conditions:
                 continue
-                
-            location = prefs.get('location', 'Unknown')
-            if location not in users_by_location:
-                users_by_location[location] = []
-            
-            users_by_location[location].append({
-                'user_id': user_id,
-                'phone_number': prefs['phone_number'],
-                'farming_type': prefs.get('farming_type', 'crop farming')
-            })
-        
-        # For each location, get weather forecast and send notifications
-        for location, users in users_by_location.items():
-            # In a real implementation, you would fetch actual weather data
-            # Here we simulate weather conditions
-            weather_conditions = self._simulate_weather_forecast(location)
+            users = self._audience(user_ids)
             
             if weather_conditions.get('rainfall_probability', 0) > 70:
                 # Heavy rain expected
-                for user in users:
-                    crop_type = self._get_primary_crop_for_user(user['user_id'])
-                    activity = "harvesting" if weather_conditions.get('rainfall_amount', 0) > 30 else "covering seedlings"
-                    
-                    message = self.templates['rainfall_forecast'].format(
-                        location=location,
-                        activity=activity,
-                        crop=crop_type
-                    )
-                    
-                    self.send_sms(user['phone_number'], message)
+                activity = "harvesting" if weather_conditions.get('rainfall_amount', 0) > 30 else "covering_seedlings"
+                for user_id, prefs in users:
+                    crop_type = self._get_primary_crop_for_user(user_id)
+                    recipients.append((prefs['phone_number'], prefs.get('language'), 'rainfall_forecast', {
+                        'location': location,
+                        'activity': activity,
+                        'crop': crop_type
+                    }))
             
             elif weather_conditions.get('temperature', 0) > 35:
                 # Extreme heat warning
-                for user in users:
-                    message = (
-                        f"Mudhumeni: High temperatures expected in {location} "
-                        f"({weather_conditions.get('temperature')}°C). Ensure adequate irrigation "
-                        f"for your crops. Dial *123# for heat management advice."
-                    )
-                    
-                    self.send_sms(user['phone_number'], message)
+                for user_id, prefs in users:
+                    recipients.append((prefs['phone_number'], prefs.get('language'), 'heat_warning', {
+                        'location': location,
+                        'temperature': weather_conditions.get('temperature')
+                    }))
+        
+        self.send_template_campaign(recipients, campaign='weather')
     
     def check_seasonal_transitions(self):
         """Check for upcoming seasonal transitions and notify users"""
@@ -217,124 +314,83 @@ class FarmingSMSNotification:
             # If within 14 days of transition, send notifications
             if days_until_transition <= 14:
                 seasonal_activities = self._get_seasonal_transition_activities(current_season, next_season)
+                params = {
+                    'current_season': current_season,
+                    'next_season': next_season,
+                    'activities': seasonal_activities
+                }
                 
-                for user_id, prefs in user_preferences.items():
-                    if not prefs.get('phone_number'):
-                        continue
-                    
-                    message = self.templates['seasonal_transition'].format(
-                        current_season=current_season.title(),
-                        next_season=next_season.title(),
-                        activities=seasonal_activities
-                    )
-                    
-                    self.send_sms(prefs['phone_number'], message)
+                self.send_template_campaign([
+                    (prefs['phone_number'], prefs.get('language'), 'seasonal_transition', params)
+                    for user_id, prefs in self._audience(audience_index.select())
+                ], campaign='seasonal_transition')
     
     def check_pest_alerts(self):
         """Check for pest alerts and notify users based on their crops"""
         print("Checking for pest alerts...")
         
-        # In a real system, you would fetch actual pest outbreak data
-        # Here we simulate some pest alerts for demonstration
+        # New reports from the outbreak feed file (officer reports arrive through the API).
+        # Dry runs leave the feed alone and preview the outbreaks already pending.
+        if not self.is_dry_run():
+            outbreak_store.ingest_feed()
         
-        # Common pests by season
-        season = get_current_season()
-        seasonal_pests = {
-            "summer": ["Fall Armyworm", "Stalk Borer", "Aphids"],
-            "autumn": ["Bollworm", "Red Spider Mites", "Whitefly"],
-            "winter": ["Aphids", "Cutworms", "Diamondback Moth"],
-            "spring": ["Thrips", "Leaf Miners", "African Armyworm"]
-        }
+        # No real feed: simulate an outbreak 30% of the time for demonstration (not in dry runs)
+        if SIMULATE_OUTBREAKS and not self.is_dry_run() and random.random() < 0.3:
+            outbreak_store.simulate(get_current_season())
         
-        # Randomly select if there's a pest alert (30% chance)
-        if random.random() < 0.3:
-            # Select a random pest for this season
-            pest = random.choice(seasonal_pests.get(season, ["Unknown Pest"]))
-            
-            # Determine affected crops
-            affected_crops = {
-                "Fall Armyworm": ["maize", "sorghum", "millet"],
-                "Stalk Borer": ["maize", "sorghum"],
-                "Aphids": ["vegetables", "cotton", "tobacco"],
-                "Bollworm": ["cotton", "maize", "tomatoes"],
-                "Red Spider Mites": ["cotton", "tomatoes"],
-                "Whitefly": ["cotton", "vegetables"],
-                "Cutworms": ["seedlings", "vegetables"],
-                "Diamondback Moth": ["cabbage", "vegetables"],
-                "Thrips": ["onions", "cotton", "vegetables"],
-                "Leaf Miners": ["vegetables", "leafy greens"],
-                "African Armyworm": ["maize", "pasture", "cereals"]
-            }
-            
-            target_crops = affected_crops.get(pest, ["crops"])
-            
-            # Determine affected regions (simulate)
-            affected_regions = random.sample([
-                "Harare", "Bulawayo", "Manicaland", "Mashonaland Central", 
-                "Mashonaland East", "Mashonaland West", "Masvingo", 
-                "Matabeleland North", "Matabeleland South", "Midlands",
-                "Gauteng", "Western Cape", "Limpopo"
-            ], k=random.randint(1, 5))
-            
-            # Notify users in affected regions with relevant crops
-            for user_id, prefs in user_preferences.items():
-                if not prefs.get('phone_number') or not prefs.get('location'):
-                    continue
-                
-                user_location = prefs['location']
-                if user_location not in affected_regions:
+        self.send_outbreak_alerts()
+    
+    def send_outbreak_alerts(self):
+        """Alert users within each pending outbreak's radius who grow an affected crop"""
+        with self._outbreak_lock:
+            for outbreak in outbreak_store.pending():
+                # Another worker may be alerting the same outbreak (dry runs only look)
+                if not self.is_dry_run() and not outbreak_store.claim(outbreak.id):
                     continue
                 
-                # Check if user has the affected crops
-                user_crop = self._get_primary_crop_for_user(user_id)
-                
-                if any(crop in user_crop.lower() for crop in target_crops):
-                    message = self.templates['pest_alert'].format(
-                        pest=pest,
-                        crop=user_crop
-                    )
+                target_crops = AFFECTED_CROPS.get(outbreak.pest, ["crops"])
+                recipients = []
+                for user_id, prefs in self._audience(pest_alert_matcher.match(outbreak)):
+                    # Check if user has the affected crops
+                    user_crop = self._get_primary_crop_for_user(user_id)
                     
-                    self.send_sms(prefs['phone_number'], message)
+                    if any(crop in user_crop.lower() for crop in target_crops):
+                        recipients.append((prefs['phone_number'], prefs.get('language'), 'pest_alert', {
+                            'pest': outbreak.pest,
+                            'crop': user_crop
+                        }))
+                
+                self.send_template_campaign(recipients, campaign=f'pest_alert_{outbreak.id}')
+                if not self.is_dry_run():
+                    outbreak_store.mark_alerted(outbreak.id, len(recipients))
     
     def send_market_price_updates(self):
         """Send market price updates to users"""
         print("Sending market price updates...")
         
-        # In a real system, you would fetch actual market prices
-        # Here we simulate market prices
-        
-        # Group users by location
-        users_by_location = {}
-        
-        for user_id, prefs in user_preferences.items():
-            if not prefs.get('phone_number'):
-                continue
-                
-            location = prefs.get('location', 'Unknown')
-            if location not in users_by_location:
-                users_by_location[location] = []
-            
-            users_by_location[location].append({
-                'user_id': user_id,
-                'phone_number': prefs['phone_number']
-            })
-        
-        # For each location, generate market prices and send notifications
-        for location, users in users_by_location.items():
-            # Simulate market prices
-            prices = self._simulate_market_prices()
-            
-            # Format price information
-            price_text = ", ".join([f"{crop}: ${price}/kg" for crop, price in prices.items()])
+        # For each location, look up the latest ingested prices and collect notifications
+        recipients = []
+        for location, user_ids in audience_index.by_location_groups().items():
+            # Latest prices for the location (or the default market) from the price store
+            prices = market_price_store.location_prices(location)
             
-            # Send to each user in the location
-            for user in users:
-                message = self.templates['market_price'].format(
-                    location=location,
-                    prices=price_text
+            if prices:
+                price_text = ", ".join(
+                    format_price_line(crop, summary, with_average=False)
+                    for crop, summary in sorted(prices.items())[:MARKET_PRICE_SMS_CROPS]
                 )
-                
-                self.send_sms(user['phone_number'], message)
+            else:
+                # No feed ingested yet: simulated prices keep the campaign demonstrable
+                price_text = ", ".join([f"{crop}: ${price}/kg" for crop, price in self._simulate_market_prices().items()])
+            
+            # Same message for every user in the location (per language)
+            for user_id, prefs in self._audience(user_ids):
+                recipients.append((prefs['phone_number'], prefs.get('language'), 'market_price', {
+                    'location': location,
+                    'prices': price_text
+                }))
+        
+        self.send_template_campaign(recipients, campaign='market_price')
     
     def send_planting_reminders(self):
         """Send planting reminders based on season and location"""
@@ -374,15 +430,10 @@ class FarmingSMSNotification:
             selected_crops = ", ".join(random.sample(upcoming_crops, min(3, len(upcoming_crops))))
             
             # Send notifications to all users
-            for user_id, prefs in user_preferences.items():
-                if not prefs.get('phone_number'):
-                    continue
-                
-                message = self.templates['planting_reminder'].format(
-                    crops=selected_crops
-                )
-                
-                self.send_sms(prefs['phone_number'], message)
+            self.send_template_campaign([
+                (prefs['phone_number'], prefs.get('language'), 'planting_reminder', {'crops': selected_crops})
+                for user_id, prefs in self._audience(audience_index.select())
+            ], campaign='planting_reminder')
     
     def send_crop_maintenance_reminders(self):
         """Send reminders about crop maintenance based on growth stage"""
@@ -423,33 +474,29 @@ class FarmingSMSNotification:
             return
         
         # Send reminders to users based on their primary crops
-        for user_id, prefs in user_preferences.items():
-            if not prefs.get('phone_number'):
-                continue
-            
+        recipients = []
+        for user_id, prefs in self._audience(audience_index.select()):
             user_crop = self._get_primary_crop_for_user(user_id)
             
             # If we have specific advice for their crop, send it
             if user_crop.lower() in seasonal_activities:
                 activity = seasonal_activities[user_crop.lower()]
                 
-                message = (
-                    f"Mudhumeni: Time for {activity} on your {user_crop} crop. "
-                    f"For detailed advice, dial *123# and select Farming Advice."
-                )
-                
-                self.send_sms(prefs['phone_number'], message)
+                recipients.append((prefs['phone_number'], prefs.get('language'), 'crop_maintenance', {
+                    'activity': activity,
+                    'crop': user_crop
+                }))
             else:
                 # Generic maintenance reminder
                 random_crop = random.choice(list(seasonal_activities.keys()))
                 activity = seasonal_activities[random_crop]
                 
-                message = (
-                    f"Mudhumeni: {current_season.title()} crop maintenance reminder. "
-                    f"Consider {activity}. Dial *123# for more specific advice."
-                )
-                
-                self.send_sms(prefs['phone_number'], message)
+                recipients.append((prefs['phone_number'], prefs.get('language'), 'seasonal_maintenance', {
+                    'season': current_season,
+                    'activity': activity
+                }))
+        
+        self.send_template_campaign(recipients, campaign='crop_maintenance')
     
     def _get_primary_crop_for_user(self, user_id):
         """Determine the primary crop for a user based on their preferences or location"""
@@ -457,24 +504,14 @@ class FarmingSMSNotification:
         # Here we make an educated guess based on available data
         
         user_prefs = user_preferences.get(user_id, {})
-        farming_type = user_prefs.get('farming_type', '').lower()
-        location = user_prefs.get('location', '').lower()
-        season = get_current_season()
+        crop = primary_crop(user_prefs.get('farming_type'))
+        if crop is not SEASONAL_CROP:
+            return crop
         
         # Get seasonal crops
-        season_crops = seasonal_crops.get(season, [])
-        
-        if "maize" in farming_type or not farming_type:
-            return "maize"  # Most common crop in Southern Africa
-        elif "cotton" in farming_type:
-            return "cotton"
-        elif "tobacco" in farming_type:
-            return "tobacco"
-        elif "vegetable" in farming_type:
-            return "vegetables"
-        elif "livestock" in farming_type:
-            return "pasture"
-        elif season_crops:
+        season_crops = seasonal_crops.get(get_current_season(), [])
+        
+        if season_crops:
             return random.choice(season_crops)
         else:
             return "crops"  # Generic fallback
@@ -497,68 +534,6 @@ class FarmingSMSNotification:
         
         return transition_activities.get((current_season, next_season), "preparation for next season")
     
-    def _simulate_weather_forecast(self, location):
-        """Simulate weather forecast for a location"""
-        # In a real system, you would fetch actual weather data
-        
-        season = get_current_season()
-        
-        # Base values by season
-        base_values = {
-            "summer": {"temp_min": 18, "temp_max": 32, "rain_prob": 60, "rain_amount": 15},
-            "autumn": {"temp_min": 12, "temp_max": 25, "rain_prob": 40, "rain_amount": 8},
-            "winter": {"temp_min": 5, "temp_max": 20, "rain_prob": 20, "rain_amount": 3},
-            "spring": {"temp_min": 12, "temp_max": 28, "rain_prob": 30, "rain_amount": 10}
-        }
-        
-        # Adjust for location
-        location_adjustments = {
-            "harare": {"temp": 0, "rain": 0},
-            "bulawayo": {"temp": 2, "rain": -10},
-            "manicaland": {"temp": -1, "rain": 10},
-            "mashonaland": {"temp": 0, "rain": 5},
-            "masvingo": {"temp": 1, "rain": -5},
-            "matabeleland": {"temp": 3, "rain": -15},
-            "midlands": {"temp": 0, "rain": 0},
-            "gauteng": {"temp": 0, "rain": 0},
-            "western cape": {"temp": -2, "rain": 5},
-            "eastern cape": {"temp": -1, "rain": 10},
-            "limpopo": {"temp": 3, "rain": -10}
-        }
-        
-        # Find the best matching location adjustment
-        location_lower = location.lower()
-        adjustment = {"temp": 0, "rain": 0}
-        
-        for loc_key, loc_adj in location_adjustments.items():
-            if loc_key in location_lower:
-                adjustment = loc_adj
-                break
-        
-        # Get base values for the season
-        base = base_values.get(season, {"temp_min": 15, "temp_max": 25, "rain_prob": 30, "rain_amount": 5})
-        
-        # Apply location adjustment and randomness
-        temp_min = base["temp_min"] + adjustment["temp"] + random.uniform(-3, 3)
-        temp_max = base["temp_max"] + adjustment["temp"] + random.uniform(-3, 3)
-        rain_prob = base["rain_prob"] + adjustment["rain"] + random.uniform(-15, 15)
-        rain_amount = base["rain_amount"] + (adjustment["rain"] / 5) + random.uniform(-3, 5)
-        
-        # Ensure values are within reasonable ranges
-        rain_prob = max(0, min(100, rain_prob))
-        rain_amount = max(0, rain_amount)
-        
-        # Today's temperature (random point between min and max)
-        temperature = temp_min + (temp_max - temp_min) * random.random()
-        
-        return {
-            "temperature": round(temperature, 1),
-            "temperature_min": round(temp_min, 1),
-            "temperature_max": round(temp_max, 1),
-            "rainfall_probability": round(rain_prob),
-            "rainfall_amount": round(rain_amount, 1)
-        }
-    
     def _simulate_market_prices(self):
         """Simulate market prices for common crops"""
         # Base prices for common crops (in local currency per kg)
@@ -586,17 +561,16 @@ class FarmingSMSNotification:
             print("Notification system already running")
             return
         
-        def run_scheduler():
-            self.running = True
-            print("Starting SMS notification scheduler")
-            
-            while self.running:
-                schedule.run_pending()
-                time.sleep(60)  # Check every minute
+        self.running = True
+        print("Starting SMS notification scheduler")
+        
+        # Every worker competes for leadership; only the leader sends campaigns
+        if self.scheduler:
+            self.scheduler.start()
         
-        self.scheduler_thread = threading.Thread(target=run_scheduler)
-        self.scheduler_thread.daemon = True
-        self.scheduler_thread.start()
+        # Drain the outbox in-process as well (more workers: python sms_queue.py drain)
+        if self.outbox_worker:
+            self.outbox_worker.start()
     
     def stop(self):
         """Stop the notification scheduler"""
@@ -605,8 +579,10 @@ class FarmingSMSNotification:
             return
         
         self.running = False
-        if self.scheduler_thread:
-            self.scheduler_thread.join(timeout=2)
+        if self.outbox_worker:
+            self.outbox_worker.stop()
+        if self.scheduler:
+            self.scheduler.stop()
         
         print("SMS notification scheduler stopped")
 
@@ -619,9 +595,39 @@ def register_sms_notification_system(app):
     # Start the SMS notification system
     sms_system.start()
     
-    # Register a shutdown handler
-    @app.teardown_appcontext
-    def shutdown_sms_system(exception=None):
-        sms_system = app.config.get('SMS_SYSTEM')
-        if sms_system:
-            sms_system.stop()
\ No newline at end of file
+    # Stop (and hand over scheduler leadership) when the worker exits. This used to be a
+    # teardown_appcontext handler, which stopped the scheduler after the first request.
+    atexit.register(sms_system.stop)
+    
+    @app.route('/metrics/scheduler', methods=['GET'])
+    def scheduler_metrics():
+        from flask import jsonify
+        if not sms_system.scheduler:
+            return jsonify({'leader': False, 'jobs': {}})
+        return jsonify(sms_system.scheduler.get_metrics())
+    
+    @app.route('/sms/dry_run', methods=['GET'])
+    def sms_dry_run():
+        """What the notification jobs would send now, e.g. /sms/dry_run?job=market_price"""
+        from flask import jsonify, request
+        
+        # Plans include audience sizes and phone numbers: admin only, refused until a token is set
+        token = os.environ.get('ANALYTICS_TOKEN')
+        if not token:
+            return jsonify({'error': 'Dry runs are disabled (ANALYTICS_TOKEN is not set)'}), 503
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode()):
+            return jsonify({'error': 'unauthorized'}), 401
+        try:
+            return jsonify(sms_system.dry_run(request.args.getlist('job')))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+
+if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Dry-run SMS notification jobs: audience, segments, cost and send time')
+    parser.add_argument('jobs', nargs='*', help='job names (default: all)')
+    args = parser.parse_args()
+    
+    print(json.dumps(FarmingSMSNotification(schedule_jobs=False).dry_run(args.jobs), indent=2))
\ No newline at end of file
@@ -0,0 +1,310 @@
+# sms_queue.py - Durable outbound SMS queue (SQLite) with idempotent enqueue
+#
+# Usage (drain from a separate worker process):
+#   python sms_queue.py drain [--path instance/sms_outbox.sqlite3] [--batch-size 500]
+#   python sms_queue.py stats
+
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Row states: pending -> sending -> sent, or back to pending for a retry, or dead
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+DEAD = 'dead'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    campaign TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    phone_number TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_by TEXT,
+    claimed_at REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_ready ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS outbox_campaign ON outbox (campaign, status);
+"""
+
+# Default database location for the CLI: the app's instance folder, not whatever directory it started in
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'sms_outbox.sqlite3')
+
+
+def campaign_run_id(campaign, when=None):
+    """Name one run of a recurring campaign (one per day), e.g. 'market_price:2026-10-19'"""
+    return f"{campaign}:{(when or datetime.now()).strftime('%Y-%m-%d')}"
+
+
+class SMSOutbox:
+    """SQLite-backed outbox; (campaign run, user) pairs are only ever enqueued once"""
+
+    def __init__(self, path=DEFAULT_DB_PATH, max_attempts=5, retry_backoff=30.0, claim_timeout=300.0):
+        """Open (and create) the outbox database"""
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.claim_timeout = claim_timeout
+        self._local = threading.local()
+
+        self._conn().executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        """Build an outbox from SMS_OUTBOX_* environment settings, or None if not configured"""
+        path = os.environ.get('SMS_OUTBOX_PATH')
+        if not path:
+            return None
+        return cls(
+            path=path,
+            max_attempts=int(os.environ.get('SMS_OUTBOX_MAX_ATTEMPTS', 5)),
+            retry_backoff=float(os.environ.get('SMS_OUTBOX_RETRY_BACKOFF', 30)),
+            claim_timeout=float(os.environ.get('SMS_OUTBOX_CLAIM_TIMEOUT', 300))
+        )
+
+    def _conn(self):
+        """One connection per thread, in WAL mode so readers don't block the writer"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _connection(self):
+        """Write transaction on this thread's connection"""
+        return _Transaction(self._conn())
+
+    def enqueue(self, campaign, items):
+        """Add (user_id, phone_number, message) rows for a campaign run; returns rows added.
+
+        Rows already enqueued for the same (campaign, user_id) are ignored, so a
+        rerun after a crash only adds the users the first run never reached.
+        """
+        now = time.time()
+        rows = [
+            (f"{campaign}|{user_id}", campaign, str(user_id), phone_number, message, now, now, now)
+            for user_id, phone_number, message in items
+        ]
+        with self._connection() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, campaign, user_id, phone_number, message, "
+                "next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            return conn.total_changes - before
+
+    def claim(self, limit, worker_id):
+        """Atomically take up to `limit` due rows for one worker"""
+        now = time.time()
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT id, campaign, user_id, phone_number, message, attempts FROM outbox "
+                "WHERE status = ? AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (PENDING, now, limit)
+            ).fetchall()
+            if rows:
+                conn.executemany(
+                    "UPDATE outbox SET status = ?, claimed_by = ?, claimed_at = ?, updated_at = ? WHERE id = ?",
+                    [(SENDING, worker_id, now, now, row[0]) for row in rows]
+                )
+        return rows
+
+    def mark_sent(self, ids):
+        """Record successful deliveries"""
+        now = time.time()
+        with self._connection() as conn:
+            conn.executemany(
+                "UPDATE outbox SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(SENT, now, row_id) for row_id in ids]
+            )
+
+    def mark_failed(self, ids, error):
+        """Schedule a retry with exponential backoff, or dead-letter after max_attempts"""
+        now = time.time()
+        with self._connection() as conn:
+            # Right-hand sides see the old `attempts`, so the backoff doubles per attempt
+            conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ?, updated_at = ?, "
+                "status = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END, "
+                "next_attempt_at = ? + ? * (1 << attempts) WHERE id = ?",
+                [(error, now, self.max_attempts, DEAD, PENDING, now, self.retry_backoff, row_id) for row_id in ids]
+            )
+
+    def recover_stale(self, older_than=None):
+        """Put rows claimed by a worker that died back in the queue; returns rows recovered"""
+        cutoff = time.time() - (self.claim_timeout if older_than is None else older_than)
+        with self._connection() as conn:
+            cursor = conn.execute(
+                "UPDATE outbox SET status = ?, claimed_by = NULL, updated_at = ? WHERE status = ? AND claimed_at < ?",
+                (PENDING, time.time(), SENDING, cutoff)
+            )
+            return cursor.rowcount
+
+    def requeue_dead(self, campaign=None):
+        """Give dead-lettered rows another full set of attempts"""
+        query = "UPDATE outbox SET status = ?, attempts = 0, next_attempt_at = ?, updated_at = ? WHERE status = ?"
+        params = [PENDING, time.time(), time.time(), DEAD]
+        if campaign:
+            query += " AND campaign = ?"
+            params.append(campaign)
+        with self._connection() as conn:
+            return conn.execute(query, params).rowcount
+
+    def stats(self, campaign=None):
+        """Row counts by campaign and status"""
+        query = "SELECT campaign, status, COUNT(*) FROM outbox"
+        params = []
+        if campaign:
+            query += " WHERE campaign = ?"
+            params.append(campaign)
+        query += " GROUP BY campaign, status"
+
+        rows = self._conn().execute(query, params).fetchall()
+
+        stats = {}
+        for campaign_name, status, count in rows:
+            stats.setdefault(campaign_name, {PENDING: 0, SENDING: 0, SENT: 0, DEAD: 0})[status] = count
+        return stats
+
+
+class _Transaction:
+    """`with` block running as one IMMEDIATE transaction on a shared connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+class OutboxWorker:
+    """Drain the outbox through the SMS dispatcher, sending identical messages in bulk"""
+
+    def __init__(self, outbox, dispatcher, batch_size=500, idle_sleep=2.0, worker_id=None):
+        self.outbox = outbox
+        self.dispatcher = dispatcher
+        self.batch_size = batch_size
+        self.idle_sleep = idle_sleep
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.running = False
+        self._thread = None
+
+    def drain_once(self):
+        """Claim and send one batch; returns the number of rows claimed"""
+        rows = self.outbox.claim(self.batch_size, self.worker_id)
+        if not rows:
+            return 0
+
+        # Group by campaign (for delivery tracking), then by message body so the dispatcher can use bulk calls.
+        # The same phone can get the same text in two campaigns, so row ids are looked up per campaign.
+        row_ids = {}
+        groups = {}
+        for row_id, campaign, user_id, phone_number, message, attempts in rows:
+            row_ids.setdefault((campaign, message, phone_number), []).append(row_id)
+            groups.setdefault(campaign, {}).setdefault(message, []).append(phone_number)
+
+        if not self.dispatcher.api_key:
+            for messages in groups.values():
+                for message, phone_numbers in messages.items():
+                    for phone_number in phone_numbers:
+                        print(f"[MOCK SMS] To: {phone_number}, Message: {message}")
+            self.outbox.mark_sent([row_id for ids in row_ids.values() for row_id in ids])
+            return len(rows)
+
+        sent_ids = []
+        failed_ids = []
+        lock = threading.Lock()
+
+        def results_for(campaign):
+            def on_result(phone_numbers, message, ok):
+                ids = [row_id for phone_number in phone_numbers
+                       for row_id in row_ids.get((campaign, message, phone_number), [])]
+                with lock:
+                    (sent_ids if ok else failed_ids).extend(ids)
+            return on_result
+
+        for campaign, messages in groups.items():
+            self.dispatcher.send_groups(list(messages.items()), on_result=results_for(campaign), campaign=campaign)
+
+        if sent_ids:
+            self.outbox.mark_sent(sent_ids)
+        if failed_ids:
+            self.outbox.mark_failed(failed_ids, 'gateway delivery failed')
+        return len(rows)
+
+    def drain(self, until_empty=True):
+        """Send batches until nothing is due (or forever with until_empty=False)"""
+        self.running = True
+        total = 0
+        self.outbox.recover_stale()
+        while self.running:
+            claimed = self.drain_once()
+            total += claimed
+            if not claimed:
+                if until_empty:
+                    break
+                time.sleep(self.idle_sleep)
+                self.outbox.recover_stale()
+        return total
+
+    def start(self):
+        """Drain continuously on a background thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self.drain, kwargs={'until_empty': False},
+                                        name='sms-outbox-worker', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drain or inspect the outbound SMS queue')
+    parser.add_argument('command', choices=['drain', 'stats', 'requeue-dead'])
+    parser.add_argument('--path', default=os.environ.get('SMS_OUTBOX_PATH', DEFAULT_DB_PATH))
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--campaign')
+    parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+    args = parser.parse_args()
+
+    outbox = SMSOutbox(args.path)
+    if args.command == 'stats':
+        for campaign, counts in sorted(outbox.stats(args.campaign).items()):
+            print(campaign, counts)
+    elif args.command == 'requeue-dead':
+        print(f"Requeued {outbox.requeue_dead(args.campaign)} dead messages")
+    else:
+        from sms_dispatch import SMSDispatcher
+        worker = OutboxWorker(outbox, SMSDispatcher.from_env(), batch_size=args.batch_size)
+        print(f"Outbox worker {worker.worker_id} draining {args.path}")
+        try:
+            sent = worker.drain(until_empty=args.once)
+            print(f"Drained {sent} messages")
+        except KeyboardInterrupt:
+            worker.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# sms_templates.py - Localized SMS templates compiled once per language
+
+import threading
+from collections import OrderedDict
+
+from translations import translation_manager
+
+# SMS template names; the text lives in translations/<lang>.json as "sms_<name>"
+SMS_TEMPLATE_NAMES = (
+    'planting_reminder', 'fertilizer_reminder', 'pest_alert', 'rainfall_forecast', 'heat_warning',
+    'market_price', 'seasonal_transition', 'harvest_reminder', 'crop_maintenance', 'seasonal_maintenance'
+)
+
+# Parameters whose values are translation keys (crop names, seasons, activities)
+LOCALIZED_PARAMS = {'crop', 'crops', 'activity', 'season', 'current_season', 'next_season'}
+
+# Localized parameters shown with a capital letter (start of a sentence)
+CAPITALIZED_PARAMS = {'season', 'current_season', 'next_season'}
+
+
+class SMSTemplateEngine:
+    """Render SMS templates in each user's language from precompiled templates"""
+
+    def __init__(self, manager=translation_manager, template_names=SMS_TEMPLATE_NAMES):
+        """Compile every template for every supported language"""
+        self.manager = manager
+        self.template_names = tuple(template_names)
+        self._lock = threading.Lock()
+        self._catalogue = None
+        self.compiled = {}
+        self.compile()
+
+    def compile(self):
+        """(Re)build the (template, language) table from the current catalogue"""
+        with self._lock:
+            catalogue = self.manager.catalogue
+            compiled = {}
+            for name in self.template_names:
+                for language in catalogue.languages:
+                    template = catalogue.get(f'sms_{name}', language)
+                    if template is not None:
+                        compiled[(name, language)] = template
+
+            self.compiled = compiled
+            self._catalogue = catalogue
+
+    def _current(self):
+        """Compiled templates, rebuilt if the translations were hot-reloaded"""
+        if self.manager.catalogue is not self._catalogue:
+            self.compile()
+        return self.compiled
+
+    def localize_params(self, params, language):
+        """Translate crop, season and activity values into the user's language"""
+        localized = {}
+        for name, value in params.items():
+            if name in LOCALIZED_PARAMS and isinstance(value, str):
+                value = ", ".join(
+                    self.manager.translate(part.strip().lower(), language, default=part.strip())
+                    for part in value.split(',')
+                )
+                if name in CAPITALIZED_PARAMS:
+                    value = value[:1].upper() + value[1:]
+            localized[name] = value
+        return localized
+
+    def render(self, template_name, language, **params):
+        """Render one SMS in the given language (code or name)"""
+        language = self.manager.normalize_language(language)
+        compiled = self._current()
+        base_template = compiled.get((template_name, self.manager.base_language))
+        template = compiled.get((template_name, language)) or base_template
+        if template is None:
+            raise KeyError(f"Unknown SMS template '{template_name}'")
+
+        # Untranslated templates fall back to English, so keep their values in English too
+        if template is base_template:
+            language = self.manager.base_language
+        return template.render(self.localize_params(params, language))
+
+    def group_recipients(self, recipients):
+        """Group (phone_number, language, template_name, params) by identical message inputs"""
+        groups = OrderedDict()
+        for phone_number, language, template_name, params in recipients:
+            language = self.manager.normalize_language(language)
+            key = (language, template_name, tuple(sorted(params.items())))
+            groups.setdefault(key, []).append(phone_number)
+        return groups
+
+    def render_groups(self, recipients):
+        """Render each distinct message once; returns [(message, [phone_number, ...]), ...]"""
+        rendered = []
+        for (language, template_name, params), phone_numbers in self.group_recipients(recipients).items():
+            rendered.append((self.render(template_name, language, **dict(params)), phone_numbers))
+        return rendered
+
+
+# Shared SMS template engine
+sms_template_engine = SMSTemplateEngine()
@@ -0,0 +1,129 @@
+# test_analytics.py - USSD menu nodes, rollup flushes (including partial failures) and the admin summaries
+from datetime import datetime
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+from analytics import (HOP_LOG, MENU_ROLLUP, RECOMMENDATION_ROLLUP, AnalyticsRollups, menu_node,
+                       recommendation_row_id)
+
+
+class FakeCollection:
+    """insert_many / $inc upserts / find over a dict, optionally failing the next writes"""
+
+    def __init__(self):
+        self.documents = {}
+        self.failures = 0
+        self.writes = 0
+
+    def _write(self):
+        self.writes += 1
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('connection reset')
+
+    def insert_many(self, documents, ordered=True):
+        self._write()
+        for document in documents:
+            self.documents[document['_id']] = dict(document)
+
+    def bulk_write(self, requests, ordered=True):
+        self._write()
+        for request in requests:
+            document = self.documents.setdefault(request._filter['_id'], {'_id': request._filter['_id']})
+            for field, amount in request._doc['$inc'].items():
+                document[field] = document.get(field, 0) + amount
+            document.update(request._doc['$set'])
+
+    def find(self, query, projection=None):
+        for document in self.documents.values():
+            if all(document.get(field) >= condition['$gte'] if isinstance(condition, dict)
+                   else document.get(field) == condition for field, condition in query.items()):
+                yield document
+
+
+def attached(**kwargs):
+    rollups = AnalyticsRollups(**kwargs)
+    rollups.collections = {name: FakeCollection() for name in (RECOMMENDATION_ROLLUP, MENU_ROLLUP, HOP_LOG)}
+    return rollups
+
+
+@pytest.fixture
+def rollups():
+    return attached()
+
+
+@pytest.mark.parametrize('text, mode, node', [
+    ('', None, 'main'),
+    ('2', None, '2'),
+    ('2*5', None, '2*5'),
+    ('2*5*40*30', None, '2*5'),
+    ('1*what do I spray on maize', None, '1'),
+    ('0*will it rain', None, '0'),
+    ('3', 'chat', '0'),
+    ('hello', None, 'main'),
+])
+def test_menu_node(text, mode, node):
+    assert menu_node(text, mode) == node
+
+
+def test_weeks_spanning_two_seasons_keep_a_row_per_season(rollups):
+    # 2026-11-30 and 2026-12-01 are both in ISO week 2026-W49
+    rollups.record_recommendation('Masvingo', 'maize', 'spring', at=datetime(2026, 11, 30, 9))
+    rollups.record_recommendation('Masvingo', 'maize', 'summer', at=datetime(2026, 12, 1, 9))
+    rollups.record_recommendation('Masvingo', 'maize', 'summer', at=datetime(2026, 12, 2, 9))
+    rollups.flush()
+
+    documents = rollups.collections[RECOMMENDATION_ROLLUP].documents
+    assert documents[recommendation_row_id('masvingo', 'maize', '2026-W49', 'spring')]['count'] == 1
+    assert documents[recommendation_row_id('masvingo', 'maize', '2026-W49', 'summer')]['count'] == 2
+    assert rollups.crop_summary('masvingo', 'spring', weeks=260)['total'] == 1
+    assert rollups.crop_summary('masvingo', 'summer', weeks=260)['total'] == 2
+    assert rollups.crop_summary('masvingo', weeks=260)['by_week'] == {'2026-W49': 3}
+
+
+def test_a_partly_failed_flush_requeues_only_what_was_not_written(rollups):
+    for number in range(3):
+        rollups.record_hop(f'session-{number}', 'farmer-1', '2', response='CON Enter nitrogen')
+    rollups.record_recommendation('Harare', 'sorghum', 'summer')
+    rollups.collections[RECOMMENDATION_ROLLUP].failures = 1
+
+    assert rollups.flush() == 0
+    assert rollups.flush_errors == 1
+    assert rollups.get_metrics()['buffered'] == {'recommendation_rows': 1, 'menu_rows': 1, 'hops': 0}
+
+    assert rollups.flush() == 2
+    assert len(rollups.collections[HOP_LOG].documents) == 3
+    assert rollups.crop_summary('harare', weeks=1)['total'] == 1
+    # Menu counters were never written by the failed flush, so they are counted once
+    assert rollups.menu_summary(days=1)['total_hops'] == 3
+
+
+def test_hops_buffered_through_an_outage_keep_the_newest():
+    rollups = attached(max_buffered_hops=3)
+    rollups.collections[HOP_LOG].failures = 1
+    rollups.record_hop('session-1', 'farmer-1', '1')
+    rollups.record_hop('session-2', 'farmer-1', '2')
+    rollups.flush()
+
+    rollups.record_hop('session-3', 'farmer-1', '3')
+    rollups.record_hop('session-4', 'farmer-1', '4')
+    assert rollups.dropped_hops == 1
+    rollups.flush()
+
+    logged = sorted(hop['session_id'] for hop in rollups.collections[HOP_LOG].documents.values())
+    assert logged == ['session-2', 'session-3', 'session-4']
+
+
+def test_menu_summary_ranks_nodes_by_hops(rollups):
+    rollups.record_hop('session-1', 'farmer-1', '', response='CON Welcome', elapsed=0.010)
+    rollups.record_hop('session-1', 'farmer-1', '7', response='END Maize $0.32/kg', elapsed=0.030)
+    rollups.record_hop('session-2', 'farmer-2', '', response='CON Welcome', elapsed=0.020)
+    rollups.flush()
+
+    summary = rollups.menu_summary(days=1)
+    assert summary['total_hops'] == 3
+    assert [(menu['node'], menu['label'], menu['hops'], menu['ended_here']) for menu in summary['menus']] == [
+        ('main', 'Main menu', 2, 0), ('7', 'Market prices', 1, 1)
+    ]
+    assert summary['menus'][0]['avg_ms'] == 15.0
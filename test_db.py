@@ -0,0 +1,159 @@
+# test_db.py - Circuit breaker, stale reads and streaming finds of the shared database layer
+import pytest
+from pymongo.errors import AutoReconnect, DuplicateKeyError
+
+from db import Database, DatabaseUnavailable
+
+
+class FakeCursor:
+    """Hands out documents one at a time and remembers how far it was read"""
+
+    def __init__(self, documents, fail_after=None):
+        self.documents = documents
+        self.fail_after = fail_after
+        self.read = 0
+        self.closed = False
+
+    def sort(self, *args, **kwargs):
+        return self
+
+    def limit(self, count):
+        self.documents = self.documents[:count]
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.fail_after is not None and self.read == self.fail_after:
+            raise AutoReconnect('connection reset')
+        if self.read == len(self.documents):
+            raise StopIteration
+        self.read += 1
+        return self.documents[self.read - 1]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCollection:
+    def __init__(self):
+        self.down = False
+        self.calls = 0
+        self.cursors = []
+        self.documents = [{'_id': index} for index in range(50)]
+
+    def find_one(self, query):
+        self.calls += 1
+        if self.down:
+            raise AutoReconnect('connection refused')
+        return {'_id': query['_id'], 'name': 'Tendai'}
+
+    def insert_one(self, document):
+        self.calls += 1
+        raise DuplicateKeyError('duplicate key')
+
+    def find(self, *args, fail_after=None, **kwargs):
+        self.calls += 1
+        if self.down:
+            raise AutoReconnect('connection refused')
+        cursor = FakeCursor(list(self.documents), fail_after)
+        self.cursors.append(cursor)
+        return cursor
+
+
+@pytest.fixture
+def database():
+    database = Database(breaker_threshold=3, breaker_reset=30.0)
+    collection = database.collection('users')
+    collection._raw = FakeCollection()
+    return database
+
+
+def test_breaker_opens_fails_fast_then_lets_one_probe_through(database):
+    collection = database.collection('users')
+    collection.raw.down = True
+    for attempt in range(3):
+        with pytest.raises(AutoReconnect):
+            collection.find_one({'_id': attempt})
+    assert database.breaker.state == 'open'
+
+    # Open: rejected without touching MongoDB
+    with pytest.raises(DatabaseUnavailable):
+        collection.find_one({'_id': 'other'})
+    assert collection.raw.calls == 3
+    assert collection.stats['find_one'].rejected == 1
+
+    # After the reset timeout a single trial call goes through; a failure reopens at once
+    database.breaker.opened_at -= database.breaker.reset_timeout
+    with pytest.raises(AutoReconnect):
+        collection.find_one({'_id': 'probe'})
+    assert collection.raw.calls == 4
+    assert database.breaker.state == 'open'
+
+    database.breaker.opened_at -= database.breaker.reset_timeout
+    collection.raw.down = False
+    assert collection.find_one({'_id': 'probe'})['name'] == 'Tendai'
+    assert database.breaker.state == 'closed'
+
+
+def test_query_errors_do_not_trip_the_breaker(database):
+    collection = database.collection('users')
+    for attempt in range(5):
+        with pytest.raises(DuplicateKeyError):
+            collection.insert_one({'_id': attempt})
+
+    assert database.breaker.state == 'closed'
+    assert collection.stats['insert_one'].errors == 5
+
+
+def test_small_reads_are_served_stale_while_the_breaker_is_open(database):
+    collection = database.collection('users')
+    profile = collection.find_one({'_id': 'farmer-1'})
+    recent = list(collection.find({}).limit(5))
+
+    collection.raw.down = True
+    for attempt in range(3):
+        with pytest.raises(AutoReconnect):
+            collection.find_one({'_id': attempt})
+    assert database.breaker.state == 'open'
+
+    assert collection.find_one({'_id': 'farmer-1'}) == profile
+    assert list(collection.find({}).limit(5)) == recent
+    assert collection.stats['find_one'].stale == 1
+    assert collection.stats['find'].stale == 1
+    # Unbounded finds have no stale copy
+    with pytest.raises(DatabaseUnavailable):
+        list(collection.find({}))
+
+
+def test_unbounded_find_streams_instead_of_loading_everything(database):
+    collection = database.collection('users')
+
+    documents = iter(collection.find({}, batch_size=10))
+    first = [next(documents) for _ in range(3)]
+    cursor = collection.raw.cursors[-1]
+    assert [document['_id'] for document in first] == [0, 1, 2]
+    assert cursor.read == 3
+
+    documents.close()
+    assert cursor.closed
+    assert collection.stats['find'].latency.summary()['count'] == 1
+
+    assert len(list(collection.find({}))) == 50
+    assert collection.raw.cursors[-1].closed
+    assert collection.stats['find'].latency.summary()['count'] == 2
+
+
+def test_outage_while_streaming_counts_against_the_breaker(database):
+    collection = database.collection('users')
+    seen = []
+
+    with pytest.raises(AutoReconnect):
+        for document in collection.find({}, fail_after=20):
+            seen.append(document)
+
+    assert len(seen) == 20
+    assert collection.stats['find'].errors == 1
+    assert database.breaker.failures == 1
+    assert collection.raw.cursors[-1].closed
@@ -0,0 +1,90 @@
+# test_delivery_reports.py - Matching delivery receipts to sends and folding them into campaign rollups
+import pytest
+
+import delivery_reports
+from delivery_reports import DeliveryReportStore
+
+ECONET = '+263771234567'
+NETONE = '+263712345678'
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'sms_delivery.sqlite3')
+
+
+def store_at(path):
+    return DeliveryReportStore(path, flush_interval=0.01, refresh_interval=3600)
+
+
+def send(store, campaign, *refs_and_numbers):
+    store.record_sent(campaign, refs_and_numbers, sent_at=1000.0)
+    store.flush()
+
+
+def receive(store, *reports):
+    store.record_reports(reports)
+    store.flush()
+
+
+def test_receipt_written_before_its_send_is_matched_on_a_later_refresh(path):
+    store = store_at(path)
+    receive(store, {'client_ref': 'ref-1', 'status': 'DELIVRD'})
+    store.refresh()
+    assert store.get_metrics()['awaiting_match'] == 1
+    assert store.get_metrics()['campaigns'] == {}
+
+    send(store, 'market_price:2026-10-16', ('ref-1', ECONET))
+    store.refresh()
+
+    metrics = store.get_metrics()
+    assert metrics['awaiting_match'] == 0
+    assert metrics['unmatched_reports'] == 0
+    assert metrics['campaigns']['market_price:2026-10-16']['delivered'] == 1
+
+
+def test_receipt_without_a_send_counts_as_unmatched_after_the_grace_period(path, monkeypatch):
+    store = store_at(path)
+    receive(store, {'client_ref': 'stranger', 'status': 'DELIVRD'})
+    store.refresh()
+    assert store.get_metrics()['unmatched_reports'] == 0
+
+    monkeypatch.setattr(delivery_reports, 'UNMATCHED_GRACE_SECONDS', 0)
+    store.refresh()
+
+    metrics = store.get_metrics()
+    assert metrics['awaiting_match'] == 0
+    assert metrics['unmatched_reports'] == 1
+
+
+def test_first_final_receipt_wins(path):
+    store = store_at(path)
+    send(store, 'weather', ('ref-1', ECONET), ('ref-2', NETONE))
+    # Resent callbacks, in the same batch and in a later one
+    receive(store, {'client_ref': 'ref-1', 'status': 'DELIVRD'}, {'client_ref': 'ref-1', 'status': 'UNDELIV'},
+            {'client_ref': 'ref-2', 'status': 'UNDELIV', 'error': 'absent subscriber'})
+    receive(store, {'client_ref': 'ref-2', 'status': 'DELIVRD'}, {'client_ref': 'ref-1', 'status': 'ACCEPTD'})
+    store.refresh()
+
+    summary = store.campaign_metrics('weather')
+    assert (summary['sent'], summary['delivered'], summary['failed']) == (2, 1, 1)
+    assert summary['failure_reasons'] == {'absent subscriber': 1}
+    assert summary['failures_by_carrier'] == {'NetOne': 1}
+    statuses = dict(store._conn().execute("SELECT ref, status FROM sms_messages"))
+    assert statuses == {'ref-1': 'delivered', 'ref-2': 'failed'}
+
+
+def test_rows_written_by_other_processes_are_folded_in_once(path):
+    sender, webhook, dashboard = store_at(path), store_at(path), store_at(path)
+    send(sender, 'pest_alert', ('ref-1', ECONET), ('ref-2', ECONET), ('ref-3', NETONE))
+    receive(webhook, {'client_ref': 'ref-1', 'status': 'DELIVRD'})
+
+    dashboard.refresh()
+    dashboard.refresh()
+    receive(webhook, {'client_ref': 'ref-3', 'status': 'EXPIRED'})
+    dashboard.refresh()
+
+    summary = dashboard.campaign_metrics('pest_alert')
+    assert (summary['sent'], summary['delivered'], summary['failed'], summary['awaiting_report']) == (3, 1, 1, 1)
+    assert summary['sent_by_carrier'] == {'Econet': 2, 'NetOne': 1}
+    assert summary['failure_reasons'] == {'EXPIRED': 1}
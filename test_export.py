@@ -0,0 +1,171 @@
+# test_export.py - Export windows: watermarks, the settle lag and the admin route's token
+import csv
+import gzip
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from flask import Flask
+
+import export
+from export import Exporter, register_export
+
+NOW = datetime(2026, 10, 19, 12, 0, 0)
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+        self.closed = False
+
+    def sort(self, field, direction):
+        self.documents.sort(key=lambda document: document[field], reverse=direction < 0)
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents = []
+        self.cursors = []
+
+    def find(self, query, projection=None, batch_size=None):
+        (field, window), = query.items()
+        cursor = FakeCursor([dict(document) for document in self.documents
+                             if document[field] < window['$lt'] and document[field] >= window.get('$gte', datetime.min)])
+        self.cursors.append(cursor)
+        return cursor
+
+
+class FakeTimedCollection:
+    def __init__(self):
+        self.raw = FakeCollection()
+
+    def create_index(self, keys):
+        pass
+
+    def update_many(self, query, pipeline):
+        (field, condition), = query.items()
+        (target, source), = pipeline[0]['$set'].items()
+        for document in self.raw.documents:
+            if field not in document:
+                document[target] = document[source.lstrip('$')]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name):
+        return self.collections.setdefault(name, FakeTimedCollection())
+
+
+def recommend(database, created_at, crop='maize', inserted_at=None):
+    document = {
+        '_id': ObjectId(), 'user_id': 'farmer-1', 'created_at': created_at,
+        'inputs': {'province': 'masvingo', 'nitrogen': 40}, 'outputs': {'predicted_crop': crop, 'season': 'summer'}
+    }
+    if inserted_at is not False:
+        document['inserted_at'] = inserted_at or created_at
+    database.collection('crop_recommendations').raw.documents.append(document)
+
+
+def exported_crops(summary):
+    with gzip.open(summary['path'], 'rt', newline='') as f:
+        return [row['predicted_crop'] for row in csv.DictReader(f)]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [NOW]
+    monkeypatch.setattr(export, 'utcnow', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def exporter(tmp_path, clock):
+    return Exporter(FakeDatabase(), out_dir=str(tmp_path), settle_seconds=300)
+
+
+def test_rows_inside_the_settle_lag_wait_for_the_next_run(exporter, clock):
+    recommend(exporter.database, NOW - timedelta(hours=1), 'maize')
+    recommend(exporter.database, NOW - timedelta(minutes=2), 'sorghum')
+
+    summary = exporter.export('recommendations', 'csv')
+
+    assert exported_crops(summary) == ['maize']
+    assert summary['since'] is None
+    assert exporter.watermarks() == {'recommendations': NOW - timedelta(minutes=5)}
+    assert os.path.exists(os.path.join(exporter.out_dir, '_watermarks.json'))
+    assert exporter.database.collection('crop_recommendations').raw.cursors[-1].closed
+
+
+def test_the_next_run_starts_at_the_watermark(exporter, clock):
+    recommend(exporter.database, NOW - timedelta(hours=1), 'maize')
+    recommend(exporter.database, NOW - timedelta(minutes=2), 'sorghum')
+    exporter.export('recommendations', 'csv')
+
+    clock[0] = NOW + timedelta(hours=1)
+    recommend(exporter.database, NOW + timedelta(minutes=30), 'beans')
+    summary = exporter.export('recommendations', 'csv')
+
+    # Each row lands in exactly one file
+    assert exported_crops(summary) == ['sorghum', 'beans']
+    assert summary['since'] == (NOW - timedelta(minutes=5)).isoformat()
+    assert exporter.watermarks()['recommendations'] == NOW + timedelta(minutes=55)
+
+    # --full ignores the watermark
+    assert exported_crops(exporter.export('recommendations', 'csv', full=True)) == ['maize', 'sorghum', 'beans']
+
+
+def test_rows_written_late_are_exported_by_the_run_after_they_land(exporter, clock):
+    recommend(exporter.database, NOW - timedelta(hours=1), 'maize')
+    exporter.export('recommendations', 'csv')
+
+    # Created before the watermark but held in a writer's buffer through an outage
+    clock[0] = NOW + timedelta(hours=1)
+    recommend(exporter.database, NOW - timedelta(minutes=30), 'millet', inserted_at=NOW + timedelta(minutes=40))
+
+    assert exported_crops(exporter.export('recommendations', 'csv')) == ['millet']
+
+
+def test_rows_from_before_inserted_at_fall_back_to_created_at(exporter, clock):
+    recommend(exporter.database, NOW - timedelta(hours=1), 'maize', inserted_at=False)
+    exporter.ensure_indexes()
+
+    assert exported_crops(exporter.export('recommendations', 'csv')) == ['maize']
+
+
+def test_a_failed_export_keeps_the_watermark(exporter, clock, monkeypatch):
+    recommend(exporter.database, NOW - timedelta(hours=1))
+    exporter.export('recommendations', 'csv')
+
+    def fail(dataset, row_chunks, path):
+        raise OSError('disk full')
+
+    monkeypatch.setitem(export.WRITERS, 'csv', fail)
+    clock[0] = NOW + timedelta(hours=1)
+    with pytest.raises(OSError):
+        exporter.export('recommendations', 'csv')
+
+    assert exporter.watermarks()['recommendations'] == NOW - timedelta(minutes=5)
+
+
+def test_admin_export_is_refused_without_a_configured_token(monkeypatch):
+    app = Flask(__name__)
+    register_export(app)
+    client = app.test_client()
+
+    monkeypatch.delenv('ANALYTICS_TOKEN', raising=False)
+    assert client.get('/admin/export/recommendations').status_code == 503
+
+    monkeypatch.setenv('ANALYTICS_TOKEN', 'secret')
+    assert client.get('/admin/export/recommendations').status_code == 401
+    assert client.get('/admin/export/recommendations', headers={'X-Admin-Token': 'wrong'}).status_code == 401
+    assert client.get('/admin/export/nothing', headers={'X-Admin-Token': 'secret'}).status_code == 404
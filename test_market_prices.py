@@ -0,0 +1,54 @@
+# test_market_prices.py - Cached latest prices and averages stay current across workers sharing one database
+import threading
+
+import pytest
+
+from market_prices import MarketPriceStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'market_prices.sqlite3')
+
+
+def test_ingest_in_another_worker_reaches_this_workers_cache(path):
+    worker_a = MarketPriceStore(path)
+    worker_b = MarketPriceStore(path)
+    worker_a.ingest_rows([('2026-10-12', 'Harare', 'Maize', 0.30), ('2026-10-12', 'Harare', 'Beans', 1.10)])
+    assert worker_b.latest('Harare', 'maize').price == 0.30
+
+    worker_a.ingest_rows([('2026-10-16', 'Harare', 'Maize', 0.45)])
+
+    summary = worker_b.latest('Harare', 'maize')
+    assert (summary.day, summary.price) == ('2026-10-16', 0.45)
+    assert worker_b.rolling_average('Harare', 'maize', 7) == 0.38
+    # Series nobody touched are left alone
+    assert worker_b.latest('Harare', 'beans').price == 1.10
+
+
+def test_new_series_and_csv_drops_from_the_cli_show_up(path, tmp_path):
+    worker = MarketPriceStore(path)
+    worker.ingest_rows([('2026-10-12', 'National', 'Maize', 0.30)])
+    assert worker.location_prices('Bulawayo').keys() == {'maize'}
+
+    drop = tmp_path / 'prices.csv'
+    drop.write_text('date,location,crop,price\n2026-10-16,Bulawayo,Sorghum,0.52\n2026-10-16,National,Maize,0.33\n')
+    MarketPriceStore(path).ingest_csv(str(drop))
+
+    assert worker.latest('Bulawayo', 'sorghum').price == 0.52
+    assert worker.latest('National', 'maize').price == 0.33
+
+
+def test_other_threads_of_the_same_worker_catch_up(path):
+    worker = MarketPriceStore(path)
+    worker.ingest_rows([('2026-10-12', 'Harare', 'Maize', 0.30)])
+    assert worker.latest('Harare', 'maize').price == 0.30
+
+    ingest = threading.Thread(target=worker.ingest_rows, args=([('2026-10-16', 'Harare', 'Maize', 0.45)],))
+    ingest.start()
+    ingest.join()
+    other = MarketPriceStore(path)
+    other.ingest_rows([('2026-10-17', 'Harare', 'Beans', 1.20)])
+
+    assert worker.latest('Harare', 'maize').price == 0.45
+    assert worker.latest('Harare', 'beans').price == 1.20
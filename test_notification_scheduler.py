@@ -0,0 +1,104 @@
+# test_notification_scheduler.py - Persisted next runs survive a leader crash and are caught up on takeover
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from notification_scheduler import FileJobStore, NotificationScheduler
+
+
+class AlwaysLeader:
+    def acquire(self, holder):
+        return True
+
+    def release(self, holder):
+        pass
+
+
+class DroppedStore:
+    """Stands in for a crashed leader's store: nothing it writes lands any more"""
+
+    def load(self):
+        return {}
+
+    def save(self, states):
+        pass
+
+
+def scheduler(store):
+    scheduler = NotificationScheduler(AlwaysLeader(), store, catch_up_window=24 * 3600)
+    scheduler._executor = ThreadPoolExecutor(max_workers=1)
+    return scheduler
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FileJobStore(str(tmp_path / 'state.json'))
+
+
+def test_run_advances_next_run_only_after_it_finishes(store):
+    now = datetime(2026, 10, 16, 12, 0, 30)
+    release = threading.Event()
+    leader = scheduler(store)
+    job = leader.add_job('market_price', release.wait, at='12:00')
+    leader._become_leader(now)
+    job.next_run = datetime(2026, 10, 16, 12, 0)
+
+    leader._dispatch_due(now)
+    saved = store.load()['market_price']
+    assert saved['in_progress'] == '2026-10-16T12:00:00'
+    assert saved['next_run'] == '2026-10-16T12:00:00'
+
+    release.set()
+    job.future.result(timeout=5)
+    saved = store.load()['market_price']
+    assert saved['in_progress'] is None
+    assert saved['last_run'] == '2026-10-16T12:00:00'
+    assert saved['next_run'] == '2026-10-17T12:00:00'
+    leader._executor.shutdown()
+
+
+def test_run_interrupted_by_leader_crash_is_caught_up_on_takeover(store):
+    now = datetime(2026, 10, 16, 12, 0, 30)
+    crashed = threading.Event()
+    first = scheduler(store)
+    first_job = first.add_job('market_price', crashed.wait, at='12:00')
+    first._become_leader(now)
+    first_job.next_run = datetime(2026, 10, 16, 12, 0)
+    first._dispatch_due(now)
+
+    # The leader dies mid-campaign; a second worker takes over ten minutes later
+    runs = []
+    second = scheduler(store)
+    second_job = second.add_job('market_price', lambda: runs.append(True), at='12:00')
+    takeover = now + timedelta(minutes=10)
+    second._become_leader(takeover)
+
+    assert second_job.catch_ups == 1
+    assert second_job.in_progress is None
+    assert second_job.next_run == datetime(2026, 10, 16, 12, 0)
+
+    second._dispatch_due(takeover)
+    second_job.future.result(timeout=5)
+    assert runs == [True]
+    assert store.load()['market_price']['next_run'] == '2026-10-17T12:00:00'
+
+    first.store = DroppedStore()
+    crashed.set()
+    first._executor.shutdown()
+    second._executor.shutdown()
+
+
+def test_unfinished_run_outside_catch_up_window_is_skipped(store):
+    store.save({'market_price': {'next_run': '2026-10-14T12:00:00', 'last_run': '2026-10-13T12:00:00',
+                                 'in_progress': '2026-10-14T12:00:00', 'last_status': 'ok'}})
+    leader = scheduler(store)
+    job = leader.add_job('market_price', lambda: None, at='12:00')
+
+    leader._become_leader(datetime(2026, 10, 16, 9, 0))
+
+    assert job.catch_ups == 0
+    assert job.next_run == datetime(2026, 10, 16, 12, 0)
+    assert store.load()['market_price']['in_progress'] is None
+    leader._executor.shutdown()
@@ -0,0 +1,85 @@
+# test_pest_alerts.py - Radius queries over the farm grid index and crop matching of outbreaks
+import pytest
+
+from audience_index import AudienceIndex
+from pest_alerts import (PROVINCE_COORDINATES, Outbreak, PestAlertMatcher, SpatialIndex, haversine_km)
+
+HARARE = PROVINCE_COORDINATES['harare']
+
+
+def outbreak(pest, latitude, longitude, radius_km):
+    return Outbreak('outbreak-1', pest, latitude, longitude, radius_km, None, 'officer', '2026-10-19T08:00:00')
+
+
+@pytest.fixture
+def index():
+    return SpatialIndex()
+
+
+def test_radius_is_inclusive_at_the_boundary(index):
+    index.update('near', {'latitude': -17.90, 'longitude': 31.05})
+    index.update('far', {'latitude': -18.50, 'longitude': 31.05})
+    distance = haversine_km(*HARARE, -17.90, 31.05)
+
+    assert index.users_within(*HARARE, distance) == {'near'}
+    assert index.users_within(*HARARE, distance - 0.01) == set()
+    assert index.users_within(*HARARE, haversine_km(*HARARE, -18.50, 31.05)) == {'near', 'far'}
+
+
+def test_farms_without_coordinates_share_their_province_centroid(index):
+    index.update('farmer-1', {'location': 'Harare'})
+    index.update('farmer-2', {'location': 'harare'})
+    index.update('farmer-3', {'location': 'Masvingo'})
+    index.update('nowhere', {'location': 'Atlantis'})
+
+    assert index.get_metrics() == {'users': 3, 'points': 2, 'cells': 2}
+    assert index.users_within(*HARARE, 5) == {'farmer-1', 'farmer-2'}
+
+
+@pytest.mark.parametrize('radius_km', [
+    30,    # bounding box smaller than the index: walk the box's cells
+    2000   # bounding box larger than the index: filter the occupied cells instead
+])
+def test_both_cell_walks_find_the_same_farms(index, radius_km):
+    farms = {f'farmer-{number}': {'latitude': -16.5 - number * 0.37, 'longitude': 29.0 + number * 0.41}
+             for number in range(20)}
+    for user_id, prefs in farms.items():
+        index.update(user_id, prefs)
+
+    expected = {user_id for user_id, prefs in farms.items()
+                if haversine_km(-18.0, 30.6, prefs['latitude'], prefs['longitude']) <= radius_km}
+    assert expected
+    assert index.users_within(-18.0, 30.6, radius_km) == expected
+
+
+def test_moving_a_farm_reindexes_it_and_drops_empty_cells(index):
+    index.update('farmer-1', {'location': 'Harare'})
+    index.update('farmer-2', {'location': 'Harare'})
+
+    index.update('farmer-1', {'location': 'Bulawayo'})
+    assert index.users_within(*HARARE, 10) == {'farmer-2'}
+    assert index.users_within(*PROVINCE_COORDINATES['bulawayo'], 10) == {'farmer-1'}
+
+    index.remove('farmer-2')
+    index.update('farmer-1', {'location': 'Atlantis'})
+    assert index.users_within(*HARARE, 1000) == set()
+    assert index.get_metrics() == {'users': 0, 'points': 0, 'cells': 0}
+
+
+def test_match_keeps_nearby_growers_of_affected_crops():
+    farms = {
+        'maize-near': {'location': 'Harare', 'farming_type': 'Maize', 'phone_number': '+263771000001'},
+        'cotton-near': {'location': 'Harare', 'farming_type': 'Cotton', 'phone_number': '+263771000002'},
+        'mixed-near': {'location': 'Harare', 'farming_type': 'Mixed', 'phone_number': '+263771000003'},
+        'maize-far': {'location': 'Bulawayo', 'farming_type': 'Maize', 'phone_number': '+263771000004'},
+        'maize-no-phone': {'location': 'Harare', 'farming_type': 'Maize'}
+    }
+    spatial, audience = SpatialIndex(), AudienceIndex()
+    spatial.rebuild(farms)
+    audience.rebuild(farms)
+    matcher = PestAlertMatcher(spatial, audience)
+
+    # Mixed farms grow a seasonal crop: the caller checks them against this season
+    assert matcher.match(outbreak('Fall Armyworm', *HARARE, 50)) == {'maize-near', 'mixed-near'}
+    assert matcher.match(outbreak('Red Spider Mites', *HARARE, 50)) == {'cotton-near', 'mixed-near'}
+    assert matcher.get_metrics()['users_matched'] == 4
@@ -0,0 +1,159 @@
+# test_recommendation_history.py - Keyset pagination and batched writes of the recommendation history
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+
+from recommendation_history import InvalidCursor, RecommendationHistory, decode_cursor, encode_cursor
+
+
+def matches(document, query):
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(matches(document, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict):
+            for operator, value in condition.items():
+                if operator == '$lt' and not document.get(key) < value:
+                    return False
+                if operator == '$in' and document.get(key) not in value:
+                    return False
+        elif document.get(key) != condition:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, spec):
+        for field, direction in reversed(spec):
+            self.documents.sort(key=lambda document: document[field], reverse=direction < 0)
+        return self
+
+    def skip(self, count):
+        self.documents = self.documents[count:]
+        return self
+
+    def limit(self, count):
+        self.documents = self.documents[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+class FakeCollection:
+    """The slice of a pymongo collection the history uses, in memory"""
+
+    def __init__(self):
+        self.documents = {}
+        self.queries = []
+
+    def create_index(self, keys):
+        pass
+
+    def insert_many(self, documents, ordered=True):
+        for document in documents:
+            self.documents[document['_id']] = dict(document)
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return FakeCursor([dict(document) for document in self.documents.values() if matches(document, query)])
+
+    def find_one(self, query, projection=None):
+        return next(iter(self.find(query, projection)), None)
+
+    def count_documents(self, query):
+        return sum(1 for document in self.documents.values() if matches(document, query))
+
+
+def stored(collection, user_id, count, start=datetime(2026, 10, 1)):
+    """`count` stored recommendations; every pair shares a created_at so _id breaks the tie"""
+    documents = [{
+        '_id': ObjectId(),
+        'user_id': user_id,
+        'created_at': start + timedelta(seconds=index // 2),
+        'inputs': {'province': 'masvingo', 'nitrogen': index},
+        'outputs': {'predicted_crop': 'maize', 'season': 'summer'}
+    } for index in range(count)]
+    collection.insert_many(documents)
+    return documents
+
+
+@pytest.fixture
+def history():
+    history = RecommendationHistory(flush_interval=0.01)
+    history.attach(FakeCollection())
+    return history
+
+
+def test_cursor_round_trip():
+    document = {'_id': ObjectId(), 'created_at': datetime(2026, 10, 16, 8, 30, 0, 123000)}
+
+    assert decode_cursor(encode_cursor(document)) == (document['created_at'], document['_id'])
+    with pytest.raises(InvalidCursor):
+        decode_cursor('not-a-cursor')
+
+
+def test_cursor_pages_cover_every_row_once_newest_first(history):
+    documents = stored(history.collection, 'farmer-1', 23)
+    stored(history.collection, 'farmer-2', 4)
+
+    seen = []
+    cursor = None
+    pages = 0
+    while True:
+        page, cursor = history.page('farmer-1', cursor, limit=5)
+        seen += [document['_id'] for document in page]
+        pages += 1
+        if cursor is None:
+            break
+
+    expected = sorted(documents, key=lambda document: (document['created_at'], document['_id']), reverse=True)
+    assert seen == [document['_id'] for document in expected]
+    assert pages == 5
+    # Later pages seek past the cursor instead of skipping rows
+    assert '$or' in history.collection.queries[-1]
+
+
+def test_last_full_page_has_no_next_cursor(history):
+    stored(history.collection, 'farmer-1', 10)
+
+    first, cursor = history.page('farmer-1', limit=5)
+    second, cursor = history.page('farmer-1', cursor, limit=5)
+
+    assert len(first) == len(second) == 5
+    assert cursor is None
+
+
+def test_queued_recommendations_show_up_before_they_are_written():
+    history = RecommendationHistory()
+    history._ensure_writer = lambda: None  # no writer thread: everything stays queued
+    history.attach(FakeCollection())
+    stored(history.collection, 'farmer-1', 3)
+
+    recommendation_id = history.record('farmer-1', {'province': 'harare'}, {'predicted_crop': 'sorghum'})
+
+    page, cursor = history.page('farmer-1', limit=2)
+    assert str(page[0]['_id']) == recommendation_id
+    assert history.count('farmer-1') == 4
+    assert history.get('farmer-1', recommendation_id)['outputs'] == {'predicted_crop': 'sorghum'}
+    assert history.get('farmer-2', recommendation_id) is None
+
+
+def test_recommendations_made_before_mongodb_connects_are_written_once_it_does():
+    history = RecommendationHistory(flush_interval=0.01, max_buffered=2)
+    first = history.record('farmer-1', {'province': 'harare'}, {'predicted_crop': 'maize'})
+    second = history.record('farmer-1', {'province': 'harare'}, {'predicted_crop': 'beans'})
+    assert history.record('farmer-1', {'province': 'harare'}, {'predicted_crop': 'rice'}) is None
+    assert history.dropped == 1
+
+    collection = FakeCollection()
+    history.attach(collection)
+    history.flush(timeout=5)
+
+    assert {str(_id) for _id in collection.documents} == {first, second}
+    assert all('inserted_at' in document for document in collection.documents.values())
+    assert history.get_metrics()['pending'] == 0
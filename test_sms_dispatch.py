@@ -0,0 +1,51 @@
+# test_sms_dispatch.py - Which gateway failures are retried (sends are not idempotent)
+import pytest
+import requests
+
+from sms_dispatch import SMSDispatcher
+
+
+class FakeSession:
+    """Replays a script of responses (status codes) and exceptions"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.posts = 0
+
+    def post(self, url, json=None, timeout=None):
+        self.posts += 1
+        outcome = self.script.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return type('Response', (), {'status_code': outcome, 'headers': {}})()
+
+
+def dispatcher(script):
+    sms = SMSDispatcher(api_key='test-key', max_retries=3, backoff_seconds=0.0, rate_per_second=0,
+                        delivery_tracker=None)
+    sms._local.session = FakeSession(script)
+    return sms
+
+
+def refused():
+    from urllib3.exceptions import MaxRetryError, NewConnectionError
+    reason = NewConnectionError(None, 'Connection refused')
+    return requests.exceptions.ConnectionError(MaxRetryError(None, '/messages', reason))
+
+
+@pytest.mark.parametrize('script, ok, posts', [
+    ([429, 503, 200], True, 3),
+    ([refused(), 200], True, 2),
+    ([requests.exceptions.ConnectTimeout('connect timed out'), 200], True, 2),
+    ([500, 200], False, 1),
+    ([502, 200], False, 1),
+    ([504, 200], False, 1),
+    ([requests.exceptions.ReadTimeout('read timed out'), 200], False, 1),
+    ([400, 200], False, 1),
+    ([503, 503, 503, 503], False, 4),
+])
+def test_only_failures_before_the_gateway_took_the_message_are_retried(script, ok, posts):
+    sms = dispatcher(script)
+
+    assert sms.send('+263771234567', 'Rain expected tomorrow') is ok
+    assert sms._local.session.posts == posts
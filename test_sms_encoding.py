@@ -0,0 +1,64 @@
+# test_sms_encoding.py - GSM-7 / UCS-2 detection, segment counts and splitting
+import pytest
+
+from sms_encoding import (SegmentReport, message_cost, prepare_for_channel, split_segments,
+                          truncate_to_segments)
+
+
+@pytest.mark.parametrize('text, encoding, units, segments', [
+    ('', 'GSM-7', 0, 0),
+    ('a' * 160, 'GSM-7', 160, 1),
+    ('a' * 161, 'GSM-7', 161, 2),
+    ('a' * 306, 'GSM-7', 306, 2),
+    ('a' * 307, 'GSM-7', 307, 3),
+    # Extension table characters take two septets
+    ('€' * 80, 'GSM-7', 160, 1),
+    ('a' * 159 + '[', 'GSM-7', 161, 2),
+    # One character outside GSM-7 switches the whole message to UCS-2
+    ('a' * 69 + 'ŵ', 'UCS-2', 70, 1),
+    ('a' * 70 + 'ŵ', 'UCS-2', 71, 2),
+    ('a' * 133 + 'ŵ', 'UCS-2', 134, 2),
+    ('a' * 134 + 'ŵ', 'UCS-2', 135, 3),
+    # Characters outside the BMP are two UTF-16 code units
+    ('🌽' * 35, 'UCS-2', 70, 1),
+    ('🌽' * 36, 'UCS-2', 72, 2),
+])
+def test_message_cost(text, encoding, units, segments):
+    assert tuple(message_cost(text)) == (encoding, units, segments)
+
+
+def test_split_segments_never_breaks_an_escape_or_surrogate_pair():
+    gsm = 'a' * 152 + '€' + 'b' * 10
+    parts = split_segments(gsm)
+    assert parts == ['a' * 152, '€' + 'b' * 10]
+    assert ''.join(parts) == gsm
+
+    ucs2 = 'a' * 66 + '🌽' + 'b' * 10
+    parts = split_segments(ucs2)
+    assert parts == ['a' * 66, '🌽' + 'b' * 10]
+    assert len(parts) == message_cost(ucs2).segments
+
+
+def test_transliteration_keeps_sms_in_gsm7():
+    message = prepare_for_channel('Maize – “good” price… 🌽 Tsvê', 'sms')
+
+    assert message == 'Maize - "good" price... Tsve'
+    assert message_cost(message).encoding == 'GSM-7'
+
+
+def test_truncate_to_segments_fits_the_limit():
+    message = truncate_to_segments('ŵ' * 500, 3)
+
+    assert message.endswith('...')
+    assert message_cost(message).segments == 3
+
+
+def test_segment_report_counts_segments_per_recipient():
+    report = SegmentReport('market_price')
+    report.add('a' * 200, recipients=10)
+    report.add('Mutengo ŵ', recipients=5)
+
+    summary = report.summary()
+    assert summary['recipients'] == 15
+    assert summary['segments'] == 2 * 10 + 1 * 5
+    assert summary['recipients_by_encoding'] == {'GSM-7': 10, 'UCS-2': 5}
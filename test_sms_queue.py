@@ -0,0 +1,77 @@
+# test_sms_queue.py - Outbox enqueue, claim, retry and dead-letter cycle
+import pytest
+
+from sms_queue import DEAD, PENDING, SENDING, SENT, OutboxWorker, SMSOutbox
+
+
+class FakeDispatcher:
+    """Fails every call for the campaigns in `failing`, succeeds for the rest"""
+
+    api_key = 'test-key'
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.calls = []
+
+    def send_groups(self, groups, on_result=None, campaign=None):
+        for message, phone_numbers in groups:
+            self.calls.append((campaign, message, list(phone_numbers)))
+            on_result(phone_numbers, message, campaign not in self.failing)
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return SMSOutbox(str(tmp_path / 'outbox.sqlite3'), max_attempts=3, retry_backoff=0.0)
+
+
+def statuses(outbox):
+    return dict(outbox._conn().execute("SELECT campaign || '|' || user_id, status FROM outbox").fetchall())
+
+
+def test_enqueue_is_idempotent_per_campaign_run_and_user(outbox):
+    assert outbox.enqueue('market_price:2026-10-16', [('u1', '+263771', 'Maize $0.30/kg'),
+                                                     ('u2', '+263772', 'Maize $0.30/kg')]) == 2
+    # A rerun after a crash only adds the user the first run missed, even if u1's number changed
+    assert outbox.enqueue('market_price:2026-10-16', [('u1', '+263779', 'Maize $0.30/kg'),
+                                                     ('u3', '+263773', 'Maize $0.30/kg')]) == 1
+    assert outbox.stats() == {'market_price:2026-10-16': {PENDING: 3, SENDING: 0, SENT: 0, DEAD: 0}}
+
+
+def test_claim_takes_due_rows_once(outbox):
+    outbox.enqueue('weather:2026-10-16', [('u1', '+263771', 'Rain'), ('u2', '+263772', 'Rain')])
+
+    first = outbox.claim(10, 'worker-a')
+    assert [row[2] for row in first] == ['u1', 'u2']
+    assert outbox.claim(10, 'worker-b') == []
+
+    # A worker that died holding rows gives them back after the claim timeout
+    assert outbox.recover_stale(older_than=-1) == 2
+    assert len(outbox.claim(10, 'worker-b')) == 2
+
+
+def test_failed_rows_retry_then_dead_letter(outbox):
+    outbox.enqueue('weather:2026-10-16', [('u1', '+263771', 'Rain')])
+    worker = OutboxWorker(outbox, FakeDispatcher(failing={'weather:2026-10-16'}))
+
+    for attempt in range(1, 4):
+        assert worker.drain_once() == 1
+        attempts, status = outbox._conn().execute("SELECT attempts, status FROM outbox").fetchone()
+        assert attempts == attempt
+        assert status == (DEAD if attempt == 3 else PENDING)
+
+    assert worker.drain_once() == 0
+    assert outbox.requeue_dead() == 1
+    worker.dispatcher.failing.clear()
+    assert worker.drain_once() == 1
+    assert statuses(outbox) == {'weather:2026-10-16|u1': SENT}
+
+
+def test_same_message_to_same_phone_in_two_campaigns_is_tracked_per_campaign(outbox):
+    outbox.enqueue('weather:2026-10-16', [('u1', '+263771', 'Frost tonight')])
+    outbox.enqueue('crop_maintenance:2026-10-16', [('u1', '+263771', 'Frost tonight')])
+    worker = OutboxWorker(outbox, FakeDispatcher(failing={'weather:2026-10-16'}))
+
+    assert worker.drain_once() == 2
+
+    assert statuses(outbox) == {'weather:2026-10-16|u1': PENDING, 'crop_maintenance:2026-10-16|u1': SENT}
+    assert [row[0] for row in outbox._conn().execute("SELECT attempts FROM outbox ORDER BY id")] == [1, 1]
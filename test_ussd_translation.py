@@ -0,0 +1,57 @@
+# test_ussd_translation.py - AI answers on the live /ussd route come back in the farmer's language
+import json
+
+import pytest
+
+import app as mudhumeni
+from ai_translation import answer_translator
+
+
+class FakeLLM:
+    """Answers farming questions in English and translation prompts with a tagged JSON array"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def invoke(self, prompt):
+        self.prompts.append(prompt)
+        if 'JSON array' in prompt:
+            items = json.loads(prompt[prompt.index('['):])
+            content = json.dumps([f"SN: {item['text']}" for item in items])
+        else:
+            content = "Plant maize after the first good rains."
+        return type('Reply', (), {'content': content})()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    llm = FakeLLM()
+    monkeypatch.setattr(mudhumeni, 'llm', llm)
+    monkeypatch.setattr(answer_translator, 'enabled', True)
+    mudhumeni.app.config['TESTING'] = True
+    with mudhumeni.app.test_client() as client:
+        client.llm = llm
+        yield client
+
+
+def dial(client, session_id, text, phone_number='+263770000101'):
+    data = {'sessionId': session_id, 'serviceCode': '*123#', 'phoneNumber': phone_number, 'text': text}
+    return client.post('/ussd', data=data).get_data(as_text=True)
+
+
+def test_custom_question_is_translated_for_shona_farmer(client):
+    assert dial(client, 'translate-1', '6*2') == "END 🗣️ Language set to: Shona"
+
+    response = dial(client, 'translate-2', '1*6*When should I plant maize?')
+
+    assert response.startswith('END')
+    assert 'SN: Plant maize after the first good rains.' in response
+    assert any('Shona' in prompt and 'JSON array' in prompt for prompt in client.llm.prompts)
+
+
+def test_english_farmer_gets_untranslated_answer(client):
+    response = dial(client, 'translate-3', '1*6*When should I plant maize?', phone_number='+263770000102')
+
+    assert 'Plant maize after the first good rains.' in response
+    assert 'SN:' not in response
+    assert not any('JSON array' in prompt for prompt in client.llm.prompts)
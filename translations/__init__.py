@@ -0,0 +1,249 @@
+# translations/__init__.py - Translation system for the USSD and SMS channels
+
+import json
+import os
+import threading
+import time
+
+from translations.catalogue import CompiledCatalogue, Template
+
+TRANSLATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Supported languages, in USSD language-menu order
+SUPPORTED_LANGUAGES = {
+    "en": "English",
+    "sn": "Shona",
+    "nd": "Ndebele",
+    "zu": "isiZulu",
+    "xh": "isiXhosa",
+    "af": "Afrikaans",
+    "st": "Sesotho",
+    "tn": "Setswana",
+    "sw": "Swahili",
+    "pt": "Portuguese"
+}
+
+# Farming words replaced in AI answers by translate_response
+RESPONSE_VOCABULARY = (
+    'summer', 'autumn', 'winter', 'spring',
+    'maize', 'sorghum', 'millet', 'groundnuts', 'cotton', 'soybeans', 'sunflower',
+    'tobacco', 'vegetables', 'wheat', 'barley', 'potatoes',
+    'planting', 'fertilizer', 'pest', 'soil', 'farmer', 'farming', 'agriculture',
+    'field', 'season', 'weather', 'rainfall', 'drought', 'irrigation', 'harvesting'
+)
+
+
+def _menu_line(catalogue, key, language):
+    """Translated menu label with a capitalized first letter"""
+    text = catalogue.lookup(key, language) or key
+    return text[:1].upper() + text[1:]
+
+
+def _main_menu(catalogue, language):
+    return "\n".join([
+        catalogue.lookup('welcome', language),
+        "1. " + _menu_line(catalogue, 'farming_advice', language),
+        "2. " + _menu_line(catalogue, 'crop_recommendations', language),
+        "3. " + _menu_line(catalogue, 'seasonal_info', language),
+        "4. " + _menu_line(catalogue, 'set_location', language),
+        "5. " + _menu_line(catalogue, 'set_farming_type', language),
+        "6. " + _menu_line(catalogue, 'language_options', language)
+    ])
+
+
+def _advice_menu(catalogue, language):
+    return "\n".join([
+        _menu_line(catalogue, 'farming_advice', language),
+        "1. " + _menu_line(catalogue, 'planting_times', language),
+        "2. " + _menu_line(catalogue, 'fertilizer_use', language),
+        "3. " + _menu_line(catalogue, 'pest_control', language),
+        "4. " + _menu_line(catalogue, 'irrigation', language),
+        "5. " + _menu_line(catalogue, 'harvesting', language),
+        "6. " + _menu_line(catalogue, 'ask_question', language)
+    ])
+
+
+def _seasonal_menu(catalogue, language):
+    return "\n".join([
+        _menu_line(catalogue, 'current_season', language) + ": {season}",
+        "1. " + _menu_line(catalogue, 'recommended_crops', language),
+        "2. " + _menu_line(catalogue, 'farming_activities', language),
+        "3. " + _menu_line(catalogue, 'weather_guidance', language),
+        "4. " + _menu_line(catalogue, 'return_to_menu', language)
+    ])
+
+
+def _language_menu(catalogue, language):
+    lines = [_menu_line(catalogue, 'language_options', language)]
+    for number, name in enumerate(SUPPORTED_LANGUAGES.values(), 1):
+        lines.append(f"{number}. {name}")
+    return "\n".join(lines)
+
+
+# Pre-rendered USSD screens, built for every language at compile time
+SCREEN_LAYOUTS = {
+    'main_menu': _main_menu,
+    'advice_menu': _advice_menu,
+    'seasonal_menu': _seasonal_menu,
+    'language_menu': _language_menu
+}
+
+
+class TranslationManager:
+    """Load the language files and serve translations from a compiled catalogue"""
+
+    def __init__(self, translations_dir=TRANSLATIONS_DIR, base_language='en'):
+        """Compile every supported language file"""
+        self.translations_dir = translations_dir
+        self.base_language = base_language
+        self.supported_languages = dict(SUPPORTED_LANGUAGES)
+        self._language_lookup = {code: code for code in self.supported_languages}
+        self._language_lookup.update({name.lower(): code for code, name in self.supported_languages.items()})
+        self._reload_lock = threading.Lock()
+        self.tables = {}
+        self.file_mtimes = {}
+        self.last_reload = None
+        self.reload_count = 0
+        self.catalogue = self.compile()
+
+    def load_language_file(self, lang_code, on_error=None):
+        """Read one language file; missing files load as empty, broken ones as `on_error` (or empty)"""
+        file_path = os.path.join(self.translations_dir, f'{lang_code}.json')
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f"Error loading translations from {file_path}: {str(e)}")
+            return {} if on_error is None else on_error
+
+    def file_mtime(self, lang_code):
+        """Modification time of a language file, or None if it does not exist"""
+        try:
+            return os.stat(os.path.join(self.translations_dir, f'{lang_code}.json')).st_mtime_ns
+        except OSError:
+            return None
+
+    def compile(self):
+        """Compile all language files into a new catalogue"""
+        self.file_mtimes = {code: self.file_mtime(code) for code in self.supported_languages}
+        self.tables = {code: self.load_language_file(code) for code in self.supported_languages}
+        return CompiledCatalogue(
+            self.tables,
+            base_language=self.base_language,
+            screen_layouts=SCREEN_LAYOUTS,
+            response_vocabulary=RESPONSE_VOCABULARY
+        )
+
+    def changed_languages(self):
+        """Language codes whose files changed on disk since they were last loaded"""
+        return [code for code in self.supported_languages if self.file_mtime(code) != self.file_mtimes.get(code)]
+
+    def reload(self, force=False):
+        """Recompile changed language files and swap the catalogue in one assignment.
+
+        Lookups in flight keep using the old catalogue until the swap. Returns a
+        summary of the reload, or None if nothing changed.
+        """
+        with self._reload_lock:
+            started = time.perf_counter()
+            changed = list(self.supported_languages) if force else self.changed_languages()
+            if not changed:
+                return None
+
+            tables = dict(self.tables)
+            mtimes = dict(self.file_mtimes)
+            for code in changed:
+                mtimes[code] = self.file_mtime(code)
+                # A half-saved or broken file keeps the strings already being served
+                tables[code] = self.load_language_file(code, on_error=self.tables.get(code))
+
+            catalogue = CompiledCatalogue(
+                tables,
+                base_language=self.base_language,
+                screen_layouts=SCREEN_LAYOUTS,
+                response_vocabulary=RESPONSE_VOCABULARY,
+                previous=self.catalogue,
+                changed_languages=changed
+            )
+
+            self.tables = tables
+            self.file_mtimes = mtimes
+            self.catalogue = catalogue
+            self.reload_count += 1
+            self.last_reload = {
+                'at': time.time(),
+                'languages': changed,
+                'rendered_screens': catalogue.rendered_screens,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 2)
+            }
+
+        print(f"Reloaded translations for {', '.join(changed)} in {self.last_reload['duration_ms']} ms")
+        return self.last_reload
+
+    def normalize_language(self, language):
+        """Map a language code or name ('sn', 'Shona') to a supported code"""
+        if not language:
+            return self.base_language
+        return self._language_lookup.get(language.strip().lower(), self.base_language)
+
+    def translate(self, key, lang='en', default=None, **kwargs):
+        """Translate a key, falling back to English, then `default`, then the key itself"""
+        catalogue = self.catalogue
+        key_id = catalogue.key_ids.get(key)
+        if key_id is None:
+            if default is None:
+                return key
+            return Template(default).render(kwargs) if kwargs else default
+
+        index = catalogue.row_offsets.get(lang, catalogue.base_offset) + key_id
+        if kwargs:
+            return catalogue.templates[index].render(kwargs)
+        return catalogue.texts[index]
+
+    def get_menu_text(self, menu_name, lang='en', **kwargs):
+        """Return a pre-rendered USSD menu in the given language"""
+        screen = self.catalogue.screen(menu_name, lang)
+        if screen is None:
+            return self.translate(menu_name, lang, **kwargs)
+        return screen.render(kwargs) if kwargs else screen.text
+
+    def translate_response(self, response, lang):
+        """Basic keyword replacement of common farming terms in an English answer"""
+        patterns = self.catalogue.response_patterns.get(lang)
+        if not patterns or not response:
+            return response
+
+        pattern, replacements = patterns
+
+        def replace(match):
+            word = match.group(0)
+            replacement = replacements[word.lower()]
+            return replacement[:1].upper() + replacement[1:] if word[:1].isupper() else replacement
+
+        return pattern.sub(replace, response)
+
+    def get_user_language(self, user_preferences, user_id):
+        """Get a user's preferred language code from their preferences"""
+        prefs = user_preferences.get(user_id, {})
+        return self.normalize_language(prefs.get('language'))
+
+    def get_coverage(self):
+        """Per-language counts of translated, missing and still-English entries"""
+        return dict(self.catalogue.coverage)
+
+    def _get_default_translations(self, lang_code):
+        """Current translations for a language with English filled in for missing keys"""
+        return {key: self.catalogue.lookup(key, lang_code) for key in self.catalogue.keys}
+
+
+# Shared translation manager instance
+translation_manager = TranslationManager()
+
+
+# Module-level helpers are bound straight to the shared manager (one call per lookup)
+translate = translation_manager.translate
+
+
+get_menu_text = translation_manager.get_menu_text
@@ -0,0 +1,189 @@
+# translations/catalogue.py - Compiled, array-backed translation catalogue
+
+import re
+import sys
+from string import Formatter
+
+_formatter = Formatter()
+_SIMPLE_FIELD = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class Template:
+    """A translated string with its format fields parsed once"""
+
+    __slots__ = ('text', 'segments')
+
+    def __init__(self, text):
+        self.text = text
+        self.segments = None
+
+        if '{' in text or '}' in text:
+            try:
+                segments = tuple(_formatter.parse(text))
+            except ValueError:
+                segments = None
+
+            # Only strings with real fields need rendering; '{{' escapes are resolved now
+            if segments and any(field is not None for _, field, _, _ in segments):
+                self.segments = segments
+            elif segments:
+                self.text = ''.join(literal for literal, _, _, _ in segments)
+
+    def render(self, values):
+        """Fill in the fields; unknown fields are left as '{name}'"""
+        if self.segments is None:
+            return self.text
+
+        try:
+            return self.text.format_map(values)
+        except (KeyError, IndexError, AttributeError, ValueError):
+            return self._render_partial(values)
+
+    def _render_partial(self, values):
+        """Slow path when some fields have no value"""
+        parts = []
+        for literal, field, spec, conversion in self.segments:
+            parts.append(literal)
+            if field is None:
+                continue
+
+            if _SIMPLE_FIELD.match(field) and field in values:
+                value = values[field]
+                if conversion == 'r':
+                    value = repr(value)
+                elif conversion == 's':
+                    value = str(value)
+                parts.append(format(value, spec) if spec else str(value))
+            else:
+                parts.append('{' + field + '}')
+
+        return ''.join(parts)
+
+
+class CompiledCatalogue:
+    """Every language compiled into one dense (language x key) table.
+
+    Missing or empty entries already point at the English template, so a
+    lookup is two dict hits and one list index with no fallback walk.
+    """
+
+    def __init__(self, tables, base_language='en', screen_layouts=None, response_vocabulary=(),
+                 previous=None, changed_languages=None):
+        """Compile {language: {key: text}} tables.
+
+        With `previous` and `changed_languages`, screens of unchanged languages
+        are reused from the previous catalogue instead of being re-rendered.
+        """
+        self.base_language = base_language
+        self.languages = list(tables)
+        if base_language not in tables:
+            raise ValueError(f"Base language '{base_language}' has no translation table")
+
+        base_table = tables[base_language]
+
+        # Intern every key once and give it a dense id (base language keys first)
+        keys = list(base_table)
+        seen = set(keys)
+        for table in tables.values():
+            for key in table:
+                if key not in seen:
+                    seen.add(key)
+                    keys.append(key)
+
+        self.keys = [sys.intern(key) for key in keys]
+        self.key_ids = {key: index for index, key in enumerate(self.keys)}
+        self.language_ids = {language: index for index, language in enumerate(self.languages)}
+        self.base_id = self.language_ids[base_language]
+        self.key_count = len(self.keys)
+
+        # Dense table of Template objects, row-major by language; `texts` mirrors
+        # it with the plain strings so parameterless lookups skip the Template
+        base_templates = [Template(base_table[key]) if base_table.get(key) else None for key in self.keys]
+        self.templates = []
+        self.coverage = {}
+
+        for language in self.languages:
+            table = tables[language]
+            translated = fallback = same_as_base = 0
+
+            for key_id, key in enumerate(self.keys):
+                text = table.get(key)
+                if language == base_language:
+                    self.templates.append(base_templates[key_id])
+                    continue
+
+                if not text or not text.strip():
+                    self.templates.append(base_templates[key_id])
+                    fallback += 1
+                elif text == base_table.get(key):
+                    # Untranslated copy of the English text: share the base template
+                    self.templates.append(base_templates[key_id])
+                    same_as_base += 1
+                else:
+                    self.templates.append(Template(text))
+                    translated += 1
+
+            self.coverage[language] = {
+                'translated': translated if language != base_language else self.key_count,
+                'missing': fallback,
+                'same_as_base': same_as_base
+            }
+
+        self.texts = [template.text if template is not None else None for template in self.templates]
+        self.row_offsets = {language: index * self.key_count for language, index in self.language_ids.items()}
+        self.base_offset = self.row_offsets[base_language]
+
+        # Pre-rendered USSD screens per language; every screen depends on its own
+        # language and the base language it falls back to
+        reusable = set()
+        if previous is not None and changed_languages is not None and base_language not in changed_languages:
+            reusable = set(self.languages) - set(changed_languages)
+
+        self.screens = {}
+        self.rendered_screens = 0
+        for screen_name, build_screen in (screen_layouts or {}).items():
+            for language in self.languages:
+                screen = previous.screens.get((screen_name, language)) if language in reusable else None
+                if screen is None:
+                    screen = Template(build_screen(self, language))
+                    self.rendered_screens += 1
+                self.screens[(screen_name, language)] = screen
+
+        # Keyword replacement patterns for AI answers, per language
+        self.response_patterns = {}
+        for language in self.languages:
+            if language == base_language:
+                continue
+            replacements = {}
+            for key in response_vocabulary:
+                source = self.lookup(key, base_language)
+                target = self.lookup(key, language)
+                if source and target and source.lower() != target.lower():
+                    replacements[source.lower()] = target
+            if replacements:
+                pattern = re.compile(
+                    r'\b(' + '|'.join(re.escape(word) for word in sorted(replacements, key=len, reverse=True)) + r')\b',
+                    re.IGNORECASE
+                )
+                self.response_patterns[language] = (pattern, replacements)
+
+    def get(self, key, language):
+        """Return the Template for a key (with English fallback), or None if unknown"""
+        key_id = self.key_ids.get(key)
+        if key_id is None:
+            return None
+        return self.templates[self.row_offsets.get(language, self.base_offset) + key_id]
+
+    def lookup(self, key, language):
+        """Return the raw text for a key, or None if unknown"""
+        key_id = self.key_ids.get(key)
+        if key_id is None:
+            return None
+        return self.texts[self.row_offsets.get(language, self.base_offset) + key_id]
+
+    def screen(self, screen_name, language):
+        """Return a pre-rendered screen Template, or None if unknown"""
+        screen = self.screens.get((screen_name, language))
+        if screen is None:
+            screen = self.screens.get((screen_name, self.base_language))
+        return screen
@@ -0,0 +1,95 @@
+# translations/reloader.py - Reload translation files without restarting workers
+
+import os
+import signal
+import threading
+
+
+class TranslationReloader:
+    """Background thread that recompiles changed translation files off the request path"""
+
+    def __init__(self, manager, interval=5.0):
+        """Poll the language files every `interval` seconds (0 disables polling)"""
+        self.manager = manager
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._force = False
+        self._thread = None
+
+    def start(self):
+        """Start the reload thread"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='translation-reloader', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reload thread"""
+        self._stopped.set()
+        self._wake.set()
+
+    def request_reload(self, force=True):
+        """Ask the reload thread to recompile now (safe to call from a signal handler)"""
+        self._force = self._force or force
+        self._wake.set()
+
+    def install_signal_handler(self, signal_name='SIGHUP'):
+        """Reload on a signal; the handler only wakes the reload thread"""
+        signum = getattr(signal, signal_name, None)
+        if signum is None:
+            print(f"Signal {signal_name} is not available; translation reload by signal disabled")
+            return False
+
+        try:
+            signal.signal(signum, lambda received, frame: self.request_reload())
+        except ValueError:
+            # Signal handlers can only be installed from the main thread
+            print(f"Could not install {signal_name} handler for translation reload outside the main thread")
+            return False
+        return True
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval if self.interval > 0 else None)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+
+            force, self._force = self._force, False
+            try:
+                self.manager.reload(force=force)
+            except Exception as e:
+                print(f"Error reloading translations: {str(e)}")
+
+    def get_metrics(self):
+        """Reload counters and the last reload summary"""
+        return {
+            'watching': self._thread is not None and not self._stopped.is_set(),
+            'interval_seconds': self.interval,
+            'reload_count': self.manager.reload_count,
+            'last_reload': self.manager.last_reload,
+            'coverage': self.manager.get_coverage()
+        }
+
+
+# Function to register with the main app
+def register_translation_reload(app, manager=None):
+    """Start the translation reloader and expose its status on /metrics/translations"""
+    if manager is None:
+        from translations import translation_manager
+        manager = translation_manager
+
+    reloader = TranslationReloader(manager, interval=float(os.environ.get('TRANSLATIONS_RELOAD_INTERVAL', 5)))
+    signal_name = os.environ.get('TRANSLATIONS_RELOAD_SIGNAL', 'SIGHUP')
+    if signal_name:
+        reloader.install_signal_handler(signal_name)
+    reloader.start()
+    app.config['TRANSLATION_RELOADER'] = reloader
+
+    @app.route('/metrics/translations')
+    def translation_metrics():
+        from flask import jsonify
+        return jsonify(reloader.get_metrics())
+
+    return reloader
@@ -0,0 +1,352 @@
+# user_profiles.py - Farmer preferences in MongoDB behind an in-memory read-through cache with write-behind
+#
+# Reads are served from memory: every profile is loaded when the store is
+# attached, a miss falls through to MongoDB, and changes written by other
+# workers are pulled in every USER_PROFILES_SYNC_INTERVAL seconds. Writes
+# update memory at once and reach MongoDB through a buffer flushed with bulk
+# upserts (at most USER_PROFILES_FLUSH_INTERVAL seconds later, and always on
+# a graceful shutdown).
+
+import atexit
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import timedelta
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from metrics import LatencyStats
+
+# Fields managed by the store itself, never part of a user's preferences
+RESERVED_FIELDS = ('_id', 'updated_at')
+
+# Re-read documents changed this long before the last sync, so writes that
+# committed late (or on a slower clock) are not missed
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+class UserProfileRepository:
+    """user_id -> preferences mapping; durable once attached to a MongoDB collection.
+
+    Works like the plain dict it replaces (get, in, [], items) so readers don't
+    change. All writes go through update().
+    """
+
+    def __init__(self, batch_size=1000, flush_interval=1.0, sync_interval=30.0, miss_ttl=60.0, on_change=None):
+        """`on_change(user_id, prefs)` is called for profiles loaded or changed by other workers"""
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        self.miss_ttl = miss_ttl
+        self.on_change = on_change
+        self.collection = None
+
+        self.writes = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.cache_misses = 0
+        self.synced = 0
+        self.flush_latency = LatencyStats()
+
+        self._profiles = {}
+        self._pending = {}
+        self._inflight = {}
+        self._misses = {}
+        self._synced_to = None
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, on_change=None):
+        """Build a repository from USER_PROFILES_* environment settings"""
+        return cls(
+            batch_size=int(os.environ.get('USER_PROFILES_BATCH_SIZE', 1000)),
+            flush_interval=float(os.environ.get('USER_PROFILES_FLUSH_INTERVAL', 1.0)),
+            sync_interval=float(os.environ.get('USER_PROFILES_SYNC_INTERVAL', 30)),
+            on_change=on_change
+        )
+
+    # Mapping interface (what app.user_preferences readers use)
+
+    def _from_document(self, document):
+        return {key: value for key, value in document.items() if key not in RESERVED_FIELDS}
+
+    def _notify(self, user_id, prefs):
+        if self.on_change is not None:
+            self.on_change(user_id, prefs)
+
+    def _load(self, user_id):
+        """Read-through: fetch a profile this process hasn't seen yet"""
+        if self.collection is None:
+            return None
+        retry_at = self._misses.get(user_id)
+        if retry_at is not None and retry_at > time.monotonic():
+            return None
+
+        self.cache_misses += 1
+        try:
+            document = self.collection.find_one({'_id': user_id})
+        except PyMongoError as e:
+            print(f"Error loading user profile {user_id}: {str(e)}")
+            return None
+
+        if document is None:
+            # Remember unknown ids for a while (web chat users often have no profile)
+            if len(self._misses) > 100000:
+                self._misses.clear()
+            self._misses[user_id] = time.monotonic() + self.miss_ttl
+            return None
+
+        with self._lock:
+            prefs = self._profiles.setdefault(user_id, self._from_document(document))
+        self._notify(user_id, prefs)
+        return prefs
+
+    def get(self, user_id, default=None):
+        prefs = self._profiles.get(user_id)
+        if prefs is None:
+            prefs = self._load(user_id)
+        return default if prefs is None else prefs
+
+    def __getitem__(self, user_id):
+        prefs = self.get(user_id)
+        if prefs is None:
+            raise KeyError(user_id)
+        return prefs
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __iter__(self):
+        return iter(list(self._profiles))
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def items(self):
+        return list(self._profiles.items())
+
+    # Writes
+
+    def update(self, user_id, values):
+        """Apply preference changes in memory now and queue them for MongoDB; returns the profile"""
+        values = {key: value for key, value in values.items() if key not in RESERVED_FIELDS}
+        existing = self.get(user_id)
+        with self._lock:
+            prefs = self._profiles.get(user_id, existing)
+            if prefs is None:
+                prefs = self._profiles[user_id] = {}
+            self._misses.pop(user_id, None)
+            prefs.update(values)
+            self.writes += 1
+            full = False
+            if self.collection is not None:
+                self._pending.setdefault(user_id, {}).update(values)
+                full = len(self._pending) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return prefs
+
+    def prime(self, profiles):
+        """Put {user_id: prefs} in the cache without writing them (bulk loads, benchmarks)"""
+        with self._lock:
+            self._profiles.update(profiles)
+
+    def flush(self):
+        """Write buffered changes as bulk upserts; returns profiles written.
+
+        On failure the changes go back in the buffer (behind any newer ones) for
+        the next flush; upserts are idempotent, so a partly applied batch is safe
+        to repeat.
+        """
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            if not batch or self.collection is None:
+                return 0
+
+            started = time.monotonic()
+            try:
+                items = list(batch.items())
+                for start in range(0, len(items), self.batch_size):
+                    self.collection.bulk_write([
+                        UpdateOne({'_id': user_id}, {'$set': fields, '$currentDate': {'updated_at': True}}, upsert=True)
+                        for user_id, fields in items[start:start + self.batch_size]
+                    ], ordered=False)
+            except PyMongoError as e:
+                with self._lock:
+                    for user_id, fields in batch.items():
+                        newer = self._pending.get(user_id)
+                        self._pending[user_id] = dict(fields, **newer) if newer else fields
+                    self._inflight = {}
+                self.flush_errors += 1
+                print(f"Error saving {len(batch)} user profiles (will retry): {str(e)}")
+                return 0
+
+            with self._lock:
+                self._inflight = {}
+            self.flush_latency.record(time.monotonic() - started)
+            self.flushed += len(batch)
+            self.flushes += 1
+            return len(batch)
+
+    # Loading and cross-worker sync
+
+    def _merge(self, documents):
+        """Fold documents into the cache, keeping local changes that aren't in MongoDB yet"""
+        changed = []
+        latest = self._synced_to
+        for document in documents:
+            user_id = document['_id']
+            updated_at = document.get('updated_at')
+            if updated_at is not None and (latest is None or updated_at > latest):
+                latest = updated_at
+            stored = self._from_document(document)
+            with self._lock:
+                for local in (self._inflight.get(user_id), self._pending.get(user_id)):
+                    if local:
+                        stored.update(local)
+                prefs = self._profiles.get(user_id)
+                if prefs is None:
+                    prefs = self._profiles[user_id] = stored
+                elif all(prefs.get(key) == value for key, value in stored.items()):
+                    continue
+                else:
+                    prefs.update(stored)
+                self._misses.pop(user_id, None)
+            changed.append((user_id, prefs))
+
+        self._synced_to = latest
+        for user_id, prefs in changed:
+            self._notify(user_id, prefs)
+        return len(changed)
+
+    def sync(self):
+        """Pull profiles changed by other workers since the last sync; returns profiles updated"""
+        if self.collection is None:
+            return 0
+        query = {}
+        if self._synced_to is not None:
+            query = {'updated_at': {'$gte': self._synced_to - SYNC_OVERLAP}}
+        try:
+            count = self._merge(self.collection.find(query, batch_size=10000))
+        except PyMongoError as e:
+            print(f"Error syncing user profiles: {str(e)}")
+            return 0
+        self._synced_at = time.monotonic()
+        self.synced += count
+        return count
+
+    def find_by_phone(self, phone_number):
+        """user_id of the most recently updated profile with this phone number, or None"""
+        if self.collection is None or not phone_number:
+            return None
+        try:
+            document = self.collection.find_one({'phone_number': phone_number}, sort=[('updated_at', -1)])
+        except PyMongoError as e:
+            print(f"Error looking up user profile by phone: {str(e)}")
+            return None
+        if document is None:
+            return None
+        self._merge([document])
+        return document['_id']
+
+    def attach(self, collection, warm=True):
+        """Persist to `collection`: load every profile (unless warm=False) and start the flusher"""
+        self.collection = collection
+        try:
+            collection.create_index([('updated_at', 1)])
+            collection.create_index([('phone_number', 1)])
+        except PyMongoError as e:
+            print(f"Error creating user profile indexes: {str(e)}")
+
+        with self._lock:
+            # Profiles created before MongoDB was attached still need saving
+            for user_id, prefs in self._profiles.items():
+                self._pending.setdefault(user_id, {}).update(prefs)
+
+        if warm:
+            started = time.monotonic()
+            loaded = self.sync()
+            print(f"Loaded {loaded} user profiles in {time.monotonic() - started:.1f}s")
+        self.start()
+
+    # Background flushing
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                if self.sync_interval and time.monotonic() - self._synced_at >= self.sync_interval:
+                    self.sync()
+            except Exception as e:
+                print(f"Error in user profile writer: {str(e)}")
+
+    def start(self):
+        if self._thread is None:
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='user-profiles', daemon=True)
+            self._thread.start()
+
+    def close(self, attempts=3):
+        """Stop the flusher and write everything still buffered"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        for _ in range(attempts):
+            self.flush()
+            if not self._pending:
+                return True
+            time.sleep(0.5)
+        print(f"WARNING: {len(self._pending)} user profile changes could not be saved")
+        return False
+
+    def get_metrics(self):
+        """Cache size, write-behind buffer and flush latency"""
+        return {
+            'persistent': self.collection is not None,
+            'cached_profiles': len(self._profiles),
+            'buffered': len(self._pending) + len(self._inflight),
+            'writes': self.writes,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'flush_errors': self.flush_errors,
+            'cache_misses': self.cache_misses,
+            'synced_from_other_workers': self.synced,
+            'last_synced_to': self._synced_to.isoformat() if self._synced_to else None,
+            'flush_latency': self.flush_latency.summary()
+        }
+
+
+def register_user_profiles(app, repository):
+    """Persist user preferences to MongoDB once it is reachable, flush on shutdown and expose /metrics/user_profiles"""
+    from db import database
+
+    # Until MongoDB is reached preferences are kept in memory; attach() saves them then
+    warm = os.environ.get('USER_PROFILES_WARM', 'true').lower() in ('1', 'true', 'yes')
+    database.on_connect(lambda: repository.attach(database.collection('user_profiles'), warm=warm))
+    app.config['USER_PROFILES'] = repository
+
+    # Flush the write-behind buffer on a normal exit, and turn SIGTERM into one
+    # when nothing else (e.g. gunicorn) handles it
+    atexit.register(repository.close)
+    if threading.current_thread() is threading.main_thread() and signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    @app.route('/metrics/user_profiles', methods=['GET'])
+    def user_profile_metrics():
+        from flask import jsonify
+        return jsonify(repository.get_metrics())
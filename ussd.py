@@ -3,11 +3,17 @@ from flask import Blueprint, request, jsonify
 import os
 import uuid
 import json
+import time
 from datetime import datetime
 import re
 
 # Import translation system
 from translations import translation_manager, translate, get_menu_text
+from ussd_tracing import tracer
+from ai_translation import answer_translator, USSD_AI_BUDGET_SECONDS
+from sms_encoding import prepare_for_channel, fits, truncate_to_budget
+from audience_index import audience_index
+from weather import weather_service
 
 # Create the blueprint
 ussd_blueprint = Blueprint('ussd', __name__)
@@ -40,6 +46,14 @@ PROVINCES = {
     "23": "Gaza", "24": "Gaborone", "25": "Other"
 }
 
+# Common pests by season (same as the SMS pest alerts)
+SEASONAL_PESTS = {
+    "summer": ["Fall Armyworm", "Stalk Borer", "Aphids"],
+    "autumn": ["Bollworm", "Red Spider Mites", "Whitefly"],
+    "winter": ["Aphids", "Cutworms", "Diamondback Moth"],
+    "spring": ["Thrips", "Leaf Miners", "African Armyworm"]
+}
+
 # Farming types
 FARMING_TYPES = {
     "1": "subsistence", "2": "small_scale_commercial", "3": "large_scale_commercial",
@@ -59,6 +73,25 @@ def ussd_handler():
     # Import these functions from main app on demand
     from app import get_current_season, seasonal_crops, user_preferences, chatbot_response, sanitize_input
     
+    tracer.start_hop(session_id, text)
+    
+    with tracer.span('session_lookup'):
+        user_session = get_ussd_session(session_id, phone_number, user_preferences)
+    user_lang = user_session['language']
+    
+    # Process the USSD request based on the text input
+    with tracer.span('menu_dispatch'):
+        response = dispatch_ussd_text(user_session, user_lang, text)
+    
+    # Update the last response
+    user_session['last_response'] = response
+    tracer.end_hop(response)
+    
+    return response
+
+def get_ussd_session(session_id, phone_number, user_preferences):
+    """Create or retrieve the USSD session, linking returning phone numbers to their profile"""
+    
     # Create or retrieve user session
     if session_id not in ussd_sessions:
         user_id = str(uuid.uuid4())
@@ -74,13 +107,13 @@ def ussd_handler():
             'start_time': datetime.now()
         }
         
-        # Check if phone number exists in user_preferences
-        for uid, prefs in user_preferences.items():
-            if prefs.get('phone_number') == phone_number:
+        # Link the phone number to an existing profile
+        with tracer.span('preference_scan'):
+            uid = audience_index.user_for_phone(phone_number)
+            if uid is not None and uid in user_preferences:
                 ussd_sessions[session_id]['user_id'] = uid
                 # Get user's preferred language
-                ussd_sessions[session_id]['language'] = prefs.get('language', 'en')
-                break
+                ussd_sessions[session_id]['language'] = user_preferences[uid].get('language', 'en')
     
     # Get the current user session
     user_session = ussd_sessions[session_id]
@@ -89,14 +122,19 @@ def ussd_handler():
     
     # Add user ID to user_preferences if not exists
     if user_id not in user_preferences:
-        user_preferences[user_id] = {
-            'phone_number': phone_number,
-            'language': user_lang,
-            'location': '',
-            'farming_type': ''
-        }
-    
-    # Process the USSD request based on the text input
+        from app import set_user_preference
+        set_user_preference(
+            user_id,
+            phone_number=phone_number,
+            language=user_lang,
+            location='',
+            farming_type=''
+        )
+    
+    return user_session
+
+def dispatch_ussd_text(user_session, user_lang, text):
+    """Route the USSD text to the main menu or the current sub-menu"""
     if not text:
         # Start of USSD session - show main menu in user's language
         user_session['menu_level'] = 0
@@ -118,9 +156,6 @@ def ussd_handler():
             # Sub-menu options
             response = handle_sub_menu(user_session, navigation)
     
-    # Update the last response
-    user_session['last_response'] = response
-    
     return response
 
 def handle_main_menu(user_session, option):
@@ -279,7 +314,7 @@ def handle_advice_menu(user_session, navigation):
 def handle_language_menu(user_session, navigation):
     """Handle the language selection menu"""
     
-    from app import user_preferences
+    from app import set_user_preference
     
     user_id = user_session['user_id']
     current_level = navigation[-1]
@@ -290,10 +325,7 @@ def handle_language_menu(user_session, navigation):
             new_language = LANGUAGE_CODES[current_level]
             
             # Update user preferences
-            if user_id not in user_preferences:
-                user_preferences[user_id] = {}
-            
-            user_preferences[user_id]['language'] = new_language
+            set_user_preference(user_id, language=new_language)
             user_session['language'] = new_language
             
             # Get language name in the new language
@@ -320,7 +352,7 @@ def handle_language_menu(user_session, navigation):
 def handle_set_location_menu(user_session, navigation):
     """Handle the set location menu with translation"""
     
-    from app import user_preferences
+    from app import set_user_preference
     
     user_id = user_session['user_id']
     user_lang = user_session['language']
@@ -330,10 +362,7 @@ def handle_set_location_menu(user_session, navigation):
         # Set the location based on the selected province
         if current_level in PROVINCES:
             location = PROVINCES[current_level]
-            if user_id not in user_preferences:
-                user_preferences[user_id] = {}
-            
-            user_preferences[user_id]['location'] = location
+            set_user_preference(user_id, location=location)
             
             success_msg = translate('location_set', user_lang) + f" {location}."
             return "END " + success_msg
@@ -358,7 +387,7 @@ def handle_set_location_menu(user_session, navigation):
 def handle_set_farming_type_menu(user_session, navigation):
     """Handle the set farming type menu with translation"""
     
-    from app import user_preferences
+    from app import set_user_preference
     
     user_id = user_session['user_id']
     user_lang = user_session['language']
@@ -368,10 +397,7 @@ def handle_set_farming_type_menu(user_session, navigation):
         # Set the farming type based on the selected option
         if current_level in FARMING_TYPES:
             farming_type = FARMING_TYPES[current_level]
-            if user_id not in user_preferences:
-                user_preferences[user_id] = {}
-            
-            user_preferences[user_id]['farming_type'] = farming_type
+            set_user_preference(user_id, farming_type=farming_type)
             
             farming_type_translated = translate(farming_type, user_lang)
             success_msg = translate('farming_type_set', user_lang) + f" {farming_type_translated}."
@@ -421,10 +447,13 @@ def handle_crop_recommendation_menu(user_session, navigation):
                 return "CON " + no_location_msg + ".\n" + province_menu
         
         elif current_level == '2':
-            # Custom Recommendation (Soil Data)
+            # Custom Recommendation (Soil Data) - values are accumulated in the session
             user_session['context']['submenu'] = 'soil_data'
+            user_session['context']['soil_values'] = []
             nitrogen_prompt = translate('enter_nitrogen', user_lang)
-            return "CON " + nitrogen_prompt
+            compact_hint = translate('enter_soil_compact', user_lang,
+                                     default="Or send all 7 at once: N,P,K,T,H,pH,R")
+            return "CON " + nitrogen_prompt + "\n" + compact_hint
         
         elif current_level == '3':
             # Return to Main Menu
@@ -509,78 +538,32 @@ def handle_seasonal_info_menu(user_session, navigation):
 def handle_soil_data_input(user_session, navigation):
     """Handle the soil data input for crop recommendations with translation"""
     
-    from app import user_preferences, validate_recommendation_data
+    from app import user_preferences, SOIL_PARAMETERS, accumulate_soil_entry
     
     user_id = user_session['user_id']
     user_lang = user_session['language']
     
-    # The expected order of inputs
-    soil_parameters = [
-        'nitrogen', 'phosphorus', 'potassium', 'temperature', 
-        'humidity', 'ph', 'rainfall'
-    ]
+    # Only the newest entry is parsed; earlier values are already in the session
+    collected = user_session['context'].setdefault('soil_values', [])
+    error = accumulate_soil_entry(collected, navigation[-1])
+    if error:
+        return "CON " + translate(f'invalid_{error}', user_lang)
     
-    # Calculate which parameter we're currently collecting
-    param_index = len(navigation) - 2
+    # Still collecting parameters - prompt for the next one in user's language
+    if len(collected) < len(SOIL_PARAMETERS):
+        prompt = translate(f"enter_{SOIL_PARAMETERS[len(collected)]}", user_lang)
+        return "CON " + prompt
     
-    # If we've collected all parameters
-    if param_index >= len(soil_parameters):
-        # Process the collected data
-        soil_data = {'inputs': {}}
-        
-        # Extract values from navigation
-        for i, param in enumerate(soil_parameters):
-            try:
-                soil_data['inputs'][param] = float(navigation[i + 2])
-            except (ValueError, IndexError):
-                error_msg = translate('invalid_input', user_lang)
-                return "END " + error_msg
-        
-        # Add user location if available
-        if user_preferences.get(user_id, {}).get('location'):
-            soil_data['inputs']['province'] = user_preferences[user_id]['location']
-        
-        # Validate the data
-        is_valid, message = validate_recommendation_data(soil_data)
-        if not is_valid:
-            validation_msg = translate('data_validation_failed', user_lang)
-            return "END " + validation_msg
-        
-        # Get recommendation
-        recommendation = get_crop_recommendation(user_id, soil_data, user_lang)
-        return "END " + recommendation
-    
-    # Still collecting parameters
-    current_param = soil_parameters[param_index]
-    
-    # Validate the previous input
-    if param_index > 0:
-        previous_param = soil_parameters[param_index - 1]
-        try:
-            value = float(navigation[-1])
-            # Validation with translated error messages
-            if previous_param == 'nitrogen' and (value < 0 or value > 150):
-                return "CON " + translate('invalid_nitrogen', user_lang)
-            elif previous_param == 'phosphorus' and (value < 0 or value > 150):
-                return "CON " + translate('invalid_phosphorus', user_lang)
-            elif previous_param == 'potassium' and (value < 0 or value > 150):
-                return "CON " + translate('invalid_potassium', user_lang)
-            elif previous_param == 'temperature' and (value < 0 or value > 50):
-                return "CON " + translate('invalid_temperature', user_lang)
-            elif previous_param == 'humidity' and (value < 0 or value > 100):
-                return "CON " + translate('invalid_humidity', user_lang)
-            elif previous_param == 'ph' and (value < 0 or value > 14):
-                return "CON " + translate('invalid_ph', user_lang)
-            elif previous_param == 'rainfall' and (value < 0 or value > 5000):
-                return "CON " + translate('invalid_rainfall', user_lang)
-        except ValueError:
-            return "CON " + translate('invalid_input', user_lang)
-    
-    # Prompt for the next parameter in user's language
-    next_param_key = f"enter_{current_param}"
-    prompt = translate(next_param_key, user_lang)
-    
-    return "CON " + prompt
+    soil_data = {'inputs': dict(zip(SOIL_PARAMETERS, collected))}
+    user_session['context']['soil_values'] = []
+    
+    # Add user location if available
+    if user_preferences.get(user_id, {}).get('location'):
+        soil_data['inputs']['province'] = user_preferences[user_id]['location']
+    
+    # Get recommendation
+    recommendation = get_crop_recommendation(user_id, soil_data, user_lang)
+    return "END " + recommendation
 
 # Utility functions with translation support
 def get_planting_advice(user_id, user_lang):
@@ -592,10 +575,9 @@ def get_planting_advice(user_id, user_lang):
     location = user_preferences.get(user_id, {}).get('location', 'Southern Africa')
     
     # Create localized advice
-    planting_advice_template = translate('planting_advice', user_lang, 
-                                       default="Best time to plant in your area is {season}. Consider local weather patterns.")
-    
-    response = planting_advice_template.format(season=season_translated)
+    response = translate('planting_advice', user_lang,
+                         default="Best time to plant in your area is {season}. Consider local weather patterns.",
+                         season=season_translated)
     
     return format_ussd_response(response)
 
@@ -607,10 +589,9 @@ def get_fertilizer_advice(user_id, user_lang):
     farming_type = user_preferences.get(user_id, {}).get('farming_type', 'crop farming')
     farming_type_translated = translate(farming_type, user_lang)
     
-    fertilizer_advice = translate('fertilizer_advice', user_lang,
-                                default="For {crop}, apply balanced fertilizer before planting and top-dress during growth.")
-    
-    response = fertilizer_advice.format(crop=farming_type_translated)
+    response = translate('fertilizer_advice', user_lang,
+                         default="For {crop}, apply balanced fertilizer before planting and top-dress during growth.",
+                         crop=farming_type_translated)
     
     return format_ussd_response(response)
 
@@ -621,10 +602,10 @@ def get_pest_control_advice(user_id, user_lang):
     season = get_current_season()
     season_translated = translate(season, user_lang)
     
-    pest_advice = translate('pest_advice', user_lang,
-                           default="Common pests in {season} include various insects. Use integrated pest management.")
-    
-    response = pest_advice.format(season=season_translated)
+    pests = ", ".join(SEASONAL_PESTS.get(season, ["various insects"]))
+    response = translate('pest_advice', user_lang,
+                         default="Common pests in {season} include {pests}. Use integrated pest management.",
+                         season=season_translated, pests=pests)
     
     return format_ussd_response(response)
 
@@ -646,15 +627,19 @@ def ask_farming_question(user_id, question, user_lang):
     """Process a custom farming question with translation"""
     from app import chatbot_response, sanitize_input
     
+    # The answer and its translation share one time budget
+    deadline = time.monotonic() + USSD_AI_BUDGET_SECONDS
+    
     # Sanitize the input
     question = sanitize_input(question)
     
     # Get the response from the chatbot
     response = chatbot_response(question, user_id)
     
-    # If user language is not English, apply basic translation
+    # If user language is not English, translate the answer (keyword replacement if out of time)
     if user_lang != 'en':
-        response = translation_manager.translate_response(response, user_lang)
+        with tracer.span('translation'):
+            response = answer_translator.translate(response, user_lang, deadline=deadline)
     
     return format_ussd_response(response)
 
@@ -678,17 +663,22 @@ def get_location_crops(user_id, user_lang):
 
 def get_crop_recommendation(user_id, soil_data, user_lang):
     """Get crop recommendation based on soil data with translation"""
-    from app import get_current_season
+    from app import get_current_season, predict_crop_from_features, SOIL_PARAMETERS
     
     province = soil_data['inputs'].get('province', translate('your_region', user_lang, default='your region'))
     
-    # Simplified recommendation logic
+    # Same cached model as /predict_crop
+    predicted_crop = predict_crop_from_features([soil_data['inputs'][p] for p in SOIL_PARAMETERS])
+    
+    # Simplified recommendation logic when the model is not trained yet
     nitrogen = soil_data['inputs'].get('nitrogen', 0)
     phosphorus = soil_data['inputs'].get('phosphorus', 0)
     potassium = soil_data['inputs'].get('potassium', 0)
     rainfall = soil_data['inputs'].get('rainfall', 0)
     
-    if nitrogen > 100 and phosphorus > 100 and rainfall > 1000:
+    if predicted_crop:
+        crops = [predicted_crop]
+    elif nitrogen > 100 and phosphorus > 100 and rainfall > 1000:
         crops = ["maize", "tobacco", "cotton"]
     elif 50 <= nitrogen <= 100 and rainfall > 800:
         crops = ["groundnuts", "soybeans", "sunflower"]
@@ -698,7 +688,7 @@ def get_crop_recommendation(user_id, soil_data, user_lang):
         crops = ["maize", "beans", "vegetables"]
     
     # Translate crops
-    crops_translated = [translate(crop, user_lang) for crop in crops]
+    crops_translated = [translate(crop, user_lang, default=crop) for crop in crops]
     
     recommended_msg = translate('recommended_crops', user_lang)
     response = f"{recommended_msg} {province}:\n"
@@ -715,14 +705,25 @@ def get_crop_recommendation(user_id, soil_data, user_lang):
 
 def get_seasonal_activities(season, user_lang):
     """Get recommended farming activities for the current season in user's language"""
-    activities = {
-        "summer": f"- {translate('planting', user_lang)} {translate('maize', user_lang)}, {translate('sorghum', user_lang)}\n- {translate('weeding', user_lang, default='Regular weeding')}\n- {translate('pest_control', user_lang)}\n- {translate('irrigation', user_lang)}",
-        "autumn": f"- {translate('harvesting', user_lang)} {translate('summer_crops', user_lang, default='summer crops')}\n- {translate('land_preparation', user_lang, default='Land preparation')}\n- {translate('planting', user_lang)} {translate('wheat', user_lang)}\n- {translate('soil_testing', user_lang, default='Soil testing')}",
-        "winter": f"- {translate('maintain_crops', user_lang, default='Maintain winter crops')}\n- {translate('prune_trees', user_lang, default='Prune fruit trees')}\n- {translate('repair_equipment', user_lang, default='Repair farm equipment')}\n- {translate('plan_planting', user_lang, default='Plan for spring planting')}",
-        "spring": f"- {translate('prepare_seedbeds', user_lang, default='Prepare seedbeds')}\n- {translate('early_planting', user_lang, default='Start early planting')}\n- {translate('apply_fertilizer', user_lang, default='Apply pre-season fertilizer')}\n- {translate('prepare_irrigation', user_lang, default='Prepare irrigation systems')}"
-    }
-    
-    return activities.get(season, translate('no_activities', user_lang, default="No specific activities for this season"))
+    # Only the requested season's strings are looked up
+    if season == "summer":
+        return f"- {translate('planting', user_lang)} {translate('maize', user_lang)}, {translate('sorghum', user_lang)}\n- {translate('weeding', user_lang, default='Regular weeding')}\n- {translate('pest_control', user_lang)}\n- {translate('irrigation', user_lang)}"
+    elif season == "autumn":
+        return f"- {translate('harvesting', user_lang)} {translate('summer_crops', user_lang, default='summer crops')}\n- {translate('land_preparation', user_lang, default='Land preparation')}\n- {translate('planting', user_lang)} {translate('wheat', user_lang)}\n- {translate('soil_testing', user_lang, default='Soil testing')}"
+    elif season == "winter":
+        return f"- {translate('maintain_crops', user_lang, default='Maintain winter crops')}\n- {translate('prune_trees', user_lang, default='Prune fruit trees')}\n- {translate('repair_equipment', user_lang, default='Repair farm equipment')}\n- {translate('plan_planting', user_lang, default='Plan for spring planting')}"
+    elif season == "spring":
+        return f"- {translate('prepare_seedbeds', user_lang, default='Prepare seedbeds')}\n- {translate('early_planting', user_lang, default='Start early planting')}\n- {translate('apply_fertilizer', user_lang, default='Apply pre-season fertilizer')}\n- {translate('prepare_irrigation', user_lang, default='Prepare irrigation systems')}"
+    
+    return translate('no_activities', user_lang, default="No specific activities for this season")
+
+# English fallbacks for the seasonal weather guidance keys
+WEATHER_GUIDANCE_DEFAULTS = {
+    "summer": "Expect hot temperatures and rainfall. Ensure proper drainage and monitor for diseases.",
+    "autumn": "Temperatures drop. Harvest on dry days and reduce irrigation.",
+    "winter": "Cooler temperatures and drier conditions. Protect crops from frost.",
+    "spring": "Temperatures rise. Watch for late frosts and prepare for rains."
+}
 
 def get_weather_guidance(season, user_id, user_lang):
     """Get weather guidance based on the season and user location in user's language"""
@@ -730,26 +731,26 @@ def get_weather_guidance(season, user_id, user_lang):
     
     location = user_preferences.get(user_id, {}).get('location', 'Southern Africa')
     
-    guidance_templates = {
-        "summer": translate('summer_weather_guidance', user_lang, 
-                          default="Expect hot temperatures and rainfall. Ensure proper drainage and monitor for diseases."),
-        "autumn": translate('autumn_weather_guidance', user_lang,
-                          default="Temperatures drop. Harvest on dry days and reduce irrigation."),
-        "winter": translate('winter_weather_guidance', user_lang,
-                          default="Cooler temperatures and drier conditions. Protect crops from frost."),
-        "spring": translate('spring_weather_guidance', user_lang,
-                          default="Temperatures rise. Watch for late frosts and prepare for rains.")
-    }
+    if season in WEATHER_GUIDANCE_DEFAULTS:
+        guidance = translate(f'{season}_weather_guidance', user_lang, default=WEATHER_GUIDANCE_DEFAULTS[season])
+    else:
+        guidance = translate('no_weather_guidance', user_lang, default=f"No specific weather guidance for {season}")
+    
+    # Cached forecast only: a cold location is fetched in the background for next time
+    forecast = weather_service.get(location, timeout=0) if location and location != 'Southern Africa' else None
+    if forecast:
+        return translate('weather_forecast_summary', user_lang, location=location, **forecast) + "\n" + guidance
     
-    return guidance_templates.get(season, translate('no_weather_guidance', user_lang, 
-                                                  default=f"No specific weather guidance for {season}"))
+    return guidance
 
 def format_ussd_response(response):
     """Format a response to fit USSD constraints"""
     max_length = 160
     
-    if len(response) > max_length:
-        truncated = response[:max_length]
+    # Budget is in GSM-7 characters; responses that need UCS-2 get half the room
+    response = prepare_for_channel(response, 'ussd')
+    if not fits(response, max_length):
+        truncated = truncate_to_budget(response, max_length, ellipsis='')
         last_period = truncated.rfind('.')
         
         if last_period > 0:
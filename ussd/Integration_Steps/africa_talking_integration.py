@@ -16,34 +16,10 @@ def initialize_africastalking():
 # Handler for USSD requests from Africa's Talking
 @at_blueprint.route('/', methods=['POST'])
 def africas_talking_handler():
-    # Get the POST data
-    session_id = request.values.get("sessionId", None)
-    service_code = request.values.get("serviceCode", None)
-    phone_number = request.values.get("phoneNumber", None)
-    text = request.values.get("text", "")
+    # Normalize the form fields and run the menu engine in-process
+    from ussd_gateways import GATEWAY_ADAPTERS, handle_gateway_request
     
-    # Process the USSD request using your existing USSD handler
-    from ussd import handle_request
-    
-    # Create a mock request object with the necessary data
-    class MockRequest:
-        def __init__(self, form_data):
-            self.form = form_data
-    
-    # Create the form data
-    form_data = {
-        'sessionId': session_id,
-        'serviceCode': service_code,
-        'phoneNumber': phone_number,
-        'text': text
-    }
-    
-    # Pass the data to your USSD handler
-    request._current_form_data = form_data
-    response = handle_request()
-    
-    # Return the response to Africa's Talking
-    return response
+    return handle_gateway_request(GATEWAY_ADAPTERS['africastalking'])
 
 # Register the blueprint with the app
 def register_africas_talking_blueprint(app):
@@ -1,28 +1,8 @@
 # infobip_integration.py
-from flask import request, jsonify
+from ussd_gateways import GATEWAY_ADAPTERS, handle_gateway_request
 
 def infobip_handler():
     """Handle USSD requests from Infobip"""
-    # Get the POST data
-    data = request.get_json()
-    
-    session_id = data.get('session_id', '')
-    service_code = data.get('service_code', '')
-    phone_number = data.get('msisdn', '')
-    text = data.get('input', '')
-    
-    # Forward the request to our USSD handler
-    forwarded_data = {
-        'sessionId': session_id,
-        'serviceCode': service_code,
-        'phoneNumber': phone_number,
-        'text': text
-    }
-    
-    response = requests.post('http://your_server/ussd', data=forwarded_data)
-    
-    # Format the response for Infobip
-    return jsonify({
-        'response': response.text.replace('CON ', ''),
-        'action': 'continue' if response.text.startswith('CON') else 'end'
-    })
\ No newline at end of file
+    # Normalize the Infobip payload and run the menu engine in-process
+    # (previously re-posted to our own /ussd endpoint over HTTP)
+    return handle_gateway_request(GATEWAY_ADAPTERS['infobip'])
@@ -0,0 +1,129 @@
+# ussd_gateways.py - In-process adapters for USSD gateway providers
+
+from collections import namedtuple
+
+from flask import request, jsonify
+
+# Provider-neutral USSD request passed to the menu engine
+USSDRequest = namedtuple('USSDRequest', ['session_id', 'service_code', 'phone_number', 'text', 'provider'])
+
+
+def split_ussd_response(response_text):
+    """Split a 'CON ...'/'END ...' response into (continue_session, message)"""
+    if response_text.startswith('CON '):
+        return True, response_text[4:]
+    if response_text.startswith('END '):
+        return False, response_text[4:]
+    return False, response_text
+
+
+class GatewayAdapter:
+    """Base adapter: normalize a provider request and format the provider response"""
+
+    name = 'base'
+
+    def parse(self, flask_request):
+        """Build a USSDRequest from the incoming provider request"""
+        raise NotImplementedError
+
+    def format_response(self, response_text):
+        """Turn the menu engine's CON/END text into the provider's response"""
+        raise NotImplementedError
+
+
+class AfricasTalkingAdapter(GatewayAdapter):
+    """Africa's Talking posts form fields and expects plain CON/END text back"""
+
+    name = 'africastalking'
+
+    def parse(self, flask_request):
+        values = flask_request.values
+        return USSDRequest(
+            session_id=values.get('sessionId', ''),
+            service_code=values.get('serviceCode', ''),
+            phone_number=values.get('phoneNumber', ''),
+            text=values.get('text', ''),
+            provider=self.name
+        )
+
+    def format_response(self, response_text):
+        return response_text
+
+
+class ComvivaAdapter(GatewayAdapter):
+    """Comviva posts JSON and expects a message with a session state"""
+
+    name = 'comviva'
+
+    def parse(self, flask_request):
+        data = flask_request.get_json(silent=True) or {}
+        return USSDRequest(
+            session_id=data.get('session_id', ''),
+            service_code=data.get('ussd_code', ''),
+            phone_number=data.get('msisdn', ''),
+            text=data.get('user_input', ''),
+            provider=self.name
+        )
+
+    def format_response(self, response_text):
+        is_continue, message = split_ussd_response(response_text)
+        return jsonify({
+            'message': message,
+            'session_state': 'CONTINUE' if is_continue else 'END'
+        })
+
+
+class InfobipAdapter(GatewayAdapter):
+    """Infobip posts JSON and expects a response with a continue/end action"""
+
+    name = 'infobip'
+
+    def parse(self, flask_request):
+        data = flask_request.get_json(silent=True) or {}
+        return USSDRequest(
+            session_id=data.get('session_id', ''),
+            service_code=data.get('service_code', ''),
+            phone_number=data.get('msisdn', ''),
+            text=data.get('input', ''),
+            provider=self.name
+        )
+
+    def format_response(self, response_text):
+        is_continue, message = split_ussd_response(response_text)
+        return jsonify({
+            'response': message,
+            'action': 'continue' if is_continue else 'end'
+        })
+
+
+GATEWAY_ADAPTERS = {
+    AfricasTalkingAdapter.name: AfricasTalkingAdapter(),
+    ComvivaAdapter.name: ComvivaAdapter(),
+    InfobipAdapter.name: InfobipAdapter()
+}
+
+
+def handle_gateway_request(adapter):
+    """Handle the current provider request in-process, without re-posting to /ussd"""
+    from app import process_ussd_request
+
+    ussd_request = adapter.parse(request)
+    response_text = process_ussd_request(
+        ussd_request.session_id,
+        ussd_request.service_code,
+        ussd_request.phone_number,
+        ussd_request.text
+    )
+    return adapter.format_response(response_text)
+
+
+# Function to register with the main app
+def register_ussd_gateways(app):
+    """Register one callback URL per provider, e.g. /ussd/comviva"""
+    for name, adapter in GATEWAY_ADAPTERS.items():
+        app.add_url_rule(
+            f'/ussd/{name}',
+            endpoint=f'ussd_gateway_{name}',
+            view_func=lambda adapter=adapter: handle_gateway_request(adapter),
+            methods=['POST']
+        )
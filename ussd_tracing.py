@@ -0,0 +1,156 @@
+# ussd_tracing.py - Per-hop USSD tracing and timing
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from metrics import LatencyHistogram
+
+# Span names used across the USSD code paths
+SPAN_NAMES = ('session_lookup', 'preference_scan', 'menu_dispatch', 'translation', 'llm', 'formatting')
+
+
+class _NoopSpan:
+    """Shared do-nothing span returned when tracing is off or no hop is active"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    """Times one named step of the current hop"""
+
+    __slots__ = ('tracer', 'hop', 'name', 'start')
+
+    def __init__(self, tracer, hop, name):
+        self.tracer = tracer
+        self.hop = hop
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.start
+        spans = self.hop['spans']
+        spans[self.name] = spans.get(self.name, 0.0) + elapsed
+        self.tracer.histogram(self.name).record(elapsed)
+        return False
+
+
+class HopTracer:
+    """Record per-hop span durations into in-process histograms and an optional JSON log"""
+
+    def __init__(self, enabled=False, log_path=None, log_max_bytes=10 * 1024 * 1024, log_backup_count=5):
+        """Initialize histograms and the optional rotating log"""
+        self.enabled = enabled
+        self.histograms = {name: LatencyHistogram() for name in SPAN_NAMES + ('hop',)}
+        self._histograms_lock = threading.Lock()
+        self._local = threading.local()
+        self.logger = None
+
+        if enabled and log_path:
+            self.logger = logging.getLogger('mudhumeni.ussd_trace')
+            self.logger.setLevel(logging.INFO)
+            self.logger.propagate = False
+            handler = RotatingFileHandler(log_path, maxBytes=log_max_bytes, backupCount=log_backup_count)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.logger.addHandler(handler)
+
+    @classmethod
+    def from_env(cls):
+        """Build a tracer from USSD_TRACING / USSD_TRACE_LOG environment settings"""
+        return cls(
+            enabled=os.environ.get('USSD_TRACING', 'false').lower() in ('1', 'true', 'yes'),
+            log_path=os.environ.get('USSD_TRACE_LOG'),
+            log_max_bytes=int(os.environ.get('USSD_TRACE_LOG_MAX_BYTES', 10 * 1024 * 1024)),
+            log_backup_count=int(os.environ.get('USSD_TRACE_LOG_BACKUPS', 5))
+        )
+
+    def histogram(self, name):
+        """Get (or create) the histogram for a span name"""
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._histograms_lock:
+                histogram = self.histograms.setdefault(name, LatencyHistogram())
+        return histogram
+
+    def start_hop(self, session_id, text, channel='ussd'):
+        """Begin tracing a USSD hop on the current thread"""
+        if not self.enabled:
+            return
+        self._local.hop = {
+            'session_id': session_id,
+            'text': text,
+            'channel': channel,
+            'spans': {},
+            'start': time.perf_counter()
+        }
+
+    def span(self, name):
+        """Context manager timing one step of the current hop"""
+        if not self.enabled:
+            return NOOP_SPAN
+        hop = getattr(self._local, 'hop', None)
+        if hop is None:
+            return NOOP_SPAN
+        return _Span(self, hop, name)
+
+    def end_hop(self, response=None):
+        """Finish the current hop, record its total time and write the log line"""
+        if not self.enabled:
+            return
+        hop = getattr(self._local, 'hop', None)
+        if hop is None:
+            return
+        self._local.hop = None
+
+        total = time.perf_counter() - hop['start']
+        self.histograms['hop'].record(total)
+
+        if self.logger:
+            self.logger.info(json.dumps({
+                'ts': datetime.now().isoformat(),
+                'session_id': hop['session_id'],
+                'text': hop['text'],
+                'channel': hop['channel'],
+                'response_type': (response or '')[:3],
+                'total_ms': round(total * 1000, 2),
+                'spans_ms': {name: round(seconds * 1000, 2) for name, seconds in hop['spans'].items()}
+            }))
+
+    def get_metrics(self):
+        """Return histogram summaries for every span that has samples"""
+        return {
+            'enabled': self.enabled,
+            'spans': {name: histogram.summary() for name, histogram in self.histograms.items() if histogram.count}
+        }
+
+
+# Shared tracer instance
+tracer = HopTracer.from_env()
+
+
+# Function to register with the main app
+def register_ussd_tracing(app):
+    """Expose the USSD span histograms on /metrics/ussd"""
+    app.config['USSD_TRACER'] = tracer
+
+    @app.route('/metrics/ussd')
+    def ussd_metrics():
+        from flask import jsonify
+        return jsonify(tracer.get_metrics())
+
+    return tracer
@@ -0,0 +1,306 @@
+# weather.py - Weather forecasts per location: pluggable providers behind a shared TTL cache
+#
+# Alerts and USSD menus read through WeatherService, which serves cached
+# forecasts, refreshes stale ones in the background (stale-while-revalidate)
+# and fetches many locations concurrently.
+
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from metrics import LatencyStats
+
+# Seasonal base values and per-region adjustments used by the simulated provider
+SEASON_BASE_VALUES = {
+    "summer": {"temp_min": 18, "temp_max": 32, "rain_prob": 60, "rain_amount": 15},
+    "autumn": {"temp_min": 12, "temp_max": 25, "rain_prob": 40, "rain_amount": 8},
+    "winter": {"temp_min": 5, "temp_max": 20, "rain_prob": 20, "rain_amount": 3},
+    "spring": {"temp_min": 12, "temp_max": 28, "rain_prob": 30, "rain_amount": 10}
+}
+
+LOCATION_ADJUSTMENTS = {
+    "harare": {"temp": 0, "rain": 0},
+    "bulawayo": {"temp": 2, "rain": -10},
+    "manicaland": {"temp": -1, "rain": 10},
+    "mashonaland": {"temp": 0, "rain": 5},
+    "masvingo": {"temp": 1, "rain": -5},
+    "matabeleland": {"temp": 3, "rain": -15},
+    "midlands": {"temp": 0, "rain": 0},
+    "gauteng": {"temp": 0, "rain": 0},
+    "western cape": {"temp": -2, "rain": 5},
+    "eastern cape": {"temp": -1, "rain": 10},
+    "limpopo": {"temp": 3, "rain": -10}
+}
+
+
+class WeatherProvider:
+    """Source of forecasts; subclasses implement fetch()"""
+
+    name = 'base'
+
+    def fetch(self, location):
+        """Return a forecast dict for the location: temperature, temperature_min,
+        temperature_max, rainfall_probability and rainfall_amount.
+
+        Raise on failure; WeatherService keeps serving the last good forecast.
+        """
+        raise NotImplementedError
+
+
+class SimulatedWeatherProvider(WeatherProvider):
+    """Random forecasts around seasonal and regional norms (the previous alert behaviour)"""
+
+    name = 'simulated'
+
+    def fetch(self, location):
+        from app import get_current_season
+
+        season = get_current_season()
+
+        # Find the best matching location adjustment
+        location_lower = location.lower()
+        adjustment = {"temp": 0, "rain": 0}
+        for loc_key, loc_adj in LOCATION_ADJUSTMENTS.items():
+            if loc_key in location_lower:
+                adjustment = loc_adj
+                break
+
+        base = SEASON_BASE_VALUES.get(season, {"temp_min": 15, "temp_max": 25, "rain_prob": 30, "rain_amount": 5})
+
+        # Apply location adjustment and randomness
+        temp_min = base["temp_min"] + adjustment["temp"] + random.uniform(-3, 3)
+        temp_max = base["temp_max"] + adjustment["temp"] + random.uniform(-3, 3)
+        rain_prob = max(0, min(100, base["rain_prob"] + adjustment["rain"] + random.uniform(-15, 15)))
+        rain_amount = max(0, base["rain_amount"] + (adjustment["rain"] / 5) + random.uniform(-3, 5))
+
+        # Today's temperature (random point between min and max)
+        temperature = temp_min + (temp_max - temp_min) * random.random()
+
+        return {
+            "temperature": round(temperature, 1),
+            "temperature_min": round(temp_min, 1),
+            "temperature_max": round(temp_max, 1),
+            "rainfall_probability": round(rain_prob),
+            "rainfall_amount": round(rain_amount, 1)
+        }
+
+
+class FileWeatherProvider(WeatherProvider):
+    """Forecasts from a local JSON file ({location: forecast}), re-read when it changes.
+
+    A stand-in for a real provider: point WEATHER_FILE at a file refreshed by a
+    cron job or edit it by hand for demos.
+    """
+
+    name = 'file'
+
+    def __init__(self, path, latency=0.0):
+        self.path = path
+        self.latency = latency
+        self._forecasts = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        with self._lock:
+            if mtime != self._mtime:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._forecasts = {location.lower(): forecast for location, forecast in data.items()}
+                self._mtime = mtime
+            return self._forecasts
+
+    def fetch(self, location):
+        if self.latency:
+            time.sleep(self.latency)
+        forecasts = self._load()
+        key = location.lower()
+        if key in forecasts:
+            return dict(forecasts[key])
+        # 'Mashonaland East' matches a 'mashonaland' entry
+        for name, forecast in forecasts.items():
+            if name in key:
+                return dict(forecast)
+        raise KeyError(f"No forecast for {location} in {self.path}")
+
+
+class WeatherService:
+    """TTL cache over a provider with stale-while-revalidate and concurrent fetches"""
+
+    def __init__(self, provider, ttl=3 * 3600, stale_ttl=24 * 3600, max_workers=8, fetch_timeout=2.0):
+        """Forecasts are fresh for `ttl` seconds and served stale (while refreshing) for
+        `stale_ttl` more; a cold read waits at most `fetch_timeout` seconds"""
+        self.provider = provider
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_workers = max_workers
+        self.fetch_timeout = fetch_timeout
+
+        self.latency = LatencyStats()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.errors = 0
+
+        self._cache = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @classmethod
+    def from_env(cls):
+        """Build the service from WEATHER_* environment settings"""
+        provider_name = os.environ.get('WEATHER_PROVIDER', 'simulated').lower()
+        if provider_name == 'file':
+            provider = FileWeatherProvider(os.environ.get('WEATHER_FILE', 'weather_forecasts.json'))
+        else:
+            provider = SimulatedWeatherProvider()
+
+        return cls(
+            provider,
+            ttl=float(os.environ.get('WEATHER_CACHE_TTL', 3 * 3600)),
+            stale_ttl=float(os.environ.get('WEATHER_STALE_TTL', 24 * 3600)),
+            max_workers=int(os.environ.get('WEATHER_FETCH_WORKERS', 8)),
+            fetch_timeout=float(os.environ.get('WEATHER_FETCH_TIMEOUT', 2.0))
+        )
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='weather')
+            return self._executor
+
+    def _fetch(self, key, location):
+        started = time.monotonic()
+        try:
+            forecast = self.provider.fetch(location)
+            with self._lock:
+                self._cache[key] = (forecast, time.time())
+                self.fetches += 1
+            return forecast
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"Error fetching weather for {location}: {str(e)}")
+            return None
+        finally:
+            self.latency.record(time.monotonic() - started)
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _refresh(self, key, location):
+        """Start (or join) a background fetch for one location; call with the lock held"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = self._inflight[key] = self._executor.submit(self._fetch, key, location)
+        return future
+
+    def _lookup(self, location):
+        """Return (forecast or None, future or None) without blocking"""
+        key = location.strip().lower()
+        self._get_executor()
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                forecast, fetched_at = entry
+                age = now - fetched_at
+                if age < self.ttl:
+                    self.hits += 1
+                    return forecast, None
+                if age < self.ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    self._refresh(key, location)
+                    return forecast, None
+            self.misses += 1
+            # Expired or never fetched; an expired forecast is still better than nothing
+            # if the provider is down
+            return (entry[0] if entry else None), self._refresh(key, location)
+
+    def get(self, location, timeout=None):
+        """Forecast for one location.
+
+        Cached forecasts (even stale ones) return at once. A cold location waits up
+        to `timeout` seconds (fetch_timeout by default; 0 never blocks) and returns
+        None if the provider hasn't answered by then.
+        """
+        forecast, future = self._lookup(location)
+        if future is None:
+            return forecast
+        timeout = self.fetch_timeout if timeout is None else timeout
+        if timeout > 0:
+            wait([future], timeout=timeout)
+            if future.done() and future.result() is not None:
+                return future.result()
+        return forecast
+
+    def get_many(self, locations, timeout=None):
+        """{location: forecast} fetching every cold location concurrently; misses are left out"""
+        results = {}
+        pending = {}
+        for location in locations:
+            forecast, future = self._lookup(location)
+            if future is None:
+                results[location] = forecast
+            else:
+                pending[location] = (forecast, future)
+
+        if pending:
+            timeout = self.fetch_timeout if timeout is None else timeout
+            wait([future for _, future in pending.values()], timeout=timeout)
+            for location, (forecast, future) in pending.items():
+                if future.done() and future.result() is not None:
+                    forecast = future.result()
+                if forecast is not None:
+                    results[location] = forecast
+        return results
+
+    def prefetch(self, locations):
+        """Warm the cache in the background (e.g. before the morning alerts)"""
+        for location in locations:
+            self._lookup(location)
+
+    def get_metrics(self):
+        """Cache effectiveness and provider latency"""
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            counters = {
+                'provider': self.provider.name,
+                'cached_locations': len(self._cache),
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+                'fetches': self.fetches,
+                'errors': self.errors,
+                'in_flight': len(self._inflight)
+            }
+        counters['provider_latency'] = self.latency.summary()
+        return counters
+
+    def shutdown(self, wait=True):
+        """Stop the fetch pool"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        # Outside the lock: running fetches need it to finish
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+# Shared by SMS weather alerts and the USSD season info screen
+weather_service = WeatherService.from_env()
+
+
+def register_weather(app):
+    """Expose forecast cache metrics on /metrics/weather"""
+    app.config['WEATHER_SERVICE'] = weather_service
+
+    @app.route('/metrics/weather', methods=['GET'])
+    def weather_metrics():
+        from flask import jsonify
+        return jsonify(weather_service.get_metrics())